@@ -0,0 +1,152 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark broadcasting cluster status from the control service.
+
+A number of convergence agents connect to a ``ControlAMPService`` over
+loopback TCP.  The configuration is then repeatedly changed, and two times
+are reported: how long the control service spends encoding and writing the
+broadcast to every connection, and how long until every agent has received
+it.  Both are measured with each broadcast serialized once and with
+serialization done per connection.
+
+The agents run in the same process, so their decoding is included in the
+delivery time.
+
+Run with::
+
+    python benchmark/cluster_status_fanout.py [agents] [datasets] [rounds]
+"""
+
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+
+from zope.interface import implementer
+
+from twisted.internet.task import react
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.protocol import ClientFactory
+from twisted.python.filepath import FilePath
+
+from flocker.control import Node, Manifestation, Dataset
+from flocker.control._clusterstate import ClusterStateService
+from flocker.control._persistence import ConfigurationPersistenceService
+from flocker.control._protocol import (
+    ControlAMPService, AgentAMP, IConvergenceAgent, _CachingArgument,
+    )
+from flocker.testtools import find_free_port
+
+
+# Number of agents connecting at the same time:
+CONNECT_BATCH = 25
+
+
+@implementer(IConvergenceAgent)
+class CountingAgent(object):
+    """
+    Convergence agent that tells a shared counter about updates.
+    """
+    def __init__(self, counter):
+        self.counter = counter
+
+    def connected(self, client):
+        pass
+
+    def disconnected(self):
+        pass
+
+    def cluster_updated(self, configuration, cluster_state):
+        self.counter.updated()
+
+
+class Counter(object):
+    """
+    Fire a ``Deferred`` once a given number of updates have been received.
+    """
+    def __init__(self):
+        self.waiting = None
+
+    def wait(self, expected):
+        self.remaining = expected
+        self.waiting = Deferred()
+        return self.waiting
+
+    def updated(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.waiting.callback(None)
+
+
+def node_with_datasets(hostname, datasets):
+    """
+    Create a ``Node`` with the given number of datasets.
+    """
+    manifestations = {}
+    for index in range(datasets):
+        dataset_id = u"%s-%032d" % (hostname, index)
+        manifestations[dataset_id] = Manifestation(
+            dataset=Dataset(dataset_id=dataset_id), primary=True)
+    return Node(hostname=hostname, manifestations=manifestations)
+
+
+def uncached_to_string(self, obj):
+    return self.serialize(obj)
+
+
+@inlineCallbacks
+def main(reactor, agents=b"500", datasets=b"20", rounds=b"5"):
+    agents, datasets, rounds = int(agents), int(datasets), int(rounds)
+    directory = mkdtemp()
+    try:
+        persistence = ConfigurationPersistenceService(
+            reactor, FilePath(directory))
+        persistence.startService()
+        cluster_state = ClusterStateService()
+        port = find_free_port()[1]
+        service = ControlAMPService(
+            reactor, cluster_state, persistence,
+            TCP4ServerEndpoint(reactor, port, interface=b"127.0.0.1"))
+        service.startService()
+
+        counter = Counter()
+        factory = ClientFactory.forProtocol(
+            lambda: AgentAMP(CountingAgent(counter)))
+        # Connect in batches that fit in the listen backlog, waiting for
+        # each agent to receive its initial status:
+        for start in range(0, agents, CONNECT_BATCH):
+            batch = min(CONNECT_BATCH, agents - start)
+            connected = counter.wait(batch)
+            for i in range(batch):
+                reactor.connectTCP(b"127.0.0.1", port, factory)
+            yield connected
+
+        original = _CachingArgument.toString
+        for name, to_string in [("once", original),
+                                ("per connection", uncached_to_string)]:
+            _CachingArgument.toString = to_string
+            broadcasts = []
+            deliveries = []
+            for i in range(rounds):
+                received = counter.wait(agents)
+                start = time()
+                persistence.save(persistence.get().update_node(
+                    node_with_datasets(u"%s-%d" % (name, i), datasets)))
+                broadcasts.append(time() - start)
+                yield received
+                deliveries.append(time() - start)
+            _CachingArgument.toString = original
+            print ("serialized %-15s %d agents: broadcast %.4fs, "
+                   "delivered %.3fs (best of %d)" % (
+                       name, agents, min(broadcasts), min(deliveries),
+                       rounds))
+        service.stopService()
+        persistence.stopService()
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
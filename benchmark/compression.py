@@ -0,0 +1,55 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark the codecs used to compress volumes pushed to volume agents.
+
+The given file, for example a ``zfs send`` stream saved from a real volume,
+is compressed in the chunks a push sends it in and then decompressed with
+each codec this node can use.  The compression ratio and the throughput of
+compression and decompression are reported.
+
+Run with::
+
+    python benchmark/compression.py <file>
+"""
+
+import sys
+from timeit import default_timer
+
+from twisted.protocols.amp import MAX_VALUE_LENGTH
+
+from flocker.common import CODECS
+
+
+def main(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    chunks = [data[i:i + MAX_VALUE_LENGTH]
+              for i in range(0, len(data), MAX_VALUE_LENGTH)]
+    megabytes = len(data) / (1024.0 * 1024)
+
+    print "%.1fMiB" % (megabytes,)
+    print "%-10s %8s %18s %20s" % (
+        "", "ratio", "compress MiB/s", "decompress MiB/s")
+    for codec in CODECS:
+        start = default_timer()
+        compressor = codec.compressor()
+        compressed = [compressor.compress(chunk) for chunk in chunks]
+        compressed.append(compressor.flush())
+        compressing = default_timer() - start
+
+        start = default_timer()
+        decompressor = codec.decompressor()
+        for chunk in compressed:
+            decompressor.decompress(chunk)
+        decompressor.flush()
+        decompressing = default_timer() - start
+
+        size = sum(len(chunk) for chunk in compressed)
+        print "%-10s %8.2f %18.1f %20.1f" % (
+            codec.name, float(len(data)) / max(size, 1),
+            megabytes / compressing, megabytes / decompressing)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,92 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark configuration writes by ``ConfigurationPersistenceService``.
+
+A number of concurrent clients each repeatedly change the dataset on their
+own node, waiting for each save to finish before making the next one, the
+way API clients would.  Writes per second are reported both for synchronous
+writes in the reactor thread and for group commit.
+
+The cost of ``fsync`` varies enormously between storage devices, so pass a
+directory on the device of interest; by default a temporary directory is
+used.
+
+Run with::
+
+    python benchmark/configuration_writes.py [clients] [saves] [directory]
+"""
+
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+
+from twisted.internet.task import react
+from twisted.internet.defer import (
+    gatherResults, inlineCallbacks, returnValue,
+    )
+from twisted.python.filepath import FilePath
+
+from flocker.control import Deployment, Node, Manifestation, Dataset
+from flocker.control._persistence import ConfigurationPersistenceService
+
+
+def change_dataset(service, client, index):
+    """
+    Save a configuration where the client's node has a new dataset.
+    """
+    dataset_id = u"%d-%d" % (client, index)
+    node = Node(
+        hostname=u"node%d" % (client,),
+        manifestations={dataset_id: Manifestation(
+            dataset=Dataset(dataset_id=dataset_id), primary=True)})
+    return service.save(service.get().update_node(node))
+
+
+@inlineCallbacks
+def run_client(service, client, saves):
+    """
+    Change datasets one after another, waiting for each save to finish.
+    """
+    for index in range(saves):
+        yield change_dataset(service, client, index)
+
+
+@inlineCallbacks
+def measure(reactor, clients, saves, group_commit_window, parent):
+    """
+    Run the clients against a new service.
+
+    :return: ``Deferred`` firing with writes per second.
+    """
+    directory = mkdtemp(dir=parent)
+    try:
+        service = ConfigurationPersistenceService(
+            reactor, FilePath(directory),
+            group_commit_window=group_commit_window)
+        service.startService()
+        yield service.save(Deployment(nodes=frozenset(
+            Node(hostname=u"node%d" % (client,))
+            for client in range(clients))))
+        start = time()
+        yield gatherResults([run_client(service, client, saves)
+                             for client in range(clients)])
+        elapsed = time() - start
+        yield service.stopService()
+    finally:
+        rmtree(directory)
+    returnValue(clients * saves / elapsed)
+
+
+@inlineCallbacks
+def main(reactor, clients=b"100", saves=b"20", parent=None):
+    clients, saves = int(clients), int(saves)
+    for name, window in [("synchronous", None),
+                         ("group commit", 0.005)]:
+        rate = yield measure(reactor, clients, saves, window, parent)
+        print "%-15s %d clients: %.1f writes/second" % (name, clients, rate)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
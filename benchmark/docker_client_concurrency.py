@@ -0,0 +1,75 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark concurrent operations with the threaded and non-blocking Docker
+clients.
+
+A ``FakeDockerServer`` is served on a UNIX socket, taking the given number
+of milliseconds to respond to each request to model the time Docker takes
+to do work.  The given number of units are then added concurrently and
+removed concurrently, first with ``DockerClient`` and then with
+``HTTPDockerClient``, reporting the time taken by each.
+
+Run with::
+
+    python benchmark/docker_client_concurrency.py [units] [delay-ms]
+"""
+
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+
+from twisted.internet.task import react
+from twisted.internet.defer import (
+    gatherResults, inlineCallbacks, returnValue,
+    )
+from twisted.python.filepath import FilePath
+from twisted.web.server import Site
+
+from flocker.node._docker import DockerClient, HTTPDockerClient
+from flocker.node.testtools import FakeDockerServer
+
+
+@inlineCallbacks
+def timed(operation, names):
+    """
+    Run an operation concurrently for each of the given names.
+
+    :return: ``Deferred`` firing with the number of seconds taken.
+    """
+    start = time()
+    yield gatherResults([operation(name) for name in names])
+    returnValue(time() - start)
+
+
+@inlineCallbacks
+def main(reactor, units=b"100", delay=b"10"):
+    units, delay = int(units), int(delay) / 1000.0
+    names = [u"unit-%d" % (i,) for i in range(units)]
+    directory = mkdtemp()
+    try:
+        path = FilePath(directory).child(b"docker.sock").path
+        server = FakeDockerServer(reactor, delay=delay)
+        # Docker's listen backlog is larger than Twisted's default:
+        port = reactor.listenUNIX(path, Site(server), backlog=units * 4)
+        base_url = u"unix://" + path
+        for name, client in [
+                ("DockerClient", DockerClient(base_url=base_url)),
+                ("HTTPDockerClient", HTTPDockerClient(
+                    reactor, base_url=base_url))]:
+            added = yield timed(
+                lambda name: client.add(name, u"busybox"), names)
+            removed = yield timed(client.remove, names)
+            assert server.containers == {}
+            print "%-20s %d units: add %.3fs, remove %.3fs" % (
+                name, units, added, removed)
+            if isinstance(client, HTTPDockerClient):
+                yield client.close()
+        yield port.stopListening()
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
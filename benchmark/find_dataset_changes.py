@@ -0,0 +1,74 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark ``find_dataset_changes``, which every node's convergence agent
+runs on every iteration.
+
+Datasets are spread evenly across the given number of nodes.  In the
+desired configuration a twentieth of them move to another node, another
+twentieth are resized and there are a twentieth as many new datasets.  The
+time taken to find the changes for one node is reported.
+
+Run with::
+
+    python benchmark/find_dataset_changes.py [nodes] [datasets ...]
+"""
+
+import sys
+from timeit import default_timer
+
+from flocker.control import Deployment, Node, Manifestation, Dataset
+from flocker.node._deploy import find_dataset_changes
+
+
+# Number of times changes are found for each size:
+REPEAT = 5
+
+
+def build_states(nodes, datasets):
+    """
+    Create current and desired ``Deployment``\ s.
+
+    :param int nodes: The number of nodes.
+    :param int datasets: The number of datasets in the current state.
+
+    :return: A tuple of the current and desired ``Deployment``\ s.
+    """
+    current = [{} for i in range(nodes)]
+    desired = [{} for i in range(nodes)]
+    for index in range(datasets + datasets // 20):
+        dataset = Dataset(dataset_id=u"%036d" % (index,),
+                          maximum_size=1024 * 1024 * 1024)
+        node = index % nodes
+        if index < datasets:
+            current[node][dataset.dataset_id] = Manifestation(
+                dataset=dataset, primary=True)
+        if index % 20 == 1:
+            node = (node + 1) % nodes
+        elif index % 20 == 2:
+            dataset = dataset.set(maximum_size=2 * 1024 * 1024 * 1024)
+        desired[node][dataset.dataset_id] = Manifestation(
+            dataset=dataset, primary=True)
+
+    def deployment(manifestations):
+        return Deployment(nodes=frozenset(
+            Node(hostname=u"node%d" % (i,), manifestations=node)
+            for i, node in enumerate(manifestations)))
+    return deployment(current), deployment(desired)
+
+
+def main(nodes, sizes):
+    print "%-10s %-10s %15s" % ("nodes", "datasets", "per node (s)")
+    for datasets in sizes:
+        current, desired = build_states(nodes, datasets)
+        times = []
+        for i in range(REPEAT):
+            start = default_timer()
+            find_dataset_changes(u"node0", current, desired)
+            times.append(default_timer() - start)
+        print "%-10d %-10d %15.4f" % (nodes, datasets, min(times))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else 500,
+         [int(size) for size in sys.argv[2:]] or [10000, 50000])
@@ -0,0 +1,107 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark finding Flocker's proxies in ``iptables-save`` output.
+
+A NAT table is generated with the given number of rules like those Docker
+creates for published ports, plus three rules for each of the given number
+of Flocker proxies.  The time taken to find the proxies is reported for:
+
+* tokenizing every line with ``shlex``, as was done originally,
+* ``parse_flocker_rules``, which skips lines without Flocker's comment,
+* ``HostNetwork.enumerate_proxies`` once its proxies are cached.
+
+Run with::
+
+    python benchmark/iptables_save_parsing.py [lines] [proxies]
+"""
+
+import shlex
+import sys
+from timeit import default_timer
+
+from twisted.internet import reactor
+
+from flocker.route import _iptables
+from flocker.route._iptables import (
+    FLOCKER_COMMENT_MARKER, HostNetwork, parse_flocker_rules,
+    parse_iptables_options,
+    )
+
+
+# Number of times the proxies are found for each approach:
+REPEAT = 5
+
+
+def nat_table(lines, proxies):
+    """
+    Generate ``iptables-save`` output for a NAT table.
+
+    :param int lines: The number of rules not created by Flocker.
+    :param int proxies: The number of Flocker proxies.
+
+    :return: The output as ``bytes``.
+    """
+    output = [b"*nat", b":PREROUTING ACCEPT [0:0]", b":OUTPUT ACCEPT [0:0]",
+              b":POSTROUTING ACCEPT [0:0]", b":DOCKER - [0:0]"]
+    for i in range(lines):
+        output.append(
+            b"-A DOCKER ! -i docker0 -p tcp -m tcp --dport %d -j DNAT "
+            b"--to-destination 172.17.%d.%d:80" % (
+                10000 + i, i // 250, i % 250 + 1))
+    for i in range(proxies):
+        ip, port = b"10.0.%d.%d" % (i // 250, i % 250 + 1), 40000 + i
+        output.extend([
+            b"-A PREROUTING -p tcp -m tcp --dport %d -m addrtype "
+            b'--dst-type LOCAL -m comment --comment "%s" -j DNAT '
+            b"--to-destination %s" % (port, FLOCKER_COMMENT_MARKER, ip),
+            b"-A OUTPUT -p tcp -m tcp --dport %d -m addrtype "
+            b"--dst-type LOCAL -j DNAT --to-destination %s" % (port, ip),
+            b"-A POSTROUTING -p tcp -m tcp --dport %d -j MASQUERADE" % (
+                port,)])
+    output.append(b"COMMIT")
+    return b"\n".join(output) + b"\n"
+
+
+def parse_every_line(output):
+    """
+    Find Flocker's rules by tokenizing every rule, as
+    ``get_flocker_rules`` originally did.
+    """
+    for line in output.splitlines():
+        if line.startswith((b"*", b":", b"COMMIT")):
+            continue
+        options = parse_iptables_options(shlex.split(line))
+        if options.comment == FLOCKER_COMMENT_MARKER:
+            yield options
+
+
+def timed(f):
+    """
+    :return: The least number of seconds ``f`` took to run.
+    """
+    times = []
+    for i in range(REPEAT):
+        start = default_timer()
+        f()
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def main(lines, proxies):
+    output = nat_table(lines, proxies)
+    _iptables.check_output = lambda argv: output
+    network = HostNetwork(reactor)
+    network.enumerate_proxies()
+    assert (list(parse_every_line(output)) ==
+            list(parse_flocker_rules(output)))
+    print "%d rules, %d proxies" % (lines + proxies * 3, proxies)
+    for name, f in [
+            ("shlex every line", lambda: list(parse_every_line(output))),
+            ("parse_flocker_rules", lambda: list(parse_flocker_rules(output))),
+            ("cached enumerate_proxies", network.enumerate_proxies)]:
+        print "%-25s %.4fs" % (name, timed(f))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]] or [20000, 100])
@@ -0,0 +1,95 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark sending a large cluster status to a convergence agent over AMP.
+
+A ``ClusterStatusCommand`` whose configuration has the given number of
+manifestations is encoded into AMP boxes and delivered to an ``AgentAMP``,
+reporting the time taken to encode and to decode it and the size on the
+wire.
+
+Run with::
+
+    python benchmark/large_cluster_status.py [manifestations ...]
+"""
+
+import sys
+from timeit import default_timer
+
+from zope.interface import implementer
+
+from twisted.protocols.amp import AMP
+from twisted.test.proto_helpers import StringTransport
+
+from flocker.control import Deployment, Node, Manifestation, Dataset
+from flocker.control._protocol import (
+    AgentAMP, ClusterStatusCommand, IConvergenceAgent,
+    )
+
+
+# Number of manifestations on each node:
+MANIFESTATIONS_PER_NODE = 100
+
+
+@implementer(IConvergenceAgent)
+class RecordingAgent(object):
+    """
+    Convergence agent that remembers the last configuration it was sent.
+    """
+    configuration = None
+
+    def connected(self, client):
+        pass
+
+    def disconnected(self):
+        pass
+
+    def cluster_updated(self, configuration, cluster_state):
+        self.configuration = configuration
+
+
+def build_deployment(manifestations):
+    """
+    Create a ``Deployment`` with the given number of manifestations.
+    """
+    nodes = []
+    for node_index in range(0, manifestations, MANIFESTATIONS_PER_NODE):
+        node_manifestations = {}
+        for index in range(node_index, min(
+                manifestations, node_index + MANIFESTATIONS_PER_NODE)):
+            dataset_id = u"%036d" % (index,)
+            node_manifestations[dataset_id] = Manifestation(
+                dataset=Dataset(dataset_id=dataset_id), primary=True)
+        nodes.append(Node(hostname=u"node%d" % (node_index,),
+                          manifestations=node_manifestations))
+    return Deployment(nodes=frozenset(nodes))
+
+
+def main(sizes):
+    print "%-15s %12s %12s %12s" % (
+        "manifestations", "encode (s)", "decode (s)", "bytes")
+    for manifestations in sizes:
+        deployment = build_deployment(manifestations)
+        empty = Deployment(nodes=frozenset())
+
+        sender = AMP()
+        sender.makeConnection(StringTransport())
+        start = default_timer()
+        sender.callRemote(ClusterStatusCommand, configuration=deployment,
+                          state=empty, generation=1)
+        encode_time = default_timer() - start
+        data = sender.transport.value()
+
+        agent = RecordingAgent()
+        receiver = AgentAMP(agent)
+        receiver.makeConnection(StringTransport())
+        start = default_timer()
+        receiver.dataReceived(data)
+        decode_time = default_timer() - start
+        assert agent.configuration == deployment
+        print "%-15d %12.4f %12.4f %12d" % (
+            manifestations, encode_time, decode_time, len(data))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,99 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark finding listening ports with ``listening_ports``.
+
+Synthetic ``/proc/net/tcp`` and ``/proc/net/tcp6`` tables are generated
+with the given number of connections, a hundredth of which are listening
+sockets.  The time taken to find the listening ports is reported, along
+with the time ``HostNetwork.enumerate_used_ports`` takes once the ports are
+cached.
+
+Run with::
+
+    python benchmark/listening_ports.py [connections]
+"""
+
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from twisted.internet import reactor
+from twisted.python.filepath import FilePath
+
+from flocker.route import _iptables
+from flocker.route._iptables import HostNetwork, listening_ports
+
+
+# Number of times the ports are found:
+REPEAT = 5
+
+HEADER = (
+    b"  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+    b"retrnsmt   uid  timeout inode\n")
+
+LINE = (
+    b"%6d: %s:%04X %s:%04X %s 00000000:00000000 00:00000000 00000000 "
+    b"1000        0 %d 1 0000000000000000 20 4 30 10 -1\n")
+
+
+def tcp_table(connections, address, remote):
+    """
+    Generate a TCP socket table.
+
+    :param int connections: The number of sockets.
+    :param bytes address: The local address, in the table's hexadecimal
+        format.
+    :param bytes remote: A remote address, likewise.
+
+    :return: The table as ``bytes``.
+    """
+    lines = [HEADER]
+    for i in range(connections):
+        if i % 100 == 0:
+            lines.append(LINE % (i, address, 1024 + i // 100,
+                                 address.replace(b"1", b"0"), 0, b"0A", i))
+        else:
+            lines.append(LINE % (i, address, 32768 + i % 28000,
+                                 remote, 1024 + i % 500, b"01", i))
+    return b"".join(lines)
+
+
+def timed(f):
+    """
+    :return: The least number of seconds ``f`` took to run.
+    """
+    times = []
+    for i in range(REPEAT):
+        start = default_timer()
+        f()
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def main(connections):
+    proc_net = FilePath(mkdtemp())
+    try:
+        proc_net.child(b"tcp").setContent(
+            tcp_table(connections // 2, b"0100007F", b"0200000A"))
+        proc_net.child(b"tcp6").setContent(
+            tcp_table(connections - connections // 2, b"1" * 32,
+                      b"2" * 32))
+        _iptables.enumerate_proxies = lambda: []
+        network = HostNetwork(reactor)
+        network.proc_net = proc_net
+        network.enumerate_used_ports()
+        print "%d connections, %d listening ports" % (
+            connections, len(listening_ports(proc_net)))
+        for name, f in [
+                ("listening_ports", lambda: listening_ports(proc_net)),
+                ("cached enumerate_used_ports",
+                 network.enumerate_used_ports)]:
+            print "%-30s %.4fs" % (name, timed(f))
+    finally:
+        rmtree(proc_net.path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else 100000)
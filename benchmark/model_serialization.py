@@ -0,0 +1,96 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark serialization of ``Deployment`` objects.
+
+The versioned format used by ``serialize_deployment`` is compared with the
+``pickle`` format previously used, reporting encode time, decode time and
+size for deployments with increasing numbers of datasets.
+
+Run with::
+
+    python benchmark/model_serialization.py [datasets ...]
+"""
+
+import sys
+from pickle import dumps, loads
+from timeit import default_timer
+
+from twisted.python.filepath import FilePath
+
+from flocker.control import (
+    Deployment, Node, Manifestation, Dataset, Application, DockerImage,
+    AttachedVolume, Port,
+    )
+from flocker.control._persistence import (
+    serialize_deployment, deserialize_deployment,
+    )
+
+
+# Number of datasets on each node:
+DATASETS_PER_NODE = 20
+
+
+def build_deployment(datasets):
+    """
+    Create a ``Deployment`` where every dataset has an application using it.
+
+    :param int datasets: The number of datasets in the deployment.
+    """
+    nodes = []
+    for node_index in range(0, datasets, DATASETS_PER_NODE):
+        manifestations = {}
+        applications = []
+        for index in range(node_index,
+                           min(datasets, node_index + DATASETS_PER_NODE)):
+            dataset_id = u"%036d" % (index,)
+            manifestation = Manifestation(
+                dataset=Dataset(dataset_id=dataset_id,
+                                metadata={u"name": u"dataset-%d" % (index,)}),
+                primary=True)
+            manifestations[dataset_id] = manifestation
+            applications.append(Application(
+                name=u"app-%d" % (index,),
+                image=DockerImage.from_string(u"clusterhq/postgres:9.1"),
+                ports=frozenset([Port(internal_port=5432,
+                                      external_port=10000 + index)]),
+                volume=AttachedVolume(manifestation=manifestation,
+                                      mountpoint=FilePath(b"/var/lib/db"))))
+        nodes.append(Node(hostname=u"node%d" % (node_index,),
+                          applications=frozenset(applications),
+                          manifestations=manifestations))
+    return Deployment(nodes=frozenset(nodes))
+
+
+def best_time(function, argument, repeat=3):
+    """
+    :return: Tuple of the shortest time in seconds of ``repeat`` calls of
+        ``function(argument)``, and the result of the call.
+    """
+    timings = []
+    for i in range(repeat):
+        start = default_timer()
+        result = function(argument)
+        timings.append(default_timer() - start)
+    return min(timings), result
+
+
+def main(sizes):
+    formats = [
+        ("pickle", dumps, loads),
+        ("versioned", serialize_deployment, deserialize_deployment),
+    ]
+    print "%-9s %-10s %12s %12s %12s" % (
+        "datasets", "format", "encode (s)", "decode (s)", "bytes")
+    for datasets in sizes:
+        deployment = build_deployment(datasets)
+        for name, encode, decode in formats:
+            encode_time, data = best_time(encode, deployment)
+            decode_time, result = best_time(decode, data)
+            assert result == deployment
+            print "%-9d %-10s %12.4f %12.4f %12d" % (
+                datasets, name, encode_time, decode_time, len(data))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [10, 1000, 10000])
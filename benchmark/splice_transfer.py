@@ -0,0 +1,70 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark streaming data from one process to another.
+
+The given number of megabytes are written by ``head`` to ``cat``, which
+discards them, using:
+
+* ``transfer``, which passes the data through Python as a producer and
+  consumer,
+* ``splice_transfer`` without ``splice``, which reads and writes each chunk,
+* ``splice_transfer``, which moves the data between the processes' pipes
+  without it passing through Python.
+
+The throughput of each, and the CPU time used by this process, is reported.
+
+Run with::
+
+    python benchmark/splice_transfer.py [megabytes]
+"""
+
+import os
+import sys
+from timeit import default_timer
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+
+from flocker.common import CommandEndpoint, splice_transfer, transfer
+from flocker.common import _splice
+
+
+def shell(reactor, command):
+    """
+    :return: A ``CommandEndpoint`` running a shell command.
+    """
+    return CommandEndpoint(reactor, [b"sh", b"-c", command], os.environ)
+
+
+@inlineCallbacks
+def main(reactor, megabytes):
+    source = b"head -c %d /dev/zero" % (megabytes * 1024 * 1024,)
+    sink = b"cat > /dev/null"
+    splice = _splice.splice
+
+    def without_splice():
+        _splice.splice = None
+        transferring = splice_transfer(
+            reactor, shell(reactor, source), shell(reactor, sink))
+        _splice.splice = splice
+        return transferring
+
+    print "%dMiB" % (megabytes,)
+    print "%-25s %10s %15s" % ("", "MiB/s", "CPU seconds")
+    for name, transferring in [
+            ("transfer", lambda: transfer(
+                shell(reactor, source), shell(reactor, sink))),
+            ("splice_transfer (copy)", without_splice),
+            ("splice_transfer", lambda: splice_transfer(
+                reactor, shell(reactor, source), shell(reactor, sink)))]:
+        cpu = os.times()
+        start = default_timer()
+        yield transferring()
+        elapsed = default_timer() - start
+        cpu = sum(os.times()[:2]) - sum(cpu[:2])
+        print "%-25s %10.1f %15.2f" % (name, megabytes / elapsed, cpu)
+
+
+if __name__ == '__main__':
+    react(main, [int(arg) for arg in sys.argv[1:]] or [2048])
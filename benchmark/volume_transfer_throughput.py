@@ -0,0 +1,164 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmark streaming volumes between ``VolumeService``\ s.
+
+Volumes stored with ``DirectoryFilesystem`` are each given a file of the
+given size.  They are then transferred to another ``VolumeService``:
+
+* by writing each one's data to the filesystem's blocking ``writer``, in
+  1MiB chunks, as ``VolumeService.receive`` originally did,
+* by ``VolumeService.receive``, for all of the volumes at once, from fake
+  process endpoints which deliver a chunk of data per reactor iteration,
+* by ``VolumeService.push`` to a ``LocalVolumeManager``, for all of the
+  volumes at once.
+
+The throughput of each is reported, along with the longest time the reactor
+was unable to run anything else.  ``DirectoryFilesystem`` still unpacks a
+volume all at once once its data has been received, and packs it all at once
+before pushing it, so this is how long the reactor is blocked while
+streaming; with ZFS that work is done by ``zfs`` processes instead.
+
+Run with::
+
+    python benchmark/volume_transfer_throughput.py [volumes] [megabytes]
+"""
+
+import os
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from twisted.internet.defer import gatherResults, inlineCallbacks
+from twisted.internet.task import LoopingCall, react
+from twisted.python.filepath import FilePath
+
+from flocker.common import MemoryProcessEndpoint
+from flocker.volume._ipc import LocalVolumeManager
+from flocker.volume.filesystems.memory import FilesystemStoragePool
+from flocker.volume.service import Volume, VolumeName, VolumeService
+
+
+# Seconds between checks of whether the reactor is running other things:
+HEARTBEAT_INTERVAL = 0.001
+
+
+class StallMonitor(object):
+    """
+    Measure the longest time the reactor doesn't run a ``LoopingCall``.
+
+    :ivar float longest: The longest delay, in seconds, beyond the interval
+        between calls.
+    """
+    def __init__(self):
+        self.longest = 0
+        self._last = None
+        self._call = LoopingCall(self._beat)
+
+    def _beat(self):
+        now = default_timer()
+        if self._last is not None:
+            self.longest = max(
+                self.longest, now - self._last - HEARTBEAT_INTERVAL)
+        self._last = now
+
+    def start(self):
+        self._call.start(HEARTBEAT_INTERVAL)
+
+    def stop(self):
+        self._beat()
+        self._call.stop()
+
+
+def create_service(reactor, root, name):
+    """
+    Create a ``VolumeService`` storing volumes with ``DirectoryFilesystem``.
+
+    :param FilePath root: The directory to store the service's files in.
+    :param bytes name: The name of the service's subdirectory.
+
+    :return: The started ``VolumeService``.
+    """
+    path = root.child(name)
+    path.makedirs()
+    service = VolumeService(
+        path.child(b"volume.json"),
+        FilesystemStoragePool(path.child(b"pool")), reactor)
+    service.startService()
+    return service
+
+
+@inlineCallbacks
+def timed(name, megabytes, transferring):
+    """
+    Report how long some transfers took.
+
+    :param str name: The name of the approach.
+    :param int megabytes: The total size of the volumes transferred.
+    :param transferring: A no-argument callable which starts the
+        transfers, returning a ``Deferred`` which fires when they are done.
+    """
+    monitor = StallMonitor()
+    monitor.start()
+    start = default_timer()
+    yield transferring()
+    elapsed = default_timer() - start
+    monitor.stop()
+    print "%-20s %10.1f %15.4f" % (name, megabytes / elapsed, monitor.longest)
+
+
+@inlineCallbacks
+def main(reactor, volumes, megabytes):
+    root = FilePath(mkdtemp())
+    try:
+        source = create_service(reactor, root, b"source")
+        contents = os.urandom(megabytes * 1024 * 1024)
+        names = [VolumeName(namespace=u"default", dataset_id=u"%d" % (i,))
+                 for i in range(volumes)]
+        created = []
+        for name in names:
+            volume = yield source.create(source.get(name))
+            volume.get_filesystem().get_path().child(
+                b"data").setContent(contents)
+            created.append(volume)
+        with created[0].get_filesystem().reader() as reader:
+            data = reader.read()
+
+        def blocking():
+            destination = create_service(reactor, root, b"blocking")
+            for volume in created:
+                destination_volume = Volume(
+                    node_id=source.node_id, name=volume.name,
+                    service=destination)
+                with destination_volume.get_filesystem().writer() as writer:
+                    for i in range(0, len(data), 1024 * 1024):
+                        writer.write(data[i:i + 1024 * 1024])
+            return gatherResults([])
+
+        def receive():
+            destination = create_service(reactor, root, b"receive")
+            return gatherResults([
+                destination.receive(
+                    source.node_id, name,
+                    MemoryProcessEndpoint(data, reactor=reactor))
+                for name in names])
+
+        def push():
+            destination = LocalVolumeManager(
+                create_service(reactor, root, b"push"))
+            return gatherResults([
+                source.push(volume, destination) for volume in created])
+
+        print "%d volumes of %dMiB" % (volumes, megabytes)
+        print "%-20s %10s %15s" % ("", "MiB/s", "max stall (s)")
+        for name, transferring in [("blocking writer", blocking),
+                                   ("receive", receive),
+                                   ("push", push)]:
+            yield timed(name, volumes * megabytes, transferring)
+    finally:
+        rmtree(root.path)
+
+
+if __name__ == '__main__':
+    react(main, [int(arg) for arg in sys.argv[1:]] or [8, 16])
@@ -4,7 +4,22 @@
 Shared flocker components.
 """
 
-__all__ = ['INode', 'FakeNode', 'ProcessNode', 'gather_deferreds']
+__all__ = [
+    'INode', 'FakeNode', 'ProcessNode', 'MemoryProcessEndpoint', 'transfer',
+    'ICommandEndpoint', 'IFileDescriptorEndpoint', 'CommandEndpoint',
+    'StandardInputEndpoint', 'TransferStatistics', 'can_splice',
+    'splice_transfer', 'gather_deferreds', 'Codec', 'CODECS', 'IDENTITY',
+    'negotiate_codec', 'CompressionStatistics', 'log_compressed_transfer',
+]
 
-from ._ipc import INode, FakeNode, ProcessNode
+from ._ipc import (
+    INode, FakeNode, ProcessNode, MemoryProcessEndpoint, transfer,
+    ICommandEndpoint, IFileDescriptorEndpoint, CommandEndpoint,
+    StandardInputEndpoint,
+    )
+from ._splice import TransferStatistics, can_splice, splice_transfer
 from ._defer import gather_deferreds
+from ._compression import (
+    Codec, CODECS, IDENTITY, negotiate_codec, CompressionStatistics,
+    log_compressed_transfer,
+    )
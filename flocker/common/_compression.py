@@ -0,0 +1,187 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Compress streams of data sent between nodes.
+"""
+
+import zlib
+
+from characteristic import attributes
+
+from eliot import Field, MessageType
+
+try:
+    import lz4.frame
+except ImportError:
+    _have_lz4 = False
+else:
+    _have_lz4 = True
+
+
+# zlib's fastest level; higher levels save little more on the data we send
+# and can't keep up with a fast network:
+ZLIB_LEVEL = 1
+
+
+@attributes(["name", "compressor", "decompressor"])
+class Codec(object):
+    """
+    A way of compressing a stream of data.
+
+    :ivar bytes name: The name the codec is negotiated by.
+    :ivar compressor: No-argument callable returning an object like those
+        returned by ``zlib.compressobj``: its ``compress`` method takes
+        some of the data and returns some of the compressed data, and its
+        ``flush`` method returns the rest once all of the data is passed.
+    :ivar decompressor: No-argument callable returning an object like those
+        returned by ``zlib.decompressobj``, with ``decompress`` and ``flush``
+        methods.
+    """
+
+
+class _Identity(object):
+    """
+    Pass data through unchanged.
+    """
+    def compress(self, data):
+        return data
+
+    decompress = compress
+
+    def flush(self):
+        return b""
+
+
+class _LZ4Compressor(object):
+    """
+    Compress data into one LZ4 frame.
+    """
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = None
+
+    def _begin(self):
+        """
+        :return: The frame header, the first time this is called, otherwise
+            empty ``bytes``.
+        """
+        if self._header is None:
+            self._header = self._compressor.begin()
+            return self._header
+        return b""
+
+    def compress(self, data):
+        return self._begin() + self._compressor.compress(data)
+
+    def flush(self):
+        return self._begin() + self._compressor.flush()
+
+
+class _LZ4Decompressor(object):
+    """
+    Decompress one LZ4 frame.
+    """
+    def __init__(self):
+        self._decompressor = lz4.frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+IDENTITY = Codec(name=b"identity", compressor=_Identity,
+                 decompressor=_Identity)
+
+ZLIB = Codec(name=b"zlib", compressor=lambda: zlib.compressobj(ZLIB_LEVEL),
+             decompressor=zlib.decompressobj)
+
+LZ4 = Codec(name=b"lz4", compressor=_LZ4Compressor,
+            decompressor=_LZ4Decompressor)
+
+# The codecs this node can use, most preferred first.  LZ4 compresses a
+# little less than zlib but is several times faster:
+CODECS = ([LZ4] if _have_lz4 else []) + [ZLIB, IDENTITY]
+
+
+def negotiate_codec(offered, codecs=CODECS):
+    """
+    Choose the codec to use for a stream.
+
+    :param list offered: The names of the codecs the other end of the stream
+        can use, most preferred first.
+    :param list codecs: The ``Codec``\ s this end can use.
+
+    :return: The first offered ``Codec`` which this end can use, or
+        ``IDENTITY`` if there are none.
+    """
+    available = {codec.name: codec for codec in codecs}
+    for name in offered:
+        if name in available:
+            return available[name]
+    return IDENTITY
+
+
+@attributes(["codec", "bytes", "compressed_bytes", "seconds"])
+class CompressionStatistics(object):
+    """
+    How well a transfer was compressed, and how quickly it was sent.
+
+    :ivar bytes codec: The name of the codec used.
+    :ivar int bytes: The number of bytes before compression.
+    :ivar int compressed_bytes: The number of bytes sent.
+    :ivar float seconds: How long the transfer took.
+    """
+    @property
+    def ratio(self):
+        """
+        How many times smaller the compressed data was.
+        """
+        if self.compressed_bytes <= 0:
+            return 1.0
+        return float(self.bytes) / self.compressed_bytes
+
+    @property
+    def bytes_per_second(self):
+        """
+        The average rate at which uncompressed data was transferred.
+        """
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds
+
+
+_CODEC = Field.forTypes(
+    "codec", [bytes], u"The name of the compression codec used.")
+_BYTES = Field.forTypes(
+    "bytes", [int, long], u"The number of bytes before compression.")
+_COMPRESSED_BYTES = Field.forTypes(
+    "compressed_bytes", [int, long], u"The number of bytes sent.")
+_RATIO = Field.forTypes(
+    "ratio", [float], u"How many times smaller the compressed data was.")
+_SECONDS = Field.forTypes(
+    "seconds", [float], u"How long the transfer took.")
+_THROUGHPUT = Field.forTypes(
+    "bytes_per_second", [float],
+    u"The average rate at which uncompressed data was transferred.")
+
+
+COMPRESSED_TRANSFER = MessageType(
+    "flocker:common:compressed_transfer",
+    [_CODEC, _BYTES, _COMPRESSED_BYTES, _RATIO, _SECONDS, _THROUGHPUT],
+    u"A compressed stream of data was transferred.")
+
+
+def log_compressed_transfer(statistics, logger):
+    """
+    Report how well a transfer was compressed.
+
+    :param CompressionStatistics statistics: The transfer's statistics.
+    :param eliot.Logger logger: The logger to write to.
+    """
+    COMPRESSED_TRANSFER(
+        codec=statistics.codec, bytes=statistics.bytes,
+        compressed_bytes=statistics.compressed_bytes,
+        ratio=statistics.ratio, seconds=statistics.seconds,
+        bytes_per_second=statistics.bytes_per_second).write(logger)
@@ -4,6 +4,7 @@
 Inter-process communication for flocker.
 """
 
+import os
 from subprocess import Popen, PIPE, check_output, CalledProcessError
 from contextlib import contextmanager
 from io import BytesIO
@@ -14,6 +15,23 @@ from zope.interface import Interface, implementer
 
 from characteristic import with_cmp, with_repr
 
+from twisted.internet.defer import (
+    Deferred, FirstError, gatherResults, maybeDeferred, succeed,
+    )
+from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
+from twisted.internet.error import (
+    ConnectionDone, ProcessDone, ProcessExitedAlready,
+    )
+from twisted.internet.interfaces import (
+    IConsumer, IPushProducer, IStreamClientEndpoint,
+    )
+from twisted.internet.protocol import Protocol, ProcessProtocol
+from twisted.internet.stdio import StandardIO
+from twisted.python.failure import Failure
+
+# The number of bytes a ``MemoryProcessEndpoint`` delivers at a time:
+MEMORY_CHUNK_SIZE = 64 * 1024
+
 
 class INode(Interface):
     """
@@ -31,6 +49,21 @@ class INode(Interface):
         :return: file-like object that can be written to.
         """
 
+    def endpoint(reactor, remote_command):
+        """Create an endpoint which runs a remote command when connected to.
+
+        The connected protocol is given the command's stdout and can write
+        to its stdin.  The connection is lost with ``ConnectionDone`` if the
+        command succeeds.
+
+        :param reactor: An ``IReactorProcess`` provider.
+
+        :param remote_command: ``list`` of ``bytes``, the command to run
+            remotely along with its arguments.
+
+        :return: An ``IStreamClientEndpoint`` provider.
+        """
+
     def get_output(remote_command):
         """Run a remote command and return its stdout.
 
@@ -43,6 +76,40 @@ class INode(Interface):
         """
 
 
+class ICommandEndpoint(IStreamClientEndpoint):
+    """
+    An endpoint which runs a process, and which can also run it with its
+    standard input or output connected directly to a file descriptor so
+    that data need not pass through this process.
+    """
+
+    def spawn(stdin=None, stdout=None):
+        """Run the process with the given file descriptors.
+
+        :param stdin: ``None`` to give the process no input, or a file
+            descriptor to use as its standard input.
+
+        :param stdout: ``None`` to discard the process's output, or a file
+            descriptor to use as its standard output.
+
+        :return: ``Deferred`` that fires with ``None`` once the process has
+            exited successfully, or fails with ``ProcessTerminated``.
+            Cancelling it kills the process.
+        """
+
+
+class IFileDescriptorEndpoint(IStreamClientEndpoint):
+    """
+    An endpoint whose data can also be read directly from a file descriptor.
+    """
+
+    def fileno():
+        """
+        :return: The file descriptor from which the data the endpoint
+            delivers to its connected protocol can be read instead.
+        """
+
+
 @with_cmp(["initial_command_arguments"])
 @with_repr(["initial_command_arguments"])
 @implementer(INode)
@@ -79,6 +146,11 @@ class ProcessNode(object):
                 # https://clusterhq.atlassian.net/browse/FLOC-155
                 raise IOError("Bad exit", remote_command, exit_code)
 
+    def endpoint(self, reactor, remote_command):
+        arguments = (self.initial_command_arguments +
+                     tuple(map(self._quote, remote_command)))
+        return CommandEndpoint(reactor, arguments, os.environ)
+
     def get_output(self, remote_command):
         try:
             return check_output(
@@ -159,6 +231,16 @@ class FakeNode(object):
         yield self.stdin
         self.stdin.seek(0, 0)
 
+    def endpoint(self, reactor, remote_command):
+        """
+        Store arguments and return an endpoint collecting "stdin" in memory.
+        """
+        self.thread_id = current_thread().ident
+        self.stdin = BytesIO()
+        self.remote_command = remote_command
+        return MemoryProcessEndpoint(
+            stdin=self.stdin, process=lambda data: self.stdin.seek(0, 0))
+
     def get_output(self, remote_command):
         """
         Return (or if an exception, raise) the next remaining output of the
@@ -171,3 +253,347 @@ class FakeNode(object):
             raise result
         else:
             return result
+
+
+class _ExitProtocol(ProcessProtocol):
+    """
+    Notice when a process exits.
+
+    :ivar exited: ``Deferred`` that fires with ``None`` if the process exits
+        successfully, or fails with the reason it didn't.  Cancelling it
+        kills the process.
+    """
+    def __init__(self):
+        self.exited = Deferred(self._kill)
+
+    def _kill(self, exited):
+        try:
+            self.transport.signalProcess("KILL")
+        except ProcessExitedAlready:
+            pass
+
+    def processEnded(self, reason):
+        if self.exited.called:
+            # Cancelled:
+            return
+        if reason.check(ProcessDone):
+            self.exited.callback(None)
+        else:
+            self.exited.errback(reason)
+
+
+@implementer(ICommandEndpoint)
+class CommandEndpoint(object):
+    """
+    An endpoint which runs a command, like ``ProcessEndpoint``.
+    """
+    def __init__(self, reactor, arguments, env):
+        """
+        :param reactor: An ``IReactorProcess`` provider.
+
+        :param arguments: ``list`` of ``bytes``, the command to run along
+            with its arguments.  The executable is found using ``PATH``.
+
+        :param dict env: The environment to run the command with.
+        """
+        self._reactor = reactor
+        self._arguments = arguments
+        self._env = env
+
+    def connect(self, factory):
+        return ProcessEndpoint(
+            self._reactor, self._arguments[0], self._arguments,
+            env=self._env).connect(factory)
+
+    def spawn(self, stdin=None, stdout=None):
+        protocol = _ExitProtocol()
+        null = os.open(os.devnull, os.O_RDWR)
+        try:
+            self._reactor.spawnProcess(
+                protocol, self._arguments[0], self._arguments,
+                env=self._env, childFDs={
+                    0: null if stdin is None else stdin,
+                    1: null if stdout is None else stdout,
+                    2: 2,
+                })
+        finally:
+            os.close(null)
+        return protocol.exited
+
+
+@implementer(IFileDescriptorEndpoint)
+class StandardInputEndpoint(object):
+    """
+    An endpoint which connects a protocol to this process's standard input
+    and output.
+    """
+    def __init__(self, reactor):
+        """
+        :param reactor: The reactor to use.
+        """
+        self._reactor = reactor
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        StandardIO(protocol, reactor=self._reactor)
+        return succeed(protocol)
+
+    def fileno(self):
+        return 0
+
+
+@implementer(IConsumer, IPushProducer)
+class _MemoryProcessTransport(object):
+    """
+    The transport of a protocol connected to a ``MemoryProcessEndpoint``.
+
+    :ivar _offset: The number of bytes of ``stdout`` already delivered.
+    """
+    def __init__(self, protocol, stdout, stdin, process, reads_stdin,
+                 reactor):
+        self._protocol = protocol
+        self._stdout = stdout
+        self._stdin = stdin
+        self._process = process
+        self._reads_stdin = reads_stdin
+        self._reactor = reactor
+        self._delivery = None
+        self._offset = 0
+        self._paused = False
+        self._delivering = False
+        self._stdin_closed = False
+        self._ended = False
+        self.producer = None
+
+    def write(self, data):
+        if not self._stdin_closed:
+            self._stdin.write(data)
+
+    def writeSequence(self, data):
+        self.write(b"".join(data))
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._deliver()
+
+    def closeStdin(self):
+        self._stdin_closed = True
+        self._maybe_end()
+
+    def loseConnection(self):
+        self._offset = len(self._stdout)
+        self.closeStdin()
+
+    def _deliver(self):
+        """
+        Deliver ``stdout`` to the protocol until it is all delivered or the
+        protocol pauses this transport.
+        """
+        if self._delivering or self._delivery is not None:
+            return
+        self._delivering = True
+        try:
+            while not self._paused and self._offset < len(self._stdout):
+                chunk = self._stdout[
+                    self._offset:self._offset + MEMORY_CHUNK_SIZE]
+                self._offset += len(chunk)
+                self._protocol.dataReceived(chunk)
+                if (self._reactor is not None and
+                        self._offset < len(self._stdout)):
+                    # Deliver the next chunk in a later reactor iteration:
+                    self._delivery = self._reactor.callLater(
+                        0, self._delivered)
+                    return
+        finally:
+            self._delivering = False
+        self._maybe_end()
+
+    def _delivered(self):
+        """
+        Deliver more of ``stdout`` in a new reactor iteration.
+        """
+        self._delivery = None
+        self._deliver()
+
+    def _maybe_end(self):
+        """
+        Pretend the process exited if all of ``stdout`` has been delivered
+        and, if it reads stdin, its stdin has been closed.
+        """
+        if self._ended or self._offset < len(self._stdout):
+            return
+        if self._reads_stdin and not self._stdin_closed:
+            return
+        self._ended = True
+        if self._process is None:
+            self._protocol.connectionLost(Failure(ConnectionDone()))
+            return
+        exiting = maybeDeferred(self._process, self._stdin.getvalue())
+        exiting.addCallback(lambda ignored: Failure(ConnectionDone()))
+        exiting.addBoth(self._protocol.connectionLost)
+
+
+@implementer(IStreamClientEndpoint)
+class MemoryProcessEndpoint(object):
+    """
+    An endpoint which pretends to run a process, without any real process.
+
+    ``stdout`` is delivered to the connected protocol in chunks, as a push
+    producer which honours ``pauseProducing``.  If the process reads stdin,
+    it pretends to exit once stdin is closed; otherwise once ``stdout`` has
+    been delivered.
+    """
+    def __init__(self, stdout=b"", stdin=None, process=None, reactor=None):
+        """
+        :param bytes stdout: The data the process writes to stdout.
+
+        :param stdin: A file-like object to which data written to the
+            process's stdin is written, or ``None``.
+
+        :param process: ``None`` or a callable which is called with all of
+            the ``bytes`` written to stdin when it is closed.  The process
+            exits when its result, which may be a ``Deferred``, is
+            available; if it fails the process fails with that reason.
+
+        :param reactor: ``None`` to deliver all of ``stdout`` at once, or an
+            ``IReactorTime`` provider to deliver each chunk in a separate
+            reactor iteration, as a real process's output would be.
+
+        The process reads stdin if ``stdin`` or ``process`` is given.
+        """
+        self._reactor = reactor
+        self._stdout = stdout
+        self._reads_stdin = stdin is not None or process is not None
+        self._stdin = stdin
+        self._process = process
+
+    def connect(self, factory):
+        stdin = self._stdin
+        if stdin is None:
+            stdin = BytesIO()
+        protocol = factory.buildProtocol(None)
+        transport = _MemoryProcessTransport(
+            protocol, self._stdout, stdin, self._process, self._reads_stdin,
+            self._reactor)
+        protocol.makeConnection(transport)
+        transport.resumeProducing()
+        return succeed(protocol)
+
+
+class _SinkProtocol(Protocol):
+    """
+    Receive nothing from the process being written to.
+
+    :ivar finished: ``Deferred`` firing when the process has exited
+        successfully, or failing if it didn't.
+    """
+    def __init__(self):
+        self.finished = Deferred()
+
+    def connectionLost(self, reason):
+        if reason.check(ConnectionDone):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
+
+
+@implementer(IPushProducer)
+class _SourceProtocol(Protocol):
+    """
+    Write everything read from one process to another, as a producer for
+    the other process's stdin so reading pauses while it is busy.
+
+    :ivar finished: ``Deferred`` firing when the process has exited
+        successfully, or failing if it didn't.
+    """
+    def __init__(self, sink):
+        """
+        :param _SinkProtocol sink: The connected protocol to write to.
+        """
+        self._sink = sink
+        self.finished = Deferred()
+
+    def connectionMade(self):
+        self._sink.transport.registerProducer(self, True)
+
+    def dataReceived(self, data):
+        self._sink.transport.write(data)
+
+    def connectionLost(self, reason):
+        self._sink.transport.unregisterProducer()
+        if reason.check(ConnectionDone):
+            self._sink.transport.closeStdin()
+            self.finished.callback(None)
+        else:
+            self._sink.transport.loseConnection()
+            self.finished.errback(reason)
+
+    def pauseProducing(self):
+        self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.transport.resumeProducing()
+
+    def stopProducing(self):
+        self.transport.loseConnection()
+
+
+def _first_failure(failure):
+    """
+    Unwrap the failure which caused ``gatherResults`` to fail.
+    """
+    failure.trap(FirstError)
+    return failure.value.subFailure
+
+
+def transfer(source, sink):
+    """
+    Stream the stdout of one process to the stdin of another without
+    blocking, reading no faster than the second process accepts the data.
+
+    :param IStreamClientEndpoint source: Runs the process to read from,
+        e.g. one created with ``INode.endpoint``.
+    :param IStreamClientEndpoint sink: Runs the process to write to.
+
+    :return: ``Deferred`` firing with ``None`` once both processes have
+        exited successfully, or failing with the reason either one failed.
+    """
+    connecting = connectProtocol(sink, _SinkProtocol())
+
+    def sink_connected(sink_protocol):
+        source_protocol = _SourceProtocol(sink_protocol)
+
+        def sink_failed(reason):
+            # Stop reading if nothing is left to write to:
+            if not source_protocol.finished.called:
+                source_protocol.stopProducing()
+            return reason
+
+        def source_not_connected(reason):
+            sink_protocol.transport.loseConnection()
+            # The reason the source failed is the one which matters:
+            sink_protocol.finished.addErrback(lambda ignored: None)
+            return reason
+
+        def source_connected(ignored):
+            sink_protocol.finished.addErrback(sink_failed)
+            finishing = gatherResults(
+                [sink_protocol.finished, source_protocol.finished],
+                consumeErrors=True)
+            finishing.addCallbacks(lambda ignored: None, _first_failure)
+            return finishing
+
+        connecting = connectProtocol(source, source_protocol)
+        connecting.addCallbacks(source_connected, source_not_connected)
+        return connecting
+    connecting.addCallback(sink_connected)
+    return connecting
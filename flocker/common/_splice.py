@@ -0,0 +1,380 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Transfer data between processes without copying it through Python.
+"""
+
+import os
+from ctypes import (
+    CDLL, c_int, c_size_t, c_ssize_t, c_uint, c_void_p, get_errno,
+    )
+from ctypes.util import find_library
+from errno import EAGAIN, EINTR, EINVAL, EPIPE
+from fcntl import fcntl, F_GETFL, F_SETFL
+from select import select
+from timeit import default_timer
+
+from zope.interface import implementer
+
+from characteristic import attributes
+
+from eliot import Field, MessageType, Logger
+
+from twisted.internet.defer import (
+    Deferred, DeferredList, maybeDeferred, succeed,
+    )
+from twisted.internet.interfaces import IReadDescriptor, IWriteDescriptor
+from twisted.python.failure import Failure
+
+from ._ipc import ICommandEndpoint, IFileDescriptorEndpoint
+
+
+# The most bytes moved by one system call:
+SPLICE_CHUNK_SIZE = 1024 * 1024
+
+# The most system calls made each time a file descriptor is ready, so other
+# things get to run during a long transfer:
+_MOVES_PER_ITERATION = 16
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+
+
+def _load_splice():
+    """
+    Find the ``splice(2)`` system call.
+
+    :return: ``None`` if it isn't available, otherwise a function taking
+        the file descriptor to move data from, the one to move it to and
+        the most bytes to move, which returns the number of bytes moved or
+        raises ``OSError``.
+    """
+    try:
+        function = CDLL(find_library("c"), use_errno=True).splice
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = [c_int, c_void_p, c_int, c_void_p, c_size_t, c_uint]
+    function.restype = c_ssize_t
+
+    def splice(source, destination, length):
+        moved = function(source, None, destination, None, length,
+                         SPLICE_F_MOVE | SPLICE_F_NONBLOCK)
+        if moved < 0:
+            errno = get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return moved
+    return splice
+
+
+splice = _load_splice()
+
+
+_BYTES = Field.forTypes(
+    "bytes", [int, long], u"The number of bytes transferred.")
+_SECONDS = Field.forTypes(
+    "seconds", [float], u"How long the transfer took.")
+_THROUGHPUT = Field.forTypes(
+    "bytes_per_second", [float], u"The average rate of the transfer.")
+
+
+SPLICED_TRANSFER = MessageType(
+    "flocker:common:spliced_transfer", [_BYTES, _SECONDS, _THROUGHPUT],
+    u"Data was transferred between processes by splice_transfer.")
+
+
+@attributes(["bytes", "seconds"])
+class TransferStatistics(object):
+    """
+    How much data a transfer moved, and how quickly.
+
+    :ivar int bytes: The number of bytes transferred.
+    :ivar float seconds: How long the transfer took.
+    """
+    @property
+    def bytes_per_second(self):
+        """
+        The average rate of the transfer.
+        """
+        if self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds
+
+
+class _Blocked(Exception):
+    """
+    No data can be moved until a file descriptor is ready.
+
+    :ivar bool reading: ``True`` if the source must become readable,
+        ``False`` if the destination must become writeable.
+    """
+    def __init__(self, reading):
+        Exception.__init__(self, reading)
+        self.reading = reading
+
+
+@implementer(IReadDescriptor, IWriteDescriptor)
+class _Ready(object):
+    """
+    Tell a ``_Pump`` when a file descriptor it is waiting for is ready.
+    """
+    def __init__(self, fd, ready, lost):
+        """
+        :param int fd: The file descriptor.
+        :param ready: A no-argument callable to call when it is ready.
+        :param lost: A no-argument callable to call when the reactor stops
+            waiting for it because it was closed at the other end.
+        """
+        self._fd = fd
+        self._ready = ready
+        self._lost = lost
+
+    def fileno(self):
+        return self._fd
+
+    def doRead(self):
+        self._ready()
+
+    doWrite = doRead
+
+    def connectionLost(self, reason):
+        self._lost()
+
+    def logPrefix(self):
+        return "_Pump"
+
+
+class _Pump(object):
+    """
+    Move all data from one file descriptor to another without blocking,
+    using ``splice`` if it is available so that the data is never copied
+    into this process.
+
+    :ivar int bytes: The number of bytes moved so far.
+    :ivar done: ``Deferred`` that fires with ``None`` once the source
+        reaches end of file and everything read from it has been written,
+        or fails if either file descriptor can't be used.
+    """
+    def __init__(self, reactor, source, destination, splice=splice):
+        """
+        :param reactor: An ``IReactorFDSet`` provider.
+        :param int source: The file descriptor to read from.  At least one
+            of it and ``destination`` must be a pipe if ``splice`` is used.
+        :param int destination: The file descriptor to write to.
+        :param splice: The ``splice`` function to use, or ``None`` to read
+            and write instead.
+        """
+        self._reactor = reactor
+        self._source = _Ready(source, self._move, self._lost)
+        self._destination = _Ready(destination, self._move, self._lost)
+        self._splice = splice
+        self._buffer = b""
+        self._waiting = None
+        self.bytes = 0
+        self.done = Deferred()
+
+    def start(self):
+        """
+        Start moving data.
+        """
+        for descriptor in (self._source, self._destination):
+            fd = descriptor.fileno()
+            fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | os.O_NONBLOCK)
+        self._move()
+
+    def _spliced(self):
+        """
+        Move some data using ``splice``.
+
+        :return: The number of bytes moved, or 0 at end of file.
+        """
+        source = self._source.fileno()
+        destination = self._destination.fileno()
+        try:
+            return self._splice(source, destination, SPLICE_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno == EINVAL:
+                # Neither file descriptor is a pipe, or the kernel can't
+                # splice between these kinds of file:
+                self._splice = None
+                return self._copied()
+            if e.errno not in (EAGAIN, EINTR):
+                raise
+        # ``splice`` doesn't say which of the two was not ready:
+        readable, writeable, _ = select([source], [destination], [], 0)
+        raise _Blocked(reading=not readable)
+
+    def _copied(self):
+        """
+        Move some data by reading it and writing it.
+
+        :return: The number of bytes moved, or 0 at end of file.
+        """
+        if not self._buffer:
+            try:
+                self._buffer = os.read(
+                    self._source.fileno(), SPLICE_CHUNK_SIZE)
+            except OSError as e:
+                if e.errno not in (EAGAIN, EINTR):
+                    raise
+                raise _Blocked(reading=True)
+            if not self._buffer:
+                return 0
+        try:
+            written = os.write(self._destination.fileno(), self._buffer)
+        except OSError as e:
+            if e.errno not in (EAGAIN, EINTR):
+                raise
+            raise _Blocked(reading=False)
+        self._buffer = self._buffer[written:]
+        return written
+
+    def _move(self):
+        """
+        Move data until it runs out, one of the file descriptors isn't
+        ready or enough has been moved for now.
+        """
+        for i in range(_MOVES_PER_ITERATION):
+            try:
+                if self._splice is None:
+                    moved = self._copied()
+                else:
+                    moved = self._spliced()
+            except _Blocked as e:
+                self._wait(e.reading)
+                return
+            except (OSError, IOError):
+                self._wait(None)
+                self.done.errback(Failure())
+                return
+            if moved == 0:
+                self._wait(None)
+                self.done.callback(None)
+                return
+            self.bytes += moved
+        # Let the reactor run other things; it will call back as soon as
+        # more can be read:
+        self._wait(reading=True)
+
+    def _lost(self):
+        """
+        The reactor has stopped waiting for a file descriptor, for example
+        because a pipe was closed at the other end without any more data
+        being written to it.  Find out what happened by moving more data.
+        """
+        self._waiting = None
+        self._move()
+
+    def _wait(self, reading):
+        """
+        Wait for one of the file descriptors to be ready.
+
+        :param reading: ``True`` to wait until the source is readable,
+            ``False`` to wait until the destination is writeable, ``None``
+            to stop waiting.
+        """
+        if reading == self._waiting:
+            return
+        if self._waiting is True:
+            self._reactor.removeReader(self._source)
+        elif self._waiting is False:
+            self._reactor.removeWriter(self._destination)
+        if reading is True:
+            self._reactor.addReader(self._source)
+        elif reading is False:
+            self._reactor.addWriter(self._destination)
+        self._waiting = reading
+
+
+def can_splice(source, sink):
+    """
+    Determine whether ``splice_transfer`` can be used instead of
+    ``transfer``.
+
+    :param IStreamClientEndpoint source: The endpoint to read from.
+    :param IStreamClientEndpoint sink: The endpoint to write to.
+
+    :return: ``True`` if the data can be transferred directly between file
+        descriptors.
+    """
+    return ICommandEndpoint.providedBy(sink) and (
+        ICommandEndpoint.providedBy(source) or
+        IFileDescriptorEndpoint.providedBy(source))
+
+
+def splice_transfer(reactor, source, sink, logger=None):
+    """
+    Stream the stdout of one process to the stdin of another, like
+    ``transfer``, but connect the processes to pipes and move the data
+    between those with ``splice`` so the data never passes through Python.
+
+    :param reactor: An ``IReactorFDSet`` provider.
+    :param source: The ``ICommandEndpoint`` running the process to read
+        from, or an ``IFileDescriptorEndpoint`` to read from.
+    :param ICommandEndpoint sink: Runs the process to write to.
+    :param eliot.Logger logger: The logger to report the transfer to.
+
+    :return: ``Deferred`` firing with ``TransferStatistics`` once both
+        processes have exited successfully, or failing with the reason one
+        of them, or failing that the transfer itself, failed.  The source's
+        failure is preferred, unless the sink stopped reading first.
+    """
+    if logger is None:
+        logger = Logger()
+    start = default_timer()
+    sink_input, sink_output = os.pipe()
+    try:
+        sinking = maybeDeferred(sink.spawn, stdin=sink_input)
+    finally:
+        os.close(sink_input)
+    if ICommandEndpoint.providedBy(source):
+        source_input, source_output = os.pipe()
+        try:
+            sourcing = maybeDeferred(source.spawn, stdout=source_output)
+        finally:
+            os.close(source_output)
+    else:
+        source_input = os.dup(source.fileno())
+        sourcing = succeed(None)
+
+    pump = _Pump(reactor, source_input, sink_output, splice)
+
+    def pumped(result):
+        # The sink sees end of file, and a source still writing sees a
+        # broken pipe:
+        os.close(sink_output)
+        os.close(source_input)
+        return result
+    pump.done.addBoth(pumped)
+    try:
+        pump.start()
+    except:
+        failure = Failure()
+        pumped(None)
+        # Nothing will be moved, so don't leave the processes running:
+        for spawned in (sourcing, sinking):
+            spawned.cancel()
+        stopping = DeferredList([sourcing, sinking], consumeErrors=True)
+        stopping.addCallback(lambda _: failure)
+        return stopping
+
+    finishing = DeferredList([sourcing, sinking, pump.done],
+                             consumeErrors=True)
+
+    def finished(results):
+        moved, reason = results[2]
+        if not moved and reason.check(OSError) and (
+                reason.value.errno == EPIPE):
+            # The sink stopped reading, so any failure of the source is
+            # just a consequence of that:
+            results = [results[1], results[0], results[2]]
+        for succeeded, result in results:
+            if not succeeded:
+                return result
+        statistics = TransferStatistics(
+            bytes=pump.bytes, seconds=default_timer() - start)
+        SPLICED_TRANSFER(
+            bytes=statistics.bytes, seconds=statistics.seconds,
+            bytes_per_second=statistics.bytes_per_second).write(logger)
+        return statistics
+    finishing.addCallback(finished)
+    return finishing
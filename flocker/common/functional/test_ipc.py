@@ -4,11 +4,13 @@
 Functional tests for IPC.
 """
 
+from twisted.internet import reactor
+from twisted.internet.error import ProcessTerminated
 from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
-from .. import ProcessNode
+from .. import ProcessNode, transfer
 from ..test.test_ipc import make_inode_tests
 from ...testtools.ssh import create_ssh_server
 
@@ -93,6 +95,29 @@ class ProcessNodeTests(TestCase):
         nonexistent = self.mktemp()
         self.assertRaises(IOError, node.get_output, [b"ls", nonexistent])
 
+    def test_endpoint_transfer(self):
+        """
+        ``transfer()`` between processes run by ``ProcessNode.endpoint``
+        writes the stdout of one to the stdin of the other.
+        """
+        node = ProcessNode(initial_command_arguments=[b"sh", b"-c"])
+        temp_file = FilePath(self.mktemp())
+        d = transfer(node.endpoint(reactor, [b"echo hello; echo world"]),
+                     node.endpoint(reactor, [b"cat > " + temp_file.path]))
+        d.addCallback(lambda _: self.assertEqual(temp_file.getContent(),
+                                                 b"hello\nworld\n"))
+        return d
+
+    def test_endpoint_bad_exit(self):
+        """
+        ``transfer()`` fails with ``ProcessTerminated`` if a process run by
+        ``ProcessNode.endpoint`` has a non-zero exit code.
+        """
+        node = ProcessNode(initial_command_arguments=[])
+        d = transfer(node.endpoint(reactor, [b"ls", self.mktemp()]),
+                     node.endpoint(reactor, [b"cat"]))
+        return self.assertFailure(d, ProcessTerminated)
+
 
 def make_sshnode(test_case):
     """
@@ -208,5 +233,9 @@ class MutatingProcessNode(ProcessNode):
     def run(self, remote_command):
         return ProcessNode.run(self, self._mutate(remote_command))
 
+    def endpoint(self, reactor, remote_command):
+        return ProcessNode.endpoint(
+            self, reactor, self._mutate(remote_command))
+
     def get_output(self, remote_command):
         return ProcessNode.get_output(self, self._mutate(remote_command))
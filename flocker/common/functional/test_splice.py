@@ -0,0 +1,204 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Functional tests for ``flocker.common._splice``.
+"""
+
+import os
+
+from zope.interface import implementer
+
+from eliot.testing import assertHasMessage, validate_logging
+
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.threads import deferToThread
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from .. import (
+    CommandEndpoint, IFileDescriptorEndpoint, TransferStatistics,
+    splice_transfer, transfer,
+    )
+from .._splice import SPLICED_TRANSFER, _Pump
+
+
+def shell(command):
+    """
+    Create an endpoint running a shell command.
+
+    :param bytes command: The command.
+
+    :return: A ``CommandEndpoint``.
+    """
+    return CommandEndpoint(reactor, [b"sh", b"-c", command], os.environ)
+
+
+@implementer(IFileDescriptorEndpoint)
+class _FileEndpoint(object):
+    """
+    An endpoint whose data can be read from a file.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+
+    def connect(self, factory):
+        raise NotImplementedError()
+
+    def fileno(self):
+        return self._fd
+
+
+class CommandEndpointTests(TestCase):
+    """
+    Tests for ``CommandEndpoint``.
+    """
+    def test_connect(self):
+        """
+        ``CommandEndpoint.connect`` runs the command, connecting the protocol
+        to its standard input and output.
+        """
+        path = FilePath(self.mktemp())
+        d = transfer(shell(b"echo hello"), shell(b"cat > " + path.path))
+        d.addCallback(lambda _: self.assertEqual(path.getContent(),
+                                                 b"hello\n"))
+        return d
+
+    def test_spawn(self):
+        """
+        ``CommandEndpoint.spawn`` runs the command with the given standard
+        input and output.
+        """
+        source = FilePath(self.mktemp())
+        source.setContent(b"hello")
+        destination = FilePath(self.mktemp())
+        stdin = os.open(source.path, os.O_RDONLY)
+        self.addCleanup(os.close, stdin)
+        stdout = os.open(destination.path, os.O_WRONLY | os.O_CREAT)
+        self.addCleanup(os.close, stdout)
+        d = shell(b"cat").spawn(stdin=stdin, stdout=stdout)
+        d.addCallback(lambda _: self.assertEqual(destination.getContent(),
+                                                 b"hello"))
+        return d
+
+    def test_spawn_fails(self):
+        """
+        The result of ``CommandEndpoint.spawn`` fails with
+        ``ProcessTerminated`` if the command fails.
+        """
+        return self.assertFailure(shell(b"exit 3").spawn(),
+                                  ProcessTerminated)
+
+    def test_spawn_cancelled(self):
+        """
+        Cancelling the result of ``CommandEndpoint.spawn`` kills the
+        process.
+        """
+        output, stdout = os.pipe()
+        self.addCleanup(os.close, output)
+        d = shell(b"exec sleep 1000").spawn(stdout=stdout)
+        os.close(stdout)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        # The pipe is only closed once the process has gone:
+        reading = deferToThread(os.read, output, 1)
+        reading.addCallback(self.assertEqual, b"")
+        return reading
+
+
+class SpliceTransferTests(TestCase):
+    """
+    Tests for ``splice_transfer``.
+    """
+    def test_transfers(self):
+        """
+        The source process's output is written to the sink process's input,
+        and the result fires with ``TransferStatistics`` once both have
+        exited.
+        """
+        path = FilePath(self.mktemp())
+        d = splice_transfer(
+            reactor, shell(b"head -c 10000000 /dev/zero"),
+            shell(b"cat > " + path.path))
+
+        def transferred(statistics):
+            self.assertEqual(
+                (statistics.bytes, path.getContent() == b"\0" * 10000000),
+                (10000000, True))
+        d.addCallback(transferred)
+        return d
+
+    @validate_logging(lambda test, logger: assertHasMessage(
+        test, logger, SPLICED_TRANSFER, {"bytes": 6}))
+    def test_logged(self, logger):
+        """
+        The amount of data transferred, and how fast, is logged.
+        """
+        d = splice_transfer(reactor, shell(b"echo hello"), shell(b"cat"),
+                            logger)
+        d.addCallback(self.assertIsInstance, TransferStatistics)
+        return d
+
+    def test_file_descriptor(self):
+        """
+        Data is read from an ``IFileDescriptorEndpoint`` source's file
+        descriptor.
+        """
+        source = FilePath(self.mktemp())
+        source.setContent(b"hello")
+        destination = FilePath(self.mktemp())
+        fd = os.open(source.path, os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        d = splice_transfer(reactor, _FileEndpoint(fd),
+                            shell(b"cat > " + destination.path))
+        d.addCallback(lambda _: self.assertEqual(destination.getContent(),
+                                                 b"hello"))
+        return d
+
+    def test_source_fails(self):
+        """
+        If the source process fails, the result fails with
+        ``ProcessTerminated``.
+        """
+        return self.assertFailure(
+            splice_transfer(reactor, shell(b"echo hello; exit 3"),
+                            shell(b"cat")),
+            ProcessTerminated)
+
+    def test_sink_fails(self):
+        """
+        If the sink process fails, the source process is not left writing
+        and the result fails with the sink's ``ProcessTerminated``.
+        """
+        d = self.assertFailure(
+            splice_transfer(reactor, shell(b"cat /dev/zero"),
+                            shell(b"exit 3")),
+            ProcessTerminated)
+        d.addCallback(lambda e: self.assertEqual(e.exitCode, 3))
+        return d
+
+    def test_source_failure_preferred(self):
+        """
+        If both processes fail after all the data was moved, the result
+        fails with the source's ``ProcessTerminated``.
+        """
+        d = self.assertFailure(
+            splice_transfer(reactor, shell(b"echo hello; exit 3"),
+                            shell(b"cat > /dev/null; exit 4")),
+            ProcessTerminated)
+        d.addCallback(lambda e: self.assertEqual(e.exitCode, 3))
+        return d
+
+    def test_start_fails(self):
+        """
+        If the transfer can't be started, both processes are killed and the
+        result fails with the reason.
+        """
+        def start(pump):
+            raise IOError()
+        self.patch(_Pump, "start", start)
+        return self.assertFailure(
+            splice_transfer(reactor, shell(b"exec cat /dev/zero"),
+                            shell(b"exec cat > /dev/null")),
+            IOError)
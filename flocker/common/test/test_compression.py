@@ -0,0 +1,207 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._compression``.
+"""
+
+from eliot import MemoryLogger
+from eliot.testing import assertHasMessage
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import (
+    CODECS, IDENTITY, CompressionStatistics, log_compressed_transfer,
+    negotiate_codec,
+    )
+from .._compression import (
+    COMPRESSED_TRANSFER, LZ4, ZLIB, _have_lz4,
+    )
+
+
+def make_codec_tests(codec):
+    """
+    Create a ``TestCase`` for a ``Codec``.
+
+    :param Codec codec: The codec to test.
+    """
+    class CodecTests(SynchronousTestCase):
+        """
+        Tests for a ``Codec``.
+        """
+        def compress(self, chunks):
+            """
+            :param chunks: The ``bytes`` to compress, in pieces.
+
+            :return: The compressed ``bytes``.
+            """
+            compressor = codec.compressor()
+            return b"".join(
+                [compressor.compress(chunk) for chunk in chunks] +
+                [compressor.flush()])
+
+        def decompress(self, chunks):
+            """
+            :param chunks: The ``bytes`` to decompress, in pieces.
+
+            :return: The decompressed ``bytes``.
+            """
+            decompressor = codec.decompressor()
+            return b"".join(
+                [decompressor.decompress(chunk) for chunk in chunks] +
+                [decompressor.flush()])
+
+        def test_round_trip(self):
+            """
+            Data compressed in pieces and decompressed in different pieces is
+            unchanged.
+            """
+            data = b"".join(b"line %d\n" % (i,) for i in range(10000))
+            compressed = self.compress(
+                [data[i:i + 1000] for i in range(0, len(data), 1000)])
+            self.assertEqual(
+                self.decompress([compressed[i:i + 333] for i in
+                                 range(0, len(compressed), 333)]),
+                data)
+
+        def test_empty(self):
+            """
+            An empty stream can be compressed and decompressed.
+            """
+            self.assertEqual(self.decompress([self.compress([])]), b"")
+
+    return CodecTests
+
+
+class IdentityTests(make_codec_tests(IDENTITY)):
+    """
+    Tests for ``IDENTITY``.
+    """
+    def test_unchanged(self):
+        """
+        ``IDENTITY`` doesn't change the data.
+        """
+        self.assertEqual(self.compress([b"abc", b"def"]), b"abcdef")
+
+
+class ZlibTests(make_codec_tests(ZLIB)):
+    """
+    Tests for ``ZLIB``.
+    """
+    def test_smaller(self):
+        """
+        ``ZLIB`` makes compressible data smaller.
+        """
+        self.assertTrue(len(self.compress([b"x" * 100000])) < 1000)
+
+
+class LZ4Tests(make_codec_tests(LZ4)):
+    """
+    Tests for ``LZ4``.
+    """
+    if not _have_lz4:
+        skip = "lz4 is not installed."
+
+
+class CodecsTests(SynchronousTestCase):
+    """
+    Tests for ``CODECS``.
+    """
+    def test_zlib(self):
+        """
+        ``ZLIB`` can always be used.
+        """
+        self.assertIn(ZLIB, CODECS)
+
+    def test_lz4_preferred(self):
+        """
+        ``LZ4`` is preferred if it is installed.
+        """
+        if not _have_lz4:
+            raise self.skipTest("lz4 is not installed.")
+        self.assertEqual(CODECS[0], LZ4)
+
+    def test_identity_last(self):
+        """
+        Not compressing is least preferred.
+        """
+        self.assertEqual(CODECS[-1], IDENTITY)
+
+
+class NegotiateCodecTests(SynchronousTestCase):
+    """
+    Tests for ``negotiate_codec``.
+    """
+    def test_first_known(self):
+        """
+        The first offered codec which is known is chosen.
+        """
+        self.assertEqual(
+            negotiate_codec([b"unknown", b"zlib", b"identity"],
+                            [IDENTITY, ZLIB]),
+            ZLIB)
+
+    def test_none_known(self):
+        """
+        If none of the offered codecs are known, ``IDENTITY`` is chosen.
+        """
+        self.assertEqual(negotiate_codec([b"unknown"], [ZLIB]), IDENTITY)
+
+
+class CompressionStatisticsTests(SynchronousTestCase):
+    """
+    Tests for ``CompressionStatistics``.
+    """
+    def test_ratio(self):
+        """
+        ``CompressionStatistics.ratio`` is the number of bytes before
+        compression divided by the number after.
+        """
+        self.assertEqual(
+            CompressionStatistics(codec=b"zlib", bytes=1000,
+                                  compressed_bytes=250, seconds=1.0).ratio,
+            4.0)
+
+    def test_ratio_nothing_sent(self):
+        """
+        ``CompressionStatistics.ratio`` is 1 if nothing was sent.
+        """
+        self.assertEqual(
+            CompressionStatistics(codec=b"zlib", bytes=0,
+                                  compressed_bytes=0, seconds=1.0).ratio,
+            1.0)
+
+    def test_bytes_per_second(self):
+        """
+        ``CompressionStatistics.bytes_per_second`` is the number of bytes
+        before compression divided by the time taken.
+        """
+        self.assertEqual(
+            CompressionStatistics(codec=b"zlib", bytes=1000,
+                                  compressed_bytes=250,
+                                  seconds=4.0).bytes_per_second,
+            250.0)
+
+    def test_instantaneous(self):
+        """
+        ``CompressionStatistics.bytes_per_second`` is 0 if no time was taken.
+        """
+        self.assertEqual(
+            CompressionStatistics(codec=b"zlib", bytes=1000,
+                                  compressed_bytes=250,
+                                  seconds=0.0).bytes_per_second,
+            0.0)
+
+    def test_logged(self):
+        """
+        ``log_compressed_transfer`` logs the statistics, including the
+        ratio and throughput.
+        """
+        logger = MemoryLogger()
+        log_compressed_transfer(
+            CompressionStatistics(codec=b"zlib", bytes=1000,
+                                  compressed_bytes=250, seconds=4.0),
+            logger)
+        logger.validate()
+        assertHasMessage(self, logger, COMPRESSED_TRANSFER, dict(
+            codec=b"zlib", bytes=1000, compressed_bytes=250, ratio=4.0,
+            seconds=4.0, bytes_per_second=250.0))
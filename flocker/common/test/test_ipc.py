@@ -6,11 +6,23 @@ Unit tests for IPC.
 
 from __future__ import absolute_import
 
+from io import BytesIO
 from unittest import TestCase as PyTestCase
 
+from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
-from .. import INode, FakeNode
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.endpoints import connectProtocol
+from twisted.internet.error import ConnectionDone
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import INode, FakeNode, MemoryProcessEndpoint, transfer
+from .._ipc import MEMORY_CHUNK_SIZE
 from ...testtools import assertNoFDsLeaked
 
 
@@ -90,8 +102,277 @@ def make_inode_tests(fixture):
             result = node.get_output([b"echo", b"hello"])
             self.assertIsInstance(result, bytes)
 
+        def test_endpoint(self):
+            """
+            ``endpoint()`` returns an ``IStreamClientEndpoint`` provider.
+            """
+            node = fixture(self)
+            self.assertTrue(verifyObject(IStreamClientEndpoint,
+                                         node.endpoint(reactor, [b"cat"])))
+
     return INodeTests
 
 
 class FakeINodeTests(make_inode_tests(lambda t: FakeNode([b"hello"]))):
     """``INode`` tests for ``FakeNode``."""
+
+
+class FakeNodeTests(SynchronousTestCase):
+    """Tests for ``FakeNode``."""
+
+    def test_endpoint_stdin(self):
+        """
+        Data written to a process run by ``FakeNode.endpoint`` is readable
+        from ``FakeNode.stdin`` once the process exits.
+        """
+        node = FakeNode()
+        self.successResultOf(transfer(MemoryProcessEndpoint(b"hello"),
+                                      node.endpoint(reactor, [b"cat"])))
+        self.assertEqual((node.remote_command, node.stdin.read()),
+                         ([b"cat"], b"hello"))
+
+
+class _CollectingProtocol(Protocol):
+    """
+    Collect the data received, and the reason the connection was lost.
+    """
+    def __init__(self):
+        self.data = []
+        self.reason = None
+
+    def dataReceived(self, data):
+        self.data.append(data)
+
+    def connectionLost(self, reason):
+        self.reason = reason
+
+
+@implementer(IStreamClientEndpoint)
+class _RecordingEndpoint(object):
+    """
+    Record the protocols connected by another endpoint.
+
+    :ivar list protocols: The connected protocols.
+    """
+    def __init__(self, endpoint):
+        self._endpoint = endpoint
+        self.protocols = []
+
+    def connect(self, factory):
+        connecting = self._endpoint.connect(factory)
+        connecting.addCallback(
+            lambda protocol: self.protocols.append(protocol) or protocol)
+        return connecting
+
+
+class MemoryProcessEndpointTests(SynchronousTestCase):
+    """Tests for ``MemoryProcessEndpoint``."""
+
+    def connect(self, endpoint, protocol=None):
+        """
+        Connect a protocol to the given endpoint.
+
+        :param protocol: The protocol to connect, by default a new
+            ``_CollectingProtocol``.
+
+        :return: The connected protocol.
+        """
+        if protocol is None:
+            protocol = _CollectingProtocol()
+        return self.successResultOf(
+            connectProtocol(endpoint, protocol))
+
+    def test_interface(self):
+        """
+        ``MemoryProcessEndpoint`` provides ``IStreamClientEndpoint``.
+        """
+        self.assertTrue(verifyObject(IStreamClientEndpoint,
+                                     MemoryProcessEndpoint()))
+
+    def test_stdout(self):
+        """
+        ``stdout`` is delivered in chunks of ``MEMORY_CHUNK_SIZE``, then the
+        connection is lost with ``ConnectionDone``.
+        """
+        stdout = b"x" * (MEMORY_CHUNK_SIZE * 2 + 1)
+        protocol = self.connect(MemoryProcessEndpoint(stdout))
+        self.assertEqual(
+            ([len(chunk) for chunk in protocol.data], b"".join(protocol.data),
+             protocol.reason.type),
+            ([MEMORY_CHUNK_SIZE, MEMORY_CHUNK_SIZE, 1], stdout,
+             ConnectionDone))
+
+    def test_paused(self):
+        """
+        No more of ``stdout`` is delivered while the transport is paused.
+        """
+        class PausingProtocol(_CollectingProtocol):
+            def dataReceived(self, data):
+                _CollectingProtocol.dataReceived(self, data)
+                self.transport.pauseProducing()
+
+        protocol = self.connect(
+            MemoryProcessEndpoint(b"x" * (MEMORY_CHUNK_SIZE * 2)),
+            PausingProtocol())
+        delivered = len(protocol.data)
+        protocol.transport.resumeProducing()
+        self.assertEqual((delivered, len(protocol.data)), (1, 2))
+
+    def test_reactor(self):
+        """
+        If a reactor is given, each chunk of ``stdout`` is delivered in a
+        separate reactor iteration.
+        """
+        clock = Clock()
+        protocol = self.connect(MemoryProcessEndpoint(
+            b"x" * (MEMORY_CHUNK_SIZE + 1), reactor=clock))
+        delivered = len(protocol.data)
+        clock.advance(0)
+        self.assertEqual((delivered, len(protocol.data), protocol.reason.type),
+                         (1, 2, ConnectionDone))
+
+    def test_reactor_paused(self):
+        """
+        If a reactor is given, no more of ``stdout`` is delivered while the
+        transport is paused.
+        """
+        clock = Clock()
+        protocol = self.connect(MemoryProcessEndpoint(
+            b"x" * (MEMORY_CHUNK_SIZE * 2), reactor=clock))
+        protocol.transport.pauseProducing()
+        clock.advance(0)
+        delivered = len(protocol.data)
+        protocol.transport.resumeProducing()
+        self.assertEqual((delivered, len(protocol.data)), (1, 2))
+
+    def test_stdin(self):
+        """
+        If ``stdin`` is given, data written to the transport is written to
+        it and the connection is only lost once stdin is closed.
+        """
+        stdin = BytesIO()
+        protocol = self.connect(MemoryProcessEndpoint(stdin=stdin))
+        protocol.transport.write(b"hello")
+        lost_before_close = protocol.reason
+        protocol.transport.closeStdin()
+        self.assertEqual(
+            (lost_before_close, stdin.getvalue(), protocol.reason.type),
+            (None, b"hello", ConnectionDone))
+
+    def test_process(self):
+        """
+        ``process`` is called with everything written to stdin once it is
+        closed, and the connection is lost when its result is available.
+        """
+        received = []
+        result = Deferred()
+        protocol = self.connect(MemoryProcessEndpoint(
+            process=lambda data: received.append(data) or result))
+        protocol.transport.writeSequence([b"hello", b" there"])
+        protocol.transport.closeStdin()
+        lost_before_result = protocol.reason
+        result.callback(None)
+        self.assertEqual((received, lost_before_result, protocol.reason.type),
+                         ([b"hello there"], None, ConnectionDone))
+
+    def test_process_fails(self):
+        """
+        If ``process`` fails, the connection is lost with its failure.
+        """
+        protocol = self.connect(MemoryProcessEndpoint(
+            process=lambda data: fail(ZeroDivisionError())))
+        protocol.transport.closeStdin()
+        self.assertEqual(protocol.reason.type, ZeroDivisionError)
+
+
+class TransferTests(SynchronousTestCase):
+    """Tests for ``transfer``."""
+
+    def test_transfers(self):
+        """
+        The source process's stdout is written to the sink process's stdin,
+        and the result fires with ``None`` once both have exited.
+        """
+        data = b"abcdefgh" * MEMORY_CHUNK_SIZE
+        stdin = BytesIO()
+        result = transfer(MemoryProcessEndpoint(data),
+                          MemoryProcessEndpoint(stdin=stdin))
+        self.assertEqual((self.successResultOf(result), stdin.getvalue()),
+                         (None, data))
+
+    def test_waits_for_sink(self):
+        """
+        The result does not fire until the sink process has exited.
+        """
+        exited = Deferred()
+        result = transfer(MemoryProcessEndpoint(b"hello"),
+                          MemoryProcessEndpoint(process=lambda data: exited))
+        self.assertNoResult(result)
+        exited.callback(None)
+        self.assertIs(self.successResultOf(result), None)
+
+    def test_backpressure(self):
+        """
+        Nothing more is read from the source process while the sink process
+        has paused its producer.
+        """
+        class PausingStdin(BytesIO):
+            def write(self, data):
+                BytesIO.write(self, data)
+                sink.protocols[0].transport.producer.pauseProducing()
+
+        stdin = PausingStdin()
+        sink = _RecordingEndpoint(MemoryProcessEndpoint(stdin=stdin))
+        result = transfer(
+            MemoryProcessEndpoint(b"x" * (MEMORY_CHUNK_SIZE * 3)), sink)
+        written = len(stdin.getvalue())
+        sink.protocols[0].transport.producer.resumeProducing()
+        self.assertEqual(
+            (written, len(stdin.getvalue())),
+            (MEMORY_CHUNK_SIZE, MEMORY_CHUNK_SIZE * 2))
+        self.assertNoResult(result)
+
+    def test_source_fails(self):
+        """
+        If the source process fails, the sink process's stdin is closed and
+        the result fails with the source's failure.
+        """
+        received = []
+        source = _RecordingEndpoint(MemoryProcessEndpoint(
+            b"hello", process=lambda data: fail(ZeroDivisionError())))
+        result = transfer(source, MemoryProcessEndpoint(
+            process=received.append))
+        source.protocols[0].transport.closeStdin()
+        self.failureResultOf(result, ZeroDivisionError)
+        self.assertEqual(received, [b"hello"])
+
+    def test_source_connect_fails(self):
+        """
+        If the source process can't be run, the sink process's stdin is
+        closed and the result fails with the reason.
+        """
+        received = []
+
+        @implementer(IStreamClientEndpoint)
+        class FailingEndpoint(object):
+            def connect(self, factory):
+                return fail(ZeroDivisionError())
+
+        result = transfer(FailingEndpoint(), MemoryProcessEndpoint(
+            process=received.append))
+        self.failureResultOf(result, ZeroDivisionError)
+        self.assertEqual(received, [b""])
+
+    def test_sink_fails(self):
+        """
+        If the sink process fails, the source process is stopped and the
+        result fails with the sink's failure.
+        """
+        source = _RecordingEndpoint(MemoryProcessEndpoint(
+            stdin=BytesIO()))
+        sink = _RecordingEndpoint(MemoryProcessEndpoint(
+            process=lambda data: fail(ZeroDivisionError())))
+        result = transfer(source, sink)
+        sink.protocols[0].transport.closeStdin()
+        self.failureResultOf(result, ZeroDivisionError)
+        self.assertTrue(source.protocols[0].finished.called)
@@ -0,0 +1,188 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._splice``.
+"""
+
+import os
+from errno import EPIPE
+
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .. import (
+    CommandEndpoint, MemoryProcessEndpoint, StandardInputEndpoint,
+    TransferStatistics, can_splice,
+    )
+from .._splice import _Pump, splice
+
+
+class TransferStatisticsTests(SynchronousTestCase):
+    """
+    Tests for ``TransferStatistics``.
+    """
+    def test_bytes_per_second(self):
+        """
+        ``TransferStatistics.bytes_per_second`` is the number of bytes
+        transferred divided by the time taken.
+        """
+        self.assertEqual(
+            TransferStatistics(bytes=1000, seconds=4.0).bytes_per_second,
+            250.0)
+
+    def test_instantaneous(self):
+        """
+        ``TransferStatistics.bytes_per_second`` is 0 if no time was taken.
+        """
+        self.assertEqual(
+            TransferStatistics(bytes=1000, seconds=0.0).bytes_per_second,
+            0.0)
+
+
+class CanSpliceTests(SynchronousTestCase):
+    """
+    Tests for ``can_splice``.
+    """
+    def test_commands(self):
+        """
+        Data can be spliced from a command to a command.
+        """
+        self.assertTrue(can_splice(CommandEndpoint(reactor, [b"cat"], {}),
+                                   CommandEndpoint(reactor, [b"cat"], {})))
+
+    def test_file_descriptor(self):
+        """
+        Data can be spliced from a file descriptor to a command.
+        """
+        self.assertTrue(can_splice(StandardInputEndpoint(reactor),
+                                   CommandEndpoint(reactor, [b"cat"], {})))
+
+    def test_not_command_source(self):
+        """
+        Data can't be spliced from an endpoint which isn't a command or a file
+        descriptor.
+        """
+        self.assertFalse(can_splice(MemoryProcessEndpoint(),
+                                    CommandEndpoint(reactor, [b"cat"], {})))
+
+    def test_not_command_sink(self):
+        """
+        Data can't be spliced to an endpoint which isn't a command.
+        """
+        self.assertFalse(can_splice(CommandEndpoint(reactor, [b"cat"], {}),
+                                    MemoryProcessEndpoint()))
+
+
+def make_pump_tests(splice):
+    """
+    Create tests for ``_Pump``.
+
+    :param splice: The ``splice`` function for the pump to use.
+    """
+    class PumpTests(TestCase):
+        """
+        Tests for ``_Pump``.
+        """
+        def open(self, content=None):
+            """
+            Open a new file.
+
+            :param bytes content: The file's content, or ``None`` to open
+                it for writing.
+
+            :return: A tuple of the file descriptor and the file's
+                ``FilePath``.
+            """
+            path = FilePath(self.mktemp())
+            if content is None:
+                fd = os.open(path.path, os.O_WRONLY | os.O_CREAT)
+            else:
+                path.setContent(content)
+                fd = os.open(path.path, os.O_RDONLY)
+            self.addCleanup(os.close, fd)
+            return fd, path
+
+        def test_through_pipe(self):
+            """
+            All of the data in the source is moved to the destination, with
+            the number of bytes moved counted, even when there is more than
+            a pipe holds at once.
+            """
+            data = os.urandom(4 * 1024 * 1024 + 1)
+            source, _ = self.open(data)
+            destination, destination_path = self.open()
+            pipe_output, pipe_input = os.pipe()
+            self.addCleanup(os.close, pipe_output)
+            to_pipe = _Pump(reactor, source, pipe_input, splice)
+            from_pipe = _Pump(reactor, pipe_output, destination, splice)
+            to_pipe.done.addCallback(lambda _: os.close(pipe_input))
+            to_pipe.start()
+            from_pipe.start()
+            d = gatherResults([to_pipe.done, from_pipe.done])
+
+            def pumped(_):
+                self.assertEqual(
+                    (to_pipe.bytes, from_pipe.bytes,
+                     destination_path.getContent() == data),
+                    (len(data), len(data), True))
+            d.addCallback(pumped)
+            return d
+
+        def test_files(self):
+            """
+            Data is moved between two files, though neither is a pipe.
+            """
+            source, _ = self.open(b"hello")
+            destination, destination_path = self.open()
+            pump = _Pump(reactor, source, destination, splice)
+            pump.start()
+            pump.done.addCallback(lambda _: self.assertEqual(
+                destination_path.getContent(), b"hello"))
+            return pump.done
+
+        def test_closed_while_waiting(self):
+            """
+            ``_Pump.done`` fires if the source is closed at its other end
+            while the pump is waiting for more data to read.
+            """
+            destination, destination_path = self.open()
+            pipe_output, pipe_input = os.pipe()
+            self.addCleanup(os.close, pipe_output)
+            pump = _Pump(reactor, pipe_output, destination, splice)
+            pump.start()
+            os.write(pipe_input, b"hello")
+            reactor.callLater(0.01, os.close, pipe_input)
+            pump.done.addCallback(lambda _: self.assertEqual(
+                destination_path.getContent(), b"hello"))
+            return pump.done
+
+        def test_broken_pipe(self):
+            """
+            ``_Pump.done`` fails if the destination can't be written to.
+            """
+            source, _ = self.open(b"hello")
+            pipe_output, pipe_input = os.pipe()
+            self.addCleanup(os.close, pipe_input)
+            os.close(pipe_output)
+            pump = _Pump(reactor, source, pipe_input, splice)
+            pump.start()
+            d = self.assertFailure(pump.done, OSError)
+            d.addCallback(lambda e: self.assertEqual(e.errno, EPIPE))
+            return d
+    return PumpTests
+
+
+class SplicePumpTests(make_pump_tests(splice)):
+    """
+    Tests for ``_Pump`` using ``splice``.
+    """
+    if splice is None:
+        skip = "splice is not available on this platform."
+
+
+class CopyingPumpTests(make_pump_tests(None)):
+    """
+    Tests for ``_Pump`` without ``splice``.
+    """
@@ -17,9 +17,17 @@ class ClusterStateService(Service):
     https://clusterhq.atlassian.net/browse/FLOC-1269 will deal with
     semantics of expiring data, which should happen so stale information
     isn't treated as correct.
+
+    :ivar dict _as_nodes: Mapping from hostname to the ``Node`` created
+        from that host's current ``NodeState``, so unchanged nodes are the
+        same object in successive results of ``as_deployment``.
+    :ivar _deployment: The cached result of ``as_deployment``, or ``None``
+        if the state has changed since it was last calculated.
     """
     def __init__(self):
         self._nodes = {}
+        self._as_nodes = {}
+        self._deployment = None
 
     def update_node_state(self, node_state):
         """
@@ -29,8 +37,16 @@ class ClusterStateService(Service):
         consistency here. See https://clusterhq.atlassian.net/browse/FLOC-1303
 
         :param NodeState node_state: The state of the node.
+
+        :return bool: ``True`` if the state changed, ``False`` if it is the
+            same as the currently known state of the node.
         """
+        if self._nodes.get(node_state.hostname) == node_state:
+            return False
         self._nodes[node_state.hostname] = node_state
+        self._as_nodes.pop(node_state.hostname, None)
+        self._deployment = None
+        return True
 
     def manifestation_path(self, hostname, dataset_id):
         """
@@ -47,7 +63,15 @@ class ClusterStateService(Service):
         """
         Return cluster state as a Deployment object.
 
+        The same object is returned until the state changes, which allows
+        cheaply detecting unchanged state.
+
         :return Deployment: Current state of the cluster.
         """
-        return Deployment(nodes=frozenset(
-            (node_state.to_node() for node_state in self._nodes.values())))
+        if self._deployment is None:
+            for hostname, node_state in self._nodes.items():
+                if hostname not in self._as_nodes:
+                    self._as_nodes[hostname] = node_state.to_node()
+            self._deployment = Deployment(
+                nodes=frozenset(self._as_nodes.values()))
+        return self._deployment
@@ -244,12 +244,14 @@ class Node(PRecord):
         and those that are unattached.
     """
     def __invariant__(self):
-        manifestations = self.manifestations.values()
         for app in self.applications:
             if not isinstance(app, Application):
                 return (False, '%r must be Appplication' % (app,))
             if app.volume is not None:
-                if app.volume.manifestation not in manifestations:
+                manifestation = app.volume.manifestation
+                existing = self.manifestations.get(manifestation.dataset_id)
+                if existing is not manifestation and (
+                        existing != manifestation):
                     return (False, '%r manifestation is not on node' % (app,))
         for key, value in self.manifestations.items():
             if key != value.dataset_id:
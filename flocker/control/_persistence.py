@@ -1,19 +1,289 @@
 # Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_persistence -*-
 
 """
 Persistence of cluster configuration.
+
+The configuration is stored as a full snapshot plus an append-only journal
+of changes made since that snapshot was written.  Each save appends a
+small delta record describing only the nodes that changed, so the cost of
+a save is proportional to the size of the change rather than the size of
+the cluster.  Once enough records have accumulated the journal is
+compacted by writing a new snapshot.
+
+Optionally, writes can be done by a dedicated writer thread which combines
+all saves arriving within a short window into a single durable write
+("group commit"), so that a burst of API requests does not block the
+reactor thread while the disk flushes.
 """
 
-from pickle import dumps, loads
+from os import O_RDONLY, close, fsync, open as os_open
+from json import dumps, loads
+from pickle import loads as pickle_loads
+from struct import Struct
+
+from eliot import Logger, write_failure
 
 from twisted.application.service import Service
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.filepath import FilePath
+from twisted.python.threadpool import ThreadPool
+
+from pyrsistent import pmap, pset
+
+from ._model import (
+    Application, AttachedVolume, Dataset, Deployment, DockerImage, Link,
+    Manifestation, Node, NodeState, Port, RestartAlways, RestartNever,
+    RestartOnFailure,
+    )
+
+
+_logger = Logger()
+
+
+# Serialized model objects start with a header consisting of this magic
+# value and the version of the format:
+_FORMAT_HEADER = Struct(b">4sB")
+_FORMAT_MAGIC = b"FLKM"
+_FORMAT_VERSION = 1
+
+
+def _identity(value):
+    return value
+
+
+# A codec is an ``(encode, decode)`` tuple of functions converting between
+# model objects and JSON-compatible values. Records are encoded as lists
+# of field values in the order given by their schema, so no class or field
+# names are included in the output.
+_VALUE = (_identity, _identity)
+
+_PATH = (lambda path: path.path.decode("latin-1"),
+         lambda data: FilePath(data.encode("latin-1")))
+
+_TUPLE = (list, tuple)
 
-from ._model import Deployment
+
+def _optional(codec):
+    """
+    :param codec: Codec for the value when it is not ``None``.
+
+    :return: Codec for a value that may be ``None``.
+    """
+    encode, decode = codec
+    return (lambda value: None if value is None else encode(value),
+            lambda data: None if data is None else decode(data))
+
+
+def _collection(codec, factory):
+    """
+    :param codec: Codec for the items of the collection.
+    :param factory: Callable that creates the collection from an iterable.
+
+    :return: Codec for a set-like collection.
+    """
+    encode, decode = codec
+    return (lambda value: [encode(item) for item in value],
+            lambda data: factory(decode(item) for item in data))
+
+
+def _mapping(codec, factory):
+    """
+    :param codec: Codec for the values of the mapping; keys must be
+        ``unicode``.
+    :param factory: Callable that creates the mapping from a ``dict``.
+
+    :return: Codec for a mapping.
+    """
+    encode, decode = codec
+    return (lambda value: {key: encode(item) for key, item in value.items()},
+            lambda data: factory(
+                {key: decode(item) for key, item in data.items()}))
+
+
+def _record(cls, *fields):
+    """
+    :param cls: The record class; it must accept its fields as keyword
+        arguments.
+    :param fields: ``(name, codec)`` tuples, the schema of the record.
+
+    :return: Codec for instances of ``cls``.
+    """
+    names = [name for name, _ in fields]
+    encoders = [(name, codec[0]) for name, codec in fields]
+    decoders = [codec[1] for _, codec in fields]
+
+    def encode(value):
+        return [encode_field(getattr(value, name))
+                for name, encode_field in encoders]
+
+    def decode(data):
+        return cls(**{name: decode_field(item) for name, decode_field, item
+                      in zip(names, decoders, data)})
+    return encode, decode
+
+
+def _one_of(*choices):
+    """
+    :param choices: ``(cls, codec)`` tuples for each possible type.
+
+    :return: Codec for a value which may be an instance of any of the given
+        record types.
+    """
+    indexes = {cls: index for index, (cls, _) in enumerate(choices)}
+    codecs = [codec for _, codec in choices]
+
+    def encode(value):
+        index = indexes[type(value)]
+        return [index] + codecs[index][0](value)
+
+    def decode(data):
+        return codecs[data[0]][1](data[1:])
+    return encode, decode
+
+
+_DOCKER_IMAGE = _record(DockerImage, ("repository", _VALUE), ("tag", _VALUE))
+_PORT = _record(Port, ("internal_port", _VALUE), ("external_port", _VALUE))
+_LINK = _record(Link, ("local_port", _VALUE), ("remote_port", _VALUE),
+                ("alias", _VALUE))
+_DATASET = _record(Dataset, ("dataset_id", _VALUE), ("deleted", _VALUE),
+                   ("maximum_size", _VALUE),
+                   ("metadata", _mapping(_VALUE, pmap)))
+_MANIFESTATION = _record(Manifestation, ("dataset", _DATASET),
+                         ("primary", _VALUE))
+_ATTACHED_VOLUME = _record(AttachedVolume,
+                           ("manifestation", _MANIFESTATION),
+                           ("mountpoint", _PATH))
+_RESTART_POLICY = _one_of(
+    (RestartNever, _record(RestartNever)),
+    (RestartAlways, _record(RestartAlways)),
+    (RestartOnFailure, _record(RestartOnFailure,
+                               ("maximum_retry_count", _VALUE))))
+
+
+def _application(volume):
+    """
+    :param volume: Codec for ``AttachedVolume``.
+
+    :return: Codec for ``Application``.
+    """
+    return _record(
+        Application,
+        ("name", _VALUE),
+        ("image", _DOCKER_IMAGE),
+        ("ports", _collection(_PORT, frozenset)),
+        ("volume", _optional(volume)),
+        ("links", _collection(_LINK, frozenset)),
+        ("environment", _optional(_collection(_TUPLE, frozenset))),
+        ("memory_limit", _VALUE),
+        ("cpu_shares", _VALUE),
+        ("restart_policy", _RESTART_POLICY))
+
+
+_APPLICATION = _application(_ATTACHED_VOLUME)
+
+
+def _node_volume(manifestations):
+    """
+    ``Node`` requires the manifestations of its applications' volumes to
+    be in its ``manifestations``, so within a ``Node`` volumes only refer
+    to their manifestation by dataset ID. This makes the output smaller and
+    means decoded applications share the node's ``Manifestation`` objects.
+
+    :param manifestations: The node's mapping from dataset ID to
+        ``Manifestation``, or ``None`` if only encoding.
+
+    :return: Codec for ``AttachedVolume`` within a ``Node``.
+    """
+    return _record(
+        AttachedVolume,
+        ("manifestation", (lambda manifestation: manifestation.dataset_id,
+                           lambda dataset_id: manifestations[dataset_id])),
+        ("mountpoint", _PATH))
+
+
+_NODE_MANIFESTATIONS = _mapping(_MANIFESTATION, pmap)
+_NODE_APPLICATIONS = _collection(_application(_node_volume(None)), pset)
+
+
+def _encode_node(node):
+    return [node.hostname, _NODE_APPLICATIONS[0](node.applications),
+            _NODE_MANIFESTATIONS[0](node.manifestations)]
+
+
+def _decode_node(data):
+    hostname, applications, manifestations = data
+    manifestations = _NODE_MANIFESTATIONS[1](manifestations)
+    decode_applications = _collection(
+        _application(_node_volume(manifestations)), pset)[1]
+    return Node(hostname=hostname,
+                applications=decode_applications(applications),
+                manifestations=manifestations)
+
+
+_NODE = (_encode_node, _decode_node)
+_DEPLOYMENT = _record(Deployment, ("nodes", _collection(_NODE, frozenset)))
+_NODE_STATE = _record(
+    NodeState,
+    ("hostname", _VALUE),
+    ("used_ports", _collection(_VALUE, pset)),
+    ("running", _collection(_APPLICATION, pset)),
+    ("not_running", _collection(_APPLICATION, pset)),
+    ("manifestations", _collection(_MANIFESTATION, pset)),
+    ("paths", _mapping(_PATH, _identity)))
+# Deltas as returned by ``deployment_delta`` are a pair of changed nodes
+# and removed hostnames:
+_NODES = _collection(_NODE, frozenset)
+_DELTA = (lambda delta: [_NODES[0](delta[0]), list(delta[1])],
+          lambda data: (_NODES[1](data[0]), frozenset(data[1])))
+
+
+def _dumps(codec, value):
+    """
+    Serialize a model object using the current format version.
+
+    :param codec: The codec for the object's type.
+    :param value: The object to serialize.
+
+    :return bytes: Serialized object, including a version header.
+    """
+    return _FORMAT_HEADER.pack(_FORMAT_MAGIC, _FORMAT_VERSION) + dumps(
+        codec[0](value), separators=(",", ":"))
+
+
+def _is_versioned(data):
+    """
+    :param bytes data: Serialized model object.
+
+    :return bool: Whether the data has a version header, rather than being
+        a pickle written by an older version of Flocker.
+    """
+    return data.startswith(_FORMAT_MAGIC)
+
+
+def _loads(codec, data):
+    """
+    Deserialize a model object serialized by ``_dumps``.
+
+    :param codec: The codec for the object's type.
+    :param bytes data: The serialized object.
+
+    :raises ValueError: If the data is not in a supported format.
+
+    :return: The deserialized object.
+    """
+    if len(data) < _FORMAT_HEADER.size:
+        raise ValueError("Serialized data is too short")
+    magic, version = _FORMAT_HEADER.unpack_from(data)
+    if magic != _FORMAT_MAGIC:
+        raise ValueError("Serialized data has unknown format")
+    if version != _FORMAT_VERSION:
+        raise ValueError(
+            "Unsupported serialization format version {}".format(version))
+    return codec[1](loads(data[_FORMAT_HEADER.size:]))
 
 
-# These should not use Pickle!@!
-# https://clusterhq.atlassian.net/browse/FLOC-1241
 def serialize_deployment(deployment):
     """
     Convert a ``Deployment`` object to ``bytes``.
@@ -22,7 +292,7 @@ def serialize_deployment(deployment):
 
     :return bytes: Serialized object.
     """
-    return dumps(deployment)
+    return _dumps(_DEPLOYMENT, deployment)
 
 
 def deserialize_deployment(data):
@@ -32,9 +302,318 @@ def deserialize_deployment(data):
 
     :param bytes data: Output of ``serialize_deployment``.
 
+    :raises ValueError: If the data is not in a supported format.
+
     :return Deployment: Deserialized object.
     """
-    return loads(data)
+    return _loads(_DEPLOYMENT, data)
+
+
+def serialize_node_state(node_state):
+    """
+    Convert a ``NodeState`` object to ``bytes``.
+
+    :param NodeState node_state: Object to serialize.
+
+    :return bytes: Serialized object.
+    """
+    return _dumps(_NODE_STATE, node_state)
+
+
+def deserialize_node_state(data):
+    """
+    Create a ``NodeState`` object that was previously serialized to given
+    ``bytes``.
+
+    :param bytes data: Output of ``serialize_node_state``.
+
+    :raises ValueError: If the data is not in a supported format.
+
+    :return NodeState: Deserialized object.
+    """
+    return _loads(_NODE_STATE, data)
+
+
+# Each journal record is prefixed with its length:
+_RECORD_HEADER = Struct(b">I")
+
+
+def deployment_delta(old, new):
+    """
+    Calculate the changes necessary to turn one ``Deployment`` into
+    another.
+
+    :param Deployment old: The original configuration.
+    :param Deployment new: The updated configuration.
+
+    :return: Tuple of (``frozenset`` of ``Node`` instances that were added
+        or changed, ``frozenset`` of hostnames of ``Node`` instances that
+        were removed).
+    """
+    old_nodes = {node.hostname: node for node in old.nodes}
+    changed = []
+    for node in new.nodes:
+        existing = old_nodes.pop(node.hostname, None)
+        # Unchanged nodes are usually the very same object, so check
+        # identity before falling back to a (much slower) comparison:
+        if existing is node or existing == node:
+            continue
+        changed.append(node)
+    return frozenset(changed), frozenset(old_nodes)
+
+
+def apply_deltas(deployment, deltas):
+    """
+    Apply a series of changes to a ``Deployment``.
+
+    :param Deployment deployment: The configuration to start from.
+    :param deltas: Iterable of values as returned by ``deployment_delta``.
+
+    :return Deployment: The configuration with all changes applied.
+    """
+    nodes = {node.hostname: node for node in deployment.nodes}
+    for changed, removed in deltas:
+        for hostname in removed:
+            nodes.pop(hostname, None)
+        for node in changed:
+            nodes[node.hostname] = node
+    return Deployment(nodes=frozenset(nodes.values()))
+
+
+def serialize_deployment_delta(delta):
+    """
+    Convert a delta as returned by ``deployment_delta`` to ``bytes``.
+
+    :param delta: Object to serialize.
+
+    :return bytes: Serialized object.
+    """
+    return _dumps(_DELTA, delta)
+
+
+def deserialize_deployment_delta(data):
+    """
+    Load a delta serialized by ``serialize_deployment_delta``.
+
+    :param bytes data: Output of ``serialize_deployment_delta``.
+
+    :raises ValueError: If the data is not in a supported format.
+
+    :return: Delta as returned by ``deployment_delta``.
+    """
+    return _loads(_DELTA, data)
+
+
+def _encode_record(payload):
+    """
+    Frame a payload so it can be appended to the journal.
+
+    :param bytes payload: The serialized record.
+
+    :return bytes: Length-prefixed record.
+    """
+    return _RECORD_HEADER.pack(len(payload)) + payload
+
+
+def _decode_records(data):
+    """
+    Split journal contents into individual records.
+
+    A trailing partial record, e.g. one written by a process that crashed
+    half way through an append, is ignored.
+
+    :param bytes data: The contents of a journal file.
+
+    :return: Tuple of (``list`` of record payloads as ``bytes``, the number
+        of bytes of ``data`` taken up by complete records).
+    """
+    records = []
+    offset = 0
+    header_size = _RECORD_HEADER.size
+    while offset + header_size <= len(data):
+        (length,) = _RECORD_HEADER.unpack_from(data, offset)
+        end = offset + header_size + length
+        if end > len(data):
+            break
+        records.append(data[offset + header_size:end])
+        offset = end
+    return records, offset
+
+
+def _fsync_directory(path):
+    """
+    Flush a directory's entries to disk, so that files renamed into it
+    survive a crash.
+
+    :param FilePath path: The directory.
+    """
+    fd = os_open(path.path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+def _write_durably(path, data):
+    """
+    Atomically replace the contents of a file, flushing the new contents to
+    disk before returning.
+
+    :param FilePath path: The file to write.
+    :param bytes data: The new contents.
+    """
+    temporary = path.temporarySibling()
+    with temporary.open("wb") as f:
+        f.write(data)
+        f.flush()
+        fsync(f.fileno())
+    temporary.moveTo(path)
+    _fsync_directory(path.parent())
+
+
+# The snapshot is stored as plain JSON; its format version is part of the
+# file name rather than a header, so a future format is written alongside
+# rather than over it:
+_SNAPSHOT_FILENAME = b"current_configuration.v1.json"
+
+# Older versions of Flocker stored a pickle, or a serialized ``Deployment``
+# with a version header, in this file:
+_LEGACY_SNAPSHOT_FILENAME = b"current_configuration.pickle"
+
+
+def _dump_snapshot(deployment):
+    """
+    :param Deployment deployment: The configuration to store.
+
+    :return bytes: The contents of a snapshot file.
+    """
+    return dumps(_DEPLOYMENT[0](deployment), separators=(",", ":"))
+
+
+def _load_snapshot(data):
+    """
+    :param bytes data: Output of ``_dump_snapshot``.
+
+    :return Deployment: The stored configuration.
+    """
+    return _DEPLOYMENT[1](loads(data))
+
+
+def _load_legacy_snapshot(data):
+    """
+    :param bytes data: The contents of a snapshot file written by an older
+        version of Flocker.
+
+    :return Deployment: The stored configuration.
+    """
+    if _is_versioned(data):
+        return deserialize_deployment(data)
+    return pickle_loads(data)
+
+
+class _GroupCommitWriter(object):
+    """
+    Run writes in a dedicated thread, combining all items submitted within
+    a short window of each other into a single write.
+
+    While a write is in progress newly submitted items are queued, and are
+    written together as soon as the current write finishes.
+
+    :ivar list _pending: ``(item, Deferred)`` pairs waiting to be written.
+    :ivar _scheduled: ``IDelayedCall`` for the next write, or ``None``.
+    :ivar bool _writing: Whether a write is currently in progress.
+    """
+    def __init__(self, reactor, window, write, written):
+        """
+        :param reactor: Reactor used to schedule writes and to receive
+            results from the writer thread.
+        :param float window: Number of seconds to wait for further items
+            after the first item of a batch is submitted.
+        :param write: Callable that takes a ``list`` of items and writes
+            them durably. It is called in the writer thread.
+        :param written: Callable taking no arguments, called in the reactor
+            thread after each successful write.
+        """
+        self._reactor = reactor
+        self._window = window
+        self._write = write
+        self._written = written
+        # The thread is only started once there is something to write:
+        self._pool = None
+        self._pending = []
+        self._scheduled = None
+        self._writing = False
+        self._drain_waiters = []
+
+    def submit(self, item):
+        """
+        Queue an item to be written.
+
+        :param item: Object to pass to ``write`` as part of a batch.
+
+        :return Deferred: Fires with ``None`` once the batch including the
+            item has been written, or with the write's failure.
+        """
+        result = Deferred()
+        self._pending.append((item, result))
+        if self._scheduled is None and not self._writing:
+            self._scheduled = self._reactor.callLater(
+                self._window, self._flush)
+        return result
+
+    def _flush(self):
+        """
+        Write all pending items in the writer thread.
+        """
+        self._scheduled = None
+        batch, self._pending = self._pending, []
+        if self._pool is None:
+            self._pool = ThreadPool(minthreads=1, maxthreads=1,
+                                    name="configuration-writer")
+            self._pool.start()
+        self._writing = True
+        writing = deferToThreadPool(
+            self._reactor, self._pool, self._write,
+            [item for item, _ in batch])
+
+        def finished(result):
+            self._writing = False
+            if self._pending:
+                self._flush()
+            if result is None:
+                self._written()
+            for _, waiting in batch:
+                if result is None:
+                    waiting.callback(None)
+                else:
+                    waiting.errback(result)
+            if not self._writing:
+                waiters, self._drain_waiters = self._drain_waiters, []
+                for waiter in waiters:
+                    waiter.callback(None)
+        writing.addBoth(finished)
+
+    def stop(self):
+        """
+        Write any pending items immediately and stop the writer thread.
+
+        :return Deferred: Fires once all submitted items have been written.
+        """
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._flush()
+        if self._writing:
+            result = Deferred()
+            self._drain_waiters.append(result)
+        else:
+            result = succeed(None)
+
+        def stop_pool(_):
+            if self._pool is not None:
+                self._pool.stop()
+                self._pool = None
+        result.addCallback(stop_pool)
+        return result
 
 
 class ConfigurationPersistenceService(Service):
@@ -42,26 +621,132 @@ class ConfigurationPersistenceService(Service):
     Persist configuration to disk, and load it back.
 
     :ivar Deployment _deployment: The current desired deployment configuration.
+    :ivar int _journal_records: The number of records in the journal since
+        the last snapshot was written.
     """
-    def __init__(self, reactor, path):
+    def __init__(self, reactor, path, journal_limit=100,
+                 group_commit_window=None):
         """
         :param reactor: Reactor to use for thread pool.
         :param FilePath path: Directory where desired deployment will be
             persisted.
+        :param int journal_limit: The number of records the journal may
+            contain before it is compacted into a new snapshot.
+        :param group_commit_window: If ``None`` saves are written
+            synchronously in the reactor thread. Otherwise the number of
+            seconds during which saves are combined into a single write
+            done by a dedicated writer thread.
         """
+        self._reactor = reactor
         self._path = path
+        self._journal_limit = journal_limit
+        self._group_commit_window = group_commit_window
+        self._writer = None
         self._change_callbacks = []
+        self._journal = None
+        # Whether a write failed, so the journal no longer leads to the
+        # configuration the next deltas are based on:
+        self._write_failed = False
 
     def startService(self):
         if not self._path.exists():
             self._path.makedirs()
-        self._config_path = self._path.child(b"current_configuration.pickle")
+        self._config_path = self._path.child(_SNAPSHOT_FILENAME)
+        self._journal_path = self._path.child(b"configuration_journal")
+        legacy_config_path = self._path.child(_LEGACY_SNAPSHOT_FILENAME)
         if self._config_path.exists():
-            self._deployment = deserialize_deployment(
-                self._config_path.getContent())
+            self._deployment, legacy = self._load(
+                _load_snapshot(self._config_path.getContent()))
+            if legacy:
+                # Don't keep journal records written by older versions of
+                # Flocker in a deprecated format around:
+                self._write_snapshot(self._deployment)
+        elif legacy_config_path.exists():
+            # Configuration written by an older version of Flocker:
+            self._deployment, _ = self._load(
+                _load_legacy_snapshot(legacy_config_path.getContent()))
+            self._write_snapshot(self._deployment)
         else:
             self._deployment = Deployment(nodes=frozenset())
-            self._sync_save(self._deployment)
+            self._write_snapshot(self._deployment)
+        if legacy_config_path.exists():
+            # Only removed once the configuration it contains is in the new
+            # snapshot, so a crash during migration loses nothing:
+            legacy_config_path.remove()
+        self._journal = self._journal_path.open("ab")
+        if self._group_commit_window is not None:
+            self._writer = _GroupCommitWriter(
+                self._reactor, self._group_commit_window,
+                self._write_batch, self._notify_changed)
+
+    def stopService(self):
+        if self._writer is not None:
+            stopping = self._writer.stop()
+            self._writer = None
+        else:
+            stopping = succeed(None)
+
+        def close_journal(_):
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        stopping.addCallback(close_journal)
+        return stopping
+
+    def _load(self, deployment):
+        """
+        Replay the journal on top of the latest snapshot.
+
+        Replaying records that are already included in the snapshot is
+        harmless, since each record sets nodes to their absolute value: this
+        makes a crash between writing a snapshot and truncating the journal
+        safe.
+
+        Older versions of Flocker journaled changes using ``pickle``; such
+        records are still loaded so that upgrades preserve configuration.
+
+        :param Deployment deployment: The configuration loaded from the
+            latest snapshot.
+
+        :return: Tuple of the persisted ``Deployment`` and whether any
+            journal records in the deprecated format were loaded.
+        """
+        legacy = False
+        self._journal_records = 0
+        if self._journal_path.exists():
+            records, valid_length = _decode_records(
+                self._journal_path.getContent())
+            if valid_length != self._journal_path.getsize():
+                # Discard a partially written trailing record so future
+                # appends are readable:
+                with self._journal_path.open("r+b") as journal:
+                    journal.truncate(valid_length)
+            deltas = []
+            for record in records:
+                if _is_versioned(record):
+                    deltas.append(deserialize_deployment_delta(record))
+                else:
+                    legacy = True
+                    deltas.append(pickle_loads(record))
+            deployment = apply_deltas(deployment, deltas)
+            self._journal_records = len(records)
+        return deployment, legacy
+
+    def _write_snapshot(self, deployment):
+        """
+        Write a full snapshot of the given deployment and empty the journal.
+
+        The snapshot is on disk before the journal is truncated, so a crash
+        at any point loses no configuration.
+        """
+        _write_durably(self._config_path, _dump_snapshot(deployment))
+        if self._journal is not None:
+            self._journal.truncate(0)
+            self._journal.flush()
+            fsync(self._journal.fileno())
+        else:
+            _write_durably(self._journal_path, b"")
+        self._journal_records = 0
 
     def register(self, change_callback):
         """
@@ -72,28 +757,81 @@ class ConfigurationPersistenceService(Service):
         """
         self._change_callbacks.append(change_callback)
 
+    def _write_batch(self, changes):
+        """
+        Save and flush a series of changes to disk synchronously, as a
+        single write.
+
+        Only the differences from the previously saved deployment are
+        written, unless the journal has grown large enough to be compacted
+        or a previous write failed: the deltas of the changes that failed
+        to be written are lost, so a full snapshot is written instead.
+
+        :param changes: ``list`` of ``(delta, deployment)`` tuples, where
+            ``delta`` is the result of ``deployment_delta`` and
+            ``deployment`` is the ``Deployment`` after applying it.
+        """
+        try:
+            if (self._write_failed or
+                    self._journal_records >= self._journal_limit):
+                self._write_snapshot(changes[-1][1])
+            else:
+                self._journal.write(b"".join(
+                    _encode_record(serialize_deployment_delta(delta))
+                    for delta, _ in changes))
+                self._journal.flush()
+                fsync(self._journal.fileno())
+                self._journal_records += len(changes)
+        except:
+            self._write_failed = True
+            raise
+        self._write_failed = False
+
     def _sync_save(self, deployment):
         """
         Save and flush new deployment to disk synchronously.
         """
-        self._config_path.setContent(serialize_deployment(deployment))
+        self._write_batch(
+            [(deployment_delta(self._deployment, deployment), deployment)])
+
+    def _notify_changed(self):
+        """
+        Call all registered change callbacks.
+        """
+        for callback in self._change_callbacks:
+            # Handle errors by catching and logging them
+            # https://clusterhq.atlassian.net/browse/FLOC-1311
+            callback()
 
     def save(self, deployment):
         """
         Save and flush new deployment to disk.
 
+        When group commit is enabled the new deployment is immediately
+        returned by ``get``, so that further changes can be based on it,
+        and change callbacks are called once per batch once it has been
+        written.
+
         :return Deferred: Fires when write is finished.
         """
-        self._sync_save(deployment)
+        if self._writer is None:
+            self._sync_save(deployment)
+            self._deployment = deployment
+            # At some future point this will likely involve talking to a
+            # distributed system (e.g. ZooKeeper or etcd), so the API
+            # doesn't guarantee immediate saving of the data.
+            self._notify_changed()
+            return succeed(None)
+
+        delta = deployment_delta(self._deployment, deployment)
         self._deployment = deployment
-        # At some future point this will likely involve talking to a
-        # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
-        # guarantee immediate saving of the data.
-        for callback in self._change_callbacks:
-            # Handle errors by catching and logging them
-            # https://clusterhq.atlassian.net/browse/FLOC-1311
-            callback()
-        return succeed(None)
+        saving = self._writer.submit((delta, deployment))
+
+        def failed(reason):
+            write_failure(reason, _logger, u"flocker:control:save")
+            return reason
+        saving.addErrback(failed)
+        return saving
 
     def get(self):
         """
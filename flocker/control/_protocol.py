@@ -14,7 +14,7 @@ Interactions:
 
 * The control service knows the desired configuration for the cluster.
   Every time it changes it notifies the convergence agents using the
-  ClusterStatusCommand.
+  ClusterStatusCommand or ClusterStatusDiffCommand.
 * The convergence agents know the state of nodes. Whenever node state
   changes they notify the control service with a NodeStateCommand.
 * The control service caches the current state of all nodes. Whenever the
@@ -22,44 +22,125 @@ Interactions:
   NodeStateCommand, the control service then aggregates that update with
   the rest of the nodes' state and sends a ClusterStatusCommand to all
   convergence agents.
+* Each change to configuration or state is numbered with a generation.
+  The control service remembers which generation each agent has
+  acknowledged and only sends the changes since that generation using
+  ClusterStatusDiffCommand. A new connection, or an agent that cannot
+  apply the changes, gets a complete ClusterStatusCommand instead.
 """
 
-from pickle import dumps, loads
-
 from characteristic import with_cmp
 
 from zope.interface import Interface
 
 from twisted.application.service import Service
 from twisted.protocols.amp import (
-    Argument, Command, Integer, CommandLocator, AMP,
+    Argument, Command, Integer, CommandLocator, AMP, MAX_VALUE_LENGTH,
 )
 from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 
-from ._persistence import serialize_deployment, deserialize_deployment
+from ._persistence import (
+    serialize_deployment, deserialize_deployment, serialize_node_state,
+    deserialize_node_state, serialize_deployment_delta,
+    deserialize_deployment_delta, deployment_delta, apply_deltas,
+    )
 
 
-class NodeStateArgument(Argument):
+class _ChunkedArgument(Argument):
     """
-    AMP argument that takes a ``NodeState`` object.
+    AMP argument whose serialization may be larger than the 64KiB limit on
+    AMP values.
+
+    The serialization is split into chunks stored under the keys
+    ``<name>.0``, ``<name>.1`` and so on, which are reassembled on the
+    receiving side.
+    """
+    def toBox(self, name, strings, objects, proto):
+        value = self.toStringProto(objects[name], proto)
+        for index, offset in enumerate(
+                range(0, max(len(value), 1), MAX_VALUE_LENGTH)):
+            strings[b"%s.%d" % (name, index)] = value[
+                offset:offset + MAX_VALUE_LENGTH]
+
+    def fromBox(self, name, strings, objects, proto):
+        chunks = []
+        while True:
+            key = b"%s.%d" % (name, len(chunks))
+            if key not in strings:
+                break
+            chunks.append(strings.pop(key))
+        objects[name] = self.fromStringProto(b"".join(chunks), proto)
+
+
+class _CachingArgument(_ChunkedArgument):
+    """
+    AMP argument that remembers the serialization of the last object it
+    serialized.
+
+    When broadcasting, the control service sends the very same objects to
+    every connection, so this ensures they are only serialized once per
+    broadcast rather than once per connection.
+
+    :ivar _last: Tuple of the last object serialized and its serialization,
+        or ``None``.
     """
+    _last = None
+
+    def __init__(self, serialize, deserialize, optional=False):
+        """
+        :param serialize: Callable converting an object to ``bytes``.
+        :param deserialize: Callable converting ``bytes`` produced by
+            ``serialize`` back to an object.
+        :param bool optional: Whether the argument may be omitted.
+        """
+        _ChunkedArgument.__init__(self, optional)
+        self._serialize = serialize
+        self._deserialize = deserialize
+
     def fromString(self, in_bytes):
-        return loads(in_bytes)
+        return self._deserialize(in_bytes)
+
+    def toString(self, obj):
+        if self._last is None or self._last[0] is not obj:
+            self._last = (obj, self._serialize(obj))
+        return self._last[1]
+
 
-    def toString(self, node_state):
-        return dumps(node_state)
+class NodeStateArgument(_CachingArgument):
+    """
+    AMP argument that takes a ``NodeState`` object.
+    """
+    def __init__(self, optional=False):
+        _CachingArgument.__init__(
+            self, serialize_node_state, deserialize_node_state, optional)
 
 
-class DeploymentArgument(Argument):
+class DeploymentArgument(_CachingArgument):
     """
     AMP argument that takes a ``Deployment`` object.
     """
-    def fromString(self, in_bytes):
-        return deserialize_deployment(in_bytes)
+    def __init__(self, optional=False):
+        _CachingArgument.__init__(
+            self, serialize_deployment, deserialize_deployment, optional)
 
-    def toString(self, deployment):
-        return serialize_deployment(deployment)
+
+class DeploymentDeltaArgument(_CachingArgument):
+    """
+    AMP argument that takes a delta between two ``Deployment`` objects, as
+    returned by ``deployment_delta``.
+    """
+    def __init__(self, optional=False):
+        _CachingArgument.__init__(
+            self, serialize_deployment_delta, deserialize_deployment_delta,
+            optional)
+
+
+class GenerationMismatch(Exception):
+    """
+    The convergence agent does not know the generation of cluster status a
+    ``ClusterStatusDiffCommand`` is based on.
+    """
 
 
 class VersionCommand(Command):
@@ -81,10 +162,25 @@ class ClusterStatusCommand(Command):
     in the convergence agent during startup.
     """
     arguments = [('configuration', DeploymentArgument()),
-                 ('state', DeploymentArgument())]
+                 ('state', DeploymentArgument()),
+                 ('generation', Integer())]
     response = []
 
 
+class ClusterStatusDiffCommand(Command):
+    """
+    Used by the control service to inform a convergence agent of changes
+    to the cluster state and desired configuration since a generation the
+    agent previously acknowledged.
+    """
+    arguments = [('base_generation', Integer()),
+                 ('generation', Integer()),
+                 ('configuration_diff', DeploymentDeltaArgument()),
+                 ('state_diff', DeploymentDeltaArgument())]
+    response = []
+    errors = {GenerationMismatch: b"GENERATION_MISMATCH"}
+
+
 class NodeStateCommand(Command):
     """
     Used by a convergence agent to update the control service about the
@@ -108,7 +204,7 @@ class ControlServiceLocator(CommandLocator):
 
     @VersionCommand.responder
     def version(self):
-        return {"major": 1}
+        return {"major": 3}
 
     @NodeStateCommand.responder
     def node_changed(self, node_state):
@@ -142,47 +238,171 @@ class ControlAMPService(Service):
     Control Service AMP server.
 
     Convergence agents connect to this server.
+
+    :ivar int _generation: Incremented every time the configuration or
+        cluster state changes.
+    :ivar dict _acknowledged: Mapping from connection to a tuple of the
+        generation, configuration and state it last acknowledged.
+    :ivar set _sending: Connections with an unacknowledged update.
+    :ivar set _pending: Connections which should be sent another update
+        once the current one is acknowledged.
+    :ivar int broadcasts_sent: The number of times the cluster status has
+        been sent to all connections.
+    :ivar int broadcasts_suppressed: The number of node state updates
+        which did not cause a broadcast of their own, because they were
+        combined with another update's broadcast.
     """
-    def __init__(self, cluster_state, configuration_service, endpoint):
+    def __init__(self, reactor, cluster_state, configuration_service,
+                 endpoint, node_state_window=None,
+                 node_state_max_latency=None):
         """
+        :param reactor: Reactor used to delay broadcasts.
         :param ClusterStateService cluster_state: Object that records known
             cluster state.
         :param ConfigurationPersistenceService configuration_service:
             Persistence service for desired cluster configuration.
         :param endpoint: Endpoint to listen on.
+        :param node_state_window: If ``None``, every node state update is
+            broadcast immediately. Otherwise the number of seconds to wait
+            for further node state updates before broadcasting; all the
+            updates are then sent together.
+        :param node_state_max_latency: The maximum number of seconds a node
+            state update will be delayed by further updates arriving within
+            ``node_state_window``. Defaults to ``node_state_window``.
         """
+        self._reactor = reactor
+        self._node_state_window = node_state_window
+        if node_state_max_latency is None:
+            node_state_max_latency = node_state_window
+        self._node_state_max_latency = node_state_max_latency
+        self._scheduled_broadcast = None
+        self._first_delayed = None
+        self.broadcasts_sent = 0
+        self.broadcasts_suppressed = 0
         self.connections = set()
         self.cluster_state = cluster_state
         self.configuration_service = configuration_service
         self.endpoint_service = StreamServerEndpointService(
             endpoint, ServerFactory.forProtocol(lambda: ControlAMP(self)))
+        self._generation = 0
+        self._acknowledged = {}
+        self._sending = set()
+        self._pending = set()
         # When configuration changes, notify all connected clients:
-        self.configuration_service.register(
-            lambda: self._send_state_to_connections(self.connections))
+        self.configuration_service.register(self._changed)
 
     def startService(self):
         self.endpoint_service.startService()
 
     def stopService(self):
         self.endpoint_service.stopService()
+        if self._scheduled_broadcast is not None:
+            self._scheduled_broadcast.cancel()
+            self._scheduled_broadcast = None
         for connection in self.connections:
             connection.transport.loseConnection()
 
+    def _changed(self):
+        """
+        The configuration has changed; start a new generation and notify all
+        connections.
+        """
+        self._generation += 1
+        self._broadcast()
+
+    def _broadcast(self):
+        """
+        Send the cluster status to all connections, including any delayed
+        node state updates.
+        """
+        if self._scheduled_broadcast is not None:
+            if self._scheduled_broadcast.active():
+                self._scheduled_broadcast.cancel()
+            self._scheduled_broadcast = None
+        self.broadcasts_sent += 1
+        self._send_state_to_connections(self.connections)
+
     def _send_state_to_connections(self, connections):
         """
         Send desired configuration and cluster state to all given connections.
 
+        Connections which have not yet acknowledged a previous update will
+        be sent the latest status once they do.
+
         :param connections: A collection of ``AMP`` instances.
         """
         configuration = self.configuration_service.get()
         state = self.cluster_state.as_deployment()
+        # Most connections will have acknowledged the same generation, so
+        # only calculate the changes from each generation once:
+        diffs = {}
         for connection in connections:
-            connection.callRemote(ClusterStatusCommand,
-                                  configuration=configuration,
-                                  state=state)
-            # Handle errors from callRemote by logging them
+            if connection in self._sending:
+                self._pending.add(connection)
+                continue
+            self._send(connection, configuration, state, diffs)
+
+    def _send(self, connection, configuration, state, diffs):
+        """
+        Send desired configuration and cluster state to a connection; only
+        the changes are sent if the connection has acknowledged a previous
+        generation.
+
+        :param connection: An ``AMP`` instance.
+        :param Deployment configuration: The current configuration.
+        :param Deployment state: The current cluster state.
+        :param dict diffs: Mapping from generation to tuple of the
+            configuration and state deltas from that generation to the
+            current one.
+        """
+        generation = self._generation
+        acknowledged = self._acknowledged.get(connection)
+        if acknowledged is None:
+            sending = connection.callRemote(ClusterStatusCommand,
+                                            configuration=configuration,
+                                            state=state,
+                                            generation=generation)
+        else:
+            base_generation, base_configuration, base_state = acknowledged
+            if base_generation not in diffs:
+                diffs[base_generation] = (
+                    deployment_delta(base_configuration, configuration),
+                    deployment_delta(base_state, state))
+            configuration_diff, state_diff = diffs[base_generation]
+            if configuration_diff == state_diff == (frozenset(), frozenset()):
+                # Nothing the agent can see has changed, so keep using the
+                # generation it knows about:
+                self._acknowledged[connection] = (
+                    base_generation, configuration, state)
+                return
+            sending = connection.callRemote(
+                ClusterStatusDiffCommand,
+                base_generation=base_generation, generation=generation,
+                configuration_diff=configuration_diff, state_diff=state_diff)
+        self._sending.add(connection)
+
+        def acknowledged(_):
+            if connection in self.connections:
+                self._acknowledged[connection] = (
+                    generation, configuration, state)
+
+        def failed(reason):
+            # Send a complete status next time:
+            self._acknowledged.pop(connection, None)
+            if reason.check(GenerationMismatch):
+                if connection in self.connections:
+                    self._pending.add(connection)
+            # Handle other errors from callRemote by logging them
             # https://clusterhq.atlassian.net/browse/FLOC-1311
 
+        def finished(_):
+            self._sending.discard(connection)
+            if connection in self._pending:
+                self._pending.discard(connection)
+                self._send_state_to_connections([connection])
+        sending.addCallbacks(acknowledged, failed)
+        sending.addCallback(finished)
+
     def connected(self, connection):
         """
         A new connection has been made to the server.
@@ -199,6 +419,9 @@ class ControlAMPService(Service):
         :param ControlAMP connection: The lost connection.
         """
         self.connections.remove(connection)
+        self._acknowledged.pop(connection, None)
+        self._sending.discard(connection)
+        self._pending.discard(connection)
 
     def node_changed(self, node_state):
         """
@@ -207,8 +430,23 @@ class ControlAMPService(Service):
         :param bytes hostname: The hostname of the node.
         :param NodeState node_state: The changed state for the node.
         """
-        self.cluster_state.update_node_state(node_state)
-        self._send_state_to_connections(self.connections)
+        if not self.cluster_state.update_node_state(node_state):
+            # Nothing changed, e.g. a keep-alive refresh of the state:
+            return
+        self._generation += 1
+        if self._node_state_window is None:
+            self._broadcast()
+            return
+        now = self._reactor.seconds()
+        if self._scheduled_broadcast is None:
+            self._first_delayed = now
+            self._scheduled_broadcast = self._reactor.callLater(
+                self._node_state_window, self._broadcast)
+        else:
+            self.broadcasts_suppressed += 1
+            deadline = min(now + self._node_state_window,
+                           self._first_delayed + self._node_state_max_latency)
+            self._scheduled_broadcast.reset(deadline - now)
 
 
 class IConvergenceAgent(Interface):
@@ -245,6 +483,11 @@ class IConvergenceAgent(Interface):
 class _AgentLocator(CommandLocator):
     """
     Command locator for convergence agent.
+
+    :ivar _generation: The generation of the latest cluster status received,
+        or ``None`` if none has been received yet.
+    :ivar Deployment _configuration: The latest desired configuration.
+    :ivar Deployment _state: The latest cluster state.
     """
     def __init__(self, agent):
         """
@@ -252,10 +495,32 @@ class _AgentLocator(CommandLocator):
         """
         CommandLocator.__init__(self)
         self.agent = agent
+        self._generation = None
+        self._configuration = None
+        self._state = None
 
-    @ClusterStatusCommand.responder
-    def cluster_updated(self, configuration, state):
+    def _update(self, generation, configuration, state):
+        """
+        Record the latest cluster status and notify the agent.
+        """
+        self._generation = generation
+        self._configuration = configuration
+        self._state = state
         self.agent.cluster_updated(configuration, state)
+
+    @ClusterStatusCommand.responder
+    def cluster_updated(self, configuration, state, generation):
+        self._update(generation, configuration, state)
+        return {}
+
+    @ClusterStatusDiffCommand.responder
+    def cluster_changed(self, base_generation, generation,
+                        configuration_diff, state_diff):
+        if self._generation is None or base_generation != self._generation:
+            raise GenerationMismatch()
+        self._update(generation,
+                     apply_deltas(self._configuration, [configuration_diff]),
+                     apply_deltas(self._state, [state_diff]))
         return {}
 
 
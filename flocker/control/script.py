@@ -17,6 +17,17 @@ from ..common.script import (
 from ._protocol import ControlAMPService
 
 
+# Configuration changes made via the API within this many seconds of each
+# other are written to disk together:
+GROUP_COMMIT_WINDOW = 0.005
+
+# Node state updates from convergence agents arriving within this many
+# seconds of each other are sent to agents in a single broadcast, delaying
+# an update by at most NODE_STATE_MAX_LATENCY seconds:
+NODE_STATE_WINDOW = 0.1
+NODE_STATE_MAX_LATENCY = 1.0
+
+
 @flocker_standard_options
 class ControlOptions(Options):
     """
@@ -29,6 +40,12 @@ class ControlOptions(Options):
          int],
         ["agent-port", "a", 4524,
          "The port convergence agents will connect to.", int],
+        ["node-state-window", None, NODE_STATE_WINDOW,
+         "Node state updates arriving within this many seconds of each "
+         "other are sent to agents in a single broadcast.", float],
+        ["node-state-max-latency", None, NODE_STATE_MAX_LATENCY,
+         "The longest time in seconds a node state update is delayed to be "
+         "combined with others.", float],
     ]
 
 
@@ -40,15 +57,18 @@ class ControlScript(object):
     def main(self, reactor, options):
         top_service = MultiService()
         persistence = ConfigurationPersistenceService(
-            reactor, options["data-path"])
+            reactor, options["data-path"],
+            group_commit_window=GROUP_COMMIT_WINDOW)
         persistence.setServiceParent(top_service)
         cluster_state = ClusterStateService()
         cluster_state.setServiceParent(top_service)
         create_api_service(persistence, cluster_state, TCP4ServerEndpoint(
             reactor, options["port"])).setServiceParent(top_service)
         amp_service = ControlAMPService(
-            cluster_state, persistence, TCP4ServerEndpoint(
-                reactor, options["agent-port"]))
+            reactor, cluster_state, persistence, TCP4ServerEndpoint(
+                reactor, options["agent-port"]),
+            node_state_window=options["node-state-window"],
+            node_state_max_latency=options["node-state-max-latency"])
         amp_service.setServiceParent(top_service)
         return main_for_service(reactor, top_service)
 
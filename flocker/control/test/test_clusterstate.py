@@ -112,3 +112,61 @@ class ClusterStateServiceTests(SynchronousTestCase):
         self.assertEqual(
             service.manifestation_path(u"host1", MANIFESTATION.dataset_id),
             FilePath(b"/xxx/yyy"))
+
+    def test_as_deployment_cached(self):
+        """
+        ``as_deployment`` returns the same object until the state changes.
+        """
+        service = self.service()
+        service.update_node_state(NodeState(hostname=u"host1",
+                                            running=[APP1], not_running=[]))
+        first = service.as_deployment()
+        second = service.as_deployment()
+        service.update_node_state(NodeState(hostname=u"host1",
+                                            running=[APP2], not_running=[]))
+        self.assertEqual((first is second, service.as_deployment() is first),
+                         (True, False))
+
+    def test_unchanged_nodes_reused(self):
+        """
+        ``Node`` instances for hosts whose state has not changed are reused
+        by subsequent results of ``as_deployment``.
+        """
+        service = self.service()
+        service.update_node_state(NodeState(hostname=u"host1",
+                                            running=[APP1], not_running=[]))
+        service.update_node_state(NodeState(hostname=u"host2",
+                                            running=[APP2], not_running=[]))
+        [first] = [node for node in service.as_deployment().nodes
+                   if node.hostname == u"host1"]
+        service.update_node_state(NodeState(hostname=u"host2",
+                                            running=[], not_running=[]))
+        [second] = [node for node in service.as_deployment().nodes
+                    if node.hostname == u"host1"]
+        self.assertIs(first, second)
+
+    def test_update_changed(self):
+        """
+        ``ClusterStateService.update_node_state`` returns ``True`` when the
+        new state differs from the known state.
+        """
+        service = self.service()
+        results = [service.update_node_state(NodeState(
+            hostname=u"host1", running=running, not_running=[]))
+            for running in ([APP1], [APP2])]
+        self.assertEqual(results, [True, True])
+
+    def test_update_unchanged(self):
+        """
+        ``ClusterStateService.update_node_state`` returns ``False`` when the
+        new state is the same as the known state, and ``as_deployment``
+        continues to return the same object.
+        """
+        service = self.service()
+        service.update_node_state(NodeState(hostname=u"host1",
+                                            running=[APP1], not_running=[]))
+        first = service.as_deployment()
+        result = service.update_node_state(NodeState(
+            hostname=u"host1", running=[APP1], not_running=[]))
+        self.assertEqual((result, service.as_deployment() is first),
+                         (False, True))
@@ -4,12 +4,24 @@
 Tests for ``flocker.control._persistence``.
 """
 
+from os import fstat
+from pickle import dumps
+
 from twisted.internet import reactor
-from twisted.trial.unittest import TestCase
+from twisted.internet.defer import gatherResults
+from twisted.trial.unittest import TestCase, SynchronousTestCase
 from twisted.python.filepath import FilePath
 
-from .._persistence import ConfigurationPersistenceService
-from .._model import Deployment, Application, DockerImage, Node
+from .. import _persistence
+from .._persistence import (
+    ConfigurationPersistenceService, serialize_deployment,
+    deserialize_deployment, serialize_node_state, deserialize_node_state,
+    deployment_delta, apply_deltas, _load_snapshot,
+    )
+from .._model import (
+    Deployment, Application, DockerImage, Node, NodeState, AttachedVolume,
+    Manifestation, Dataset, Port, Link, RestartAlways, RestartOnFailure,
+    )
 
 
 TEST_DEPLOYMENT = Deployment(nodes=frozenset([
@@ -21,6 +33,98 @@ TEST_DEPLOYMENT = Deployment(nodes=frozenset([
 ]))
 
 
+MANIFESTATION = Manifestation(
+    dataset=Dataset(dataset_id=u"d1", maximum_size=1024 * 1024 * 100,
+                    metadata={u"name": u"db"}),
+    primary=True)
+FULL_APPLICATION = Application(
+    name=u"database",
+    image=DockerImage(repository=u"clusterhq/postgres", tag=u"9.1"),
+    ports=frozenset([Port(internal_port=5432, external_port=5433)]),
+    volume=AttachedVolume(manifestation=MANIFESTATION,
+                          mountpoint=FilePath(b"/var/lib/data")),
+    links=frozenset([Link(local_port=80, remote_port=8080, alias=u"WEB")]),
+    environment=frozenset([(u"KEY", u"value")]),
+    memory_limit=100000000,
+    cpu_shares=512,
+    restart_policy=RestartOnFailure(maximum_retry_count=2))
+FULL_DEPLOYMENT = Deployment(nodes=frozenset([
+    Node(hostname=u"node1.example.com",
+         applications=frozenset([
+             FULL_APPLICATION,
+             Application(name=u"web",
+                         image=DockerImage.from_string(u"nginx"),
+                         restart_policy=RestartAlways())]),
+         manifestations={MANIFESTATION.dataset_id: MANIFESTATION}),
+    Node(hostname=u"node2.example.com",
+         manifestations={u"d2": Manifestation(
+             dataset=Dataset(dataset_id=u"d2", deleted=True),
+             primary=False)}),
+]))
+
+
+class SerializationTests(SynchronousTestCase):
+    """
+    Tests for serialization of model objects.
+    """
+    def test_deployment_roundtrip(self):
+        """
+        A ``Deployment`` using all supported model types can be serialized
+        and deserialized.
+        """
+        self.assertEqual(
+            deserialize_deployment(serialize_deployment(FULL_DEPLOYMENT)),
+            FULL_DEPLOYMENT)
+
+    def test_node_state_roundtrip(self):
+        """
+        A ``NodeState`` can be serialized and deserialized.
+        """
+        node_state = NodeState(
+            hostname=u"node1.example.com",
+            used_ports=[22, 5433],
+            running=[FULL_APPLICATION],
+            not_running=[Application(
+                name=u"web", image=DockerImage.from_string(u"nginx"))],
+            manifestations=[MANIFESTATION],
+            paths={MANIFESTATION.dataset_id: FilePath(b"/flocker/d1")})
+        self.assertEqual(
+            deserialize_node_state(serialize_node_state(node_state)),
+            node_state)
+
+    def test_no_class_names(self):
+        """
+        The serialized form does not include Python class or module names.
+        """
+        data = serialize_deployment(FULL_DEPLOYMENT)
+        self.assertEqual([name for name in [b"flocker", b"Manifestation",
+                                            b"Dataset", b"FilePath"]
+                          if name in data], [])
+
+    def test_version_header(self):
+        """
+        Serialized data starts with a version header.
+        """
+        self.assertTrue(
+            serialize_deployment(FULL_DEPLOYMENT).startswith(b"FLKM\x01"))
+
+    def test_unsupported_version(self):
+        """
+        Deserializing data with an unknown format version raises
+        ``ValueError``.
+        """
+        data = serialize_deployment(FULL_DEPLOYMENT)
+        self.assertRaises(ValueError, deserialize_deployment,
+                          b"FLKM\x02" + data[5:])
+
+    def test_pickle_rejected(self):
+        """
+        Deserializing pickled data raises ``ValueError``.
+        """
+        self.assertRaises(ValueError, deserialize_deployment,
+                          dumps(FULL_DEPLOYMENT))
+
+
 class ConfigurationPersistenceServiceTests(TestCase):
     """
     Tests for ``ConfigurationPersistenceService``.
@@ -60,7 +164,22 @@ class ConfigurationPersistenceServiceTests(TestCase):
         """
         path = FilePath(self.mktemp())
         self.service(path)
-        self.assertTrue(path.child(b"current_configuration.pickle").exists())
+        self.assertTrue(path.child(b"current_configuration.v1.json").exists())
+
+    def test_snapshot_is_json(self):
+        """
+        The snapshot file contains the configuration encoded as JSON.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, journal_limit=0)
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            _load_snapshot(path.child(
+                b"current_configuration.v1.json").getContent()),
+            TEST_DEPLOYMENT)
 
     def test_save_then_get(self):
         """
@@ -108,3 +227,337 @@ class ConfigurationPersistenceServiceTests(TestCase):
             self.assertEqual((l, l2), ([1, 1], [1]))
         d.addCallback(saved_again)
         return d
+
+    def test_save_appends_to_journal(self):
+        """
+        Saving a configuration appends a record to the journal rather than
+        rewriting the snapshot.
+        """
+        path = FilePath(self.mktemp())
+        service = self.service(path)
+        snapshot = path.child(b"current_configuration.v1.json").getContent()
+        d = service.save(TEST_DEPLOYMENT)
+
+        def saved(_):
+            self.assertEqual(
+                (path.child(b"current_configuration.v1.json").getContent(),
+                 path.child(b"configuration_journal").getsize() > 0),
+                (snapshot, True))
+        d.addCallback(saved)
+        return d
+
+    def test_journal_only_contains_changes(self):
+        """
+        A journal record only includes the nodes that changed, so its size
+        does not depend on the number of unchanged nodes.
+        """
+        path = FilePath(self.mktemp())
+        service = self.service(path)
+        journal = path.child(b"configuration_journal")
+        big_deployment = Deployment(nodes=frozenset(
+            Node(hostname=u"node%d.example.com" % (i,),
+                 applications=frozenset([Application(
+                     name=u"app%d" % (i,),
+                     image=DockerImage.from_string(u"postgresql"))]))
+            for i in range(100)))
+        service.save(big_deployment)
+        journal.restat()
+        after_first = journal.getsize()
+        service.save(big_deployment.update_node(
+            Node(hostname=u"node0.example.com")))
+        journal.restat()
+        self.assertTrue(journal.getsize() - after_first < after_first / 10)
+
+    def test_persist_removal_across_restarts(self):
+        """
+        Removal of a node is persisted in the journal and is visible to a
+        new service.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(reactor, path)
+        service.startService()
+        service.save(TEST_DEPLOYMENT)
+        service.save(Deployment(nodes=frozenset()))
+        service.stopService()
+        self.assertEqual(self.service(path).get(),
+                         Deployment(nodes=frozenset()))
+
+    def test_compaction(self):
+        """
+        Once the journal contains ``journal_limit`` records the next save
+        writes a new snapshot and empties the journal.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, journal_limit=2)
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.save(TEST_DEPLOYMENT)
+        service.save(Deployment(nodes=frozenset()))
+        service.save(TEST_DEPLOYMENT)
+        journal = path.child(b"configuration_journal")
+        journal.restat()
+        self.assertEqual(
+            (_load_snapshot(
+                path.child(b"current_configuration.v1.json").getContent()),
+             journal.getsize()),
+            (TEST_DEPLOYMENT, 0))
+
+    def test_compaction_durable(self):
+        """
+        When the journal is compacted the new snapshot and the directory
+        containing it are flushed to disk before the journal is truncated.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, journal_limit=1)
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.save(TEST_DEPLOYMENT)
+        journal = path.child(b"configuration_journal")
+        synced = []
+        original_fsync = _persistence.fsync
+
+        def fsync(fd):
+            journal.restat()
+            synced.append((fstat(fd).st_ino, journal.getsize()))
+            return original_fsync(fd)
+        self.patch(_persistence, "fsync", fsync)
+        service.save(Deployment(nodes=frozenset()))
+        snapshot = path.child(b"current_configuration.v1.json")
+        journal_size = synced[0][1]
+        self.assertEqual(
+            (journal_size > 0, synced),
+            (True, [(snapshot.getInodeNumber(), journal_size),
+                    (path.getInodeNumber(), journal_size),
+                    (journal.getInodeNumber(), 0)]))
+
+    def test_persist_after_compaction(self):
+        """
+        Changes saved after a compaction are loaded by a new service.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, journal_limit=1)
+        service.startService()
+        service.save(Deployment(nodes=frozenset()))
+        service.save(Deployment(nodes=frozenset()))
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        self.assertEqual(self.service(path).get(), TEST_DEPLOYMENT)
+
+    def test_partial_record_ignored(self):
+        """
+        A partially written record at the end of the journal, e.g. due to a
+        crash, is ignored and discarded on startup.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(reactor, path)
+        service.startService()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        journal = path.child(b"configuration_journal")
+        valid = journal.getContent()
+        journal.setContent(valid + b"\x00\x00\x10\x00partial")
+
+        new_service = self.service(path)
+        journal.restat()
+        self.assertEqual((new_service.get(), journal.getContent()),
+                         (TEST_DEPLOYMENT, valid))
+
+    def assert_migrated(self, legacy_content):
+        """
+        Assert that configuration stored in the snapshot file of older
+        versions of Flocker is loaded, written to the current snapshot file
+        and the old file is removed.
+
+        :param bytes legacy_content: The content of the old snapshot file,
+            storing ``TEST_DEPLOYMENT``.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        legacy = path.child(b"current_configuration.pickle")
+        legacy.setContent(legacy_content)
+        service = self.service(path)
+        self.assertEqual(
+            (service.get(),
+             _load_snapshot(path.child(
+                 b"current_configuration.v1.json").getContent()),
+             legacy.exists()),
+            (TEST_DEPLOYMENT, TEST_DEPLOYMENT, False))
+
+    def test_legacy_pickle_migrated(self):
+        """
+        Configuration pickled by older versions of Flocker is loaded, and
+        migrated to the current snapshot file.
+        """
+        self.assert_migrated(dumps(TEST_DEPLOYMENT))
+
+    def test_legacy_versioned_migrated(self):
+        """
+        Configuration serialized with a version header into the old snapshot
+        file is loaded, and migrated to the current snapshot file.
+        """
+        self.assert_migrated(serialize_deployment(TEST_DEPLOYMENT))
+
+    def test_legacy_ignored_if_migrated(self):
+        """
+        If both the current and the old snapshot file exist, e.g. due to a
+        crash during migration, only the current one is loaded and the old
+        one is removed.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(reactor, path)
+        service.startService()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        legacy = path.child(b"current_configuration.pickle")
+        legacy.setContent(dumps(Deployment(nodes=frozenset())))
+        self.assertEqual((self.service(path).get(), legacy.exists()),
+                         (TEST_DEPLOYMENT, False))
+
+
+class DeploymentDeltaTests(SynchronousTestCase):
+    """
+    Tests for ``deployment_delta`` and ``apply_deltas``.
+    """
+    def test_unchanged(self):
+        """
+        Identical deployments have an empty delta.
+        """
+        self.assertEqual(deployment_delta(TEST_DEPLOYMENT, TEST_DEPLOYMENT),
+                         (frozenset(), frozenset()))
+
+    def test_changed_and_removed(self):
+        """
+        The delta includes changed nodes and the hostnames of removed nodes.
+        """
+        old = TEST_DEPLOYMENT.update_node(Node(hostname=u"node2"))
+        changed = Node(hostname=u"node3")
+        new = Deployment(nodes=frozenset([changed]))
+        self.assertEqual(
+            deployment_delta(old, new),
+            (frozenset([changed]),
+             frozenset([u"node1.example.com", u"node2"])))
+
+    def test_roundtrip(self):
+        """
+        Applying the delta between two deployments to the first results in
+        the second.
+        """
+        old = TEST_DEPLOYMENT.update_node(Node(hostname=u"node2"))
+        new = TEST_DEPLOYMENT.update_node(Node(hostname=u"node3"))
+        self.assertEqual(
+            apply_deltas(old, [deployment_delta(old, new)]), new)
+
+
+class GroupCommitTests(TestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` with group commit enabled.
+    """
+    def service(self, path):
+        """
+        Start a service using group commit, schedule its stop.
+
+        :param FilePath path: Where to store data.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(
+            reactor, path, group_commit_window=0.01)
+        service.startService()
+        self.addCleanup(service.stopService)
+        return service
+
+    def test_get_reflects_save_immediately(self):
+        """
+        ``get`` returns a saved configuration before it has been written, so
+        that further changes can be based on it.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        d = service.save(TEST_DEPLOYMENT)
+        self.assertEqual(service.get(), TEST_DEPLOYMENT)
+        return d
+
+    def test_saves_combined(self):
+        """
+        Saves made within the window are written by a single write, after
+        which all their ``Deferred``\ s fire.
+        """
+        service = ConfigurationPersistenceService(
+            reactor, FilePath(self.mktemp()), group_commit_window=0.01)
+        batches = []
+        original = service._write_batch
+        self.patch(service, "_write_batch",
+                   lambda changes: batches.append(len(changes))
+                   or original(changes))
+        service.startService()
+        self.addCleanup(service.stopService)
+        d = gatherResults([service.save(TEST_DEPLOYMENT),
+                           service.save(Deployment(nodes=frozenset())),
+                           service.save(TEST_DEPLOYMENT)])
+        d.addCallback(lambda _: self.assertEqual(batches, [3]))
+        return d
+
+    def test_callbacks_once_per_batch(self):
+        """
+        Change callbacks are called once per write, after the write has
+        finished.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        called = []
+        service.register(lambda: called.append(1))
+        d = gatherResults([service.save(TEST_DEPLOYMENT),
+                           service.save(Deployment(nodes=frozenset()))])
+        self.assertEqual(called, [])
+        d.addCallback(lambda _: self.assertEqual(called, [1]))
+        return d
+
+    def test_failed_write_recovered(self):
+        """
+        If a write fails its saves fail, and the next write brings the
+        configuration on disk up to date, including the changes which
+        failed to be written.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, group_commit_window=0.01)
+        service.startService()
+        self.addCleanup(service.stopService)
+        original = _persistence.fsync
+        failing = [True]
+
+        def fsync(fd):
+            if failing:
+                failing.pop()
+                raise IOError("disk on fire")
+            return original(fd)
+        self.patch(_persistence, "fsync", fsync)
+        d = service.save(TEST_DEPLOYMENT)
+        d = self.assertFailure(d, IOError)
+        d.addCallback(lambda _: self.flushLoggedErrors(IOError))
+        d.addCallback(lambda _: service.save(
+            TEST_DEPLOYMENT.update_node(
+                Node(hostname=u"node2.example.com"))))
+        d.addCallback(lambda _: service.stopService())
+        d.addCallback(lambda _: self.assertEqual(
+            self.service(path).get(),
+            TEST_DEPLOYMENT.update_node(
+                Node(hostname=u"node2.example.com"))))
+        return d
+
+    def test_stop_writes_pending(self):
+        """
+        Stopping the service writes any pending saves, so they are loaded
+        by a new service.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(
+            reactor, path, group_commit_window=10)
+        service.startService()
+        service.save(Deployment(nodes=frozenset()))
+        service.save(TEST_DEPLOYMENT)
+        d = service.stopService()
+        d.addCallback(lambda _: self.assertEqual(self.service(path).get(),
+                                                 TEST_DEPLOYMENT))
+        return d
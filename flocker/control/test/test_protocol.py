@@ -13,25 +13,32 @@ from characteristic import attributes, Attribute
 
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.test.proto_helpers import StringTransport, MemoryReactor
-from twisted.protocols.amp import UnknownRemoteError, RemoteAmpError, AMP
+from twisted.protocols.amp import (
+    UnknownRemoteError, RemoteAmpError, AMP, MAX_VALUE_LENGTH,
+    )
 from twisted.python.failure import Failure
 from twisted.internet.error import ConnectionLost
 from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.internet.defer import succeed
+from twisted.internet.defer import succeed, Deferred
+from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
 from twisted.application.internet import StreamServerEndpointService
 
 from .._protocol import (
-    NodeStateArgument, DeploymentArgument,
-    VersionCommand, ClusterStatusCommand, NodeStateCommand, IConvergenceAgent,
-    AgentAMP, ControlAMPService, ControlAMP
+    NodeStateArgument, DeploymentArgument, DeploymentDeltaArgument,
+    VersionCommand, ClusterStatusCommand, ClusterStatusDiffCommand,
+    NodeStateCommand, IConvergenceAgent, AgentAMP, ControlAMPService,
+    ControlAMP, GenerationMismatch,
 )
 from .._clusterstate import ClusterStateService
 from .._model import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset,
 )
-from .._persistence import ConfigurationPersistenceService
+from .._persistence import (
+    ConfigurationPersistenceService, deployment_delta, serialize_deployment,
+    )
+from .. import _protocol
 
 
 class LoopbackAMPClient(object):
@@ -94,6 +101,22 @@ NODE_STATE = NodeState(hostname=u'node1.example.com',
                        manifestations=frozenset([MANIFESTATION]))
 
 
+def _large_node(hostname, count):
+    """
+    Create a ``Node`` with many manifestations.
+    """
+    manifestations = {}
+    for index in range(count):
+        dataset_id = u"%s-%032d" % (hostname, index)
+        manifestations[dataset_id] = Manifestation(
+            dataset=Dataset(dataset_id=dataset_id), primary=True)
+    return Node(hostname=hostname, manifestations=manifestations)
+
+# Big enough that its serialization does not fit in a single AMP value:
+LARGE_DEPLOYMENT = Deployment(nodes=frozenset([
+    _large_node(u"node%d.example.com" % (i,), 500) for i in range(10)]))
+
+
 class SerializationTests(SynchronousTestCase):
     """
     Tests for argument serialization.
@@ -118,15 +141,56 @@ class SerializationTests(SynchronousTestCase):
         self.assertEqual([bytes, TEST_DEPLOYMENT],
                          [type(as_bytes), deserialized])
 
+    def test_serialized_once(self):
+        """
+        Serializing the same object repeatedly only serializes it once.
+        """
+        serialized = []
+        self.patch(_protocol, "serialize_deployment",
+                   lambda deployment: serialized.append(deployment) or b"x")
+        argument = DeploymentArgument()
+        results = [argument.toString(TEST_DEPLOYMENT) for i in range(3)]
+        self.assertEqual((results, serialized),
+                         ([b"x"] * 3, [TEST_DEPLOYMENT]))
+
+    def test_different_object_serialized(self):
+        """
+        Serializing a different object, even if equal to the previous one,
+        serializes it again.
+        """
+        serialized = []
+        self.patch(_protocol, "serialize_deployment",
+                   lambda deployment: serialized.append(deployment) or b"x")
+        argument = DeploymentArgument()
+        argument.toString(TEST_DEPLOYMENT)
+        argument.toString(Deployment(nodes=TEST_DEPLOYMENT.nodes))
+        self.assertEqual(len(serialized), 2)
+
+    def test_deployment_delta(self):
+        """
+        ``DeploymentDeltaArgument`` can round-trip a delta between two
+        ``Deployment`` instances.
+        """
+        argument = DeploymentDeltaArgument()
+        delta = (frozenset(TEST_DEPLOYMENT.nodes), frozenset([u"node2"]))
+        as_bytes = argument.toString(delta)
+        deserialized = argument.fromString(as_bytes)
+        self.assertEqual([bytes, delta],
+                         [type(as_bytes), deserialized])
+
 
-def build_control_amp_service(test):
+def build_control_amp_service(test, reactor=None, **kwargs):
     """
     Create a new ``ControlAMPService``.
 
     :param TestCase test: The test this service is for.
+    :param reactor: The reactor to use, by default a new ``Clock``.
+    :param kwargs: Additional keyword arguments for ``ControlAMPService``.
 
     :return ControlAMPService: Not started.
     """
+    if reactor is None:
+        reactor = Clock()
     cluster_state = ClusterStateService()
     cluster_state.startService()
     test.addCleanup(cluster_state.stopService)
@@ -134,8 +198,9 @@ def build_control_amp_service(test):
         None, FilePath(test.mktemp()))
     persistence_service.startService()
     test.addCleanup(persistence_service.stopService)
-    return ControlAMPService(cluster_state, persistence_service,
-                             TCP4ServerEndpoint(MemoryReactor(), 1234))
+    return ControlAMPService(reactor, cluster_state, persistence_service,
+                             TCP4ServerEndpoint(MemoryReactor(), 1234),
+                             **kwargs)
 
 
 class ControlAMPTests(SynchronousTestCase):
@@ -176,7 +241,8 @@ class ControlAMPTests(SynchronousTestCase):
             sent[0],
             (((ClusterStatusCommand,),
               dict(configuration=TEST_DEPLOYMENT,
-                   state=cluster_state))))
+                   state=cluster_state,
+                   generation=1))))
 
     def test_connection_lost(self):
         """
@@ -198,7 +264,7 @@ class ControlAMPTests(SynchronousTestCase):
         """
         self.assertEqual(
             self.successResultOf(self.client.callRemote(VersionCommand)),
-            {"major": 1})
+            {"major": 3})
 
     def test_nodestate_updates_node_state(self):
         """
@@ -216,6 +282,23 @@ class ControlAMPTests(SynchronousTestCase):
                          manifestations={MANIFESTATION.dataset_id:
                                          MANIFESTATION})])))
 
+    def test_unchanged_nodestate_not_broadcast(self):
+        """
+        ``NodeStateCommand`` with the same state as the control service
+        already knows about does not result in a broadcast.
+        """
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand, node_state=NODE_STATE))
+        sent = []
+        self.patch(self.protocol, "callRemote",
+                   lambda *args, **kwargs: sent.append((args, kwargs))
+                   or succeed(None))
+        broadcasts = self.control_amp_service.broadcasts_sent
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand, node_state=NODE_STATE))
+        self.assertEqual(
+            (sent, self.control_amp_service.broadcasts_sent), ([], broadcasts))
+
     def test_nodestate_notifies_all_connected(self):
         """
         ``NodeStateCommand`` results in all connected ``ControlAMP``
@@ -223,9 +306,7 @@ class ControlAMPTests(SynchronousTestCase):
         desired configuration.
         """
         self.control_amp_service.configuration_service.save(TEST_DEPLOYMENT)
-        self.protocol.makeConnection(StringTransport())
         another_protocol = ControlAMP(self.control_amp_service)
-        another_protocol.makeConnection(StringTransport())
         sent1 = []
         sent2 = []
         self.patch(self.protocol, "callRemote",
@@ -234,6 +315,8 @@ class ControlAMPTests(SynchronousTestCase):
         self.patch(another_protocol, "callRemote",
                    lambda *args, **kwargs: sent2.append((args, kwargs))
                    or succeed(None))
+        self.protocol.makeConnection(StringTransport())
+        another_protocol.makeConnection(StringTransport())
 
         self.successResultOf(
             self.client.callRemote(NodeStateCommand,
@@ -241,9 +324,12 @@ class ControlAMPTests(SynchronousTestCase):
         cluster_state = self.control_amp_service.cluster_state.as_deployment()
         self.assertListEqual(
             [sent1[-1], sent2[-1]],
-            [(((ClusterStatusCommand,),
-              dict(configuration=TEST_DEPLOYMENT,
-                   state=cluster_state)))] * 2)
+            [(((ClusterStatusDiffCommand,),
+              dict(base_generation=1,
+                   generation=2,
+                   configuration_diff=(frozenset(), frozenset()),
+                   state_diff=deployment_delta(
+                       Deployment(nodes=frozenset()), cluster_state))))] * 2)
 
 
 class ControlAMPServiceTests(SynchronousTestCase):
@@ -291,6 +377,30 @@ class ControlAMPServiceTests(SynchronousTestCase):
              [c.transport.disconnecting for c in connections]),
             ([False] * 3, [True] * 3))
 
+    def test_broadcast_serialized_once(self):
+        """
+        When the status is sent to multiple connections the configuration
+        and state are only serialized once.
+        """
+        service = build_control_amp_service(self)
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        service.cluster_state.update_node_state(NODE_STATE)
+        serialized = []
+        self.patch(_protocol, "serialize_deployment",
+                   lambda deployment: serialized.append(deployment)
+                   or serialize_deployment(deployment))
+        transports = []
+        for i in range(3):
+            transport = StringTransport()
+            ControlAMP(service).makeConnection(transport)
+            transports.append(transport)
+        self.assertEqual(
+            (len(serialized) <= 2,
+             len(serialized) == len(set(map(id, serialized))),
+             len(set(t.value() for t in transports)),
+             min(len(t.value()) for t in transports) > 0),
+            (True, True, 1, True))
+
     def test_configuration_change(self):
         """
         A configuration change results in connected protocols being notified
@@ -299,16 +409,214 @@ class ControlAMPServiceTests(SynchronousTestCase):
         service = build_control_amp_service(self)
         service.startService()
         protocol = ControlAMP(service)
-        protocol.makeConnection(StringTransport())
         sent = []
         self.patch(protocol, "callRemote",
                    lambda *args, **kwargs: sent.append((args, kwargs))
                    or succeed(None))
+        protocol.makeConnection(StringTransport())
+        service.configuration_service.save(TEST_DEPLOYMENT)
+
+        self.assertEqual(
+            sent[1:],
+            [((ClusterStatusDiffCommand,),
+              dict(base_generation=0, generation=1,
+                   configuration_diff=deployment_delta(
+                       Deployment(nodes=frozenset()), TEST_DEPLOYMENT),
+                   state_diff=(frozenset(), frozenset())))])
+
+    def connection(self, service):
+        """
+        Create a connected ``ControlAMP`` whose commands are recorded
+        rather than sent.
+
+        :param ControlAMPService service: The service the connection is to.
+
+        :return: Tuple of the ``ControlAMP`` and a ``list`` that will have
+            ``(command, kwargs, Deferred)`` tuples appended when commands are
+            sent; the ``Deferred`` is returned by ``callRemote``.
+        """
+        protocol = ControlAMP(service)
+        sent = []
+
+        def callRemote(command, **kwargs):
+            result = Deferred()
+            sent.append((command, kwargs, result))
+            return result
+        self.patch(protocol, "callRemote", callRemote)
+        protocol.makeConnection(StringTransport())
+        return protocol, sent
+
+    def test_first_status_is_complete(self):
+        """
+        A new connection is sent the complete configuration and cluster state
+        along with the current generation.
+        """
+        service = build_control_amp_service(self)
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        protocol, sent = self.connection(service)
+        self.assertEqual(
+            [(command, kwargs) for command, kwargs, _ in sent],
+            [(ClusterStatusCommand,
+              dict(configuration=TEST_DEPLOYMENT,
+                   state=Deployment(nodes=frozenset()), generation=1))])
+
+    def test_wait_for_acknowledgement(self):
+        """
+        While a connection has not acknowledged a status update, further
+        changes are not sent; once it does, only the latest status is sent,
+        as changes from the acknowledged generation.
+        """
+        service = build_control_amp_service(self)
+        protocol, sent = self.connection(service)
+        service.node_changed(NODE_STATE)
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        sending_while_unacknowledged = len(sent)
+        sent[0][2].callback({})
+        self.assertEqual(
+            (sending_while_unacknowledged,
+             [(command, kwargs) for command, kwargs, _ in sent[1:]]),
+            (1, [(ClusterStatusDiffCommand,
+                  dict(base_generation=0, generation=2,
+                       configuration_diff=deployment_delta(
+                           Deployment(nodes=frozenset()), TEST_DEPLOYMENT),
+                       state_diff=deployment_delta(
+                           Deployment(nodes=frozenset()),
+                           service.cluster_state.as_deployment())))]))
+
+    def test_unchanged_not_sent(self):
+        """
+        If nothing visible to the agent changed since the generation it
+        acknowledged, nothing is sent.
+        """
+        service = build_control_amp_service(self)
+        protocol, sent = self.connection(service)
+        sent[0][2].callback({})
+        service.configuration_service.save(Deployment(nodes=frozenset()))
+        self.assertEqual(len(sent), 1)
+
+    def test_mismatch_sends_complete(self):
+        """
+        If a connection fails a ``ClusterStatusDiffCommand`` with
+        ``GenerationMismatch`` it is sent the complete status.
+        """
+        service = build_control_amp_service(self)
+        protocol, sent = self.connection(service)
+        sent[0][2].callback({})
+        service.configuration_service.save(TEST_DEPLOYMENT)
+        sent[1][2].errback(GenerationMismatch())
+        self.assertEqual(
+            [(command, kwargs) for command, kwargs, _ in sent[2:]],
+            [(ClusterStatusCommand,
+              dict(configuration=TEST_DEPLOYMENT,
+                   state=Deployment(nodes=frozenset()), generation=1))])
+
+    def test_other_failure_complete_next_time(self):
+        """
+        If a connection fails a status update for some other reason,
+        nothing is sent immediately but the next update is complete.
+        """
+        service = build_control_amp_service(self)
+        protocol, sent = self.connection(service)
+        sent[0][2].errback(ConnectionLost())
         service.configuration_service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            [command for command, _, _ in sent],
+            [ClusterStatusCommand, ClusterStatusCommand])
+
+    def test_disconnect_forgets(self):
+        """
+        When a connection is lost the service forgets about it, and late
+        acknowledgements are ignored.
+        """
+        service = build_control_amp_service(self)
+        protocol, sent = self.connection(service)
+        protocol.connectionLost(Failure(ConnectionLost()))
+        sent[0][2].callback({})
+        self.assertEqual(
+            (service._acknowledged, service._sending, service._pending),
+            ({}, set(), set()))
+
+
+class NodeStateBroadcastTests(SynchronousTestCase):
+    """
+    Tests for combining node state updates into a single broadcast in
+    ``ControlAMPService``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.service = build_control_amp_service(
+            self, self.reactor, node_state_window=1.0,
+            node_state_max_latency=5.0)
+        self.protocol = ControlAMP(self.service)
+        self.sent = []
+        self.patch(self.protocol, "callRemote",
+                   lambda command, **kwargs: self.sent.append(command)
+                   or succeed(None))
+        self.protocol.makeConnection(StringTransport())
+        del self.sent[:]
+
+    def node_state(self, port):
+        """
+        :return: A ``NodeState`` with the given used port.
+        """
+        return NodeState(hostname=u"node1.example.com", used_ports=[port])
+
+    def test_delayed(self):
+        """
+        A node state update is broadcast once the window has passed.
+        """
+        self.service.node_changed(self.node_state(1))
+        before = list(self.sent)
+        self.reactor.advance(1.0)
+        self.assertEqual((before, self.sent,
+                          self.service.cluster_state.as_deployment()),
+                         ([], [ClusterStatusDiffCommand],
+                          Deployment(nodes=frozenset(
+                              [self.node_state(1).to_node()]))))
+
+    def test_combined(self):
+        """
+        Node state updates arriving within the window of each other are
+        sent in a single broadcast.
+        """
+        self.service.node_changed(self.node_state(1))
+        self.reactor.advance(0.5)
+        self.service.node_changed(self.node_state(2))
+        self.reactor.advance(0.9)
+        before = list(self.sent)
+        self.reactor.advance(0.1)
+        self.assertEqual(
+            (before, self.sent, self.service.broadcasts_sent,
+             self.service.broadcasts_suppressed),
+            ([], [ClusterStatusDiffCommand], 1, 1))
+
+    def test_maximum_latency(self):
+        """
+        Continuous updates delay a broadcast by at most the maximum latency.
+        """
+        for i in range(6):
+            self.service.node_changed(self.node_state(i))
+            self.reactor.advance(0.9)
+        self.assertEqual(self.sent, [ClusterStatusDiffCommand])
 
-        self.assertEqual(sent, [((ClusterStatusCommand,),
-                                 dict(configuration=TEST_DEPLOYMENT,
-                                      state=Deployment(nodes=frozenset())))])
+    def test_configuration_change_immediate(self):
+        """
+        A configuration change is broadcast immediately, including any
+        delayed node state updates, which are then not sent again.
+        """
+        self.service.node_changed(self.node_state(1))
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(1.0)
+        self.assertEqual(self.sent, [ClusterStatusDiffCommand])
+
+    def test_stop_cancels(self):
+        """
+        Stopping the service cancels any delayed broadcast.
+        """
+        self.service.startService()
+        self.service.node_changed(self.node_state(1))
+        self.service.stopService()
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
 
 
 @implementer(IConvergenceAgent)
@@ -380,13 +688,109 @@ class AgentClientTests(SynchronousTestCase):
         actual = Deployment(nodes=frozenset())
         d = self.server.callRemote(ClusterStatusCommand,
                                    configuration=TEST_DEPLOYMENT,
-                                   state=actual)
+                                   state=actual,
+                                   generation=1)
+        self.successResultOf(d)
+        self.assertEqual(self.agent, FakeAgent(is_connected=True,
+                                               client=self.client,
+                                               desired=TEST_DEPLOYMENT,
+                                               actual=actual))
+
+    def send_over_wire(self, command, **kwargs):
+        """
+        Send a command to the connected ``AgentAMP`` encoded as real AMP
+        boxes.
+        """
+        sender = AMP()
+        sender.makeConnection(StringTransport())
+        d = sender.callRemote(command, **kwargs)
+        self.client.dataReceived(sender.transport.value())
+        sender.dataReceived(self.client.transport.value())
+        self.client.transport.clear()
+        return d
+
+    def test_large_cluster_updated(self):
+        """
+        A ``ClusterStatusCommand`` whose configuration is larger than the
+        AMP limit on value lengths is delivered to the agent.
+        """
+        self.assertTrue(
+            len(serialize_deployment(LARGE_DEPLOYMENT)) > MAX_VALUE_LENGTH)
+        self.client.makeConnection(StringTransport())
+        d = self.send_over_wire(ClusterStatusCommand,
+                                configuration=LARGE_DEPLOYMENT,
+                                state=TEST_DEPLOYMENT,
+                                generation=1)
+        self.successResultOf(d)
+        self.assertEqual((self.agent.desired, self.agent.actual),
+                         (LARGE_DEPLOYMENT, TEST_DEPLOYMENT))
+
+    def test_large_cluster_changed(self):
+        """
+        A ``ClusterStatusDiffCommand`` whose changes are larger than the AMP
+        limit on value lengths is applied by the agent.
+        """
+        empty = Deployment(nodes=frozenset())
+        self.client.makeConnection(StringTransport())
+        self.send_over_wire(ClusterStatusCommand,
+                            configuration=empty, state=empty, generation=1)
+        d = self.send_over_wire(
+            ClusterStatusDiffCommand, base_generation=1, generation=2,
+            configuration_diff=deployment_delta(empty, LARGE_DEPLOYMENT),
+            state_diff=deployment_delta(empty, empty))
+        self.successResultOf(d)
+        self.assertEqual(self.agent.desired, LARGE_DEPLOYMENT)
+
+    def test_cluster_changed(self):
+        """
+        ``ClusterStatusDiffCommand`` based on the last received generation
+        results in the agent having the changes applied to its cluster
+        state and configuration.
+        """
+        self.client.makeConnection(StringTransport())
+        empty = Deployment(nodes=frozenset())
+        self.successResultOf(self.server.callRemote(
+            ClusterStatusCommand, configuration=empty, state=empty,
+            generation=1))
+        actual = Deployment(nodes=frozenset([NODE_STATE.to_node()]))
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand, base_generation=1, generation=2,
+            configuration_diff=deployment_delta(empty, TEST_DEPLOYMENT),
+            state_diff=deployment_delta(empty, actual))
         self.successResultOf(d)
         self.assertEqual(self.agent, FakeAgent(is_connected=True,
                                                client=self.client,
                                                desired=TEST_DEPLOYMENT,
                                                actual=actual))
 
+    def test_cluster_changed_mismatch(self):
+        """
+        ``ClusterStatusDiffCommand`` based on a generation other than the
+        last received one fails with ``GenerationMismatch``.
+        """
+        self.client.makeConnection(StringTransport())
+        empty = Deployment(nodes=frozenset())
+        self.successResultOf(self.server.callRemote(
+            ClusterStatusCommand, configuration=empty, state=empty,
+            generation=1))
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand, base_generation=2, generation=3,
+            configuration_diff=deployment_delta(empty, TEST_DEPLOYMENT),
+            state_diff=(frozenset(), frozenset()))
+        self.failureResultOf(d, GenerationMismatch)
+
+    def test_cluster_changed_before_status(self):
+        """
+        ``ClusterStatusDiffCommand`` received before any
+        ``ClusterStatusCommand`` fails with ``GenerationMismatch``.
+        """
+        self.client.makeConnection(StringTransport())
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand, base_generation=0, generation=1,
+            configuration_diff=(frozenset(), frozenset()),
+            state_diff=(frozenset(), frozenset()))
+        self.failureResultOf(d, GenerationMismatch)
+
 
 def iconvergence_agent_tests_factory(fixture):
     """
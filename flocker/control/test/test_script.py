@@ -4,7 +4,9 @@ from twisted.web.server import Site
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 
-from ..script import ControlOptions, ControlScript
+from ..script import (
+    ControlOptions, ControlScript, NODE_STATE_WINDOW, NODE_STATE_MAX_LATENCY,
+    )
 from ...testtools import MemoryCoreReactor, StandardOptionsTestsMixin
 from .._clusterstate import ClusterStateService
 from .._protocol import ControlAMP, ControlAMPService
@@ -70,6 +72,31 @@ class ControlOptionsTests(StandardOptionsTestsMixin,
         options.parseOptions([b"--agent-port", b"1234"])
         self.assertEqual(options["agent-port"], 1234)
 
+    def test_default_node_state_window(self):
+        """
+        By default ``ControlOptions`` combines node state updates arriving
+        within ``NODE_STATE_WINDOW`` seconds, delaying them by at most
+        ``NODE_STATE_MAX_LATENCY`` seconds.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(
+            (options["node-state-window"], options["node-state-max-latency"]),
+            (NODE_STATE_WINDOW, NODE_STATE_MAX_LATENCY))
+
+    def test_custom_node_state_window(self):
+        """
+        The ``--node-state-window`` and ``--node-state-max-latency``
+        command-line options allow configuring how node state updates are
+        combined.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--node-state-window", b"0.5",
+                              b"--node-state-max-latency", b"2.5"])
+        self.assertEqual(
+            (options["node-state-window"], options["node-state-max-latency"]),
+            (0.5, 2.5))
+
 
 class ControlScriptEffectsTests(SynchronousTestCase):
     """
@@ -138,3 +165,20 @@ class ControlScriptEffectsTests(SynchronousTestCase):
         self.assertEqual(
             (port, protocol.__class__, protocol.control_amp_service.__class__),
             (8001, ControlAMP, ControlAMPService))
+
+    def test_node_state_window(self):
+        """
+        ``ControlScript.main`` gives the AMP service the configured node
+        state window and maximum latency.
+        """
+        options = ControlOptions()
+        options.parseOptions(
+            [b"--node-state-window", b"0.5", b"--node-state-max-latency",
+             b"2.5", b"--data-path", self.mktemp()])
+        reactor = MemoryCoreReactor()
+        ControlScript().main(reactor, options)
+        service = reactor.tcpServers[1][1].buildProtocol(
+            None).control_amp_service
+        self.assertEqual(
+            (service._node_state_window, service._node_state_max_latency),
+            (0.5, 2.5))
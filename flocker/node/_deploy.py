@@ -5,8 +5,6 @@
 Deploy applications on nodes.
 """
 
-from itertools import chain
-
 from zope.interface import Interface, implementer
 
 from characteristic import attributes
@@ -17,7 +15,9 @@ from eliot import write_failure, Logger
 
 from twisted.internet.defer import gatherResults, fail, succeed
 
-from ._docker import DockerClient, PortMap, Environment, Volume as DockerVolume
+from ._docker import (
+    DockerClient, PortMap, Environment, Volume as DockerVolume, ImageManager,
+    )
 from ..control._model import (
     Application, DatasetChanges, AttachedVolume, DatasetHandoff,
     NodeState, DockerImage, Port, Link, Manifestation, Dataset
@@ -225,6 +225,19 @@ def _link_environment(protocol, alias, local_port, hostname, remote_port):
     }
 
 
+@implementer(IStateChange)
+@attributes(["image"])
+class PullImage(object):
+    """
+    Make sure the given image is available locally, so that starting an
+    application using it doesn't have to wait for it to be pulled.
+
+    :ivar DockerImage image: The image to pull.
+    """
+    def run(self, deployer):
+        return deployer.image_manager.pull(self.image.full_name)
+
+
 @implementer(IStateChange)
 @attributes(["application"])
 class StopApplication(object):
@@ -299,10 +312,9 @@ class HandoffDataset(object):
     """
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.handoff(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname))
 
 
 @implementer(IStateChange)
@@ -320,10 +332,9 @@ class PushDataset(object):
     """
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.push(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname))
 
 
 @implementer(IStateChange)
@@ -356,6 +367,16 @@ class DeleteDataset(PRecord):
         return d
 
 
+def _proxy_key(proxy):
+    """
+    :param Proxy proxy: A proxy, either desired or read back from the
+        network, whose ``ip`` may be text or an ``IPv4Address``.
+
+    :return: A key which is equal for proxies to the same address and port.
+    """
+    return (unicode(proxy.ip), proxy.port)
+
+
 @implementer(IStateChange)
 @attributes(["ports"])
 class SetProxies(object):
@@ -365,20 +386,36 @@ class SetProxies(object):
     :ivar ports: A collection of ``Port`` objects.
     """
     def run(self, deployer):
-        results = []
+        """
+        Delete the existing proxies which are not desired and create the
+        desired proxies which do not exist in one update, leaving the rest
+        untouched.
+        """
+        desired = {_proxy_key(proxy): proxy for proxy in self.ports}
+        existing = {_proxy_key(proxy): proxy
+                    for proxy in deployer.network.enumerate_proxies()}
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for proxy in deployer.network.enumerate_proxies():
-            try:
-                deployer.network.delete_proxy(proxy)
-            except:
-                results.append(fail())
-        for proxy in self.ports:
-            try:
-                deployer.network.create_proxy_to(proxy.ip, proxy.port)
-            except:
-                results.append(fail())
-        return gather_deferreds(results)
+        try:
+            deployer.network.update_proxies(
+                delete=[proxy for key, proxy in existing.items()
+                        if key not in desired],
+                create=[proxy for key, proxy in desired.items()
+                        if key not in existing])
+        except:
+            return gather_deferreds([fail()])
+        return succeed(None)
+
+
+def _ssh_volume_manager(hostname):
+    """
+    Create a ``RemoteVolumeManager`` which runs ``flocker-volume`` over SSH.
+
+    :param bytes hostname: The hostname of the node.
+
+    :return: A ``RemoteVolumeManager``.
+    """
+    return RemoteVolumeManager(standard_node(hostname))
 
 
 @implementer(IDeployer)
@@ -391,19 +428,51 @@ class P2PNodeDeployer(object):
     :ivar VolumeService volume_service: The volume manager for this node.
     :ivar IDockerClient docker_client: The Docker client API to use in
         deployment operations. Default ``DockerClient``.
+    :ivar ImageManager image_manager: Pulls images using ``docker_client``.
     :ivar INetwork network: The network routing API to use in
-        deployment operations. Default is iptables-based implementation.
+        deployment operations. Default is iptables-based implementation
+        which applies each update in one ``iptables-restore`` transaction;
+        its ``configure_forwarding`` must be called before proxies work.
     """
     def __init__(self, hostname, volume_service, docker_client=None,
-                 network=None):
+                 network=None, remote_volume_manager=None, reactor=None):
+        """
+        :param remote_volume_manager: Callable which is given a hostname
+            and returns the ``IRemoteVolumeManager`` to push volumes to
+            that node with.  It is called once per node.  Default is to
+            create a ``RemoteVolumeManager`` which uses SSH.
+        :param reactor: The reactor used by the default network.  Default
+            is the global reactor.
+        """
         self.hostname = hostname
         if docker_client is None:
             docker_client = DockerClient()
         self.docker_client = docker_client
+        self.image_manager = ImageManager(docker_client)
         if network is None:
-            network = make_host_network()
+            if reactor is None:
+                from twisted.internet import reactor
+            network = make_host_network(reactor, batched=True)
         self.network = network
         self.volume_service = volume_service
+        if remote_volume_manager is None:
+            remote_volume_manager = _ssh_volume_manager
+        self._make_remote_volume_manager = remote_volume_manager
+        self._remote_volume_managers = {}
+
+    def remote_volume_manager(self, hostname):
+        """
+        Get the remote volume manager for a node, which is reused for every
+        push and handoff to that node.
+
+        :param bytes hostname: The hostname of the node.
+
+        :return: An ``IRemoteVolumeManager`` provider.
+        """
+        if hostname not in self._remote_volume_managers:
+            self._remote_volume_managers[hostname] = (
+                self._make_remote_volume_manager(hostname))
+        return self._remote_volume_managers[hostname]
 
     def discover_local_state(self):
         """
@@ -415,6 +484,10 @@ class P2PNodeDeployer(object):
         # Add real namespace support in
         # https://clusterhq.atlassian.net/browse/FLOC-737; for now we just
         # strip the namespace since there will only ever be one.
+        #
+        # The rest of this iteration uses what the storage pool lists here,
+        # but other processes may have changed it since the last iteration:
+        self.volume_service.pool.invalidate()
         volumes = self.volume_service.enumerate()
 
         def map_volumes_to_size(volumes):
@@ -528,11 +601,13 @@ class P2PNodeDeployer(object):
 
         1. Change proxies to point to new addresses (should really be
            last, see https://clusterhq.atlassian.net/browse/FLOC-380)
-        2. Stop all relevant containers.
-        3. Handoff volumes.
-        4. Wait for volumes.
-        5. Create volumes.
-        6. Start and restart any relevant containers.
+        2. Pull the images of containers that will be started, so they
+           aren't pulled while applications are stopped.
+        3. Stop all relevant containers.
+        4. Handoff volumes.
+        5. Wait for volumes.
+        6. Create volumes.
+        7. Start and restart any relevant containers.
 
         :param NodeState local_state: The local state of the node.
         :param Deployment desired_configuration: The intended
@@ -565,7 +640,9 @@ class P2PNodeDeployer(object):
                         # https://clusterhq.atlassian.net/browse/FLOC-322
                         desired_proxies.add(Proxy(ip=node.hostname,
                                                   port=port.external_port))
-        if desired_proxies != set(self.network.enumerate_proxies()):
+        existing_proxies = self.network.enumerate_proxies()
+        if ({_proxy_key(proxy) for proxy in desired_proxies} !=
+                {_proxy_key(proxy) for proxy in existing_proxies}):
             phases.append(SetProxies(ports=desired_proxies))
 
         # We are a node-specific IDeployer:
@@ -648,6 +725,14 @@ class P2PNodeDeployer(object):
                             hostname=handoff.hostname)
                 for handoff in dataset_changes.going]))
 
+        start_restart = start_containers + restart_containers
+        images = {start.application.image for start in start_containers} | {
+            restart.changes[-1].application.image
+            for restart in restart_containers}
+        if images:
+            phases.append(InParallel(changes=[
+                PullImage(image=image) for image
+                in sorted(images, key=lambda image: image.full_name)]))
         if stop_containers:
             phases.append(InParallel(changes=stop_containers))
         if dataset_changes.going:
@@ -673,7 +758,6 @@ class P2PNodeDeployer(object):
             phases.append(InParallel(changes=[
                 DeleteDataset(dataset=dataset)
                 for dataset in dataset_changes.deleting]))
-        start_restart = start_containers + restart_containers
         if start_restart:
             phases.append(InParallel(changes=start_restart))
         return Sequentially(changes=phases)
@@ -725,64 +809,51 @@ def find_dataset_changes(hostname, current_state, desired_state):
     :return DatasetChanges: Changes to datasets that will be needed in
          order to match desired configuration.
     """
-    desired_datasets = {node.hostname:
-                        set(manifestation.dataset for manifestation
-                            in node.manifestations.values())
-                        for node in desired_state.nodes}
-    current_datasets = {node.hostname:
-                        set(manifestation.dataset for manifestation
-                            in node.manifestations.values())
-                        for node in current_state.nodes}
-    local_desired_datasets = desired_datasets.get(hostname, set())
-    local_desired_dataset_ids = set(dataset.dataset_id for dataset in
-                                    local_desired_datasets)
-    local_current_dataset_ids = set(dataset.dataset_id for dataset in
-                                    current_datasets.get(hostname, set()))
+    # Index the current datasets by dataset ID, so that each desired
+    # manifestation can be looked up in constant time:
+    local_current_datasets = {}
     remote_current_dataset_ids = set()
-    for dataset_hostname, current in current_datasets.items():
-        if dataset_hostname != hostname:
-            remote_current_dataset_ids |= set(
-                dataset.dataset_id for dataset in current)
-
-    # If a dataset exists locally and is desired anywhere on the cluster, and
-    # the desired dataset is a different maximum_size to the existing dataset,
-    # the existing local dataset should be resized before any other action
-    # is taken on it.
-    resizing = set()
-    for desired in desired_datasets.values():
-        for new_dataset in desired:
-            if new_dataset.dataset_id in local_current_dataset_ids:
-                for cur_dataset in current_datasets[hostname]:
-                    if cur_dataset.dataset_id != new_dataset.dataset_id:
-                        continue
-                    if cur_dataset.maximum_size != new_dataset.maximum_size:
-                        resizing.add(new_dataset)
-
-    # Look at each dataset that is going to be running elsewhere and is
-    # currently running here, and add a DatasetHandoff for it to `going`.
+    for node in current_state.nodes:
+        if node.hostname == hostname:
+            for dataset_id, manifestation in node.manifestations.items():
+                local_current_datasets[dataset_id] = manifestation.dataset
+        else:
+            remote_current_dataset_ids.update(node.manifestations)
+
     going = set()
-    for dataset_hostname, desired in desired_datasets.items():
-        if dataset_hostname != hostname:
-            for dataset in desired:
-                if dataset.dataset_id in local_current_dataset_ids:
+    coming = set()
+    creating = set()
+    resizing = set()
+    deleting = set()
+    for node in desired_state.nodes:
+        is_local = node.hostname == hostname
+        for dataset_id, manifestation in node.manifestations.items():
+            dataset = manifestation.dataset
+            if dataset.deleted:
+                deleting.add(dataset)
+            current = local_current_datasets.get(dataset_id)
+            if current is not None:
+                # If a dataset exists locally and is desired anywhere on
+                # the cluster, and the desired dataset is a different
+                # maximum_size to the existing dataset, the existing local
+                # dataset should be resized before any other action is
+                # taken on it.
+                if current.maximum_size != dataset.maximum_size:
+                    resizing.add(dataset)
+                # A dataset that is going to be running elsewhere and is
+                # currently running here needs to be handed off.
+                if not is_local:
                     going.add(DatasetHandoff(dataset=dataset,
-                                             hostname=dataset_hostname))
-
-    # Look at each dataset that is going to be hosted on this node.  If it
-    # was running somewhere else, we want that dataset to be in `coming`.
-    coming_dataset_ids = local_desired_dataset_ids.intersection(
-        remote_current_dataset_ids)
-    coming = set(dataset for dataset in local_desired_datasets
-                 if dataset.dataset_id in coming_dataset_ids)
-
-    # For each dataset that is going to be hosted on this node and did not
-    # exist previously, make sure that dataset is in `creating`.
-    creating_dataset_ids = local_desired_dataset_ids.difference(
-        local_current_dataset_ids | remote_current_dataset_ids)
-    creating = set(dataset for dataset in local_desired_datasets
-                   if dataset.dataset_id in creating_dataset_ids)
-
-    deleting = set(dataset for dataset in chain(*desired_datasets.values())
-                   if dataset.deleted)
+                                             hostname=node.hostname))
+            if is_local:
+                if dataset_id in remote_current_dataset_ids:
+                    # A dataset that is going to be hosted on this node
+                    # and was running somewhere else is coming here.
+                    coming.add(dataset)
+                elif current is None:
+                    # A dataset that is going to be hosted on this node and
+                    # did not exist previously needs to be created.
+                    creating.add(dataset)
+
     return DatasetChanges(going=going, coming=coming, deleting=deleting,
                           creating=creating, resizing=resizing)
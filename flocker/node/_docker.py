@@ -7,29 +7,61 @@ Docker API client.
 
 from __future__ import absolute_import
 
-from time import sleep
+from io import BytesIO
+from json import JSONDecoder, dumps, loads
+from contextlib import contextmanager
+from threading import Event, Thread
+from time import sleep, time
+from urllib import quote, urlencode
 
 from zope.interface import Interface, implementer
 
 from docker import Client
 from docker.errors import APIError
-from docker.utils import create_host_config
+from docker.utils import create_host_config, parse_repository_tag
 
 from characteristic import attributes, Attribute
 
+from eliot import Logger, write_failure
+
 from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
-from twisted.internet.defer import succeed, fail
+from twisted.application.service import Service
+from twisted.internet.defer import (
+    CancelledError, Deferred, DeferredSemaphore, gatherResults,
+    maybeDeferred, succeed, fail,
+    )
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.internet.task import deferLater
 from twisted.internet.threads import deferToThread
-from twisted.web.http import NOT_FOUND, INTERNAL_SERVER_ERROR
+from twisted.web.client import (
+    Agent, HTTPConnectionPool, FileBodyProducer, readBody,
+    )
+from twisted.web.http import (
+    OK, NOT_FOUND, CONFLICT, INTERNAL_SERVER_ERROR,
+    )
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IAgentEndpointFactory
 
 from ..control._model import RestartNever, RestartAlways, RestartOnFailure
+from ._logging import LIFECYCLE_STEP
+
+
+_logger = Logger()
 
 
 class AlreadyExists(Exception):
     """A unit with the given name already exists."""
 
 
+class LifecycleTimeout(Exception):
+    """
+    A step in the lifecycle of a container could not be completed before its
+    deadline, e.g. because a container never appeared after being created.
+    """
+
+
 @attributes(["variables"])
 class Environment(object):
     """
@@ -202,6 +234,16 @@ class IDockerClient(Interface):
         :return: ``Deferred`` firing with ``set`` of :class:`Unit`.
         """
 
+    def pull(image_name):
+        """
+        Pull an image, unless it is already available locally.
+
+        :param unicode image_name: The name of the Docker image.
+
+        :return: ``Deferred`` that fires once the image is available
+            locally.
+        """
+
 
 @implementer(IDockerClient)
 class FakeDockerClient(object):
@@ -210,7 +252,11 @@ class FakeDockerClient(object):
     The state the the simulated units is stored in memory.
 
     :ivar dict _units: See ``units`` of ``__init__``\ .
+
+    :ivar unicode namespace: The prefix added to unit names to make
+        container names, which is empty for the fake.
     """
+    namespace = u""
 
     def __init__(self, units=None):
         """
@@ -228,6 +274,8 @@ class FakeDockerClient(object):
             restart_policy=RestartNever()):
         if unit_name in self._units:
             return fail(AlreadyExists(unit_name))
+        if ports is None:
+            ports = frozenset()
         self._units[unit_name] = Unit(
             name=unit_name,
             container_name=unit_name,
@@ -254,6 +302,34 @@ class FakeDockerClient(object):
         units = set(self._units.values())
         return succeed(units)
 
+    def list_by_id(self):
+        """
+        Like ``list``, but the fake uses container names as container IDs.
+
+        :return: ``Deferred`` firing with a ``dict`` mapping container IDs
+            to ``Unit``\ s.
+        """
+        return succeed({unit.container_name: unit
+                        for unit in self._units.values()})
+
+    def pull(self, image_name):
+        return succeed(None)
+
+    def inspect_unit(self, container):
+        """
+        Inspect a single container; the fake uses container names as
+        container IDs.
+
+        :param unicode container: The name of the container.
+
+        :return: ``Deferred`` firing with ``None`` if the container does not
+            exist, otherwise a tuple of the container name and its ``Unit``.
+        """
+        for unit in self._units.values():
+            if unit.container_name == container:
+                return succeed((container, unit))
+        return succeed(None)
+
 
 @attributes(['internal_port', 'external_port'])
 class PortMap(object):
@@ -270,23 +346,80 @@ class PortMap(object):
 BASE_NAMESPACE = u"flocker--"
 BASE_DOCKER_API_URL = u'unix://var/run/docker.sock'
 
+# Maximum number of containers ``DockerClient.list`` inspects at once:
+INSPECT_CONCURRENCY = 8
 
-@implementer(IDockerClient)
-class DockerClient(object):
+# Number of seconds Docker waits for a container to stop before killing it:
+STOP_TIMEOUT = 10
+
+# Maximum number of seconds to keep retrying a container lifecycle step
+# which Docker isn't ready for yet:
+LIFECYCLE_DEADLINE = 60
+
+# Delays between retries of a lifecycle step double from the initial delay
+# up to the maximum delay:
+RETRY_INITIAL_DELAY = 0.01
+RETRY_MAXIMUM_DELAY = 1.0
+
+
+def _retry_delays():
     """
-    Talk to the real Docker server directly.
+    :return: An infinite iterator of the delays, in seconds, between
+        retries of a container lifecycle step.
+    """
+    delay = RETRY_INITIAL_DELAY
+    while True:
+        yield delay
+        delay = min(delay * 2, RETRY_MAXIMUM_DELAY)
+
+
+def _log_step(logger, step, container_name, duration):
+    """
+    Log how long a step in the lifecycle of a container took.
+
+    :param logger: The ``eliot.Logger`` to log to.
+    :param unicode step: The step, e.g. ``u"create"``.
+    :param unicode container_name: The name of the container.
+    :param float duration: The number of seconds taken.
+    """
+    LIFECYCLE_STEP(step=step, container=container_name,
+                   duration=float(duration)).write(logger)
+
+# Docker API version used by the clients:
+DOCKER_API_VERSION = b"1.15"
+
+# Maximum number of persistent connections ``HTTPDockerClient`` keeps open
+# to the Docker server:
+DOCKER_CONNECTIONS = 10
 
-    Some operations can take a while (e.g. stopping a container), so we
-    use a thread pool. See https://clusterhq.atlassian.net/browse/FLOC-718
-    for using a custom thread pool.
+
+class _DockerClientBase(object):
+    """
+    Naming, parsing and listing shared by the clients which talk to the
+    real Docker server.
+
+    Subclasses provide ``inspect_unit`` and ``_list_containers``.
 
     :ivar unicode namespace: A namespace prefix to add to container names
         so we don't clobber other applications interacting with Docker.
+    :ivar int stop_timeout: The number of seconds Docker gives a container
+        to stop gracefully before killing it.
+    :ivar float deadline: The maximum number of seconds to keep retrying a
+        lifecycle step which Docker isn't ready for, after which
+        ``LifecycleTimeout`` is raised.
+    :ivar logger: The ``eliot.Logger`` the duration of each lifecycle step
+        is logged to.
     """
-    def __init__(self, namespace=BASE_NAMESPACE,
-                 base_url=BASE_DOCKER_API_URL):
+    logger = _logger
+
+    def __init__(self, namespace, stop_timeout=STOP_TIMEOUT,
+                 deadline=LIFECYCLE_DEADLINE):
         self.namespace = namespace
-        self._client = Client(version="1.15", base_url=base_url)
+        self.stop_timeout = stop_timeout
+        self.deadline = deadline
+        # Maps (container ID, state) to the container's ``Unit``:
+        self._inspected = {}
+        self._inspections = DeferredSemaphore(INSPECT_CONCURRENCY)
 
     def _to_container_name(self, unit_name):
         """
@@ -387,6 +520,209 @@ class DockerClient(object):
         except KeyError:
             raise ValueError("Unknown restart policy: %r" % (restart_policy,))
 
+    def _unit_from_inspection(self, data):
+        """
+        Parse the result of inspecting a container.
+
+        :param dict data: The container's configuration and state, as
+            returned by the Docker inspect API.
+
+        :return: A tuple of the container's ID and its ``Unit``, or ``None``
+            instead of the ``Unit`` if the container is not in this
+            client's namespace.
+        """
+        name = data[u"Name"]
+        if name.startswith(u"/" + self.namespace):
+            name = name[1 + len(self.namespace):]
+        else:
+            return data[u"Id"], None
+        state = (u"active" if data[u"State"][u"Running"]
+                 else u"inactive")
+        image = data[u"Config"][u"Image"]
+        port_bindings = data[u"HostConfig"][u"PortBindings"]
+        if port_bindings is not None:
+            ports = self._parse_container_ports(port_bindings)
+        else:
+            ports = list()
+        volumes = []
+        binds = data[u"HostConfig"]['Binds']
+        if binds is not None:
+            for bind_config in binds:
+                parts = bind_config.split(':', 2)
+                node_path, container_path = parts[:2]
+                volumes.append(
+                    Volume(container_path=FilePath(container_path),
+                           node_path=FilePath(node_path))
+                )
+        # Our Unit model counts None as the value for cpu_shares and
+        # mem_limit in containers without specified limits, however
+        # Docker returns the values in these cases as zero, so we
+        # manually convert.
+        cpu_shares = data[u"Config"][u"CpuShares"]
+        cpu_shares = None if cpu_shares == 0 else cpu_shares
+        mem_limit = data[u"Config"][u"Memory"]
+        mem_limit = None if mem_limit == 0 else mem_limit
+        restart_policy = self._parse_restart_policy(
+            data[U"HostConfig"][u"RestartPolicy"])
+        return data[u"Id"], Unit(
+            name=name,
+            container_name=self._to_container_name(name),
+            activation_state=state,
+            container_image=image,
+            ports=frozenset(ports),
+            volumes=frozenset(volumes),
+            mem_limit=mem_limit,
+            cpu_shares=cpu_shares,
+            restart_policy=restart_policy)
+
+    def _state_of(self, container):
+        """
+        Summarize the state of a container from a list API response.
+
+        The ``Status`` text includes times (e.g. ``Up 5 minutes``) which
+        change without the container changing, so only its first word is
+        used.
+
+        :param dict container: An entry from the list API response.
+
+        :return: A ``tuple`` of the container ID and its state, which
+            changes whenever the container needs to be inspected again.
+        """
+        status = container.get(u"Status") or u""
+        return container[u"Id"], status.split(u" ", 1)[0]
+
+    def _in_namespace(self, container):
+        """
+        :param dict container: An entry from the list API response.
+
+        :return: Whether the container is named within this client's
+            namespace. Names of linked containers include a ``/`` and are
+            not considered.
+        """
+        prefix = u"/" + self.namespace
+        for name in container.get(u"Names") or []:
+            if name.startswith(prefix) and u"/" not in name[1:]:
+                return True
+        return False
+
+    def list(self):
+        """
+        List the containers in this client's namespace.
+
+        Containers are filtered by the names in the list API response
+        before being inspected, inspections run concurrently (at most
+        ``INSPECT_CONCURRENCY`` at once) and the resulting ``Unit``s are
+        cached by container ID and state so unchanged containers are not
+        inspected again.
+        """
+        d = self.list_by_id()
+        d.addCallback(lambda units: set(units.values()))
+        return d
+
+    def list_by_id(self):
+        """
+        Like ``list``, but also find out the IDs of the containers.
+
+        :return: ``Deferred`` firing with a ``dict`` mapping container IDs
+            to ``Unit``\ s.
+        """
+        d = self._list_containers()
+        d.addCallback(self._inspect_containers)
+        return d
+
+    def _inspect_containers(self, containers):
+        """
+        Inspect the namespaced containers from a list API response,
+        reusing cached results for those whose state has not changed.
+
+        :param list containers: The list API response.
+
+        :return: ``Deferred`` firing with a ``dict`` mapping container IDs
+            to ``Unit``\ s.
+        """
+        cache = {}
+        inspecting = []
+
+        def inspected(result, key):
+            # The container may have been removed since it was listed:
+            if result is not None and result[1] is not None:
+                cache[key] = result[1]
+
+        for container in containers:
+            if not self._in_namespace(container):
+                continue
+            key = self._state_of(container)
+            if key in self._inspected:
+                cache[key] = self._inspected[key]
+                continue
+            d = self._inspections.run(self.inspect_unit, key[0])
+            d.addCallback(inspected, key)
+            inspecting.append(d)
+
+        def done(_):
+            # Only remember containers that still exist:
+            self._inspected = cache
+            return {container_id: unit
+                    for (container_id, _), unit in cache.items()}
+        d = gatherResults(inspecting, consumeErrors=True)
+        d.addErrback(lambda failure: failure.value.subFailure)
+        d.addCallback(done)
+        return d
+
+
+@implementer(IDockerClient)
+class DockerClient(_DockerClientBase):
+    """
+    Talk to the real Docker server directly.
+
+    Some operations can take a while (e.g. stopping a container), so we
+    use a thread pool. See https://clusterhq.atlassian.net/browse/FLOC-718
+    for using a custom thread pool.
+
+    :ivar unicode namespace: A namespace prefix to add to container names
+        so we don't clobber other applications interacting with Docker.
+    """
+    def __init__(self, namespace=BASE_NAMESPACE,
+                 base_url=BASE_DOCKER_API_URL, stop_timeout=STOP_TIMEOUT,
+                 deadline=LIFECYCLE_DEADLINE):
+        _DockerClientBase.__init__(self, namespace, stop_timeout, deadline)
+        self._client = Client(version=DOCKER_API_VERSION, base_url=base_url)
+
+    @contextmanager
+    def _timed(self, step, container_name):
+        """
+        Log how long the wrapped block of code takes.
+
+        :param unicode step: The lifecycle step being done.
+        :param unicode container_name: The name of the container.
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            _log_step(self.logger, step, container_name, time() - start)
+
+    def _blocking_retry(self, step, container_name, attempt):
+        """
+        Call a function until it succeeds, waiting for increasing delays in
+        between.
+
+        :param unicode step: The lifecycle step being done.
+        :param unicode container_name: The name of the container.
+        :param attempt: A function returning ``True`` if it succeeded and
+            ``False`` if it should be retried.
+
+        :raises LifecycleTimeout: If ``attempt`` doesn't succeed within
+            ``deadline`` seconds.
+        """
+        deadline = time() + self.deadline
+        for delay in _retry_delays():
+            if attempt():
+                return
+            if time() + delay > deadline:
+                raise LifecycleTimeout(container_name, step)
+            sleep(delay)
+
     def add(self, unit_name, image_name, ports=None, environment=None,
             volumes=(), mem_limit=None, cpu_shares=None,
             restart_policy=RestartNever()):
@@ -429,12 +765,15 @@ class DockerClient(object):
 
         def _add():
             try:
-                _create()
+                with self._timed(u"create", container_name):
+                    _create()
             except APIError as e:
                 if e.response.status_code == NOT_FOUND:
                     # Image was not found, so we need to pull it first:
-                    self._client.pull(image_name)
-                    _create()
+                    with self._timed(u"pull", container_name):
+                        self._client.pull(image_name)
+                    with self._timed(u"create", container_name):
+                        _create()
                 else:
                     raise
             # Just because we got a response doesn't mean Docker has
@@ -442,10 +781,12 @@ class DockerClient(object):
             # stop on this container Docker might well complain it knows
             # not the container of which we speak. To prevent this we poll
             # until it does exist.
-            while not self._blocking_exists(container_name):
-                sleep(0.001)
-                continue
-            self._client.start(container_name)
+            with self._timed(u"wait", container_name):
+                self._blocking_retry(
+                    u"wait", container_name,
+                    lambda: self._blocking_exists(container_name))
+            with self._timed(u"start", container_name):
+                self._client.start(container_name)
         d = deferToThread(_add)
 
         def _extract_error(failure):
@@ -476,35 +817,48 @@ class DockerClient(object):
         container_name = self._to_container_name(unit_name)
         return deferToThread(self._blocking_exists, container_name)
 
+    def pull(self, image_name):
+        def _pull():
+            try:
+                self._client.inspect_image(image_name)
+            except APIError as e:
+                if e.response.status_code != NOT_FOUND:
+                    raise
+                self._client.pull(image_name)
+        return deferToThread(_pull)
+
     def remove(self, unit_name):
         container_name = self._to_container_name(unit_name)
 
-        def _remove():
-            while True:
-                # There is a race condition between a process dying and
-                # docker noticing that fact.
-                # https://github.com/docker/docker/issues/5165#issuecomment-65753753  # noqa
-                # We loop here to let docker notice that the process is dead.
-                # Docker will return NOT_MODIFIED (which isn't an error) in
-                # that case.
-                try:
-                    self._client.stop(container_name)
-                except APIError as e:
-                    if e.response.status_code == NOT_FOUND:
-                        # If the container doesn't exist, we swallow the error,
-                        # since this method is supposed to be idempotent.
-                        break
-                    elif e.response.status_code == INTERNAL_SERVER_ERROR:
-                        # Docker returns this if the process had died, but
-                        # hasn't noticed it yet.
-                        continue
-                    else:
-                        raise
+        def _stop():
+            try:
+                self._client.stop(container_name, timeout=self.stop_timeout)
+            except APIError as e:
+                if e.response.status_code == NOT_FOUND:
+                    # If the container doesn't exist, we swallow the error,
+                    # since this method is supposed to be idempotent.
+                    return True
+                elif e.response.status_code == INTERNAL_SERVER_ERROR:
+                    # Docker returns this if the process had died, but
+                    # hasn't noticed it yet.
+                    return False
                 else:
-                    break
+                    raise
+            return True
+
+        def _remove():
+            # There is a race condition between a process dying and
+            # docker noticing that fact.
+            # https://github.com/docker/docker/issues/5165#issuecomment-65753753  # noqa
+            # We retry here to let docker notice that the process is dead.
+            # Docker will return NOT_MODIFIED (which isn't an error) in
+            # that case.
+            with self._timed(u"stop", container_name):
+                self._blocking_retry(u"stop", container_name, _stop)
 
             try:
-                self._client.remove_container(container_name)
+                with self._timed(u"remove", container_name):
+                    self._client.remove_container(container_name)
             except APIError as e:
                 # If the container doesn't exist, we swallow the error,
                 # since this method is supposed to be idempotent.
@@ -516,67 +870,464 @@ class DockerClient(object):
         d = deferToThread(_remove)
         return d
 
-    def list(self):
-        def _list():
-            result = set()
-            ids = [d[u"Id"] for d in
-                   self._client.containers(quiet=True, all=True)]
-            for i in ids:
-
-                try:
-                    data = self._client.inspect_container(i)
-                except APIError as e:
-                    # The container ID returned by the list API call above, may
-                    # have been removed in another thread.
-                    if e.response.status_code == NOT_FOUND:
-                        continue
-
-                state = (u"active" if data[u"State"][u"Running"]
-                         else u"inactive")
-                name = data[u"Name"]
-                image = data[u"Config"][u"Image"]
-                port_bindings = data[u"HostConfig"][u"PortBindings"]
-                if port_bindings is not None:
-                    ports = self._parse_container_ports(port_bindings)
-                else:
-                    ports = list()
-                volumes = []
-                binds = data[u"HostConfig"]['Binds']
-                if binds is not None:
-                    for bind_config in binds:
-                        parts = bind_config.split(':', 2)
-                        node_path, container_path = parts[:2]
-                        volumes.append(
-                            Volume(container_path=FilePath(container_path),
-                                   node_path=FilePath(node_path))
-                        )
-                if name.startswith(u"/" + self.namespace):
-                    name = name[1 + len(self.namespace):]
-                else:
-                    continue
-                # Our Unit model counts None as the value for cpu_shares and
-                # mem_limit in containers without specified limits, however
-                # Docker returns the values in these cases as zero, so we
-                # manually convert.
-                cpu_shares = data[u"Config"][u"CpuShares"]
-                cpu_shares = None if cpu_shares == 0 else cpu_shares
-                mem_limit = data[u"Config"][u"Memory"]
-                mem_limit = None if mem_limit == 0 else mem_limit
-                restart_policy = self._parse_restart_policy(
-                    data[U"HostConfig"][u"RestartPolicy"])
-                result.add(Unit(
-                    name=name,
-                    container_name=self._to_container_name(name),
-                    activation_state=state,
-                    container_image=image,
-                    ports=frozenset(ports),
-                    volumes=frozenset(volumes),
-                    mem_limit=mem_limit,
-                    cpu_shares=cpu_shares,
-                    restart_policy=restart_policy)
-                )
+    def _blocking_inspect_unit(self, container):
+        """
+        Blocking API to inspect a container.
+
+        :param unicode container: The ID or name of the container.
+
+        :return: ``None`` if the container does not exist, otherwise a tuple
+            of the container's ID and its ``Unit``, or ``None`` instead of
+            the ``Unit`` if the container is not in this client's
+            namespace.
+        """
+        try:
+            data = self._client.inspect_container(container)
+        except APIError as e:
+            # The container may have been removed in the meantime:
+            if e.response.status_code == NOT_FOUND:
+                return None
+            raise
+
+        return self._unit_from_inspection(data)
+
+    def inspect_unit(self, container):
+        """
+        Inspect a single container.
+
+        :param unicode container: The ID or name of the container.
+
+        :return: ``Deferred`` firing with ``None`` if the container does not
+            exist, otherwise a tuple of the container's ID and its ``Unit``,
+            or ``None`` instead of the ``Unit`` if the container is not in
+            this client's namespace.
+        """
+        return deferToThread(self._blocking_inspect_unit, container)
+
+    def _list_containers(self):
+        """
+        List all containers.
+
+        :return: ``Deferred`` firing with the list API response.
+        """
+        return deferToThread(self._client.containers, all=True)
+
+
+class DockerAPIError(Exception):
+    """
+    The Docker API responded with an error.
+
+    :ivar int code: The HTTP response code.
+    :ivar bytes body: The body of the response.
+    """
+    def __init__(self, code, body):
+        Exception.__init__(self, code, body)
+        self.code = code
+        self.body = body
+
+
+def _progress_error(data):
+    """
+    Find an error reported in a stream of JSON progress messages, like the
+    response to a Docker API request to pull an image.  Docker reports such
+    errors with a successful response code.
+
+    :param bytes data: The concatenated JSON messages.
+
+    :return: The ``unicode`` error message, or ``None`` if there is none.
+    """
+    decoder = JSONDecoder()
+    data = data.decode("utf-8")
+    offset = 0
+    while True:
+        while offset < len(data) and data[offset].isspace():
+            offset += 1
+        if offset == len(data):
+            return None
+        message, offset = decoder.raw_decode(data, offset)
+        if isinstance(message, dict) and u"error" in message:
+            return message[u"error"]
+
+
+@implementer(IAgentEndpointFactory)
+class _UNIXEndpointFactory(object):
+    """
+    Connect to a UNIX socket regardless of the URI being requested.
+
+    :ivar reactor: The reactor to connect with.
+    :ivar bytes path: The path of the UNIX socket.
+    """
+    def __init__(self, reactor, path):
+        self._reactor = reactor
+        self._path = path
+
+    def endpointForURI(self, uri):
+        return UNIXClientEndpoint(self._reactor, self._path)
+
+
+@implementer(IDockerClient)
+class HTTPDockerClient(_DockerClientBase):
+    """
+    Talk to the real Docker server over its UNIX socket without using
+    threads.
+
+    Unlike ``DockerClient``, which wraps blocking docker-py calls with
+    ``deferToThread``, requests are made with a Twisted HTTP client over
+    persistent connections, so operations don't compete with everything
+    else for the reactor thread pool.
+
+    :ivar unicode namespace: A namespace prefix to add to container names
+        so we don't clobber other applications interacting with Docker.
+    """
+    def __init__(self, reactor, namespace=BASE_NAMESPACE,
+                 base_url=BASE_DOCKER_API_URL, stop_timeout=STOP_TIMEOUT,
+                 deadline=LIFECYCLE_DEADLINE):
+        """
+        :param reactor: The reactor to make requests with.
+        :param unicode namespace: See ``namespace``.
+        :param unicode base_url: The ``unix://`` URL of the Docker API.
+        :param int stop_timeout: See ``stop_timeout``.
+        :param float deadline: See ``deadline``.
+
+        :raises ValueError: If ``base_url`` is not a ``unix://`` URL.
+        """
+        if not base_url.startswith(u"unix://"):
+            raise ValueError(
+                "Only unix:// Docker API URLs are supported: %r" % (
+                    base_url,))
+        _DockerClientBase.__init__(self, namespace, stop_timeout, deadline)
+        self._reactor = reactor
+        path = b"/" + base_url[len(u"unix://"):].lstrip(u"/").encode("utf-8")
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = DOCKER_CONNECTIONS
+        self._agent = Agent.usingEndpointFactory(
+            reactor, _UNIXEndpointFactory(reactor, path), pool=self._pool)
+
+    def _timed(self, step, container_name, f, *args):
+        """
+        Log how long an asynchronous operation takes.
+
+        :param unicode step: The lifecycle step being done.
+        :param unicode container_name: The name of the container.
+        :param f: A function returning a ``Deferred``, called with ``args``.
+
+        :return: The ``Deferred`` returned by ``f``.
+        """
+        start = self._reactor.seconds()
+
+        def done(result):
+            _log_step(self.logger, step, container_name,
+                      self._reactor.seconds() - start)
             return result
-        return deferToThread(_list)
+        return f(*args).addBoth(done)
+
+    def _retry(self, step, container_name, attempt):
+        """
+        Call a function until it succeeds, waiting for increasing delays in
+        between.
+
+        :param unicode step: The lifecycle step being done.
+        :param unicode container_name: The name of the container.
+        :param attempt: A function returning a ``Deferred`` that fires with
+            ``True`` if it succeeded and ``False`` if it should be retried.
+
+        :return: ``Deferred`` that fires once ``attempt`` has succeeded, or
+            fails with ``LifecycleTimeout`` if it doesn't succeed within
+            ``deadline`` seconds.
+        """
+        deadline = self._reactor.seconds() + self.deadline
+        delays = _retry_delays()
+
+        def attempted(succeeded):
+            if succeeded:
+                return None
+            delay = next(delays)
+            if self._reactor.seconds() + delay > deadline:
+                raise LifecycleTimeout(container_name, step)
+            retrying = deferLater(self._reactor, delay, attempt)
+            retrying.addCallback(attempted)
+            return retrying
+        return attempt().addCallback(attempted)
+
+    def close(self):
+        """
+        Close the persistent connections to the Docker server.
+
+        :return: ``Deferred`` that fires once they are closed.
+        """
+        return self._pool.closeCachedConnections()
+
+    def _request(self, method, path, query=None, body=None):
+        """
+        Make a request to the Docker API.
+
+        :param bytes method: The HTTP method.
+        :param unicode path: The path of the API endpoint, e.g.
+            ``u"/containers/json"``.
+        :param dict query: Query arguments, or ``None``.
+        :param body: An object to send encoded as JSON, or ``None``.
+
+        :return: ``Deferred`` firing with the body of the response, or
+            failing with ``DockerAPIError`` if the response code indicates
+            an error.
+        """
+        uri = b"http://docker/v%s%s" % (
+            DOCKER_API_VERSION, quote(path.encode("utf-8")))
+        if query:
+            uri += b"?" + urlencode(query)
+        headers = Headers()
+        producer = None
+        if body is not None:
+            headers.addRawHeader(b"Content-Type", b"application/json")
+            producer = FileBodyProducer(BytesIO(dumps(body)))
+        d = self._agent.request(method, uri, headers, producer)
+
+        def got_response(response):
+            reading = readBody(response)
+
+            def got_body(data):
+                if response.code >= 400:
+                    raise DockerAPIError(response.code, data)
+                return data
+            reading.addCallback(got_body)
+            return reading
+        d.addCallback(got_response)
+        return d
+
+    def add(self, unit_name, image_name, ports=None, environment=None,
+            volumes=(), mem_limit=None, cpu_shares=None,
+            restart_policy=RestartNever()):
+        container_name = self._to_container_name(unit_name)
+
+        if environment is not None:
+            environment = [u"%s=%s" % item
+                           for item in environment.to_dict().items()]
+        if ports is None:
+            ports = []
+
+        config = {
+            u"Image": image_name,
+            u"Env": environment,
+            u"ExposedPorts": {u"%d/tcp" % (p.internal_port,): {}
+                              for p in ports},
+            u"Memory": mem_limit or 0,
+            u"CpuShares": cpu_shares or 0,
+            u"HostConfig": create_host_config(
+                binds={
+                    volume.node_path.path: {
+                        'bind': volume.container_path.path,
+                        'ro': False,
+                    }
+                    for volume in volumes
+                },
+                port_bindings={
+                    p.internal_port: p.external_port
+                    for p in ports
+                },
+                restart_policy=self._serialize_restart_policy(
+                    restart_policy),
+            ),
+        }
+
+        def create():
+            return self._timed(
+                u"create", container_name, self._request,
+                b"POST", u"/containers/create",
+                {b"name": container_name.encode("utf-8")}, config)
+
+        def pull_if_missing(failure):
+            failure.trap(DockerAPIError)
+            if failure.value.code != NOT_FOUND:
+                return failure
+            # Image was not found, so we need to pull it first:
+            pulling = self._timed(
+                u"pull", container_name, self._pull, image_name)
+            pulling.addCallback(lambda _: create())
+            return pulling
+
+        d = create()
+        d.addErrback(pull_if_missing)
+        # Just because we got a response doesn't mean Docker has actually
+        # updated any internal state yet, so we wait until the container
+        # exists.
+        d.addCallback(lambda _: self._timed(
+            u"wait", container_name, self._retry,
+            u"wait", container_name, lambda: self.exists(unit_name)))
+        d.addCallback(lambda _: self._timed(
+            u"start", container_name, self._request,
+            b"POST", u"/containers/%s/start" % (container_name,)))
+
+        def _extract_error(failure):
+            failure.trap(DockerAPIError)
+            if failure.value.code == CONFLICT:
+                raise AlreadyExists(unit_name)
+            return failure
+        d.addErrback(_extract_error)
+        d.addCallback(lambda _: None)
+        return d
+
+    def _pull(self, image_name):
+        """
+        Pull an image.
+
+        :param unicode image_name: The name of the Docker image.
+
+        :return: ``Deferred`` that fires once the image has been pulled, or
+            fails with ``DockerAPIError`` if Docker reported an error while
+            pulling it.
+        """
+        repository, tag = parse_repository_tag(image_name)
+        query = {b"fromImage": repository.encode("utf-8")}
+        if tag is not None:
+            query[b"tag"] = tag.encode("utf-8")
+        d = self._request(b"POST", u"/images/create", query)
+
+        def pulled(data):
+            if _progress_error(data) is not None:
+                raise DockerAPIError(OK, data)
+            return data
+        d.addCallback(pulled)
+        return d
+
+    def pull(self, image_name):
+        d = self._request(b"GET", u"/images/%s/json" % (image_name,))
+
+        def not_found(failure):
+            failure.trap(DockerAPIError)
+            if failure.value.code != NOT_FOUND:
+                return failure
+            return self._pull(image_name)
+        d.addErrback(not_found)
+        d.addCallback(lambda _: None)
+        return d
+
+    def exists(self, unit_name):
+        container_name = self._to_container_name(unit_name)
+        d = self._request(b"GET", u"/containers/%s/json" % (container_name,))
+        d.addCallback(lambda _: True)
+
+        def failed(failure):
+            failure.trap(DockerAPIError)
+            return False
+        d.addErrback(failed)
+        return d
+
+    def remove(self, unit_name):
+        container_name = self._to_container_name(unit_name)
+
+        def stop():
+            stopping = self._request(
+                b"POST", u"/containers/%s/stop" % (container_name,),
+                {b"t": str(self.stop_timeout)})
+            stopping.addCallbacks(lambda _: True, stop_failed)
+            return stopping
+
+        def stop_failed(failure):
+            failure.trap(DockerAPIError)
+            code = failure.value.code
+            if code == NOT_FOUND:
+                # If the container doesn't exist, we swallow the error,
+                # since this method is supposed to be idempotent.
+                return True
+            elif code == INTERNAL_SERVER_ERROR:
+                # Docker returns this if the process had died, but hasn't
+                # noticed it yet, so we retry; see https://github.com/docker/docker/issues/5165  # noqa
+                return False
+            return failure
+
+        def remove():
+            removing = self._timed(
+                u"remove", container_name, self._request,
+                b"DELETE", u"/containers/%s" % (container_name,))
+            removing.addErrback(remove_failed)
+            return removing
+
+        def remove_failed(failure):
+            failure.trap(DockerAPIError)
+            # If the container doesn't exist, we swallow the error, since
+            # this method is supposed to be idempotent.
+            if failure.value.code != NOT_FOUND:
+                return failure
+
+        d = self._timed(u"stop", container_name, self._retry,
+                        u"stop", container_name, stop)
+        d.addCallback(lambda _: remove())
+        d.addCallback(lambda _: None)
+        return d
+
+    def inspect_unit(self, container):
+        """
+        Inspect a single container.
+
+        :param unicode container: The ID or name of the container.
+
+        :return: ``Deferred`` firing with ``None`` if the container does not
+            exist, otherwise a tuple of the container's ID and its ``Unit``,
+            or ``None`` instead of the ``Unit`` if the container is not in
+            this client's namespace.
+        """
+        d = self._request(b"GET", u"/containers/%s/json" % (container,))
+        d.addCallback(lambda data: self._unit_from_inspection(loads(data)))
+
+        def not_found(failure):
+            failure.trap(DockerAPIError)
+            # The container may have been removed in the meantime:
+            if failure.value.code != NOT_FOUND:
+                return failure
+        d.addErrback(not_found)
+        return d
+
+    def _list_containers(self):
+        """
+        List all containers.
+
+        :return: ``Deferred`` firing with the list API response.
+        """
+        d = self._request(b"GET", u"/containers/json", {b"all": b"1"})
+        d.addCallback(loads)
+        return d
+
+
+class ImageManager(object):
+    """
+    Make Docker images available locally, sharing a single pull between
+    everyone who wants the same image at the same time.
+
+    :ivar IDockerClient _client: The client used to pull images.
+    :ivar dict _waiting: Maps the names of images being pulled to a
+        ``list`` of ``Deferred``\ s to fire once the pull is done.
+    """
+    def __init__(self, client):
+        """
+        :param IDockerClient client: See ``_client``.
+        """
+        self._client = client
+        self._waiting = {}
+
+    def pull(self, image_name):
+        """
+        Pull an image, unless it is already available locally. If the image
+        is already being pulled no new pull is started.
+
+        :param unicode image_name: The name of the Docker image.
+
+        :return: ``Deferred`` that fires once the image is available
+            locally, or fails if pulling it failed.
+        """
+        waiting = Deferred()
+        if image_name in self._waiting:
+            self._waiting[image_name].append(waiting)
+            return waiting
+        self._waiting[image_name] = [waiting]
+
+        def pulled(result):
+            for d in self._waiting.pop(image_name):
+                if isinstance(result, Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+        maybeDeferred(self._client.pull, image_name).addBoth(pulled)
+        return waiting
 
 
 class NamespacedDockerClient(proxyForInterface(IDockerClient, "_client")):
@@ -597,3 +1348,361 @@ class NamespacedDockerClient(proxyForInterface(IDockerClient, "_client")):
         """
         self._client = DockerClient(
             namespace=BASE_NAMESPACE + namespace + u"--")
+
+
+class IDockerEvents(Interface):
+    """
+    A source of events from the Docker daemon.
+    """
+    def watch(receive):
+        """
+        Start delivering events.
+
+        :param receive: Callable called in the reactor thread with each
+            event, a ``dict`` with at least ``u"status"`` and ``u"id"``
+            keys.
+
+        :return: ``Deferred`` that fires when the stream of events ends, or
+            fails if it was interrupted by an error.  Cancelling it stops
+            the stream: no more events are delivered.
+        """
+
+
+@implementer(IDockerEvents)
+class DockerEvents(object):
+    """
+    Stream events from the Docker ``/events`` API.
+
+    The API blocks until there is an event, so the stream is read in a
+    daemon thread rather than the reactor's thread pool, which would
+    otherwise be unable to stop while no events arrive.  Cancelling the
+    ``Deferred`` returned by ``watch`` closes the stream, and the thread
+    delivers nothing more to the reactor even if it is still blocked
+    reading.
+    """
+    def __init__(self, reactor, base_url=BASE_DOCKER_API_URL):
+        """
+        :param reactor: Reactor to deliver events to.
+        :param unicode base_url: The URL of the Docker API.
+        """
+        self._reactor = reactor
+        self._base_url = base_url
+
+    def watch(self, receive):
+        client = Client(version=DOCKER_API_VERSION, base_url=self._base_url,
+                        timeout=None)
+        stopped = Event()
+
+        def stop(finished):
+            stopped.set()
+            client.close()
+        finished = Deferred(stop)
+
+        def deliver(f, *args):
+            if not stopped.is_set():
+                f(*args)
+
+        def read():
+            try:
+                for chunk in client.events():
+                    if stopped.is_set():
+                        return
+                    self._reactor.callFromThread(
+                        deliver, receive, loads(chunk))
+            except:
+                if not stopped.is_set():
+                    self._reactor.callFromThread(
+                        deliver, finished.errback, Failure())
+            else:
+                self._reactor.callFromThread(
+                    deliver, finished.callback, None)
+        thread = Thread(target=read, name="docker-events")
+        thread.daemon = True
+        thread.start()
+        return finished
+
+
+@implementer(IDockerEvents)
+class FakeDockerEvents(object):
+    """
+    In-memory fake source of Docker events.
+
+    :ivar int watches: The number of times ``watch`` has been called.
+    """
+    def __init__(self):
+        self.watches = 0
+        self._receive = None
+        self._finished = None
+
+    def watch(self, receive):
+        self.watches += 1
+        self._receive = receive
+
+        def stop(finished):
+            self._receive = self._finished = None
+        self._finished = Deferred(stop)
+        return self._finished
+
+    def send(self, event):
+        """
+        Deliver an event to the current watcher.
+
+        :param dict event: The event.
+        """
+        self._receive(event)
+
+    def end(self, reason=None):
+        """
+        End the current stream of events.
+
+        :param Failure reason: The error interrupting the stream, or
+            ``None`` if it ended cleanly.
+        """
+        finished, self._finished = self._finished, None
+        self._receive = None
+        if reason is None:
+            finished.callback(None)
+        else:
+            finished.errback(reason)
+
+
+# Docker events which change the state of a container:
+_CONTAINER_EVENTS = frozenset([
+    u"create", u"start", u"restart", u"die", u"kill", u"oom", u"stop",
+    u"destroy", u"pause", u"unpause",
+])
+
+# Seconds between complete refreshes of units from Docker:
+RESYNC_INTERVAL = 300
+
+# Seconds to wait before watching again when the event stream ends:
+EVENTS_RETRY_INTERVAL = 5
+
+
+@implementer(IDockerClient)
+class WatchingDockerClient(Service):
+    """
+    Docker client which keeps an in-memory model of units up to date using
+    Docker events, rather than inspecting every container whenever units
+    are listed.
+
+    Only containers mentioned by events are inspected, and containers
+    outside the client's namespace are ignored after they have been
+    inspected once.  All units are refreshed every ``resync_interval``
+    seconds in case events were missed, and whenever the event stream is
+    restarted.
+
+    :ivar dict _units: Mapping from container name to ``Unit`` for units
+        known to exist.
+    :ivar dict _ids: Mapping from container ID to container name, or to
+        ``None`` for containers outside the namespace.
+    :ivar _queue: ``Deferred`` which fires once all queued refreshes are
+        done; refreshes happen one at a time so they are applied in order.
+    :ivar set _queued: Containers with a refresh waiting in ``_queue``.
+    :ivar bool _synced: Whether the model has been populated from Docker.
+    :ivar list _callbacks: Callables called with no arguments whenever the
+        model changes.
+    :ivar _watching: The ``Deferred`` from ``IDockerEvents.watch`` for the
+        current stream of events, or ``None``.
+    """
+    def __init__(self, reactor, client, events,
+                 resync_interval=RESYNC_INTERVAL,
+                 retry_interval=EVENTS_RETRY_INTERVAL):
+        """
+        :param reactor: Reactor used to schedule refreshes.
+        :param client: ``DockerClient`` (or ``FakeDockerClient``) used to
+            talk to Docker.
+        :param IDockerEvents events: Source of Docker events.
+        :param float resync_interval: Seconds between complete refreshes.
+        :param float retry_interval: Seconds to wait before watching again
+            when the event stream ends.
+        """
+        self._reactor = reactor
+        self._client = client
+        self._events = events
+        self._resync_interval = resync_interval
+        self._retry_interval = retry_interval
+        self._units = {}
+        self._ids = {}
+        self._queue = succeed(None)
+        self._queued = set()
+        self._synced = False
+        self._callbacks = []
+        self._watch_call = None
+        self._resync_call = None
+        self._watching = None
+
+    def register(self, callback):
+        """
+        Register a callback to be called whenever the known units change.
+
+        :param callback: Callable called with no arguments.
+        """
+        self._callbacks.append(callback)
+
+    def startService(self):
+        Service.startService(self)
+        self._watch()
+
+    def stopService(self):
+        Service.stopService(self)
+        for call in (self._watch_call, self._resync_call):
+            if call is not None and call.active():
+                call.cancel()
+        self._watch_call = self._resync_call = None
+        if self._watching is not None:
+            self._watching.cancel()
+
+    def _watch(self):
+        """
+        Start watching events, and refresh all units since events may have
+        been missed.
+        """
+        self._watch_call = None
+        self._watching = d = self._events.watch(self._received)
+
+        def ended(result):
+            self._watching = None
+            if isinstance(result, Failure):
+                if result.check(CancelledError):
+                    return
+                write_failure(result, _logger, u"flocker:docker:events")
+            if self.running:
+                self._watch_call = self._reactor.callLater(
+                    self._retry_interval, self._watch)
+        d.addBoth(ended)
+        self._resync()
+
+    def _resync(self):
+        """
+        Queue a complete refresh of the known units.
+        """
+        def resync(_):
+            d = self._client.list_by_id()
+            d.addCallback(self._replace)
+            return d
+        self._enqueue(resync)
+        if self._resync_call is not None and self._resync_call.active():
+            self._resync_call.cancel()
+        self._resync_call = None
+        if self.running:
+            self._resync_call = self._reactor.callLater(
+                self._resync_interval, self._resync)
+
+    def _enqueue(self, refresh):
+        """
+        Add a refresh to the queue; failures are logged.
+        """
+        self._queue.addCallback(refresh)
+        self._queue.addErrback(
+            write_failure, _logger, u"flocker:docker:refresh")
+
+    def _replace(self, units):
+        """
+        Replace the known units with the result of a complete refresh.
+
+        :param dict units: Mapping from container IDs to ``Unit``\ s.
+        """
+        self._ids = {container_id: unit.container_name
+                     for container_id, unit in units.items()}
+        units = {unit.container_name: unit for unit in units.values()}
+        self._synced = True
+        if units != self._units:
+            self._units = units
+            self._changed()
+
+    def _refresh(self, container):
+        """
+        Queue a refresh of a single container.
+
+        :param unicode container: The ID or name of the container.
+        """
+        if container in self._queued:
+            return
+        self._queued.add(container)
+
+        def refresh(_):
+            self._queued.discard(container)
+            d = self._client.inspect_unit(container)
+            d.addCallback(self._inspected, container)
+            return d
+        self._enqueue(refresh)
+
+    def _inspected(self, result, container):
+        """
+        Update the model with the result of inspecting a container.
+        """
+        if result is None:
+            if container not in self._ids and container not in self._units:
+                # A container which was never known, e.g. a short-lived
+                # one outside the namespace, has gone:
+                return
+            name = self._ids.pop(container, container)
+            if self._units.pop(name, None) is not None:
+                self._changed()
+            return
+        container_id, unit = result
+        if unit is None:
+            self._ids[container_id] = None
+            return
+        self._ids[container_id] = unit.container_name
+        if self._units.get(unit.container_name) != unit:
+            self._units[unit.container_name] = unit
+            self._changed()
+
+    def _received(self, event):
+        """
+        Handle an event from Docker.
+        """
+        if event.get(u"status") not in _CONTAINER_EVENTS:
+            return
+        container_id = event[u"id"]
+        if container_id in self._ids and self._ids[container_id] is None:
+            # Not in our namespace:
+            if event[u"status"] == u"destroy":
+                del self._ids[container_id]
+            return
+        self._refresh(container_id)
+
+    def _changed(self):
+        for callback in self._callbacks:
+            callback()
+
+    def add(self, unit_name, image_name, ports=None, environment=None,
+            volumes=(), mem_limit=None, cpu_shares=None,
+            restart_policy=RestartNever()):
+        d = self._client.add(unit_name, image_name, ports=ports,
+                             environment=environment, volumes=volumes,
+                             mem_limit=mem_limit, cpu_shares=cpu_shares,
+                             restart_policy=restart_policy)
+        d.addCallback(self._after_change, unit_name)
+        return d
+
+    def exists(self, unit_name):
+        return self._client.exists(unit_name)
+
+    def pull(self, image_name):
+        return self._client.pull(image_name)
+
+    def remove(self, unit_name):
+        d = self._client.remove(unit_name)
+        d.addCallback(self._after_change, unit_name)
+        return d
+
+    def _after_change(self, result, unit_name):
+        """
+        Refresh a unit changed by this client, so that it is listed
+        correctly as soon as the change is done.
+        """
+        self._refresh(self._client.namespace + unit_name)
+        d = Deferred()
+        self._queue.addCallback(lambda _: d.callback(result))
+        return d
+
+    def list(self):
+        if not self._synced:
+            return self._client.list()
+        d = Deferred()
+        self._queue.addCallback(
+            lambda _: d.callback(set(self._units.values())))
+        return d
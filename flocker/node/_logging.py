@@ -0,0 +1,28 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+from eliot import Field, MessageType
+
+
+def _system(name):
+    return u"flocker:node:docker:" + name
+
+
+CONTAINER = Field.forTypes(
+    u"container", [unicode],
+    u"The name of a Docker container.")
+
+
+STEP = Field.forTypes(
+    u"step", [unicode],
+    u"A step in the lifecycle of a container, e.g. create or stop.")
+
+
+DURATION = Field.forTypes(
+    u"duration", [float],
+    u"The number of seconds a step took.")
+
+
+LIFECYCLE_STEP = MessageType(
+    _system(u"lifecycle_step"),
+    [CONTAINER, STEP, DURATION],
+    u"A step in the lifecycle of a Docker container has finished.")
@@ -13,9 +13,13 @@ The ClusterStatus state machine receives inputs from the connection to the
 control service, and sends inputs to the ConvergenceLoop state machine.
 """
 
+from random import random
+
 from zope.interface import implementer
 
-from characteristic import attributes
+from characteristic import attributes, Attribute
+
+from eliot import Logger, write_failure
 
 from machinist import (
     trivialInput, TransitionTable, constructFiniteStateMachine,
@@ -29,6 +33,10 @@ from twisted.internet.protocol import ReconnectingClientFactory
 from ..control._protocol import (
     NodeStateCommand, IConvergenceAgent, AgentAMP,
     )
+from ._deploy import Sequentially
+
+
+_logger = Logger()
 
 
 class ClusterStatusInputs(Names):
@@ -192,6 +200,10 @@ class ConvergenceLoopInputs(Names):
     # Finished applying necessary changes to local state, a single
     # iteration of the convergence loop:
     ITERATION_DONE = NamedConstant()
+    # Time to start the next iteration of the convergence loop:
+    WAKEUP = NamedConstant()
+    # Something changed the local state, e.g. a container stopped:
+    LOCAL_STATE_CHANGED = NamedConstant()
 
 
 @attributes(["client", "configuration", "state"])
@@ -218,6 +230,8 @@ class ConvergenceLoopStates(Names):
     # Local state is being converged, and once that is done we will
     # immediately stop:
     CONVERGING_STOPPING = NamedConstant()
+    # Waiting before starting the next iteration:
+    SLEEPING = NamedConstant()
 
 
 class ConvergenceLoopOutputs(Names):
@@ -229,6 +243,81 @@ class ConvergenceLoopOutputs(Names):
     STORE_INFO = NamedConstant()
     # Start an iteration of the covergence loop:
     CONVERGE = NamedConstant()
+    # Arrange for the next iteration to start later:
+    SCHEDULE_WAKEUP = NamedConstant()
+    # Cancel a previously scheduled wakeup:
+    CANCEL_WAKEUP = NamedConstant()
+    # Make sure the next iteration starts soon after the current one:
+    NOTE_CHANGE = NamedConstant()
+
+
+# Seconds after which the local state is sent to the control service even
+# if it has not changed:
+NODE_STATE_KEEPALIVE = 60
+
+# Default ceiling, in seconds, on the delay between convergence iterations
+# while nothing is changing:
+MAXIMUM_CONVERGENCE_INTERVAL = 10.0
+
+# The change calculated when the local state already matches the desired
+# configuration:
+_NO_CHANGES = Sequentially(changes=[])
+
+
+@attributes([
+    Attribute("minimum", default_value=0.1),
+    Attribute("maximum", default_value=MAXIMUM_CONVERGENCE_INTERVAL),
+    Attribute("failure_maximum", default_value=60.0),
+    Attribute("random", default_value=random),
+])
+class ConvergenceSchedule(object):
+    """
+    Policy for how long to wait between iterations of the convergence loop.
+
+    While changes are being made iterations are ``minimum`` seconds apart.
+    Once the local state has converged the delay doubles with each
+    iteration up to ``maximum``.  Failed iterations back off exponentially
+    up to ``failure_maximum``, with random jitter so that many agents
+    failing for the same reason don't retry in lockstep.
+
+    :ivar float minimum: The shortest delay in seconds.
+    :ivar float maximum: The longest delay in seconds once converged.
+    :ivar float failure_maximum: The longest delay in seconds after
+        failures.
+    :ivar random: Callable returning a random ``float`` between 0 and 1.
+    """
+    def __init__(self):
+        self._converged = 0
+        self._failures = 0
+
+    def _backoff(self, count, maximum):
+        return min(self.minimum * 2 ** count, maximum)
+
+    def changed(self):
+        """
+        :return: Delay in seconds after an iteration that made changes, or
+            during which the desired configuration changed.
+        """
+        self._converged = self._failures = 0
+        return self.minimum
+
+    def converged(self):
+        """
+        :return: Delay in seconds after an iteration that found nothing to
+            do.
+        """
+        self._failures = 0
+        self._converged += 1
+        return self._backoff(self._converged, self.maximum)
+
+    def failed(self):
+        """
+        :return: Delay in seconds after a failed iteration.
+        """
+        self._converged = 0
+        self._failures += 1
+        return max(self.minimum, self.random() * self._backoff(
+            self._failures, self.failure_maximum))
 
 
 class ConvergenceLoop(object):
@@ -245,60 +334,165 @@ class ConvergenceLoop(object):
     :ivar Deployment state: Actual cluster state.  Initially ``None``.
 
     :ivar fsm: The finite state machine this is part of.
+
+    :ivar _sent_state: The ``NodeState`` last sent to the control service
+        using the current client, or ``None`` if it needs to be sent
+        again.
+
+    :ivar _sent_at: The time ``_sent_state`` was sent.
+
+    :ivar _updated: Whether a status update was received, or the local state
+        changed, during the current iteration.
+
+    :ivar _delay: Seconds to wait before the next iteration.
+
+    :ivar _wakeup: The ``IDelayedCall`` for the next iteration, or
+        ``None``.
     """
-    def __init__(self, deployer):
+    client = None
+
+    def __init__(self, reactor, deployer, schedule):
         """
+        :param reactor: Reactor used to schedule iterations and to decide
+            when to refresh unchanged local state.
+
         :param IDeployer deployer: Used to discover local state and calcualte
             necessary changes to match desired configuration.
+
+        :param ConvergenceSchedule schedule: Decides how long to wait
+            between iterations.
         """
+        self.reactor = reactor
         self.deployer = deployer
+        self.schedule = schedule
+        self._sent_state = None
+        self._sent_at = None
+        self._updated = False
+        self._delay = None
+        self._wakeup = None
 
     def output_STORE_INFO(self, context):
+        if context.client is not self.client:
+            # A new connection knows nothing of what we sent before:
+            self._sent_state = None
         self.client, self.configuration, self.cluster_state = (
             context.client, context.configuration, context.state)
+        self._updated = True
+
+    def output_NOTE_CHANGE(self, context):
+        self._updated = True
+
+    def output_SCHEDULE_WAKEUP(self, context):
+        self._wakeup = self.reactor.callLater(
+            self._delay, self.fsm.receive, ConvergenceLoopInputs.WAKEUP)
+
+    def output_CANCEL_WAKEUP(self, context):
+        if self._wakeup.active():
+            self._wakeup.cancel()
+        self._wakeup = None
+
+    def _send_local_state(self, local_state):
+        """
+        Send the local state to the control service, unless it is the same
+        as was last sent and that was recent enough.
+
+        :param NodeState local_state: The discovered local state.
+        """
+        now = self.reactor.seconds()
+        if (local_state == self._sent_state and
+                now - self._sent_at < NODE_STATE_KEEPALIVE):
+            return
+        self._sent_state, self._sent_at = local_state, now
+        client = self.client
+        d = client.callRemote(NodeStateCommand, node_state=local_state)
+
+        def failed(reason):
+            # Make sure the state is sent again next iteration:
+            if self.client is client and self._sent_state is local_state:
+                self._sent_state = None
+            # This needs logging:
+            # https://clusterhq.atlassian.net/browse/FLOC-1311
+        d.addErrback(failed)
 
     def output_CONVERGE(self, context):
+        self._updated = False
+        self._wakeup = None
         d = self.deployer.discover_local_state()
 
         def got_local_state(local_state):
-            self.client.callRemote(NodeStateCommand, node_state=local_state)
+            self._send_local_state(local_state)
             action = self.deployer.calculate_necessary_state_changes(
                 local_state, self.configuration, self.cluster_state)
-            return action.run(self.deployer)
+            d = action.run(self.deployer)
+            d.addCallback(lambda _: action == _NO_CHANGES)
+            return d
         d.addCallback(got_local_state)
+
+        def succeeded(converged):
+            if converged and not self._updated:
+                self._delay = self.schedule.converged()
+            else:
+                self._delay = self.schedule.changed()
+
+        def failed(reason):
+            write_failure(reason, _logger, u"flocker:agent:converge")
+            self._delay = self.schedule.failed()
+        d.addCallbacks(succeeded, failed)
         d.addCallback(lambda _: self.fsm.receive(
             ConvergenceLoopInputs.ITERATION_DONE))
-        # This needs error handling:
-        # https://clusterhq.atlassian.net/browse/FLOC-1357
 
 
-def build_convergence_loop_fsm(deployer):
+def build_convergence_loop_fsm(reactor, deployer, schedule=None):
     """
     Create a convergence loop FSM.
 
+    :param reactor: Reactor used to schedule iterations and to decide when
+        to refresh unchanged local state.
+
     :param IDeployer deployer: Used to discover local state and calcualte
         necessary changes to match desired configuration.
+
+    :param ConvergenceSchedule schedule: Decides how long to wait between
+        iterations, or ``None`` to use the default schedule.
     """
+    if schedule is None:
+        schedule = ConvergenceSchedule()
     I = ConvergenceLoopInputs
     O = ConvergenceLoopOutputs
     S = ConvergenceLoopStates
 
     table = TransitionTable()
-    table = table.addTransition(
-        S.STOPPED, I.STATUS_UPDATE, [O.STORE_INFO, O.CONVERGE], S.CONVERGING)
+    table = table.addTransitions(
+        S.STOPPED, {
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.CONVERGE], S.CONVERGING),
+            # The change will be noticed once convergence starts:
+            I.LOCAL_STATE_CHANGED: ([], S.STOPPED),
+        })
     table = table.addTransitions(
         S.CONVERGING, {
             I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
+            I.LOCAL_STATE_CHANGED: ([O.NOTE_CHANGE], S.CONVERGING),
             I.STOP: ([], S.CONVERGING_STOPPING),
-            I.ITERATION_DONE: ([O.CONVERGE], S.CONVERGING),
+            I.ITERATION_DONE: ([O.SCHEDULE_WAKEUP], S.SLEEPING),
         })
     table = table.addTransitions(
         S.CONVERGING_STOPPING, {
             I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
+            I.LOCAL_STATE_CHANGED: ([], S.CONVERGING_STOPPING),
             I.ITERATION_DONE: ([], S.STOPPED),
         })
+    table = table.addTransitions(
+        S.SLEEPING, {
+            I.WAKEUP: ([O.CONVERGE], S.CONVERGING),
+            # A new configuration or cluster state is acted on immediately:
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.CANCEL_WAKEUP, O.CONVERGE],
+                              S.CONVERGING),
+            I.LOCAL_STATE_CHANGED: ([O.CANCEL_WAKEUP, O.CONVERGE],
+                                    S.CONVERGING),
+            I.STOP: ([O.CANCEL_WAKEUP], S.STOPPED),
+        })
 
-    loop = ConvergenceLoop(deployer)
+    loop = ConvergenceLoop(reactor, deployer, schedule)
     fsm = constructFiniteStateMachine(
         inputs=I, outputs=O, states=S, initial=S.STOPPED, table=table,
         richInputs=[_ClientStatusUpdate], inputContext={},
@@ -308,7 +502,9 @@ def build_convergence_loop_fsm(deployer):
 
 
 @implementer(IConvergenceAgent)
-@attributes(["reactor", "deployer", "host", "port"])
+@attributes(["reactor", "deployer", "host", "port",
+             Attribute("maximum_interval",
+                       default_value=MAXIMUM_CONVERGENCE_INTERVAL)])
 class AgentLoopService(object, MultiService):
     """
     Service in charge of running the convergence loop.
@@ -318,14 +514,19 @@ class AgentLoopService(object, MultiService):
             then changing it.
     :ivar host: Host to connect to.
     :ivar port: Port to connect to.
+    :ivar float maximum_interval: The longest time in seconds between
+        convergence iterations while nothing is changing.
     :ivar cluster_status: A cluster status FSM.
+    :ivar convergence_loop: A convergence loop FSM.
     :ivar factory: The factory used to connect to the control service.
     """
 
     def __init__(self):
         MultiService.__init__(self)
-        convergence_loop = build_convergence_loop_fsm(self.deployer)
-        self.cluster_status = build_cluster_status_fsm(convergence_loop)
+        self.convergence_loop = build_convergence_loop_fsm(
+            self.reactor, self.deployer,
+            ConvergenceSchedule(maximum=self.maximum_interval))
+        self.cluster_status = build_cluster_status_fsm(self.convergence_loop)
         self.factory = ReconnectingClientFactory.forProtocol(
             lambda: AgentAMP(self))
 
@@ -338,6 +539,13 @@ class AgentLoopService(object, MultiService):
         self.factory.stopTrying()
         self.cluster_status.receive(ClusterStatusInputs.SHUTDOWN)
 
+    def local_state_changed(self):
+        """
+        Converge soon, because the local state is known to have changed.
+        """
+        self.convergence_loop.receive(
+            ConvergenceLoopInputs.LOCAL_STATE_CHANGED)
+
     # IConvergenceAgent methods:
 
     def connected(self, client):
@@ -16,6 +16,7 @@ from docker import Client
 Client = partial(Client, version="1.15")
 
 from twisted.trial.unittest import TestCase
+from twisted.internet import reactor
 from twisted.python.filepath import FilePath
 from twisted.internet.defer import succeed, gatherResults
 from twisted.internet.error import ConnectionRefusedError
@@ -30,7 +31,7 @@ from ...testtools import (
 from ..test.test_docker import make_idockerclient_tests
 from .._docker import (
     DockerClient, PortMap, Environment, NamespacedDockerClient,
-    BASE_NAMESPACE, Volume)
+    BASE_NAMESPACE, Volume, DockerEvents, HTTPDockerClient)
 from ...control._model import RestartNever, RestartAlways, RestartOnFailure
 from ..testtools import if_docker_configured, wait_for_unit_state
 
@@ -62,6 +63,25 @@ class IDockerClientNamespacedTests(make_idockerclient_tests(
         pass
 
 
+def http_docker_client(test_case):
+    """
+    Create a ``HTTPDockerClient`` with a random namespace, closing its
+    connections once the test is done.
+    """
+    client = HTTPDockerClient(reactor, namespace=random_name())
+    test_case.addCleanup(client.close)
+    return client
+
+
+class HTTPIDockerClientTests(make_idockerclient_tests(http_docker_client)):
+    """
+    ``IDockerClient`` tests for ``HTTPDockerClient``.
+    """
+    @if_docker_configured
+    def setUp(self):
+        pass
+
+
 class GenericDockerClientTests(TestCase):
     """
     Functional tests for ``DockerClient`` and other clients that talk to
@@ -655,6 +675,83 @@ class DockerClientTests(TestCase):
 
         return running_assertions
 
+    def test_inspect_unit(self):
+        """
+        ``DockerClient.inspect_unit`` returns the ID and ``Unit`` of a
+        container in the client's namespace.
+        """
+        client = DockerClient(namespace=namespace_for_test(self))
+        name = random_name()
+        self.addCleanup(client.remove, name)
+        d = client.add(name, u"busybox")
+        d.addCallback(lambda _: gatherResults([
+            client.inspect_unit(client._to_container_name(name)),
+            client.list()]))
+
+        def check(result):
+            (container_id, unit), [listed] = result
+            self.assertEqual((container_id, unit),
+                             (Client().inspect_container(
+                                 unit.container_name)[u"Id"], listed))
+        d.addCallback(check)
+        return d
+
+    def test_inspect_unit_other_namespace(self):
+        """
+        ``DockerClient.inspect_unit`` returns ``None`` instead of a ``Unit``
+        for a container outside the client's namespace.
+        """
+        client = DockerClient(namespace=namespace_for_test(self))
+        other = DockerClient(namespace=random_name())
+        name = random_name()
+        self.addCleanup(client.remove, name)
+        d = client.add(name, u"busybox")
+        d.addCallback(lambda _: other.inspect_unit(
+            client._to_container_name(name)))
+        d.addCallback(lambda result: self.assertEqual(result[1], None))
+        return d
+
+    def test_inspect_unit_missing(self):
+        """
+        ``DockerClient.inspect_unit`` returns ``None`` for a container which
+        does not exist.
+        """
+        client = DockerClient(namespace=namespace_for_test(self))
+        d = client.inspect_unit(random_name())
+        d.addCallback(self.assertIs, None)
+        return d
+
+
+class DockerEventsTests(TestCase):
+    """
+    Tests for ``DockerEvents``.
+    """
+    @if_docker_configured
+    def setUp(self):
+        pass
+
+    def test_events(self):
+        """
+        ``DockerEvents.watch`` delivers events for containers as they
+        happen.
+        """
+        events = []
+        DockerEvents(reactor).watch(events.append)
+        client = DockerClient(namespace=namespace_for_test(self))
+        name = random_name()
+        self.addCleanup(client.remove, name)
+        d = client.add(name, u"busybox")
+        d.addCallback(lambda _: client.inspect_unit(
+            client._to_container_name(name)))
+
+        def created(result):
+            container_id = result[0]
+            return loop_until(lambda: any(
+                event[u"id"] == container_id and
+                event[u"status"] == u"create" for event in events))
+        d.addCallback(created)
+        return d
+
 
 class NamespacedDockerClientTests(GenericDockerClientTests):
     """
@@ -24,13 +24,19 @@ from ..volume.service import (
     ICommandLineVolumeScript, VolumeScript)
 
 from ..volume.script import flocker_volume_options
+from ..volume._agent import AgentVolumeManager
+from ..volume._ipc import standard_node
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service)
 from ..control import (
     ConfigurationError, current_from_configuration, model_from_configuration,
 )
+from ..route import make_host_network
 from . import P2PNodeDeployer, change_node_state
-from ._loop import AgentLoopService
+from ._loop import AgentLoopService, MAXIMUM_CONVERGENCE_INTERVAL
+from ._docker import (
+    DockerClient, DockerEvents, HTTPDockerClient, WatchingDockerClient,
+    )
 
 
 __all__ = [
@@ -148,9 +154,11 @@ class ChangeStateScript(object):
         self._docker_client = docker_client
 
     def main(self, reactor, options, volume_service):
+        network = make_host_network(reactor, batched=True)
+        network.configure_forwarding()
         deployer = P2PNodeDeployer(
             options['hostname'].decode("ascii"),
-            volume_service, self._docker_client)
+            volume_service, self._docker_client, network)
         return change_node_state(deployer, options['deployment'],
                                  options['current'])
 
@@ -204,7 +212,8 @@ class ReportStateScript(object):
         # away someday soon: https://clusterhq.atlassian.net/browse/FLOC-1353
         deployer = P2PNodeDeployer(
             u"localhost",
-            volume_service, self._docker_client, self._network)
+            volume_service, self._docker_client, self._network,
+            reactor=reactor)
         d = deployer.discover_local_state()
         d.addCallback(marshal_configuration)
         d.addCallback(safe_dump)
@@ -237,6 +246,23 @@ class ZFSAgentOptions(Options):
     optParameters = [
         ["destination-port", "p", 4524,
          "The port on the control service to connect to.", int],
+        ["maximum-convergence-interval", None, MAXIMUM_CONVERGENCE_INTERVAL,
+         "The longest time in seconds between checks of the local state "
+         "while nothing is changing.", float],
+    ]
+
+    optFlags = [
+        ["watch-docker-events", None,
+         "Track containers using the Docker events API instead of "
+         "inspecting all of them on every check of the local state."],
+        ["volume-agent", None,
+         "Push volumes through a long-running flocker-volume agent on each "
+         "node, which compresses streams, instead of new flocker-volume "
+         "processes per push.  The data then passes through this process, "
+         "so it can't be spliced between pipes."],
+        ["http-docker-client", None,
+         "Talk to Docker with an asynchronous HTTP client instead of "
+         "making blocking API calls in the reactor's thread pool."],
     ]
 
     def parseArgs(self, hostname, host):
@@ -256,11 +282,37 @@ class ZFSAgentScript(object):
     def main(self, reactor, options, volume_service):
         host = options["destination-host"]
         port = options["destination-port"]
+        docker_client = None
+        if options["http-docker-client"]:
+            docker_client = HTTPDockerClient(reactor)
+        watching = None
+        if options["watch-docker-events"]:
+            docker_client = watching = WatchingDockerClient(
+                reactor, docker_client or DockerClient(),
+                DockerEvents(reactor))
+
+        remote_volume_manager = None
+        if options["volume-agent"]:
+            def remote_volume_manager(hostname):
+                # Each node's volume agent is started once and reused,
+                # rather than starting a flocker-volume process for every
+                # request:
+                return AgentVolumeManager.for_node(
+                    reactor, standard_node(hostname))
+        # The system configuration proxies rely upon is written once at
+        # startup, rather than whenever proxies are created:
+        network = make_host_network(reactor, batched=True)
+        network.configure_forwarding()
         deployer = P2PNodeDeployer(options["hostname"].decode("ascii"),
-                                   volume_service)
-        loop = AgentLoopService(reactor=reactor, deployer=deployer,
-                                host=host, port=port)
+                                   volume_service, docker_client, network,
+                                   remote_volume_manager=remote_volume_manager)
+        loop = AgentLoopService(
+            reactor=reactor, deployer=deployer, host=host, port=port,
+            maximum_interval=options["maximum-convergence-interval"])
         volume_service.setServiceParent(loop)
+        if watching is not None:
+            watching.register(loop.local_state_changed)
+            watching.setServiceParent(loop)
         return main_for_service(reactor, loop)
 
 
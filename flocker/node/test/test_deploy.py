@@ -13,6 +13,8 @@ from eliot.testing import validate_logging
 
 from pyrsistent import pmap, pset
 
+from ipaddr import IPAddress
+
 from twisted.internet.defer import fail, FirstError, succeed, Deferred
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 from twisted.python.filepath import FilePath
@@ -25,19 +27,21 @@ from .._deploy import (
     IStateChange, Sequentially, InParallel, StartApplication, StopApplication,
     CreateDataset, WaitForDataset, HandoffDataset, SetProxies, PushDataset,
     ResizeDataset, _link_environment, _to_volume_name, IDeployer,
-    DeleteDataset,
+    DeleteDataset, PullImage, find_dataset_changes,
 )
 from ...testtools import CustomException
 from .. import _deploy
-from ...control._model import AttachedVolume, Dataset, Manifestation
+from ...control._model import (
+    AttachedVolume, Dataset, Manifestation, DatasetChanges, DatasetHandoff,
+    )
 from .._docker import (
     FakeDockerClient, AlreadyExists, Unit, PortMap, Environment,
-    DockerClient, Volume as DockerVolume)
+    DockerClient, Volume as DockerVolume, ImageManager)
 from ...route import Proxy, make_memory_network
 from ...route._iptables import HostNetwork
 from ...volume.service import Volume, VolumeName
 from ...volume._model import VolumeSize
-from ...volume.testtools import create_volume_service
+from ...volume.testtools import create_volume_service, VolumeCommandNode
 from ...volume._ipc import RemoteVolumeManager, standard_node
 
 
@@ -65,6 +69,19 @@ class P2PNodeDeployerAttributesTests(SynchronousTestCase):
                             docker_client=dummy_docker_client).docker_client
         )
 
+    def test_image_manager(self):
+        """
+        ``P2PNodeDeployer.image_manager`` is an ``ImageManager`` pulling
+        images with the deployer's Docker client.
+        """
+        docker_client = FakeDockerClient()
+        deployer = P2PNodeDeployer(u'example.com', create_volume_service(self),
+                                   docker_client=docker_client)
+        self.assertEqual(
+            (ImageManager, docker_client),
+            (deployer.image_manager.__class__,
+             deployer.image_manager._client))
+
     def test_network_default(self):
         """
         ``P2PNodeDeployer._network`` is a ``HostNetwork`` by default.
@@ -72,6 +89,13 @@ class P2PNodeDeployerAttributesTests(SynchronousTestCase):
         self.assertIsInstance(P2PNodeDeployer(u'example.com', None).network,
                               HostNetwork)
 
+    def test_network_batched(self):
+        """
+        The default ``HostNetwork`` applies updates in batches.
+        """
+        self.assertTrue(
+            P2PNodeDeployer(u'example.com', None).network.batched)
+
     def test_network_override(self):
         """
         ``P2PNodeDeployer._network`` can be overridden in the constructor.
@@ -83,6 +107,42 @@ class P2PNodeDeployerAttributesTests(SynchronousTestCase):
                             network=dummy_network).network
         )
 
+    def test_remote_volume_manager_default(self):
+        """
+        ``P2PNodeDeployer.remote_volume_manager`` returns a
+        ``RemoteVolumeManager`` which uses SSH by default.
+        """
+        self.assertEqual(
+            P2PNodeDeployer(u'example.com', None).remote_volume_manager(
+                b"node2.example.com"),
+            RemoteVolumeManager(standard_node(b"node2.example.com")))
+
+    def test_remote_volume_manager_override(self):
+        """
+        ``P2PNodeDeployer.remote_volume_manager`` returns the result of the
+        factory given to the constructor, called with the hostname.
+        """
+        deployer = P2PNodeDeployer(
+            u'example.com', None,
+            remote_volume_manager=lambda hostname: (u"manager", hostname))
+        self.assertEqual(
+            deployer.remote_volume_manager(b"node2.example.com"),
+            (u"manager", b"node2.example.com"))
+
+    def test_remote_volume_manager_reused(self):
+        """
+        ``P2PNodeDeployer.remote_volume_manager`` returns the same remote
+        volume manager every time it is called with the same hostname.
+        """
+        deployer = P2PNodeDeployer(
+            u'example.com', None, remote_volume_manager=lambda hostname: [])
+        self.assertEqual(
+            (deployer.remote_volume_manager(b"node2.example.com") is
+             deployer.remote_volume_manager(b"node2.example.com"),
+             deployer.remote_volume_manager(b"node2.example.com") is
+             deployer.remote_volume_manager(b"node3.example.com")),
+            (True, False))
+
 
 def make_istatechange_tests(klass, kwargs1, kwargs2):
     """
@@ -130,6 +190,8 @@ StartApplicationIStateChangeTests = make_istatechange_tests(
     dict(application=2, hostname="node2.example.com"))
 StopApplicationIStageChangeTests = make_istatechange_tests(
     StopApplication, dict(application=1), dict(application=2))
+PullImageIStateChangeTests = make_istatechange_tests(
+    PullImage, dict(image=1), dict(image=2))
 SetProxiesIStateChangeTests = make_istatechange_tests(
     SetProxies, dict(ports=[1]), dict(ports=[2]))
 WaitForVolumeIStateChangeTests = make_istatechange_tests(
@@ -719,6 +781,28 @@ MANIFESTATION_WITH_SIZE = APPLICATION_WITH_VOLUME_SIZE.volume.manifestation
 DISCOVERED_APPLICATION_WITH_VOLUME = APPLICATION_WITH_VOLUME
 
 
+class PullImageTests(SynchronousTestCase):
+    """
+    Tests for ``PullImage``.
+    """
+    def test_pull(self):
+        """
+        ``PullImage.run()`` pulls the image using the deployer's
+        ``ImageManager``, returning a ``Deferred`` that fires once the image
+        has been pulled.
+        """
+        pulled = []
+        api = P2PNodeDeployer(u'example.com', create_volume_service(self),
+                              docker_client=FakeDockerClient())
+        self.patch(api.image_manager, "pull",
+                   lambda image_name: pulled.append(image_name) or
+                   succeed(None))
+        result = PullImage(image=DockerImage(
+            repository=u'clusterhq/flocker', tag=u'release-14.0')).run(api)
+        self.assertEqual((self.successResultOf(result), pulled),
+                         (None, [u'clusterhq/flocker:release-14.0']))
+
+
 class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
     """
     Tests for ``P2PNodeDeployer.discover_local_state``.
@@ -745,6 +829,30 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
                                    running=[], not_running=[]),
                          self.successResultOf(d))
 
+    def test_pool_invalidated(self):
+        """
+        ``P2PNodeDeployer.discover_local_state`` invalidates the storage pool
+        before enumerating the volumes in it, so that changes made by other
+        processes since the last iteration are seen.
+        """
+        pool = self.volume_service.pool
+        calls = []
+        self.patch(pool, "invalidate", lambda: calls.append("invalidate"))
+        original_enumerate = pool.enumerate
+
+        def enumerate():
+            calls.append("enumerate")
+            return original_enumerate()
+        self.patch(pool, "enumerate", enumerate)
+        api = P2PNodeDeployer(
+            u'example.com',
+            self.volume_service,
+            docker_client=FakeDockerClient(units={}),
+            network=self.network
+        )
+        self.successResultOf(api.discover_local_state())
+        self.assertEqual(calls, ["invalidate", "enumerate"])
+
     def test_discover_one(self):
         """
         ``P2PNodeDeployer.discover_local_state`` returns ``NodeState`` with a
@@ -1326,6 +1434,33 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         expected = Sequentially(changes=[SetProxies(ports=frozenset())])
         self.assertEqual(expected, result)
 
+    def test_proxy_exists_as_address(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` does not return
+        a ``SetProxies`` when the desired proxies already exist, even though
+        the network reports their ``ip`` as an ``IPv4Address`` rather than
+        text.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(ip=IPAddress(u'192.0.2.100'), port=1001)
+        api = P2PNodeDeployer(u'node2.example.com',
+                              create_volume_service(self),
+                              docker_client=FakeDockerClient(units={}),
+                              network=network)
+        application = Application(
+            name=b'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql',
+                              tag=u'release-14.0'),
+            ports=frozenset([Port(internal_port=3306, external_port=1001)]),
+        )
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'192.0.2.100',
+                 applications=frozenset([application]))]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state()),
+            desired_configuration=desired, current_cluster_state=EMPTY)
+        self.assertEqual(Sequentially(changes=[]), result)
+
     def test_application_needs_stopping(self):
         """
         ``P2PNodeDeployer.calculate_necessary_state_changes`` specifies that an
@@ -1379,11 +1514,35 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             self.successResultOf(api.discover_local_state()),
             desired_configuration=desired,
             current_cluster_state=EMPTY)
-        expected = Sequentially(changes=[InParallel(
-            changes=[StartApplication(application=application,
-                                      hostname="node.example.com")])])
+        expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=application.image)]),
+            InParallel(
+                changes=[StartApplication(application=application,
+                                          hostname="node.example.com")])])
         self.assertEqual(expected, result)
 
+    def test_shared_image_pulled_once(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` pulls an image
+        used by several applications that are being started only once.
+        """
+        api = P2PNodeDeployer(u'node.example.com', create_volume_service(self),
+                              docker_client=FakeDockerClient(units={}),
+                              network=make_memory_network())
+        image = DockerImage(repository=u'clusterhq/flocker',
+                            tag=u'release-14.0')
+        applications = [Application(name=name, image=image)
+                        for name in (u'mysql-1', u'mysql-2')]
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset(applications))]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state()),
+            desired_configuration=desired,
+            current_cluster_state=EMPTY)
+        self.assertEqual(result.changes[0],
+                         InParallel(changes=[PullImage(image=image)]))
+
     def test_only_this_node(self):
         """
         ``P2PNodeDeployer.calculate_necessary_state_changes`` does not specify
@@ -1527,6 +1686,8 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME.volume
 
         expected = Sequentially(changes=[
+            InParallel(changes=[
+                PullImage(image=APPLICATION_WITH_VOLUME.image)]),
             InParallel(changes=[CreateDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
                 application=APPLICATION_WITH_VOLUME,
@@ -1671,6 +1832,8 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME.volume
 
         expected = Sequentially(changes=[
+            InParallel(changes=[
+                PullImage(image=APPLICATION_WITH_VOLUME.image)]),
             InParallel(changes=[WaitForDataset(dataset=volume.dataset)]),
             InParallel(changes=[ResizeDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
@@ -1875,6 +2038,8 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
                     dataset=APPLICATION_WITH_VOLUME_SIZE.volume.dataset,
                     )]
             ),
+            InParallel(changes=[
+                PullImage(image=APPLICATION_WITH_VOLUME_SIZE.image)]),
             InParallel(
                 changes=[Sequentially(
                     changes=[
@@ -2024,6 +2189,8 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME_SIZE.volume
 
         expected = Sequentially(changes=[
+            InParallel(changes=[
+                PullImage(image=APPLICATION_WITH_VOLUME_SIZE.image)]),
             InParallel(changes=[WaitForDataset(dataset=volume.dataset)]),
             InParallel(changes=[ResizeDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
@@ -2063,11 +2230,14 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             desired_configuration=desired,
             current_cluster_state=EMPTY)
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[StopApplication(application=application),
-                                  StartApplication(application=application,
-                                                   hostname="n.example.com")]),
-        ])])
+        expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=application.image)]),
+            InParallel(changes=[
+                Sequentially(changes=[
+                    StopApplication(application=application),
+                    StartApplication(application=application,
+                                     hostname="n.example.com")]),
+            ])])
         self.assertEqual(expected, result)
 
     def test_not_local_not_running_applications_stopped(self):
@@ -2182,6 +2352,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         expected = Sequentially(changes=[
             InParallel(changes=[PushDataset(
                 dataset=volume.dataset, hostname=another_node.hostname)]),
+            InParallel(changes=[PullImage(image=another_application.image)]),
             InParallel(changes=[StopApplication(
                 application=Application(name=APPLICATION_WITH_VOLUME_NAME,
                                         image=DockerImage.from_string(
@@ -2251,6 +2422,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         )
 
         expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=new_postgres_app.image)]),
             InParallel(changes=[
                 CreateDataset(dataset=new_postgres_app.volume.dataset)]),
             InParallel(changes=[
@@ -2310,13 +2482,15 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             current_cluster_state=EMPTY,
         )
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[
-                StopApplication(application=old_postgres_app),
-                StartApplication(application=new_postgres_app,
-                                 hostname="node1.example.com")
-                ]),
-        ])])
+        expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=new_postgres_app.image)]),
+            InParallel(changes=[
+                Sequentially(changes=[
+                    StopApplication(application=old_postgres_app),
+                    StartApplication(application=new_postgres_app,
+                                     hostname="node1.example.com")
+                    ]),
+            ])])
 
         self.assertEqual(expected, result)
 
@@ -2380,13 +2554,15 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             current_cluster_state=EMPTY,
         )
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[
-                StopApplication(application=old_postgres_app),
-                StartApplication(application=new_postgres_app,
-                                 hostname="node1.example.com")
-                ]),
-        ])])
+        expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=new_postgres_app.image)]),
+            InParallel(changes=[
+                Sequentially(changes=[
+                    StopApplication(application=old_postgres_app),
+                    StartApplication(application=new_postgres_app,
+                                     hostname="node1.example.com")
+                    ]),
+            ])])
 
         self.assertEqual(expected, result)
 
@@ -2448,13 +2624,15 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             current_cluster_state=EMPTY,
         )
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[
-                StopApplication(application=old_wordpress_app),
-                StartApplication(application=new_wordpress_app,
-                                 hostname="node1.example.com")
-                ]),
-        ])])
+        expected = Sequentially(changes=[
+            InParallel(changes=[PullImage(image=new_wordpress_app.image)]),
+            InParallel(changes=[
+                Sequentially(changes=[
+                    StopApplication(application=old_wordpress_app),
+                    StartApplication(application=new_wordpress_app,
+                                     hostname="node1.example.com")
+                    ]),
+            ])])
 
         self.assertEqual(expected, result)
 
@@ -2908,6 +3086,62 @@ class SetProxiesTests(SynchronousTestCase):
             set(fake_network.enumerate_proxies())
         )
 
+    def test_only_differences_changed(self):
+        """
+        Only proxies which are not desired are deleted and only desired
+        proxies which do not exist are created; proxies which exist and are
+        still desired are left alone.
+        """
+        fake_network = make_memory_network()
+        kept = fake_network.create_proxy_to(ip=u'192.0.2.101', port=3306)
+        removed = fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
+        added = Proxy(ip=u'192.0.2.102', port=8080)
+        changes = []
+        create_proxy_to = fake_network.create_proxy_to
+        delete_proxy = fake_network.delete_proxy
+
+        def record_create(ip, port):
+            changes.append(("create", Proxy(ip=ip, port=port)))
+            return create_proxy_to(ip, port)
+
+        def record_delete(proxy):
+            changes.append(("delete", proxy))
+            return delete_proxy(proxy)
+
+        fake_network.create_proxy_to = record_create
+        fake_network.delete_proxy = record_delete
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[kept, added]).run(api)
+        self.successResultOf(d)
+        self.assertEqual(
+            ([("delete", removed), ("create", added)],
+             {kept, added}),
+            (changes, set(fake_network.enumerate_proxies())))
+
+    def test_addresses_compared_as_text(self):
+        """
+        A desired proxy whose ``ip`` is text matches an existing proxy whose
+        ``ip`` is the equivalent ``IPv4Address``, as read back from
+        ``iptables``, so it is neither deleted nor recreated.
+        """
+        fake_network = make_memory_network()
+        fake_network.create_proxy_to(ip=IPAddress(u'192.0.2.100'), port=3306)
+        fake_network.create_proxy_to = lambda ip, port: 1/0
+        fake_network.delete_proxy = lambda proxy: 1/0
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[Proxy(ip=u'192.0.2.100', port=3306)]).run(api)
+        self.successResultOf(d)
+
     def test_delete_proxy_errors_as_errbacks(self):
         """
         Exceptions raised in `delete_proxy` operations are reported as
@@ -2951,9 +3185,10 @@ class SetProxiesTests(SynchronousTestCase):
         )
         self.flushLoggedErrors(ZeroDivisionError)
 
-    def test_create_proxy_errors_all_logged(self):
+    def test_create_proxy_errors_logged(self):
         """
-        Exceptions raised in `create_proxy_to` operations are all logged.
+        An exception raised in a `create_proxy_to` operation is logged and
+        stops the update, since proxies are updated in a single transaction.
         """
         fake_network = make_memory_network()
         fake_network.create_proxy_to = lambda ip, port: 1/0
@@ -2972,7 +3207,144 @@ class SetProxiesTests(SynchronousTestCase):
         self.failureResultOf(d, FirstError)
 
         failures = self.flushLoggedErrors(ZeroDivisionError)
-        self.assertEqual(3, len(failures))
+        self.assertEqual(1, len(failures))
+
+    def test_one_update(self):
+        """
+        All proxies to delete and create are passed to a single
+        ``INetwork.update_proxies`` call.
+        """
+        fake_network = make_memory_network()
+        removed = fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
+        added = [Proxy(ip=u'192.0.2.101', port=3306),
+                 Proxy(ip=u'192.0.2.102', port=3306)]
+        updates = []
+        update_proxies = fake_network.update_proxies
+
+        def record_update(delete, create):
+            updates.append((delete, set(create)))
+            return update_proxies(delete, create)
+        fake_network.update_proxies = record_update
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        self.successResultOf(SetProxies(ports=added).run(api))
+        self.assertEqual([([removed], set(added))], updates)
+
+
+def node_with_datasets(hostname, *datasets):
+    """
+    Create a ``Node`` with primary manifestations of the given datasets.
+
+    :param unicode hostname: The hostname of the node.
+    :param datasets: ``Dataset``\ s to manifest on the node.
+
+    :return: The ``Node``.
+    """
+    return Node(hostname=hostname, manifestations={
+        dataset.dataset_id: Manifestation(dataset=dataset, primary=True)
+        for dataset in datasets})
+
+
+class FindDatasetChangesTests(SynchronousTestCase):
+    """
+    Tests for ``find_dataset_changes``.
+    """
+    def assert_changes(self, current, desired, **expected):
+        """
+        Assert the changes found for ``node1`` between the given nodes.
+
+        :param list current: The ``Node``\ s in the current state.
+        :param list desired: The ``Node``\ s in the desired state.
+        :param expected: The expected ``DatasetChanges`` attributes; those
+            not given are expected to be empty.
+        """
+        for name in (u"going", u"coming", u"creating", u"resizing",
+                     u"deleting"):
+            expected.setdefault(name, set())
+        self.assertEqual(
+            find_dataset_changes(u"node1",
+                                 Deployment(nodes=frozenset(current)),
+                                 Deployment(nodes=frozenset(desired))),
+            DatasetChanges(**expected))
+
+    def test_unchanged(self):
+        """
+        A dataset which stays on this node needs no changes.
+        """
+        self.assert_changes([node_with_datasets(u"node1", DATASET)],
+                            [node_with_datasets(u"node1", DATASET)])
+
+    def test_creating(self):
+        """
+        A dataset desired on this node which exists nowhere is created.
+        """
+        self.assert_changes([], [node_with_datasets(u"node1", DATASET)],
+                            creating={DATASET})
+
+    def test_coming(self):
+        """
+        A dataset desired on this node which exists on another node is
+        coming here.
+        """
+        self.assert_changes([node_with_datasets(u"node2", DATASET)],
+                            [node_with_datasets(u"node1", DATASET)],
+                            coming={DATASET})
+
+    def test_going(self):
+        """
+        A dataset on this node which is desired on another node is handed
+        off to it.
+        """
+        self.assert_changes(
+            [node_with_datasets(u"node1", DATASET)],
+            [node_with_datasets(u"node2", DATASET)],
+            going={DatasetHandoff(dataset=DATASET, hostname=u"node2")})
+
+    def test_resizing_local(self):
+        """
+        A dataset on this node which stays here with a different maximum
+        size is resized.
+        """
+        self.assert_changes(
+            [node_with_datasets(u"node1", DATASET)],
+            [node_with_datasets(u"node1", DATASET_WITH_SIZE)],
+            resizing={DATASET_WITH_SIZE})
+
+    def test_resizing_going(self):
+        """
+        A dataset on this node which is desired on another node with a
+        different maximum size is resized before being handed off.
+        """
+        self.assert_changes(
+            [node_with_datasets(u"node1", DATASET)],
+            [node_with_datasets(u"node2", DATASET_WITH_SIZE)],
+            resizing={DATASET_WITH_SIZE},
+            going={DatasetHandoff(dataset=DATASET_WITH_SIZE,
+                                  hostname=u"node2")})
+
+    def test_remote_changes_ignored(self):
+        """
+        Datasets moving between or created on other nodes need no changes
+        on this node.
+        """
+        other = Dataset(dataset_id=unicode(uuid4()))
+        self.assert_changes(
+            [node_with_datasets(u"node2", DATASET)],
+            [node_with_datasets(u"node3", DATASET, other)])
+
+    def test_deleting(self):
+        """
+        Datasets marked as deleted on any node are deleted.
+        """
+        deleted = DATASET.set(deleted=True)
+        self.assert_changes(
+            [node_with_datasets(u"node2", DATASET)],
+            [node_with_datasets(u"node2", deleted)],
+            deleting={deleted})
 
 
 class ChangeNodeStateTests(SynchronousTestCase):
@@ -3386,6 +3758,39 @@ class PushVolumeTests(SynchronousTestCase):
             [volume_service.get(_to_volume_name(DATASET.dataset_id)),
              RemoteVolumeManager(standard_node(hostname))])
 
+    def test_default_negotiates_features(self):
+        """
+        A push with the default remote volume manager asks the destination
+        which stream features its storage pool can receive, and which
+        interrupted stream to resume, before sending the volume.
+        """
+        volume_service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        nodes = []
+
+        def node(hostname):
+            nodes.append(VolumeCommandNode(to_service))
+            return nodes[-1]
+        self.patch(_deploy, "standard_node", node)
+        volume = self.successResultOf(volume_service.create(
+            volume_service.get(_to_volume_name(DATASET.dataset_id))))
+        deployer = P2PNodeDeployer(
+            u'example.com',
+            volume_service,
+            docker_client=FakeDockerClient(),
+            network=make_memory_network())
+        push = PushDataset(
+            dataset=APPLICATION_WITH_VOLUME.volume.dataset,
+            hostname=b"dest.example.com")
+        self.successResultOf(push.run(deployer))
+        self.assertEqual(
+            ([command[3] for command in nodes[0].commands],
+             Volume(node_id=volume.node_id, name=volume.name,
+                    service=to_service) in
+             self.successResultOf(to_service.enumerate())),
+            ([b"snapshots", b"stream_features", b"resume_token",
+              b"receive"], True))
+
     def test_return(self):
         """
         ``PushVolume.run()`` returns the result of
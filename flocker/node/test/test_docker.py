@@ -2,15 +2,36 @@
 
 """Tests for :module:`flocker.node._docker`."""
 
+from itertools import islice
+from tempfile import mkdtemp
+
 from zope.interface.verify import verifyObject
 
-from twisted.trial.unittest import TestCase
+from eliot.testing import LoggedMessage, validateLogging
+
+from twisted.trial.unittest import SynchronousTestCase, TestCase
 from twisted.python.filepath import FilePath
+from twisted.python.failure import Failure
+from twisted.internet.defer import (
+    CancelledError, Deferred, maybeDeferred, succeed)
+from twisted.internet import reactor
+from twisted.internet.task import Clock
+from twisted.web.http import NOT_FOUND, INTERNAL_SERVER_ERROR
+from twisted.web.server import Site
+
+from docker.errors import APIError
 
 from ...testtools import random_name, make_with_init_tests
+from .. import _docker
 from .._docker import (
     IDockerClient, FakeDockerClient, AlreadyExists, PortMap, Unit,
-    Environment, Volume)
+    Environment, Volume, IDockerEvents, FakeDockerEvents,
+    WatchingDockerClient, RESYNC_INTERVAL, EVENTS_RETRY_INTERVAL,
+    DockerClient, INSPECT_CONCURRENCY, HTTPDockerClient, DockerAPIError,
+    ImageManager, LifecycleTimeout, RETRY_INITIAL_DELAY, RETRY_MAXIMUM_DELAY,
+    _retry_delays)
+from .._logging import LIFECYCLE_STEP
+from ..testtools import FakeDockerServer
 
 from ...control._model import RestartAlways, RestartNever, RestartOnFailure
 
@@ -70,6 +91,16 @@ def make_idockerclient_tests(fixture):
             d.addCallback(lambda _: client.remove(name))
             return d
 
+        def test_pull(self):
+            """An image can be pulled, after which a unit using it can be
+            added."""
+            client = fixture(self)
+            name = random_name()
+            d = client.pull(u"busybox")
+            d.addCallback(lambda _: client.add(name, u"busybox"))
+            d.addCallback(lambda _: client.remove(name))
+            return d
+
         def test_unknown_does_not_exist(self):
             """A unit that was never added does not exist."""
             client = fixture(self)
@@ -257,6 +288,869 @@ class FakeDockerClientImplementationTests(TestCase):
         self.assertEqual(units, FakeDockerClient(units=units)._units)
 
 
+class FakeDockerEventsTests(TestCase):
+    """
+    Tests for ``FakeDockerEvents``.
+    """
+    def test_interface(self):
+        """
+        ``FakeDockerEvents`` provides ``IDockerEvents``.
+        """
+        self.assertTrue(verifyObject(IDockerEvents, FakeDockerEvents()))
+
+    def test_send(self):
+        """
+        ``FakeDockerEvents.send`` delivers events to the current watcher.
+        """
+        events = FakeDockerEvents()
+        received = []
+        events.watch(received.append)
+        events.send({u"status": u"start", u"id": u"abc"})
+        self.assertEqual(received, [{u"status": u"start", u"id": u"abc"}])
+
+    def test_end(self):
+        """
+        ``FakeDockerEvents.end`` fires the ``Deferred`` returned by
+        ``watch``.
+        """
+        events = FakeDockerEvents()
+        d = events.watch(lambda event: None)
+        events.end()
+        self.assertEqual(self.successResultOf(d), None)
+
+    def test_cancel(self):
+        """
+        Cancelling the ``Deferred`` returned by ``watch`` stops delivering
+        events to the watcher.
+        """
+        events = FakeDockerEvents()
+        received = []
+        d = events.watch(received.append)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(events._receive, None)
+
+
+def start_watching_client(test, client=None, events=None, reactor=None):
+    """
+    Create and start a ``WatchingDockerClient``.
+
+    :param TestCase test: The test the client is for.
+    :param FakeDockerClient client: The client to wrap, by default a new
+        ``FakeDockerClient``.
+    :param FakeDockerEvents events: The source of events, by default a
+        new ``FakeDockerEvents``.
+    :param reactor: The reactor, by default a new ``Clock``.
+
+    :return: The started ``WatchingDockerClient``.
+    """
+    if client is None:
+        client = FakeDockerClient()
+    if events is None:
+        events = FakeDockerEvents()
+    if reactor is None:
+        reactor = Clock()
+    watching = WatchingDockerClient(reactor, client, events)
+    watching.startService()
+    test.addCleanup(watching.stopService)
+    return watching
+
+
+class WatchingIDockerClientTests(
+        make_idockerclient_tests(start_watching_client)):
+    """
+    ``IDockerClient`` tests for ``WatchingDockerClient``.
+    """
+
+
+def make_unit(name, activation_state=u"active"):
+    """
+    Create a ``Unit`` as ``FakeDockerClient`` would.
+    """
+    return Unit(name=name, container_name=name,
+                activation_state=activation_state,
+                container_image=u"busybox")
+
+
+class WatchingDockerClientTests(TestCase):
+    """
+    Tests for ``WatchingDockerClient``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.units = {u"one": make_unit(u"one")}
+        self.client = FakeDockerClient(units=self.units)
+        self.inspected = []
+        inspect_unit = self.client.inspect_unit
+        self.patch(self.client, "inspect_unit",
+                   lambda container: self.inspected.append(container)
+                   or inspect_unit(container))
+        self.events = FakeDockerEvents()
+        self.watching = start_watching_client(
+            self, self.client, self.events, self.reactor)
+        self.changes = []
+        self.watching.register(lambda: self.changes.append(None))
+
+    def listed(self):
+        """
+        :return: The units listed by the ``WatchingDockerClient``.
+        """
+        return self.successResultOf(self.watching.list())
+
+    def test_initial_units(self):
+        """
+        Once started, the units that exist are listed.
+        """
+        self.assertEqual(self.listed(), {make_unit(u"one")})
+
+    def test_no_inspection_without_events(self):
+        """
+        Changes without corresponding events are not noticed, since
+        containers are not inspected when listing units.
+        """
+        self.units[u"two"] = make_unit(u"two")
+        self.assertEqual((self.listed(), self.inspected, self.changes),
+                         ({make_unit(u"one")}, [], []))
+
+    def test_event_refreshes(self):
+        """
+        An event for a container results in it being inspected, and the
+        registered callbacks are called if it changed.
+        """
+        self.units[u"two"] = make_unit(u"two")
+        self.events.send({u"status": u"start", u"id": u"two"})
+        self.assertEqual((self.listed(), self.inspected, self.changes),
+                         ({make_unit(u"one"), make_unit(u"two")},
+                          [u"two"], [None]))
+
+    def test_unchanged_no_callback(self):
+        """
+        An event for a container whose unit has not changed does not call
+        the registered callbacks.
+        """
+        self.events.send({u"status": u"start", u"id": u"one"})
+        self.assertEqual((self.inspected, self.changes), ([u"one"], []))
+
+    def test_irrelevant_event(self):
+        """
+        Events which don't change containers are ignored.
+        """
+        self.events.send({u"status": u"pull", u"id": u"busybox"})
+        self.assertEqual(self.inspected, [])
+
+    def test_destroy(self):
+        """
+        A unit whose container has been destroyed is no longer listed.
+        """
+        self.events.send({u"status": u"start", u"id": u"one"})
+        del self.units[u"one"]
+        self.events.send({u"status": u"destroy", u"id": u"one"})
+        self.assertEqual((self.listed(), self.changes), (set(), [None]))
+
+    def test_destroy_unknown_ignored(self):
+        """
+        If a container which was never known is destroyed, units are not
+        refreshed.
+        """
+        listings = []
+        list_by_id = self.client.list_by_id
+        self.patch(self.client, "list_by_id",
+                   lambda: listings.append(None) or list_by_id())
+        del self.units[u"one"]
+        self.events.send({u"status": u"destroy", u"id": u"abcdef"})
+        self.assertEqual((self.listed(), self.changes, listings),
+                         ({make_unit(u"one")}, [], []))
+
+    def test_destroy_listed(self):
+        """
+        A unit learned about from a complete refresh is no longer listed
+        once its container is destroyed, even though its container ID is
+        not its name.
+        """
+        self.patch(self.client, "list_by_id",
+                   lambda: succeed({u"abcdef": make_unit(u"two")}))
+        self.reactor.advance(RESYNC_INTERVAL)
+        self.events.send({u"status": u"destroy", u"id": u"abcdef"})
+        self.assertEqual(self.listed(), set())
+
+    def test_other_namespace_ignored(self):
+        """
+        A container outside the client's namespace is only inspected once.
+        """
+        self.patch(self.client, "inspect_unit",
+                   lambda container: self.inspected.append(container)
+                   or succeed((container, None)))
+        for status in (u"create", u"start", u"die"):
+            self.events.send({u"status": status, u"id": u"other"})
+        self.assertEqual((self.inspected, self.changes), ([u"other"], []))
+
+    def test_resync(self):
+        """
+        All units are refreshed every ``RESYNC_INTERVAL`` seconds.
+        """
+        self.units[u"one"] = make_unit(u"one", u"inactive")
+        self.reactor.advance(RESYNC_INTERVAL)
+        self.assertEqual((self.listed(), self.changes),
+                         ({make_unit(u"one", u"inactive")}, [None]))
+
+    def test_stream_ended(self):
+        """
+        If the stream of events ends, it is watched again after
+        ``EVENTS_RETRY_INTERVAL`` seconds, and all units are refreshed.
+        """
+        self.events.end(Failure(RuntimeError()))
+        self.units[u"two"] = make_unit(u"two")
+        before = self.events.watches
+        self.reactor.advance(EVENTS_RETRY_INTERVAL)
+        self.assertEqual((before, self.events.watches, self.listed()),
+                         (1, 2, {make_unit(u"one"), make_unit(u"two")}))
+
+    def test_added_listed(self):
+        """
+        A unit added using the ``WatchingDockerClient`` is listed once
+        adding is done, without waiting for an event.
+        """
+        self.successResultOf(self.watching.add(u"two", u"busybox"))
+        self.assertIn(u"two", {unit.name for unit in self.listed()})
+
+    def test_stop(self):
+        """
+        Stopping the service cancels scheduled refreshes.
+        """
+        self.events.end()
+        self.watching.stopService()
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_stop_watching(self):
+        """
+        Stopping the service stops watching events, without logging an
+        error or watching again.
+        """
+        self.watching.stopService()
+        self.reactor.advance(EVENTS_RETRY_INTERVAL)
+        self.assertEqual((self.events._receive, self.events.watches),
+                         (None, 1))
+
+
+class FakeResponse(object):
+    """
+    A ``requests`` response for a Docker API error.
+
+    :ivar int status_code: The HTTP response code.
+    """
+    content = b""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeDockerAPI(object):
+    """
+    Just enough of ``docker.Client`` to list, inspect, add and remove
+    containers. Containers that are created use their name as their ID.
+
+    :ivar dict containers_by_id: Maps container IDs to tuples of container
+        name and status.
+    :ivar list inspected: IDs of the containers that have been inspected.
+    :ivar set removed: IDs of containers which are listed but are gone by
+        the time they are inspected.
+    :ivar int hidden: The number of times inspecting a container will claim
+        it doesn't exist, like Docker does just after creating it.
+    :ivar int stop_errors: The number of times stopping a container will
+        fail with an internal server error before succeeding.
+    :ivar list stop_timeouts: The timeouts containers were stopped with.
+    """
+    def __init__(self, containers=None):
+        if containers is None:
+            containers = {}
+        self.containers_by_id = containers
+        self.inspected = []
+        self.removed = set()
+        self.hidden = 0
+        self.stop_errors = 0
+        self.stop_timeouts = []
+
+    def _missing(self, container_id):
+        """
+        :raise APIError: For a missing container.
+        """
+        raise APIError(u"No such container: " + container_id,
+                       FakeResponse(NOT_FOUND))
+
+    def containers(self, all):
+        return [{u"Id": container_id, u"Names": [u"/" + name],
+                 u"Status": status}
+                for container_id, (name, status)
+                in self.containers_by_id.items()]
+
+    def inspect_container(self, container_id):
+        self.inspected.append(container_id)
+        if container_id in self.removed:
+            self._missing(container_id)
+        if self.hidden:
+            self.hidden -= 1
+            self._missing(container_id)
+        if container_id not in self.containers_by_id:
+            self._missing(container_id)
+        name, status = self.containers_by_id[container_id]
+        return {
+            u"Id": container_id, u"Name": u"/" + name,
+            u"State": {u"Running": status.startswith(u"Up")},
+            u"Config": {u"Image": u"busybox", u"CpuShares": 0,
+                        u"Memory": 0},
+            u"HostConfig": {u"PortBindings": None, u"Binds": None,
+                            u"RestartPolicy": {u"Name": u""}},
+        }
+
+    def create_container(self, name, image, **kwargs):
+        self.containers_by_id[name] = (name, u"")
+
+    def start(self, container_id):
+        self.containers_by_id[container_id] = (
+            self.containers_by_id[container_id][0], u"Up 1 second")
+
+    def stop(self, container_id, timeout):
+        self.stop_timeouts.append(timeout)
+        if self.stop_errors:
+            self.stop_errors -= 1
+            raise APIError(u"Cannot stop container",
+                           FakeResponse(INTERNAL_SERVER_ERROR))
+        if container_id not in self.containers_by_id:
+            self._missing(container_id)
+        self.containers_by_id[container_id] = (
+            self.containers_by_id[container_id][0], u"Exited (0)")
+
+    def remove_container(self, container_id):
+        if container_id not in self.containers_by_id:
+            self._missing(container_id)
+        del self.containers_by_id[container_id]
+
+
+class DockerClientListTests(TestCase):
+    """
+    Tests for ``DockerClient.list``, using a fake Docker API.
+    """
+    def setUp(self):
+        self.api = FakeDockerAPI({
+            u"1": (u"flocker--one", u"Up 3 minutes"),
+            u"2": (u"other", u"Up 1 hour"),
+        })
+        self.client = DockerClient()
+        self.client._client = self.api
+        self.pending = []
+        self.patch(_docker, "deferToThread", self.defer_to_thread)
+
+    def defer_to_thread(self, f, *args, **kwargs):
+        """
+        Call a function synchronously, unless ``self.blocking`` is set in
+        which case inspections wait until fired from ``self.pending``.
+        """
+        if getattr(self, "blocking", False) and f != self.api.containers:
+            d = Deferred()
+            self.pending.append(d)
+            d.addCallback(lambda _: f(*args, **kwargs))
+            return d
+        return succeed(f(*args, **kwargs))
+
+    def listed(self):
+        """
+        :return: The names of the units listed by the client.
+        """
+        return {unit.name for unit in
+                self.successResultOf(self.client.list())}
+
+    def test_only_namespace_inspected(self):
+        """
+        Only containers whose names are in the client's namespace are
+        inspected.
+        """
+        self.assertEqual((self.listed(), self.api.inspected),
+                         ({u"one"}, [u"1"]))
+
+    def test_unchanged_not_inspected(self):
+        """
+        A container whose state has not changed since it was last listed
+        is not inspected again, even if its status text has.
+        """
+        self.listed()
+        self.api.containers_by_id[u"1"] = (u"flocker--one", u"Up 4 minutes")
+        self.assertEqual((self.listed(), self.api.inspected),
+                         ({u"one"}, [u"1"]))
+
+    def test_changed_state_inspected(self):
+        """
+        A container whose state has changed is inspected again.
+        """
+        self.listed()
+        self.api.containers_by_id[u"1"] = (
+            u"flocker--one", u"Exited (0) 1 second ago")
+        units = self.successResultOf(self.client.list())
+        self.assertEqual(
+            ([unit.activation_state for unit in units], self.api.inspected),
+            ([u"inactive"], [u"1", u"1"]))
+
+    def test_new_container_inspected(self):
+        """
+        A container with a new ID is inspected, even if an earlier
+        container had the same name.
+        """
+        self.listed()
+        del self.api.containers_by_id[u"1"]
+        self.api.containers_by_id[u"3"] = (u"flocker--one", u"Up 1 second")
+        self.assertEqual((self.listed(), self.api.inspected),
+                         ({u"one"}, [u"1", u"3"]))
+
+    def test_removed_forgotten(self):
+        """
+        A container that is no longer listed is no longer cached.
+        """
+        self.listed()
+        del self.api.containers_by_id[u"1"]
+        self.assertEqual((self.listed(), self.client._inspected),
+                         (set(), {}))
+
+    def test_list_by_id(self):
+        """
+        ``DockerClient.list_by_id`` maps the IDs of the namespaced containers
+        to their units.
+        """
+        units = self.successResultOf(self.client.list_by_id())
+        self.assertEqual({container_id: unit.name
+                          for container_id, unit in units.items()},
+                         {u"1": u"one"})
+
+    def test_removed_while_inspecting(self):
+        """
+        A container which is removed after being listed but before being
+        inspected is not included.
+        """
+        self.api.removed.add(u"1")
+        self.assertEqual(self.listed(), set())
+
+    def test_bounded_concurrency(self):
+        """
+        At most ``INSPECT_CONCURRENCY`` containers are inspected at once.
+        """
+        for i in range(INSPECT_CONCURRENCY * 2):
+            self.api.containers_by_id[u"c%d" % (i,)] = (
+                u"flocker--c%d" % (i,), u"Up 1 second")
+        self.blocking = True
+        d = self.client.list()
+        outstanding = len(self.pending)
+        while self.pending:
+            self.pending.pop(0).callback(None)
+        self.assertEqual(
+            (outstanding, len(self.successResultOf(d))),
+            (INSPECT_CONCURRENCY, INSPECT_CONCURRENCY * 2 + 1))
+
+
+def assert_lifecycle_logged(case, logger, container_name, steps):
+    """
+    Assert that the durations of the given lifecycle steps were logged, in
+    order.
+
+    :param TestCase case: The test.
+    :param MemoryLogger logger: The logger the client logged to.
+    :param unicode container_name: The name of the container.
+    :param list steps: The expected steps.
+    """
+    messages = LoggedMessage.ofType(logger.messages, LIFECYCLE_STEP)
+    case.assertEqual(
+        [(message.message[u"container"], message.message[u"step"],
+          isinstance(message.message[u"duration"], float))
+         for message in messages],
+        [(container_name, step, True) for step in steps])
+
+
+class RetryDelaysTests(SynchronousTestCase):
+    """
+    Tests for ``_retry_delays``.
+    """
+    def test_delays(self):
+        """
+        The delays double from ``RETRY_INITIAL_DELAY`` up to
+        ``RETRY_MAXIMUM_DELAY``.
+        """
+        delays = list(islice(_retry_delays(), 10))
+        self.assertEqual(
+            (delays[:3], delays[-1], sorted(delays) == delays),
+            ([RETRY_INITIAL_DELAY, RETRY_INITIAL_DELAY * 2,
+              RETRY_INITIAL_DELAY * 4], RETRY_MAXIMUM_DELAY, True))
+
+
+class DockerClientLifecycleTests(TestCase):
+    """
+    Tests for the waits and retries done by ``DockerClient.add`` and
+    ``DockerClient.remove``, using a fake Docker API.
+    """
+    def setUp(self):
+        self.api = FakeDockerAPI()
+        self.client = DockerClient(namespace=u"", stop_timeout=3,
+                                   deadline=1)
+        self.client._client = self.api
+        self.now = 0
+        self.sleeps = []
+        self.patch(_docker, "deferToThread", maybeDeferred)
+        self.patch(_docker, "time", lambda: self.now)
+        self.patch(_docker, "sleep", self.sleep)
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+    def test_wait_backoff(self):
+        """
+        ``DockerClient.add`` waits for a created container to exist, with
+        increasing delays between checks.
+        """
+        self.api.hidden = 3
+        self.successResultOf(self.client.add(u"one", u"busybox"))
+        self.assertEqual(
+            (self.sleeps, self.api.containers_by_id[u"one"]),
+            ([RETRY_INITIAL_DELAY, RETRY_INITIAL_DELAY * 2,
+              RETRY_INITIAL_DELAY * 4], (u"one", u"Up 1 second")))
+
+    def test_wait_deadline(self):
+        """
+        If a created container doesn't appear within ``deadline`` seconds,
+        ``DockerClient.add`` fails with ``LifecycleTimeout``.
+        """
+        self.api.hidden = 1000
+        failure = self.failureResultOf(
+            self.client.add(u"one", u"busybox"), LifecycleTimeout)
+        self.assertEqual(
+            (failure.value.args, sum(self.sleeps) <= 1),
+            ((u"one", u"wait"), True))
+
+    def test_stop_backoff(self):
+        """
+        ``DockerClient.remove`` retries stopping a container that Docker
+        fails to stop with an internal server error, with increasing
+        delays between attempts.
+        """
+        self.successResultOf(self.client.add(u"one", u"busybox"))
+        self.api.stop_errors = 2
+        self.successResultOf(self.client.remove(u"one"))
+        self.assertEqual(
+            (self.sleeps, self.api.containers_by_id),
+            ([RETRY_INITIAL_DELAY, RETRY_INITIAL_DELAY * 2], {}))
+
+    def test_stop_deadline(self):
+        """
+        If a container can't be stopped within ``deadline`` seconds,
+        ``DockerClient.remove`` fails with ``LifecycleTimeout``.
+        """
+        self.successResultOf(self.client.add(u"one", u"busybox"))
+        self.api.stop_errors = 1000
+        failure = self.failureResultOf(
+            self.client.remove(u"one"), LifecycleTimeout)
+        self.assertEqual(failure.value.args, (u"one", u"stop"))
+
+    def test_stop_timeout(self):
+        """
+        Containers are given ``stop_timeout`` seconds to stop gracefully.
+        """
+        self.successResultOf(self.client.add(u"one", u"busybox"))
+        self.successResultOf(self.client.remove(u"one"))
+        self.assertEqual(self.api.stop_timeouts, [3])
+
+    @validateLogging(None)
+    def test_logged(self, logger):
+        """
+        The duration of each lifecycle step is logged.
+        """
+        self.client.logger = logger
+        self.successResultOf(self.client.add(u"one", u"busybox"))
+        self.successResultOf(self.client.remove(u"one"))
+        assert_lifecycle_logged(
+            self, logger, u"one",
+            [u"create", u"wait", u"start", u"stop", u"remove"])
+
+
+class CountingSite(Site):
+    """
+    A ``Site`` which counts the connections made to it.
+
+    :ivar int connections: The number of connections made.
+    """
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return Site.buildProtocol(self, addr)
+
+
+def start_http_docker_client(test, server=None):
+    """
+    Serve a ``FakeDockerServer`` on a UNIX socket for the duration of a
+    test, and create a ``HTTPDockerClient`` that talks to it.
+
+    :param TestCase test: The test the client is for.
+    :param FakeDockerServer server: The server to use, by default a new
+        ``FakeDockerServer``.
+
+    :return: A tuple of the ``HTTPDockerClient`` and the ``CountingSite``
+        serving the Docker API.
+    """
+    if server is None:
+        server = FakeDockerServer()
+    directory = FilePath(mkdtemp())
+    test.addCleanup(directory.remove)
+    path = directory.child(b"docker.sock").path
+    site = CountingSite(server)
+    port = reactor.listenUNIX(path, site)
+    test.addCleanup(port.stopListening)
+    client = HTTPDockerClient(reactor, base_url=u"unix://" + path)
+    test.addCleanup(client.close)
+    return client, site
+
+
+class HTTPIDockerClientTests(
+        make_idockerclient_tests(
+            lambda test: start_http_docker_client(test)[0])):
+    """
+    ``IDockerClient`` tests for ``HTTPDockerClient`` talking to a
+    ``FakeDockerServer``.
+    """
+
+
+class HTTPDockerClientTests(TestCase):
+    """
+    Tests for ``HTTPDockerClient``.
+    """
+    def setUp(self):
+        self.server = FakeDockerServer()
+        self.client, self.site = start_http_docker_client(self, self.server)
+
+    def test_unix_only(self):
+        """
+        ``HTTPDockerClient`` only supports Docker API URLs for UNIX sockets.
+        """
+        self.assertRaises(ValueError, HTTPDockerClient, reactor,
+                          base_url=u"tcp://127.0.0.1:2375")
+
+    def test_no_threads(self):
+        """
+        ``HTTPDockerClient`` doesn't use the reactor thread pool.
+        """
+        def no_threads(*args, **kwargs):
+            raise AssertionError("deferToThread was called")
+        self.patch(_docker, "deferToThread", no_threads)
+        d = self.client.add(u"one", u"busybox")
+        d.addCallback(lambda _: self.client.list())
+        d.addCallback(lambda units: self.assertEqual(
+            [unit.name for unit in units], [u"one"]))
+        d.addCallback(lambda _: self.client.remove(u"one"))
+        return d
+
+    def test_persistent_connections(self):
+        """
+        Consecutive requests reuse the same connection to the Docker
+        server.
+        """
+        d = self.client.add(u"one", u"busybox")
+        d.addCallback(lambda _: self.client.list())
+        d.addCallback(lambda _: self.client.remove(u"one"))
+        d.addCallback(lambda _: self.assertEqual(self.site.connections, 1))
+        return d
+
+    def test_pull_missing_image(self):
+        """
+        If the image of an added unit does not exist it is pulled.
+        """
+        self.server.images = set()
+        d = self.client.add(u"one", u"busybox")
+        d.addCallback(lambda _: self.client.exists(u"one"))
+        d.addCallback(lambda exists: self.assertEqual(
+            (exists, self.server.pulled), (True, [u"busybox"])))
+        return d
+
+    def test_pull_existing_image(self):
+        """
+        ``HTTPDockerClient.pull`` doesn't pull an image which is already
+        available locally.
+        """
+        self.server.images = {u"busybox"}
+        d = self.client.pull(u"busybox")
+        d.addCallback(lambda _: self.assertEqual(self.server.pulled, []))
+        return d
+
+    def test_pull_image(self):
+        """
+        ``HTTPDockerClient.pull`` pulls an image which is not available
+        locally.
+        """
+        self.server.images = set()
+        d = self.client.pull(u"clusterhq/flocker:release-14.0")
+        d.addCallback(lambda _: self.assertEqual(
+            self.server.pulled, [u"clusterhq/flocker:release-14.0"]))
+        return d
+
+    def test_pull_error(self):
+        """
+        If Docker reports an error in the progress stream of a pull,
+        ``HTTPDockerClient.pull`` fails with ``DockerAPIError``.
+        """
+        self.server.images = set()
+        self.server.pull_errors[u"busybox:nosuchtag"] = (
+            u"Tag nosuchtag not found in repository busybox")
+        d = self.assertFailure(self.client.pull(u"busybox:nosuchtag"),
+                               DockerAPIError)
+        d.addCallback(lambda error: self.assertIn(
+            b"Tag nosuchtag not found", error.body))
+        return d
+
+    def test_add_pull_error(self):
+        """
+        If pulling the missing image of an added unit fails,
+        ``HTTPDockerClient.add`` fails with the ``DockerAPIError`` and
+        doesn't try to create the container again.
+        """
+        self.server.images = set()
+        self.server.pull_errors[u"busybox"] = u"Error: image not found"
+        d = self.assertFailure(self.client.add(u"one", u"busybox"),
+                               DockerAPIError)
+        d.addCallback(lambda _: self.assertEqual(self.server.containers, {}))
+        return d
+
+    def test_stop_retried(self):
+        """
+        If Docker fails to stop a container with an internal server error,
+        stopping it is retried.
+        """
+        d = self.client.add(u"one", u"busybox")
+
+        def added(_):
+            self.server.stop_errors = 2
+            return self.client.remove(u"one")
+        d.addCallback(added)
+        d.addCallback(lambda _: self.assertEqual(
+            (self.server.containers, self.server.stop_errors), ({}, 0)))
+        return d
+
+    def test_stop_timeout(self):
+        """
+        Containers are given ``stop_timeout`` seconds to stop gracefully.
+        """
+        self.client.stop_timeout = 3
+        d = self.client.add(u"one", u"busybox")
+        d.addCallback(lambda _: self.client.remove(u"one"))
+        d.addCallback(lambda _: self.assertEqual(
+            self.server.stop_timeouts, [b"3"]))
+        return d
+
+    def test_stop_deadline(self):
+        """
+        If a container can't be stopped within ``deadline`` seconds,
+        ``HTTPDockerClient.remove`` fails with ``LifecycleTimeout``.
+        """
+        self.client.deadline = RETRY_INITIAL_DELAY * 4
+        d = self.client.add(u"one", u"busybox")
+
+        def added(_):
+            self.server.stop_errors = 1000
+            return self.client.remove(u"one")
+        d.addCallback(added)
+        d = self.assertFailure(d, LifecycleTimeout)
+        d.addCallback(lambda error: self.assertEqual(
+            error.args, (u"flocker--one", u"stop")))
+        return d
+
+    @validateLogging(None)
+    def test_logged(self, logger):
+        """
+        The duration of each lifecycle step is logged.
+        """
+        self.client.logger = logger
+        self.server.images = set()
+        d = self.client.add(u"one", u"busybox")
+        d.addCallback(lambda _: self.client.remove(u"one"))
+        d.addCallback(lambda _: assert_lifecycle_logged(
+            self, logger, u"flocker--one",
+            [u"create", u"pull", u"create", u"wait", u"start", u"stop",
+             u"remove"]))
+        return d
+
+    def test_error(self):
+        """
+        Error responses from the Docker server are reported as
+        ``DockerAPIError``.
+        """
+        self.patch(self.server, "_respond",
+                   lambda *args: (INTERNAL_SERVER_ERROR, None))
+        d = self.assertFailure(self.client.list(), DockerAPIError)
+        d.addCallback(lambda error: self.assertEqual(
+            error.code, INTERNAL_SERVER_ERROR))
+        return d
+
+
+class ImageManagerTests(TestCase):
+    """
+    Tests for ``ImageManager``.
+    """
+    def setUp(self):
+        self.client = FakeDockerClient()
+        self.pulls = []
+
+        def pull(image_name):
+            d = Deferred()
+            self.pulls.append((image_name, d))
+            return d
+        self.patch(self.client, "pull", pull)
+        self.manager = ImageManager(self.client)
+
+    def test_pulls(self):
+        """
+        ``ImageManager.pull`` pulls the image using the client, returning a
+        ``Deferred`` that fires once the image has been pulled.
+        """
+        d = self.manager.pull(u"busybox")
+        before = d.called
+        self.pulls[0][1].callback(None)
+        self.assertEqual((before, self.successResultOf(d)), (False, None))
+
+    def test_concurrent_pulls_shared(self):
+        """
+        Pulling an image while it is being pulled doesn't start a new pull,
+        and both callers are told when it is done.
+        """
+        first = self.manager.pull(u"busybox")
+        second = self.manager.pull(u"busybox")
+        self.pulls[0][1].callback(None)
+        self.assertEqual(
+            ([image for image, _ in self.pulls],
+             self.successResultOf(first), self.successResultOf(second)),
+            ([u"busybox"], None, None))
+
+    def test_different_images(self):
+        """
+        Different images are pulled separately.
+        """
+        self.manager.pull(u"busybox")
+        self.manager.pull(u"openshift/busybox-http-app")
+        self.assertEqual([image for image, _ in self.pulls],
+                         [u"busybox", u"openshift/busybox-http-app"])
+
+    def test_pull_again(self):
+        """
+        Once a pull is done, pulling the same image starts a new pull.
+        """
+        self.manager.pull(u"busybox")
+        self.pulls[0][1].callback(None)
+        self.manager.pull(u"busybox")
+        self.assertEqual(len(self.pulls), 2)
+
+    def test_failure(self):
+        """
+        If pulling an image fails, everyone waiting for it is told.
+        """
+        first = self.manager.pull(u"busybox")
+        second = self.manager.pull(u"busybox")
+        self.pulls[0][1].errback(ZeroDivisionError())
+        self.failureResultOf(first, ZeroDivisionError)
+        self.failureResultOf(second, ZeroDivisionError)
+
+
 class PortMapInitTests(
         make_with_init_tests(
             record_type=PortMap,
@@ -9,17 +9,21 @@ from zope.interface import implementer
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.test.proto_helpers import StringTransport, MemoryReactorClock
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
-from twisted.internet.defer import succeed, Deferred
+from twisted.internet.defer import succeed, fail, Deferred
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
 
 from ...testtools import FakeAMPClient
 from .._loop import (
     build_cluster_status_fsm, ClusterStatusInputs, _ClientStatusUpdate,
     _StatusUpdate, _ConnectedToControlService, ConvergenceLoopInputs,
     ConvergenceLoopStates, build_convergence_loop_fsm, AgentLoopService,
-    ClusterStatus, ConvergenceLoop,
+    ClusterStatus, ConvergenceLoop, NODE_STATE_KEEPALIVE, ConvergenceSchedule,
+    MAXIMUM_CONVERGENCE_INTERVAL,
     )
-from .._deploy import IDeployer, IStateChange
+from .._deploy import IDeployer, IStateChange, Sequentially
 from ...control._protocol import NodeStateCommand, _AgentLocator, AgentAMP
+from ...control import NodeState
 from ...control.test.test_protocol import iconvergence_agent_tests_factory
 
 
@@ -269,7 +273,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         """
         A newly created FSM is stopped.
         """
-        loop = build_convergence_loop_fsm(ControllableDeployer([], []))
+        loop = build_convergence_loop_fsm(
+            Clock(), ControllableDeployer([], []))
         self.assertEqual(loop.state, ConvergenceLoopStates.STOPPED)
 
     def test_new_status_update_starts_discovery(self):
@@ -277,7 +282,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         A stopped FSM that receives a status update starts discovery.
         """
         deployer = ControllableDeployer([Deferred()], [])
-        loop = build_convergence_loop_fsm(deployer)
+        loop = build_convergence_loop_fsm(Clock(), deployer)
         loop.receive(_ClientStatusUpdate(client=object(),
                                          configuration=object(),
                                          state=object()))
@@ -305,11 +310,11 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         discovered state to the control service using the last received
         client.
         """
-        local_state = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
         client = self.successful_amp_client([local_state])
         action = ControllableAction(Deferred())
         deployer = ControllableDeployer([succeed(local_state)], [action])
-        loop = build_convergence_loop_fsm(deployer)
+        loop = build_convergence_loop_fsm(Clock(), deployer)
         loop.receive(_ClientStatusUpdate(client=client,
                                          configuration=object(),
                                          state=object()))
@@ -322,7 +327,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         calculated changes using last received desired configuration and
         cluster state.
         """
-        local_state = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
         configuration = object()
         state = object()
         # Since this Deferred is unfired we never proceed to next
@@ -330,7 +335,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         # only configured one discovery result.
         action = ControllableAction(Deferred())
         deployer = ControllableDeployer([succeed(local_state)], [action])
-        loop = build_convergence_loop_fsm(deployer)
+        loop = build_convergence_loop_fsm(Clock(), deployer)
         loop.receive(_ClientStatusUpdate(
             client=self.successful_amp_client([local_state]),
             configuration=configuration, state=state))
@@ -343,8 +348,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         A FSM doing a convergence iteration does another iteration when
         applying changes is done.
         """
-        local_state = object()
-        local_state2 = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
+        local_state2 = NodeState(hostname=u"192.0.2.123", used_ports=[1])
         configuration = object()
         state = object()
         action = ControllableAction(succeed(None))
@@ -356,9 +361,11 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
             [succeed(local_state), succeed(local_state2)],
             [action, action2])
         client = self.successful_amp_client([local_state, local_state2])
-        loop = build_convergence_loop_fsm(deployer)
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
         loop.receive(_ClientStatusUpdate(
             client=client, configuration=configuration, state=state))
+        reactor.advance(1)
         # Calculating actions happened, result was run... and then we did
         # whole thing again:
         self.assertEqual((deployer.calculate_inputs, client.calls),
@@ -373,8 +380,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         client, desired configuration and cluster state, which are then
         used in next convergence iteration.
         """
-        local_state = object()
-        local_state2 = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
+        local_state2 = NodeState(hostname=u"192.0.2.123", used_ports=[1])
         configuration = object()
         state = object()
         # Until this Deferred fires the first iteration won't finish:
@@ -385,7 +392,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
             [succeed(local_state), succeed(local_state2)],
             [action, action2])
         client = self.successful_amp_client([local_state])
-        loop = build_convergence_loop_fsm(deployer)
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
         loop.receive(_ClientStatusUpdate(
             client=client, configuration=configuration, state=state))
 
@@ -400,6 +408,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         # which happens with second set of client, desired configuration
         # and cluster state:
         action.result.callback(None)
+        reactor.advance(1)
         self.assertEqual(
             (deployer.calculate_inputs, client.calls, client2.calls),
             ([(local_state, configuration, state),
@@ -412,7 +421,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         A FSM doing convergence that receives a stop input stops when the
         convergence iteration finishes.
         """
-        local_state = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
         configuration = object()
         state = object()
         # Until this Deferred fires the first iteration won't finish:
@@ -422,7 +431,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         deployer = ControllableDeployer([succeed(local_state)],
                                         [action])
         client = self.successful_amp_client([local_state])
-        loop = build_convergence_loop_fsm(deployer)
+        loop = build_convergence_loop_fsm(Clock(), deployer)
         loop.receive(_ClientStatusUpdate(
             client=client, configuration=configuration, state=state))
 
@@ -446,8 +455,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         update continues on to to next convergence iteration (i.e. stop
         ends up being ignored).
         """
-        local_state = object()
-        local_state2 = object()
+        local_state = NodeState(hostname=u"192.0.2.123")
+        local_state2 = NodeState(hostname=u"192.0.2.123", used_ports=[1])
         configuration = object()
         state = object()
         # Until this Deferred fires the first iteration won't finish:
@@ -458,7 +467,8 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
             [succeed(local_state), succeed(local_state2)],
             [action, action2])
         client = self.successful_amp_client([local_state])
-        loop = build_convergence_loop_fsm(deployer)
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
         loop.receive(_ClientStatusUpdate(
             client=client, configuration=configuration, state=state))
 
@@ -475,6 +485,7 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
         # which happens with second set of client, desired configuration
         # and cluster state:
         action.result.callback(None)
+        reactor.advance(1)
         self.assertEqual(
             (deployer.calculate_inputs, client.calls, client2.calls),
             ([(local_state, configuration, state),
@@ -483,6 +494,331 @@ class ConvergenceLoopFSMTests(SynchronousTestCase):
              [(NodeStateCommand, dict(node_state=local_state2))]))
 
 
+class FailingAMPClient(object):
+    """
+    AMP client whose commands all fail.
+
+    :ivar list calls: ``(command, kwargs)`` tuples of commands that have
+        been sent using ``callRemote``.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, command, **kwargs):
+        self.calls.append((command, kwargs))
+        return fail(ConnectionLost())
+
+
+class NodeStateSuppressionTests(SynchronousTestCase):
+    """
+    Tests for sending of local state by the FSM created by
+    ``build_convergence_loop_fsm``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.local_state = NodeState(hostname=u"192.0.2.123")
+        # Each iteration waits for its action's Deferred to fire:
+        self.actions = [ControllableAction(Deferred()) for i in range(3)]
+        self.deployer = ControllableDeployer(
+            [succeed(self.local_state) for i in range(3)], self.actions[:])
+        self.loop = build_convergence_loop_fsm(self.reactor, self.deployer)
+
+    def status_update(self, client):
+        """
+        Send a status update with the given client to the loop.
+        """
+        self.loop.receive(_ClientStatusUpdate(
+            client=client, configuration=object(), state=object()))
+
+    def next_iteration(self, seconds=1):
+        """
+        Finish the current iteration and let time pass, starting the next.
+        """
+        self.actions.pop(0).result.callback(None)
+        self.reactor.advance(seconds)
+
+    def test_unchanged_not_sent(self):
+        """
+        Local state that is the same as what was last sent is not sent
+        again.
+        """
+        client = FakeAMPClient()
+        client.register_response(
+            NodeStateCommand, dict(node_state=self.local_state), {})
+        self.status_update(client)
+        self.next_iteration()
+        self.next_iteration()
+        self.assertEqual(client.calls, [
+            (NodeStateCommand, dict(node_state=self.local_state))])
+
+    def test_keepalive(self):
+        """
+        Unchanged local state is sent again once ``NODE_STATE_KEEPALIVE``
+        seconds have passed since it was last sent.
+        """
+        client = FakeAMPClient()
+        client.register_response(
+            NodeStateCommand, dict(node_state=self.local_state), {})
+        self.status_update(client)
+        self.next_iteration(NODE_STATE_KEEPALIVE - 1)
+        self.next_iteration(1)
+        self.assertEqual(client.calls, [
+            (NodeStateCommand, dict(node_state=self.local_state))] * 2)
+
+    def test_new_client(self):
+        """
+        Unchanged local state is sent again when the loop is given a new
+        client.
+        """
+        client = FakeAMPClient()
+        client2 = FakeAMPClient()
+        for c in (client, client2):
+            c.register_response(
+                NodeStateCommand, dict(node_state=self.local_state), {})
+        self.status_update(client)
+        self.status_update(client2)
+        self.next_iteration()
+        self.assertEqual((client.calls, client2.calls), (
+            [(NodeStateCommand, dict(node_state=self.local_state))],
+            [(NodeStateCommand, dict(node_state=self.local_state))]))
+
+    def test_failure_resent(self):
+        """
+        Local state is sent again if sending it failed.
+        """
+        client = FailingAMPClient()
+        self.status_update(client)
+        self.next_iteration()
+        self.assertEqual(client.calls, [
+            (NodeStateCommand, dict(node_state=self.local_state))] * 2)
+
+
+class ConvergenceScheduleTests(SynchronousTestCase):
+    """
+    Tests for ``ConvergenceSchedule``.
+    """
+    def test_changed(self):
+        """
+        ``ConvergenceSchedule.changed`` returns the minimum delay.
+        """
+        schedule = ConvergenceSchedule(minimum=2.0)
+        self.assertEqual(schedule.changed(), 2.0)
+
+    def test_converged_backoff(self):
+        """
+        ``ConvergenceSchedule.converged`` returns a delay that doubles each
+        time it is called, up to the maximum.
+        """
+        schedule = ConvergenceSchedule(minimum=1.0, maximum=5.0)
+        self.assertEqual([schedule.converged() for i in range(4)],
+                         [2.0, 4.0, 5.0, 5.0])
+
+    def test_changed_resets(self):
+        """
+        ``ConvergenceSchedule.changed`` resets the back off of
+        ``ConvergenceSchedule.converged``.
+        """
+        schedule = ConvergenceSchedule(minimum=1.0, maximum=5.0)
+        schedule.converged()
+        schedule.converged()
+        schedule.changed()
+        self.assertEqual(schedule.converged(), 2.0)
+
+    def test_failed_backoff(self):
+        """
+        ``ConvergenceSchedule.failed`` returns a random fraction of a delay
+        that doubles each time it is called, up to the failure maximum.
+        """
+        schedule = ConvergenceSchedule(minimum=1.0, failure_maximum=10.0,
+                                       random=lambda: 0.5)
+        self.assertEqual([schedule.failed() for i in range(5)],
+                         [1.0, 2.0, 4.0, 5.0, 5.0])
+
+    def test_failed_at_least_minimum(self):
+        """
+        ``ConvergenceSchedule.failed`` never returns less than the minimum
+        delay.
+        """
+        schedule = ConvergenceSchedule(minimum=1.0, random=lambda: 0.0)
+        self.assertEqual(schedule.failed(), 1.0)
+
+    def test_converged_resets_failures(self):
+        """
+        ``ConvergenceSchedule.converged`` resets the back off of
+        ``ConvergenceSchedule.failed``.
+        """
+        schedule = ConvergenceSchedule(minimum=1.0, failure_maximum=100.0,
+                                       random=lambda: 1.0)
+        schedule.failed()
+        schedule.failed()
+        schedule.converged()
+        self.assertEqual(schedule.failed(), 2.0)
+
+
+class ConvergenceLoopSchedulingTests(SynchronousTestCase):
+    """
+    Tests for the scheduling of iterations by the FSM created by
+    ``build_convergence_loop_fsm``.
+    """
+    def setUp(self):
+        self.reactor = Clock()
+        self.local_state = NodeState(hostname=u"192.0.2.123")
+        self.client = FakeAMPClient()
+        self.client.register_response(
+            NodeStateCommand, dict(node_state=self.local_state), {})
+        self.schedule = ConvergenceSchedule(
+            minimum=1.0, maximum=4.0, random=lambda: 1.0)
+
+    def build_loop(self, local_states, actions):
+        """
+        Create a convergence loop FSM.
+
+        :param local_states: ``Deferred`` results of discovery.
+        :param actions: ``IStateChange`` providers calculated by the
+            deployer.
+        """
+        self.deployer = ControllableDeployer(local_states, actions)
+        return build_convergence_loop_fsm(
+            self.reactor, self.deployer, self.schedule)
+
+    def status_update(self, loop):
+        """
+        Send a status update to the loop.
+        """
+        loop.receive(_ClientStatusUpdate(
+            client=self.client, configuration=object(), state=object()))
+
+    def iterations(self):
+        """
+        :return: The number of iterations that have calculated changes.
+        """
+        return len(self.deployer.calculate_inputs)
+
+    def test_changes_minimum_delay(self):
+        """
+        After an iteration that made changes the next iteration starts after
+        the schedule's minimum delay.
+        """
+        loop = self.build_loop(
+            [succeed(self.local_state) for i in range(2)],
+            [ControllableAction(succeed(None)),
+             ControllableAction(Deferred())])
+        self.status_update(loop)
+        self.reactor.advance(0.9)
+        before = (self.iterations(), loop.state)
+        self.reactor.advance(0.1)
+        self.assertEqual((before, self.iterations()),
+                         ((1, ConvergenceLoopStates.SLEEPING), 2))
+
+    def test_converged_backoff(self):
+        """
+        While there is nothing to do the delay between iterations grows up to
+        the schedule's maximum.
+        """
+        loop = self.build_loop(
+            [succeed(self.local_state) for i in range(5)],
+            [Sequentially(changes=[])] * 4 + [ControllableAction(Deferred())])
+        self.status_update(loop)
+        times = []
+        for i in range(4):
+            iterations = self.iterations()
+            while self.iterations() == iterations:
+                self.reactor.advance(1)
+            times.append(self.reactor.seconds())
+        self.assertEqual(times, [2, 6, 10, 14])
+
+    def test_failure_backoff(self):
+        """
+        After failed iterations the delay between iterations grows, and the
+        loop continues.
+        """
+        loop = self.build_loop(
+            [fail(ZeroDivisionError()), fail(ZeroDivisionError()),
+             succeed(self.local_state)],
+            [ControllableAction(Deferred())])
+        self.status_update(loop)
+        self.reactor.advance(2)
+        before = len(self.deployer.local_states)
+        self.reactor.advance(4)
+        self.assertEqual((before, self.iterations()), (1, 1))
+
+    def test_status_update_wakes(self):
+        """
+        A status update received while sleeping starts an iteration
+        immediately, replacing the scheduled one.
+        """
+        loop = self.build_loop(
+            [succeed(self.local_state) for i in range(2)],
+            [Sequentially(changes=[]), ControllableAction(Deferred())])
+        self.status_update(loop)
+        self.status_update(loop)
+        self.assertEqual((self.iterations(), self.reactor.getDelayedCalls()),
+                         (2, []))
+
+    def test_status_update_during_iteration(self):
+        """
+        If a status update is received during an iteration which found
+        nothing to do, the next iteration starts after the minimum delay.
+        """
+        discovery = Deferred()
+        loop = self.build_loop(
+            [discovery, succeed(self.local_state)],
+            [Sequentially(changes=[]), ControllableAction(Deferred())])
+        self.status_update(loop)
+        self.status_update(loop)
+        discovery.callback(self.local_state)
+        self.reactor.advance(1)
+        self.assertEqual(self.iterations(), 2)
+
+    def test_local_change_wakes(self):
+        """
+        A local state change while sleeping starts an iteration
+        immediately.
+        """
+        loop = self.build_loop(
+            [succeed(self.local_state) for i in range(2)],
+            [Sequentially(changes=[]), ControllableAction(Deferred())])
+        self.status_update(loop)
+        loop.receive(ConvergenceLoopInputs.LOCAL_STATE_CHANGED)
+        self.assertEqual((self.iterations(), self.reactor.getDelayedCalls()),
+                         (2, []))
+
+    def test_local_change_during_iteration(self):
+        """
+        If the local state changes during an iteration which found nothing
+        to do, the next iteration starts after the minimum delay.
+        """
+        discovery = Deferred()
+        loop = self.build_loop(
+            [discovery, succeed(self.local_state)],
+            [Sequentially(changes=[]), ControllableAction(Deferred())])
+        self.status_update(loop)
+        loop.receive(ConvergenceLoopInputs.LOCAL_STATE_CHANGED)
+        discovery.callback(self.local_state)
+        self.reactor.advance(1)
+        self.assertEqual(self.iterations(), 2)
+
+    def test_local_change_stopped(self):
+        """
+        A local state change while stopped is ignored.
+        """
+        loop = self.build_loop([], [])
+        loop.receive(ConvergenceLoopInputs.LOCAL_STATE_CHANGED)
+        self.assertEqual(loop.state, ConvergenceLoopStates.STOPPED)
+
+    def test_stop_while_sleeping(self):
+        """
+        A stop input received while sleeping stops the loop, cancelling the
+        next iteration.
+        """
+        loop = self.build_loop([succeed(self.local_state)],
+                               [Sequentially(changes=[])])
+        self.status_update(loop)
+        loop.receive(ConvergenceLoopInputs.STOP)
+        self.assertEqual((loop.state, self.reactor.getDelayedCalls()),
+                         (ConvergenceLoopStates.STOPPED, []))
+
+
 class AgentLoopServiceTests(SynchronousTestCase):
     """
     Tests for ``AgentLoopService``.
@@ -503,6 +839,35 @@ class AgentLoopServiceTests(SynchronousTestCase):
                           convergence_loop_fsm_world.deployer),
                          (ClusterStatus, ConvergenceLoop, deployer))
 
+    def test_local_state_changed(self):
+        """
+        ``AgentLoopService.local_state_changed`` tells the convergence loop
+        the local state changed.
+        """
+        service = AgentLoopService(
+            reactor=None, deployer=object(), host=u"example.com", port=1234)
+        fsm = StubFSM()
+        service.convergence_loop = fsm
+        service.local_state_changed()
+        self.assertEqual(fsm.inputted,
+                         [ConvergenceLoopInputs.LOCAL_STATE_CHANGED])
+
+    def test_maximum_interval(self):
+        """
+        The convergence loop's schedule uses the service's maximum interval,
+        which defaults to ``MAXIMUM_CONVERGENCE_INTERVAL``.
+        """
+        schedules = []
+        for kwargs in [{}, {"maximum_interval": 2.5}]:
+            service = AgentLoopService(
+                reactor=None, deployer=object(), host=u"example.com",
+                port=1234, **kwargs)
+            cluster_status_fsm_world = (
+                service.cluster_status._fsm._world.original)
+            schedules.append(cluster_status_fsm_world.convergence_loop_fsm.
+                             _fsm._world.original.schedule.maximum)
+        self.assertEqual(schedules, [MAXIMUM_CONVERGENCE_INTERVAL, 2.5])
+
     def test_start_service(self):
         """
         Starting the service starts a reconnecting TCP client to given host
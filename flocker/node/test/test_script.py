@@ -16,24 +16,46 @@ from twisted.application.service import Service
 from yaml import safe_dump, safe_load
 from ...testtools import StandardOptionsTestsMixin, MemoryCoreReactor
 from ...volume.testtools import make_volume_options_tests
+from ...volume._agent import AgentVolumeManager
+from ...volume._ipc import RemoteVolumeManager
 from ...route import make_memory_network
+from ...route._iptables import HostNetwork
 
 from ..script import (
     ZFSAgentOptions, ZFSAgentScript,
     ChangeStateOptions, ChangeStateScript,
     ReportStateOptions, ReportStateScript)
 from .. import script as script_module
-from .._docker import FakeDockerClient, Unit
+from .._docker import (
+    FakeDockerClient, Unit, FakeDockerEvents, WatchingDockerClient,
+    HTTPDockerClient,
+    )
 from ...control._model import (
     Application, Deployment, DockerImage, Node, AttachedVolume, Dataset,
     Manifestation)
 from ...control._config import dataset_id_from_name
-from .._loop import AgentLoopService
+from .._loop import AgentLoopService, MAXIMUM_CONVERGENCE_INTERVAL
 from .._deploy import P2PNodeDeployer
 
 from ...volume.testtools import create_volume_service
 
 
+def patch_forwarding(test):
+    """
+    Make ``HostNetwork.configure_forwarding`` write to a new directory
+    rather than the real system configuration.
+
+    :param TestCase test: The test to patch ``HostNetwork`` for.
+
+    :return: The ``FilePath`` of the directory standing in for
+        ``/proc/sys/net/ipv4/conf``.
+    """
+    conf = FilePath(test.mktemp())
+    conf.child(b"default").makedirs()
+    test.patch(HostNetwork, "conf", conf)
+    return conf
+
+
 class ChangeStateScriptTests(SynchronousTestCase):
     """
     Tests for ``ChangeStateScript``.
@@ -50,6 +72,9 @@ class ChangeStateScriptMainTests(SynchronousTestCase):
     """
     Tests for ``ChangeStateScript.main``.
     """
+    def setUp(self):
+        self.conf = patch_forwarding(self)
+
     def test_main_calls_deployer_change_node_state(self):
         """
         ``ChangeStateScript.main`` calls ``change_node_state`` with
@@ -417,6 +442,25 @@ class ZFSAgentScriptTests(SynchronousTestCase):
     """
     Tests for ``ZFSAgentScript``.
     """
+    def setUp(self):
+        self.conf = patch_forwarding(self)
+
+    def test_forwarding_configured(self):
+        """
+        ``ZFSAgentScript.main`` writes the system configuration proxies rely
+        upon once at startup, and gives the deployer a batched
+        ``HostNetwork``.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        service = Service()
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        network = service.parent.deployer.network
+        self.assertEqual(
+            (network.__class__, network.batched,
+             self.conf.descendant([b"default", b"forwarding"]).getContent()),
+            (HostNetwork, True, b"1"))
+
     def test_main_starts_service(self):
         """
         ``ZFSAgentScript.main`` starts the given service.
@@ -443,8 +487,9 @@ class ZFSAgentScriptTests(SynchronousTestCase):
         """
         service = Service()
         options = ZFSAgentOptions()
-        options.parseOptions([b"--destination-port", b"1234", b"1.2.3.4",
-                              b"example.com"])
+        options.parseOptions([b"--destination-port", b"1234",
+                              b"--maximum-convergence-interval", b"2.5",
+                              b"1.2.3.4", b"example.com"])
         test_reactor = MemoryCoreReactor()
         ZFSAgentScript().main(test_reactor, options, service)
         parent_service = service.parent
@@ -458,9 +503,90 @@ class ZFSAgentScriptTests(SynchronousTestCase):
                          (AgentLoopService(reactor=test_reactor,
                                            deployer=None,
                                            host=u"example.com",
-                                           port=1234),
+                                           port=1234,
+                                           maximum_interval=2.5),
                           P2PNodeDeployer, b"1.2.3.4", service, True))
 
+    def test_remote_volume_managers(self):
+        """
+        By default ``ZFSAgentScript.main`` gives the deployer a
+        ``RemoteVolumeManager`` for each other node, so volume data can be
+        spliced to a ``flocker-volume receive`` process.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        deployer = service.parent.deployer
+        self.assertIsInstance(
+            deployer.remote_volume_manager(b"node2.example.com"),
+            RemoteVolumeManager)
+
+    def test_volume_agents(self):
+        """
+        With ``--volume-agent`` ``ZFSAgentScript.main`` gives the deployer
+        an ``AgentVolumeManager`` for each other node, so volumes are pushed
+        to a long-running volume agent.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"--volume-agent", b"1.2.3.4", b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        deployer = service.parent.deployer
+        self.assertIsInstance(
+            deployer.remote_volume_manager(b"node2.example.com"),
+            AgentVolumeManager)
+
+    def test_watch_docker_events(self):
+        """
+        With ``--watch-docker-events`` ``ZFSAgentScript.main`` gives the
+        deployer a ``WatchingDockerClient`` which is a child of the
+        convergence loop service and tells it about changes.
+        """
+        self.patch(script_module, "DockerEvents",
+                   lambda reactor: FakeDockerEvents())
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"--watch-docker-events", b"1.2.3.4",
+                              b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        loop = service.parent
+        docker_client = loop.deployer.docker_client
+        self.assertEqual(
+            (docker_client.__class__, docker_client.parent,
+             docker_client._callbacks),
+            (WatchingDockerClient, loop, [loop.local_state_changed]))
+
+    def test_http_docker_client(self):
+        """
+        With ``--http-docker-client`` ``ZFSAgentScript.main`` gives the
+        deployer an ``HTTPDockerClient``.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"--http-docker-client", b"1.2.3.4",
+                              b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        self.assertIsInstance(service.parent.deployer.docker_client,
+                              HTTPDockerClient)
+
+    def test_watched_http_docker_client(self):
+        """
+        With both ``--http-docker-client`` and ``--watch-docker-events`` the
+        ``WatchingDockerClient`` talks to Docker using an
+        ``HTTPDockerClient``.
+        """
+        self.patch(script_module, "DockerEvents",
+                   lambda reactor: FakeDockerEvents())
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"--http-docker-client",
+                              b"--watch-docker-events", b"1.2.3.4",
+                              b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        self.assertIsInstance(service.parent.deployer.docker_client._client,
+                              HTTPDockerClient)
+
 
 class ZFSAgentOptionsTests(make_volume_options_tests(
         ZFSAgentOptions, [b"1.2.3.4", b"example.com"])):
@@ -486,6 +612,53 @@ class ZFSAgentOptionsTests(make_volume_options_tests(
                               b"1.2.3.4", b"example.com"])
         self.assertEqual(options["destination-port"], 1234)
 
+    def test_default_maximum_convergence_interval(self):
+        """
+        The default maximum convergence interval configured by
+        ``ZFSAgentOptions`` is ``MAXIMUM_CONVERGENCE_INTERVAL``.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        self.assertEqual(options["maximum-convergence-interval"],
+                         MAXIMUM_CONVERGENCE_INTERVAL)
+
+    def test_custom_maximum_convergence_interval(self):
+        """
+        The ``--maximum-convergence-interval`` command-line option allows
+        configuring the maximum convergence interval.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"--maximum-convergence-interval", b"2.5",
+                              b"1.2.3.4", b"example.com"])
+        self.assertEqual(options["maximum-convergence-interval"], 2.5)
+
+    def test_default_watch_docker_events(self):
+        """
+        By default ``ZFSAgentOptions`` does not enable watching Docker
+        events.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        self.assertEqual(options["watch-docker-events"], False)
+
+    def test_default_volume_agent(self):
+        """
+        By default ``ZFSAgentOptions`` does not enable pushing volumes
+        through volume agents.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        self.assertEqual(options["volume-agent"], False)
+
+    def test_default_http_docker_client(self):
+        """
+        By default ``ZFSAgentOptions`` does not enable the HTTP Docker
+        client.
+        """
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        self.assertEqual(options["http-docker-client"], False)
+
     def test_host(self):
         """
         The second required command-line argument allows configuring the
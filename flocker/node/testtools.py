@@ -8,7 +8,18 @@ import errno
 import os
 import pwd
 import socket
+from json import dumps, loads
 from unittest import skipUnless
+from urllib import unquote
+from urlparse import urlparse, parse_qs
+from uuid import uuid4
+
+from twisted.web.http import (
+    OK, CREATED, NO_CONTENT, NOT_MODIFIED, NOT_FOUND, CONFLICT,
+    INTERNAL_SERVER_ERROR,
+    )
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
 
 from ._docker import BASE_DOCKER_API_URL
 from ..testtools import loop_until
@@ -67,3 +78,181 @@ def wait_for_unit_state(docker_client, unit_name, expected_activation_states):
         return responded
 
     return loop_until(check_if_in_states)
+
+
+class FakeDockerServer(Resource):
+    """
+    An in-memory implementation of the parts of the Docker HTTP API used by
+    the Docker clients.
+
+    :ivar dict containers: Maps container IDs to their inspection data, as
+        returned by the Docker inspect API.
+    :ivar images: A ``set`` of the names of images that exist, or ``None``
+        if every image exists.
+    :ivar list pulled: The names of images that have been pulled.
+    :ivar dict pull_errors: Maps the names of images to the error message
+        Docker reports in the progress stream when pulling them fails.
+    :ivar int stop_errors: The number of times stopping a container will
+        fail with an internal server error before succeeding, like Docker
+        does when a process has died but it hasn't noticed yet.
+    :ivar list stop_timeouts: The timeouts containers were stopped with.
+    """
+    isLeaf = True
+
+    def __init__(self, reactor=None, delay=0, images=None):
+        """
+        :param reactor: The reactor used to delay responses, needed if
+            ``delay`` is given.
+        :param float delay: The number of seconds to wait before responding
+            to each request, to model the time Docker takes to do work.
+        :param images: See ``images``.
+        """
+        Resource.__init__(self)
+        self._reactor = reactor
+        self._delay = delay
+        self.containers = {}
+        self.images = images
+        self.pulled = []
+        self.pull_errors = {}
+        self.stop_errors = 0
+        self.stop_timeouts = []
+
+    def _find(self, container):
+        """
+        :param bytes container: The ID or name of a container.
+
+        :return: The inspection data of the container, or ``None`` if it
+            does not exist.
+        """
+        for data in self.containers.values():
+            if container in (data[u"Id"], data[u"Name"][1:]):
+                return data
+        return None
+
+    def render(self, request):
+        path = [unquote(segment) for segment
+                in urlparse(request.uri).path.split(b"/")[2:]]
+        query = {key: values[0] for key, values
+                 in parse_qs(urlparse(request.uri).query).items()}
+        body = request.content.read()
+        code, response = self._respond(
+            request.method, path, query, loads(body) if body else None)
+        request.setResponseCode(code)
+        if response is not None:
+            request.setHeader(b"content-type", b"application/json")
+            if not isinstance(response, bytes):
+                response = dumps(response)
+        else:
+            response = b""
+        if not self._delay:
+            return response
+
+        def respond():
+            request.write(response)
+            request.finish()
+        self._reactor.callLater(self._delay, respond)
+        return NOT_DONE_YET
+
+    def _respond(self, method, path, query, body):
+        """
+        Handle a request.
+
+        :param bytes method: The HTTP method.
+        :param list path: The segments of the path after the API version.
+        :param dict query: The query arguments.
+        :param body: The decoded JSON body of the request, or ``None``.
+
+        :return: A tuple of the response code and an object to be encoded
+            as the JSON response, ``bytes`` to send as they are, or ``None``
+            for an empty response.
+        """
+        if path == [b"containers", b"json"]:
+            return OK, [
+                {u"Id": data[u"Id"], u"Names": [data[u"Name"]],
+                 u"Status": u"Up 1 second" if data[u"State"][u"Running"]
+                 else u"Exited (0) 1 second ago"}
+                for data in self.containers.values()]
+        elif path == [b"containers", b"create"]:
+            return self._create(query[b"name"].decode("utf-8"), body)
+        elif path == [b"images", b"create"]:
+            image = query[b"fromImage"].decode("utf-8")
+            if b"tag" in query:
+                image += u":" + query[b"tag"].decode("utf-8")
+            self.pulled.append(image)
+            # Docker streams progress messages, and reports failures among
+            # them rather than with the response code:
+            progress = [{u"status": u"Pulling repository " + image}]
+            if image in self.pull_errors:
+                error = self.pull_errors[image]
+                progress.append(
+                    {u"errorDetail": {u"message": error}, u"error": error})
+            else:
+                if self.images is not None:
+                    self.images.add(image)
+                progress.append({u"status": u"Downloaded newer image"})
+            return OK, b"".join(dumps(message) + b"\r\n"
+                                for message in progress)
+        elif path[:1] == [b"images"] and path[-1:] == [b"json"]:
+            image = b"/".join(path[1:-1]).decode("utf-8")
+            if self.images is not None and image not in self.images:
+                return NOT_FOUND, None
+            return OK, {u"Id": image}
+        elif path[:1] != [b"containers"] or len(path) < 2:
+            return NOT_FOUND, None
+        data = self._find(path[1].decode("utf-8"))
+        if data is None:
+            return NOT_FOUND, None
+        action = (method, path[2:])
+        if action == (b"GET", [b"json"]):
+            return OK, data
+        elif action == (b"POST", [b"start"]):
+            if data[u"State"][u"Running"]:
+                return NOT_MODIFIED, None
+            data[u"State"][u"Running"] = True
+            return NO_CONTENT, None
+        elif action == (b"POST", [b"stop"]):
+            self.stop_timeouts.append(query.get(b"t"))
+            if self.stop_errors:
+                self.stop_errors -= 1
+                return INTERNAL_SERVER_ERROR, None
+            if not data[u"State"][u"Running"]:
+                return NOT_MODIFIED, None
+            data[u"State"][u"Running"] = False
+            return NO_CONTENT, None
+        elif action == (b"DELETE", []):
+            if data[u"State"][u"Running"]:
+                return CONFLICT, None
+            del self.containers[data[u"Id"]]
+            return NO_CONTENT, None
+        return NOT_FOUND, None
+
+    def _create(self, name, config):
+        """
+        Create a container.
+
+        :param unicode name: The name of the container.
+        :param dict config: The configuration of the container.
+
+        :return: See ``_respond``.
+        """
+        if self._find(name) is not None:
+            return CONFLICT, None
+        if self.images is not None and config[u"Image"] not in self.images:
+            return NOT_FOUND, None
+        host_config = {u"PortBindings": None, u"Binds": None,
+                       u"RestartPolicy": {u"Name": u""}}
+        host_config.update(config.get(u"HostConfig") or {})
+        container_id = unicode(uuid4().hex)
+        self.containers[container_id] = {
+            u"Id": container_id,
+            u"Name": u"/" + name,
+            u"State": {u"Running": False},
+            u"Config": {
+                u"Image": config[u"Image"],
+                u"Env": config.get(u"Env"),
+                u"CpuShares": config.get(u"CpuShares") or 0,
+                u"Memory": config.get(u"Memory") or 0,
+            },
+            u"HostConfig": host_config,
+        }
+        return CREATED, {u"Id": container_id}
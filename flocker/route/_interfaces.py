@@ -39,6 +39,16 @@ class INetwork(Interface):
             :py:meth:`enumerate_proxies`.
         """
 
+    def update_proxies(delete, create):
+        """
+        Delete some existing TCP proxies and create some new ones.
+
+        :param delete: A sequence of objects as accepted by
+            :py:meth:`delete_proxy`.
+        :param create: A sequence of objects with ``ip`` and ``port``
+            attributes as accepted by :py:meth:`create_proxy_to`.
+        """
+
     def enumerate_proxies():
         """
         Retrieve configured proxy information.
@@ -8,21 +8,35 @@ Manipulate network routing behavior on a node using ``iptables``.
 from __future__ import unicode_literals
 
 import shlex
-from subprocess import check_call, check_output
+from subprocess import (
+    CalledProcessError, PIPE, Popen, check_call, check_output,
+    )
 
 from zope.interface import implementer
 from ipaddr import IPAddress
 from characteristic import attributes
 from eliot import Logger
-from psutil import net_connections
 from twisted.python.filepath import FilePath
 
-from ._logging import CREATE_PROXY_TO, DELETE_PROXY, IPTABLES
+from ._logging import (
+    CREATE_PROXY_TO, DELETE_PROXY, IPTABLES, IPTABLES_RESTORE,
+    )
 from ._interfaces import INetwork
 from ._model import Proxy
 
 FLOCKER_COMMENT_MARKER = b"flocker create_proxy_to"
 
+# The number of seconds for which HostNetwork trusts proxies it enumerated,
+# unless it changes them itself, before looking for changes made by others:
+PROXY_CACHE_LIFETIME = 5
+
+# The number of seconds for which HostNetwork trusts the listening ports it
+# found before looking again:
+LISTENING_PORTS_CACHE_LIFETIME = 5
+
+# The value of the "st" column of /proc/net/tcp for listening sockets:
+TCP_LISTEN = b"0A"
+
 
 @attributes(["comment", "destination_port", "to_destination"])
 class RuleOptions(object):
@@ -48,6 +62,100 @@ def iptables(logger, argv):
         check_call([b"iptables"] + argv)
 
 
+def iptables_restore(logger, executable, rules):
+    """
+    Apply rules to the existing ones with ``iptables-restore --noflush``,
+    which applies them all or none of them.
+
+    :param bytes executable: The path to ``iptables-restore``.
+    :param bytes rules: The input to give ``iptables-restore``.
+
+    :raise CalledProcessError: If ``iptables-restore`` fails.
+    """
+    with IPTABLES_RESTORE(logger=logger, rules=rules.decode("ascii")):
+        process = Popen([executable, b"--noflush"], stdin=PIPE)
+        process.communicate(rules)
+        if process.returncode:
+            raise CalledProcessError(process.returncode, executable)
+
+
+def configure_forwarding(conf):
+    """
+    Enable the system configuration which proxies rely upon.
+
+    :param FilePath conf: The ``/proc/sys/net/ipv4/conf`` directory.
+    """
+    # The network stack only considers forwarding traffic when certain
+    # system configuration is in place.
+    #
+    # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
+    # will explain the meaning of these in (very slightly) more detail.
+    descendant = conf.descendant([b"default", b"forwarding"])
+    with descendant.open("wb") as forwarding:
+        forwarding.write(b"1")
+
+    # In order to have the OUTPUT chain DNAT rule affect routing decisions,
+    # we also need to tell the system to make routing decisions about
+    # traffic from or to localhost.
+    for path in conf.children():
+        with path.child(b"route_localnet").open("wb") as route_localnet:
+            route_localnet.write(b"1")
+
+
+def proxy_rules(ip, port):
+    """
+    Describe the rules in the NAT table which make up a proxy, as
+    ``create_proxy_to`` creates them one at a time.
+
+    :param ip: The destination to which to proxy.
+    :param int port: The TCP port number on which to proxy.
+
+    :return: A ``list`` of ``(chain, rule)`` tuples in the order the rules
+        are created, where ``rule`` is a ``list`` of ``bytes`` giving the
+        rule specification.
+    """
+    ip = unicode(ip).encode("ascii")
+    port = unicode(port).encode("ascii")
+    return [
+        (b"PREROUTING",
+         [b"--protocol", b"tcp", b"--destination-port", port,
+          b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+          b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
+          b"--jump", b"DNAT", b"--to-destination", ip]),
+        (b"POSTROUTING",
+         [b"--protocol", b"tcp", b"--destination-port", port,
+          b"--jump", b"MASQUERADE"]),
+        (b"OUTPUT",
+         [b"--protocol", b"tcp", b"--destination-port", port,
+          b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+          b"--jump", b"DNAT", b"--to-destination", ip]),
+    ]
+
+
+def restore_input(delete, create):
+    """
+    Build ``iptables-restore`` input which deletes and creates proxies in a
+    single transaction.
+
+    :param delete: ``Proxy`` instances to delete.
+    :param create: ``Proxy`` instances to create.
+
+    :return: The input as ``bytes``.
+    """
+    lines = [b"*nat"]
+    for operation, proxies in [(b"--delete", delete), (b"--append", create)]:
+        for proxy in proxies:
+            for chain, rule in proxy_rules(proxy.ip, proxy.port):
+                lines.append(b" ".join(
+                    [operation, chain] +
+                    # iptables-restore splits the rule on whitespace except
+                    # within double quotes:
+                    [b'"%s"' % (argument,) if b" " in argument else argument
+                     for argument in rule]))
+    lines.append(b"COMMIT")
+    return b"\n".join(lines) + b"\n"
+
+
 def create_proxy_to(logger, ip, port):
     """
     :see: ``HostNetwork.create_proxy_to``
@@ -156,22 +264,7 @@ def create_proxy_to(logger, ip, port):
             b"--jump", b"DNAT", b"--to-destination", encoded_ip,
         ])
 
-        # The network stack only considers forwarding traffic when certain
-        # system configuration is in place.
-        #
-        # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
-        # will explain the meaning of these in (very slightly) more detail.
-        conf = FilePath(b"/proc/sys/net/ipv4/conf")
-        descendant = conf.descendant([b"default", b"forwarding"])
-        with descendant.open("wb") as forwarding:
-            forwarding.write(b"1")
-
-        # In order to have the OUTPUT chain DNAT rule affect routing decisions,
-        # we also need to tell the system to make routing decisions about
-        # traffic from or to localhost.
-        for path in conf.children():
-            with path.child(b"route_localnet").open("wb") as route_localnet:
-                route_localnet.write(b"1")
+        configure_forwarding(FilePath(b"/proc/sys/net/ipv4/conf"))
 
         return Proxy(ip=ip, port=port)
 
@@ -180,25 +273,9 @@ def delete_proxy(logger, proxy):
     """
     :see: ``HostNetwork.delete_proxy``
     """
-    ip = unicode(proxy.ip).encode("ascii")
-    port = unicode(proxy.port).encode("ascii")
-
     commands = [
-        [b"--table", b"nat",
-         b"--delete", b"PREROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
-         b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"nat",
-         b"--delete", b"POSTROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"MASQUERADE"],
-        [b"--table", b"nat",
-         b"--delete", b"OUTPUT",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--jump", b"DNAT", b"--to-destination", ip],
+        [b"--table", b"nat", b"--delete", chain] + rule
+        for chain, rule in proxy_rules(proxy.ip, proxy.port)
     ]
 
     with DELETE_PROXY(logger, target_ip=proxy.ip, target_port=proxy.port):
@@ -231,8 +308,19 @@ def get_flocker_rules():
     # Life is horrible.
     # https://stackoverflow.com/questions/109553/how-can-i-programmatically-manage-iptables-rules-on-the-fly
     # At least we know all the rules we need to inspect are in the NAT table.
-    output = check_output([b"iptables-save", b"--table", b"nat"])
+    return parse_flocker_rules(
+        check_output([b"iptables-save", b"--table", b"nat"]))
+
+
+def parse_flocker_rules(output):
+    """
+    Find the rules created/managed by flocker in iptables-save(8) output.
 
+    :param bytes output: The output of ``iptables-save``.
+
+    :return: An iterator of :py:class:`Options` instances, one for each rule
+        found.
+    """
     # Find the beginning of the NAT table
     header = b"*nat\n"
     begin = output.find(header) + len(header)
@@ -245,8 +333,10 @@ def get_flocker_rules():
     nat = output[begin:end]
 
     for line in nat.splitlines():
-        if line.startswith(b":"):
-            # Skip these lines describing a chain or the table overall.
+        # Hosts running Docker can have many thousands of rules, so skip
+        # lines which can't be Flocker's before doing any real parsing.
+        # This also skips the lines describing a chain or the table overall.
+        if FLOCKER_COMMENT_MARKER not in line:
             continue
 
         options = parse_iptables_options(shlex.split(line))
@@ -255,6 +345,37 @@ def get_flocker_rules():
             yield options
 
 
+def listening_ports(proc_net):
+    """
+    Find the TCP ports on which sockets are listening.
+
+    This reads the kernel's tables of TCP sockets directly, which needs no
+    privileges and doesn't involve looking at every process's open files.
+
+    :param FilePath proc_net: The ``/proc/net`` directory.
+
+    :return: A ``set`` of ``int`` port numbers.
+    """
+    ports = set()
+    for name in [b"tcp", b"tcp6"]:
+        try:
+            table = proc_net.child(name).getContent()
+        except IOError:
+            # The tcp6 table is missing if IPv6 is disabled.
+            continue
+        # Lines look like this, after a header line:
+        #
+        #    0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 ...
+        #
+        # giving the local address and port, the remote address and port
+        # and the state, all in hexadecimal.
+        for line in table.splitlines()[1:]:
+            fields = line.split(None, 4)
+            if fields[3] == TCP_LISTEN:
+                ports.add(int(fields[1].rsplit(b":", 1)[1], 16))
+    return ports
+
+
 def parse_iptables_options(argv):
     """
     Parse a single line of iptables-save(8) output from the NAT table section.
@@ -306,8 +427,56 @@ def parse_iptables_options(argv):
 class HostNetwork(object):
     """
     An ``INetwork`` implementation based on ``iptables``.
+
+    :ivar bool batched: If ``True``, proxies are created and deleted with a
+        single ``iptables-restore`` transaction per call, rather than
+        running ``iptables`` for every rule and rewriting the configuration
+        for every proxy created.  The system configuration proxies rely
+        upon is then only written by ``configure_forwarding``, which should
+        be called once at startup.
+
+    :ivar bytes restore_command: The ``iptables-restore`` executable used
+        when batched.  Primarily intended as a testing hook.
+
+    :ivar FilePath conf: The ``/proc/sys/net/ipv4/conf`` directory written
+        by ``configure_forwarding``.  Primarily intended as a testing hook.
+
+    :ivar FilePath proc_net: The ``/proc/net`` directory read to find
+        listening ports.  Primarily intended as a testing hook.
+
+    :ivar _proxies: The ``list`` of proxies last enumerated, or ``None`` if
+        they must be enumerated again.
+    :ivar _proxies_expire: The time at which ``_proxies`` will be
+        enumerated again to notice changes made by anything else.
+
+    :ivar _listening: The ``set`` of listening ports last found, or
+        ``None`` if none have been found yet.
+    :ivar _listening_expire: The time at which listening ports will be found
+        again.
     """
     logger = Logger()
+    restore_command = b"iptables-restore"
+    conf = FilePath(b"/proc/sys/net/ipv4/conf")
+    proc_net = FilePath(b"/proc/net")
+
+    def __init__(self, reactor, batched=False):
+        """
+        :param reactor: A ``twisted.internet.interfaces.IReactorTime``
+            provider used to expire enumerated proxies.
+        :param bool batched: See ``HostNetwork.batched``.
+        """
+        self._reactor = reactor
+        self.batched = batched
+        self._proxies = None
+        self._proxies_expire = 0
+        self._listening = None
+        self._listening_expire = 0
+
+    def configure_forwarding(self):
+        """
+        Enable the system configuration which proxies rely upon.
+        """
+        configure_forwarding(self.conf)
 
     def create_proxy_to(self, ip, port):
         """
@@ -315,7 +484,12 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
         """
-        return create_proxy_to(self.logger, ip, port)
+        if not self.batched:
+            self._proxies = None
+            return create_proxy_to(self.logger, ip, port)
+        proxy = Proxy(ip=ip, port=port)
+        self.update_proxies(delete=[], create=[proxy])
+        return proxy
 
     def delete_proxy(self, proxy):
         """
@@ -323,35 +497,76 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.delete_proxy` for parameter documentation.
         """
-        return delete_proxy(self.logger, proxy)
+        if not self.batched:
+            self._proxies = None
+            return delete_proxy(self.logger, proxy)
+        self.update_proxies(delete=[proxy], create=[])
 
-    enumerate_proxies = staticmethod(enumerate_proxies)
+    def update_proxies(self, delete, create):
+        """
+        Delete some proxies and create others, in one ``iptables-restore``
+        transaction when batched.
+
+        :see: :meth:`INetwork.update_proxies` for parameter documentation.
+        """
+        if not self.batched:
+            for proxy in delete:
+                self.delete_proxy(proxy)
+            for proxy in create:
+                self.create_proxy_to(proxy.ip, proxy.port)
+            return
+        if not (delete or create):
+            return
+        self._proxies = None
+        iptables_restore(
+            self.logger, self.restore_command, restore_input(delete, create))
+
+    def enumerate_proxies(self):
+        """
+        Find the proxies configured in iptables, reusing those found in the
+        last ``PROXY_CACHE_LIFETIME`` seconds unless this object has changed
+        them since.
+
+        :see: :meth:`INetwork.enumerate_proxies` for parameter documentation.
+        """
+        now = self._reactor.seconds()
+        if self._proxies is None or now >= self._proxies_expire:
+            self._proxies = enumerate_proxies()
+            self._proxies_expire = now + PROXY_CACHE_LIFETIME
+        return list(self._proxies)
 
     def enumerate_used_ports(self):
         """
         Find all ports that are in use on this node by normal TCP servers or by
         proxies managed by this object.
 
+        Listening ports found in the last ``LISTENING_PORTS_CACHE_LIFETIME``
+        seconds are reused.
+
         :see: :meth:`INetwork.enumerate_used_ports` for parameter
             documentation.
         """
-        listening = set(
-            conn.laddr[1]
-            for conn
-            in net_connections(kind='tcp')
-        )
+        now = self._reactor.seconds()
+        if self._listening is None or now >= self._listening_expire:
+            self._listening = listening_ports(self.proc_net)
+            self._listening_expire = now + LISTENING_PORTS_CACHE_LIFETIME
         proxied = set(
             proxy.port
             for proxy in self.enumerate_proxies()
         )
-        # net_connections won't tell us about ports bound by sockets that
-        # haven't entered the TCP state graph yet.
-        return frozenset(listening | proxied)
+        # The kernel's tables won't tell us about ports bound by sockets that
+        # haven't started listening yet.
+        return frozenset(self._listening | proxied)
 
 
-def make_host_network():
+def make_host_network(reactor, batched=False):
     """
     Create a new ``INetwork`` provider which will interact with the underlying
     system's network configuration.
+
+    :param reactor: A ``twisted.internet.interfaces.IReactorTime`` provider
+        used to expire enumerated proxies.
+    :param bool batched: Whether to apply changes in batches using
+        ``iptables-restore``; see ``HostNetwork``.
     """
-    return HostNetwork()
+    return HostNetwork(reactor, batched=batched)
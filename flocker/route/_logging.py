@@ -46,6 +46,19 @@ IPTABLES = ActionType(
     u"An iptables command which Flocker is executing against the system.")
 
 
+RULES = Field.forTypes(
+    u"rules", [unicode],
+    u"The input given to iptables-restore.")
+
+
+IPTABLES_RESTORE = ActionType(
+    _system(u"iptables_restore"),
+    [RULES],
+    [],
+    u"Flocker is applying iptables rules in one iptables-restore "
+    u"transaction.")
+
+
 CREATE_PROXY_TO = ActionType(
     _system(u"create_proxy_to"),
     [TARGET_IP, TARGET_PORT],
@@ -33,6 +33,12 @@ class MemoryNetwork(object):
     def delete_proxy(self, proxy):
         self._proxies.remove(proxy)
 
+    def update_proxies(self, delete, create):
+        for proxy in delete:
+            self.delete_proxy(proxy)
+        for proxy in create:
+            self.create_proxy_to(proxy.ip, proxy.port)
+
     def enumerate_proxies(self):
         return list(self._proxies)
 
@@ -94,6 +94,21 @@ def make_proxying_tests(make_network):
             self.network.delete_proxy(proxy_one)
             self.assertEqual([proxy_two], self.network.enumerate_proxies())
 
+        def test_update_proxies(self):
+            """
+            :py:meth:`INetwork.update_proxies` deletes the given proxies and
+            creates proxies like the given ones, leaving other proxies
+            alone.
+            """
+            kept = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+            deleted = self.network.create_proxy_to(IPAddress("10.0.0.2"), 2)
+            created = self.network.create_proxy_to(IPAddress("10.0.0.3"), 3)
+            self.network.delete_proxy(created)
+            self.network.update_proxies(delete=[deleted], create=[created])
+            self.assertEqual(
+                sorted([kept, created]),
+                sorted(self.network.enumerate_proxies()))
+
         def test_proxied_ports_used(self):
             """
             The port number used to create a proxy is marked as used in the
@@ -16,6 +16,7 @@ from subprocess import check_call
 from ipaddr import IPAddress, IPNetwork
 from eliot.testing import LoggedAction, validateLogging, assertHasAction
 
+from twisted.internet import reactor
 from twisted.trial.unittest import TestCase
 from twisted.python.procutils import which
 
@@ -126,7 +127,8 @@ class GetIPTablesTests(TestCase):
         self.assertEqual(first, second)
 
 
-class IPTablesProxyTests(make_proxying_tests(make_host_network)):
+class IPTablesProxyTests(
+        make_proxying_tests(lambda: make_host_network(reactor))):
     """
     Apply the generic ``INetwork`` test suite to the implementation which
     manipulates the actual system configuration.
@@ -142,6 +144,32 @@ class IPTablesProxyTests(make_proxying_tests(make_host_network)):
         super(IPTablesProxyTests, self).setUp()
 
 
+def make_batched_network():
+    """
+    Create a batched ``HostNetwork`` with forwarding configured, as
+    ``flocker-zfs-agent`` does at startup.
+    """
+    network = make_host_network(reactor, batched=True)
+    network.configure_forwarding()
+    return network
+
+
+class BatchedIPTablesProxyTests(make_proxying_tests(make_batched_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the implementation which
+    manipulates the actual system configuration using ``iptables-restore``.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        """
+        Arrange for the tests to not corrupt the system network configuration.
+        """
+        self.namespace = create_network_namespace()
+        self.addCleanup(self.namespace.restore)
+        super(BatchedIPTablesProxyTests, self).setUp()
+
+
 class CreateTests(TestCase):
     """
     Tests for the creation of new external routing rules.
@@ -156,7 +184,7 @@ class CreateTests(TestCase):
         self.namespace = create_network_namespace()
         self.addCleanup(self.namespace.restore)
 
-        self.network = make_host_network()
+        self.network = make_host_network(reactor)
 
         # https://clusterhq.atlassian.net/browse/FLOC-135
         # Don't hardcode addresses in the created namespace
@@ -335,7 +363,7 @@ class EnumerateTests(TestCase):
     @_environment_skip
     def setUp(self):
         self.addCleanup(create_network_namespace().restore)
-        self.network = make_host_network()
+        self.network = make_host_network(reactor)
 
     def test_unrelated_iptables_rules(self):
         """
@@ -356,7 +384,7 @@ class DeleteTests(TestCase):
     @_environment_skip
     def setUp(self):
         self.addCleanup(create_network_namespace().restore)
-        self.network = make_host_network()
+        self.network = make_host_network(reactor)
 
     @validateLogging(some_iptables_logged(DELETE_PROXY))
     def test_created_rules_deleted(self, logger):
@@ -424,7 +452,7 @@ class UsedPortsTests(TestCase):
         :raise: If the port number is not indicated as used, a failure
             exception is raised.
         """
-        network = make_host_network()
+        network = make_host_network(reactor)
         listener = socket()
         self.addCleanup(listener.close)
 
@@ -451,10 +479,10 @@ class UsedPortsTests(TestCase):
     def test_client_ports(self):
         """
         If a socket is bound to a port and connected to a server then the
-        client port is included in ``HostNetwork.enumerate_used_ports``\ s
-        return value.
+        client port is not included in ``HostNetwork.enumerate_used_ports``\ s
+        return value, since only listening ports prevent new servers.
         """
-        network = make_host_network()
+        network = make_host_network(reactor)
         listener = socket()
         self.addCleanup(listener.close)
 
@@ -469,5 +497,5 @@ class UsedPortsTests(TestCase):
         except error:
             pass
 
-        self.assertIn(
+        self.assertNotIn(
             client.getsockname()[1], network.enumerate_used_ports())
@@ -0,0 +1,409 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._iptables`.
+"""
+
+from subprocess import CalledProcessError
+
+from ipaddr import IPAddress
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+from twisted.internet.task import Clock
+
+from .. import Proxy, make_host_network
+from .. import _iptables
+from .._iptables import (
+    LISTENING_PORTS_CACHE_LIFETIME, PROXY_CACHE_LIFETIME, RuleOptions,
+    listening_ports, parse_flocker_rules, restore_input,
+    )
+from .._logging import IPTABLES_RESTORE
+
+
+IPTABLES_SAVE_OUTPUT = b"""\
+# Generated by iptables-save v1.4.21 on Thu Jan  1 00:00:00 2015
+*nat
+:PREROUTING ACCEPT [0:0]
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+:DOCKER - [0:0]
+-A PREROUTING -m addrtype --dst-type LOCAL -j DOCKER
+-A PREROUTING -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL \
+-m comment --comment "flocker create_proxy_to" -j DNAT \
+--to-destination 10.1.2.3
+-A OUTPUT -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL -j DNAT \
+--to-destination 10.1.2.3
+-A POSTROUTING -p tcp -m tcp --dport 4567 -j MASQUERADE
+-A DOCKER ! -i docker0 -p tcp -m tcp --dport 49153 -j DNAT \
+--to-destination 172.17.0.2:80
+COMMIT
+# Completed on Thu Jan  1 00:00:00 2015
+"""
+
+
+class ParseFlockerRulesTests(SynchronousTestCase):
+    """
+    Tests for ``parse_flocker_rules``.
+    """
+    def test_flocker_rules(self):
+        """
+        ``parse_flocker_rules`` finds only the rules with Flocker's comment,
+        ignoring other rules even if they look similar.
+        """
+        self.assertEqual(
+            [RuleOptions(comment=b"flocker create_proxy_to",
+                         destination_port=4567,
+                         to_destination=IPAddress(u"10.1.2.3"))],
+            list(parse_flocker_rules(IPTABLES_SAVE_OUTPUT)))
+
+    def test_no_rules(self):
+        """
+        ``parse_flocker_rules`` finds nothing in a NAT table with no rules.
+        """
+        self.assertEqual(
+            [], list(parse_flocker_rules(b"*nat\n:PREROUTING ACCEPT [0:0]\n"
+                                         b"COMMIT\n")))
+
+
+TCP_TABLE = b"""\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt \
+  uid  timeout inode
+   0: 00000000:0016 00000000:0000 0A 00000000:00000000 00:00000000 00000000 \
+    0        0 10001 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000 \
+    0        0 10002 1 0000000000000000 100 0 0 10 0
+   2: 0100007F:C41E 0100007F:0CEA 01 00000000:00000000 02:000011E6 00000000 \
+    0        0 10003 2 0000000000000000 20 4 0 19 -1
+10000: 0100007F:C41F 0100007F:0CEA 06 00000000:00000000 03:00000F9E 00000000 \
+    0        0 0 3 0000000000000000
+"""
+
+TCP6_TABLE = b"""\
+  sl  local_address                         remote_address                \
+        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000000000000:1F90 \
+00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 \
+00000000     0        0 10004 1 0000000000000000 100 0 0 10 0
+"""
+
+
+class ListeningPortsTests(SynchronousTestCase):
+    """
+    Tests for ``listening_ports``.
+    """
+    def setUp(self):
+        self.proc_net = FilePath(self.mktemp())
+        self.proc_net.makedirs()
+        self.proc_net.child(b"tcp").setContent(TCP_TABLE)
+
+    def test_listening(self):
+        """
+        ``listening_ports`` finds the ports of listening IPv4 and IPv6
+        sockets, ignoring other sockets.
+        """
+        self.proc_net.child(b"tcp6").setContent(TCP6_TABLE)
+        self.assertEqual({22, 3306, 8080}, listening_ports(self.proc_net))
+
+    def test_no_ipv6(self):
+        """
+        ``listening_ports`` finds the ports of listening IPv4 sockets if
+        there is no IPv6 table.
+        """
+        self.assertEqual({22, 3306}, listening_ports(self.proc_net))
+
+
+class RestoreInputTests(SynchronousTestCase):
+    """
+    Tests for ``restore_input``.
+    """
+    def test_rules(self):
+        """
+        ``restore_input`` deletes the three NAT rules of each proxy to delete
+        and then appends the three NAT rules of each proxy to create, quoting
+        the Flocker comment.
+        """
+        self.assertEqual(
+            b"*nat\n"
+            b"--delete PREROUTING --protocol tcp --destination-port 1234 "
+            b"--match addrtype --dst-type LOCAL "
+            b'--match comment --comment "flocker create_proxy_to" '
+            b"--jump DNAT --to-destination 10.0.0.1\n"
+            b"--delete POSTROUTING --protocol tcp --destination-port 1234 "
+            b"--jump MASQUERADE\n"
+            b"--delete OUTPUT --protocol tcp --destination-port 1234 "
+            b"--match addrtype --dst-type LOCAL "
+            b"--jump DNAT --to-destination 10.0.0.1\n"
+            b"--append PREROUTING --protocol tcp --destination-port 5678 "
+            b"--match addrtype --dst-type LOCAL "
+            b'--match comment --comment "flocker create_proxy_to" '
+            b"--jump DNAT --to-destination 10.0.0.2\n"
+            b"--append POSTROUTING --protocol tcp --destination-port 5678 "
+            b"--jump MASQUERADE\n"
+            b"--append OUTPUT --protocol tcp --destination-port 5678 "
+            b"--match addrtype --dst-type LOCAL "
+            b"--jump DNAT --to-destination 10.0.0.2\n"
+            b"COMMIT\n",
+            restore_input(
+                delete=[Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)],
+                create=[Proxy(ip=u"10.0.0.2", port=5678)]))
+
+    def test_empty(self):
+        """
+        ``restore_input`` with nothing to delete or create commits an empty
+        transaction.
+        """
+        self.assertEqual(b"*nat\nCOMMIT\n", restore_input([], []))
+
+
+class BatchedHostNetworkTests(SynchronousTestCase):
+    """
+    Tests for ``HostNetwork`` in batched mode, using a fake
+    ``iptables-restore`` which records its arguments and input.
+    """
+    def setUp(self):
+        directory = FilePath(self.mktemp())
+        directory.makedirs()
+        self.invocations = directory.child(b"invocations")
+        self.input = directory.child(b"input")
+        self.exit_code = directory.child(b"exit-code")
+        self.exit_code.setContent(b"0")
+        command = directory.child(b"iptables-restore")
+        command.setContent(
+            b"#!/bin/sh\n"
+            b'echo "$@" >> %s\n'
+            b"cat >> %s\n"
+            b"exit $(cat %s)\n" % (
+                self.invocations.path, self.input.path, self.exit_code.path))
+        command.chmod(0700)
+
+        self.conf = directory.child(b"conf")
+        for interface in [b"default", b"eth0"]:
+            self.conf.child(interface).makedirs()
+
+        self.network = make_host_network(Clock(), batched=True)
+        self.patch(self.network, "restore_command", command.path)
+        self.patch(self.network, "conf", self.conf)
+
+    def test_update_proxies(self):
+        """
+        ``HostNetwork.update_proxies`` runs ``iptables-restore --noflush``
+        once with input deleting and creating all of the given proxies.
+        """
+        delete = [Proxy(ip=IPAddress(u"10.0.0.%d" % (i,)), port=1000 + i)
+                  for i in range(1, 251)]
+        create = [Proxy(ip=u"10.0.1.%d" % (i,), port=2000 + i)
+                  for i in range(1, 251)]
+        self.network.update_proxies(delete=delete, create=create)
+        self.assertEqual(
+            (b"--noflush\n", restore_input(delete, create)),
+            (self.invocations.getContent(), self.input.getContent()))
+
+    def test_create_proxy_to(self):
+        """
+        ``HostNetwork.create_proxy_to`` creates a proxy with one
+        ``iptables-restore`` transaction and returns a ``Proxy``.
+        """
+        proxy = self.network.create_proxy_to(IPAddress(u"10.0.0.1"), 1234)
+        self.assertEqual(
+            (Proxy(ip=IPAddress(u"10.0.0.1"), port=1234),
+             restore_input(delete=[], create=[proxy])),
+            (proxy, self.input.getContent()))
+
+    def test_delete_proxy(self):
+        """
+        ``HostNetwork.delete_proxy`` deletes a proxy with one
+        ``iptables-restore`` transaction.
+        """
+        proxy = Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)
+        self.network.delete_proxy(proxy)
+        self.assertEqual(restore_input(delete=[proxy], create=[]),
+                         self.input.getContent())
+
+    def test_nothing_to_update(self):
+        """
+        ``HostNetwork.update_proxies`` doesn't run ``iptables-restore`` when
+        there is nothing to delete or create.
+        """
+        self.network.update_proxies(delete=[], create=[])
+        self.assertFalse(self.invocations.exists())
+
+    def test_configure_forwarding(self):
+        """
+        ``HostNetwork.configure_forwarding`` writes the system configuration
+        proxies rely on.
+        """
+        self.network.configure_forwarding()
+        self.assertEqual(
+            (b"1", b"1"),
+            (self.conf.descendant([b"default", b"forwarding"]).getContent(),
+             self.conf.descendant([b"eth0", b"route_localnet"]).getContent()))
+
+    def test_create_proxy_forwarding_unchanged(self):
+        """
+        Creating a proxy in batched mode doesn't rewrite the system
+        configuration, which ``HostNetwork.configure_forwarding`` writes once
+        at startup.
+        """
+        self.network.create_proxy_to(IPAddress(u"10.0.0.1"), 1234)
+        self.assertFalse(
+            self.conf.descendant([b"default", b"forwarding"]).exists())
+
+    def test_failure(self):
+        """
+        ``HostNetwork.update_proxies`` raises ``CalledProcessError`` if
+        ``iptables-restore`` fails.
+        """
+        self.exit_code.setContent(b"1")
+        self.assertRaises(
+            CalledProcessError, self.network.update_proxies,
+            delete=[Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)], create=[])
+
+    @validateLogging(assertHasAction, IPTABLES_RESTORE, True)
+    def test_logged(self, logger):
+        """
+        ``HostNetwork.update_proxies`` logs an ``IPTABLES_RESTORE`` action.
+        """
+        self.patch(self.network, "logger", logger)
+        self.network.update_proxies(
+            delete=[Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)], create=[])
+
+
+class HostNetworkProxyCacheTests(SynchronousTestCase):
+    """
+    Tests for the caching of proxies by ``HostNetwork.enumerate_proxies``.
+    """
+    def setUp(self):
+        self.proxies = [Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)]
+        self.enumerations = 0
+
+        def enumerate_proxies():
+            self.enumerations += 1
+            return list(self.proxies)
+        self.patch(_iptables, "enumerate_proxies", enumerate_proxies)
+        self.patch(_iptables, "create_proxy_to",
+                   lambda logger, ip, port: Proxy(ip=ip, port=port))
+        self.patch(_iptables, "delete_proxy", lambda logger, proxy: None)
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, executable, rules: None)
+        self.patch(_iptables, "configure_forwarding", lambda conf: None)
+        self.clock = Clock()
+
+    def test_cached(self):
+        """
+        Proxies enumerated again within ``PROXY_CACHE_LIFETIME`` seconds are
+        the ones found the first time.
+        """
+        network = make_host_network(self.clock)
+        first = network.enumerate_proxies()
+        self.clock.advance(PROXY_CACHE_LIFETIME - 1)
+        self.assertEqual((self.proxies, 1),
+                         (network.enumerate_proxies(), self.enumerations))
+        self.assertEqual(self.proxies, first)
+
+    def test_copy(self):
+        """
+        Changing the ``list`` returned by ``HostNetwork.enumerate_proxies``
+        does not change the cached proxies.
+        """
+        network = make_host_network(self.clock)
+        network.enumerate_proxies().append(None)
+        self.assertEqual(self.proxies, network.enumerate_proxies())
+
+    def test_expired(self):
+        """
+        After ``PROXY_CACHE_LIFETIME`` seconds the proxies are enumerated
+        again, noticing changes made by something else.
+        """
+        network = make_host_network(self.clock)
+        network.enumerate_proxies()
+        self.proxies = []
+        self.clock.advance(PROXY_CACHE_LIFETIME)
+        self.assertEqual(([], 2),
+                         (network.enumerate_proxies(), self.enumerations))
+
+    def assert_invalidated(self, batched, change):
+        """
+        Assert that a change made by a ``HostNetwork`` causes the proxies to
+        be enumerated again.
+
+        :param bool batched: Whether the network is batched.
+        :param change: A callable which is given the network to change.
+        """
+        network = make_host_network(self.clock, batched=batched)
+        network.enumerate_proxies()
+        change(network)
+        network.enumerate_proxies()
+        self.assertEqual(2, self.enumerations)
+
+    def test_create_invalidates(self):
+        """
+        Creating a proxy causes the proxies to be enumerated again.
+        """
+        self.assert_invalidated(
+            False, lambda network: network.create_proxy_to(
+                IPAddress(u"10.0.0.2"), 5678))
+
+    def test_delete_invalidates(self):
+        """
+        Deleting a proxy causes the proxies to be enumerated again.
+        """
+        self.assert_invalidated(
+            False, lambda network: network.delete_proxy(self.proxies[0]))
+
+    def test_batched_update_invalidates(self):
+        """
+        Updating proxies in batched mode causes the proxies to be enumerated
+        again.
+        """
+        self.assert_invalidated(
+            True, lambda network: network.update_proxies(
+                delete=self.proxies,
+                create=[Proxy(ip=IPAddress(u"10.0.0.2"), port=5678)]))
+
+
+class HostNetworkUsedPortsTests(SynchronousTestCase):
+    """
+    Tests for ``HostNetwork.enumerate_used_ports``.
+    """
+    def setUp(self):
+        self.proc_net = FilePath(self.mktemp())
+        self.proc_net.makedirs()
+        self.proc_net.child(b"tcp").setContent(TCP_TABLE)
+        self.patch(_iptables, "enumerate_proxies", lambda: [
+            Proxy(ip=IPAddress(u"10.0.0.1"), port=1234)])
+        self.clock = Clock()
+        self.network = make_host_network(self.clock)
+        self.patch(self.network, "proc_net", self.proc_net)
+
+    def test_used_ports(self):
+        """
+        ``HostNetwork.enumerate_used_ports`` includes listening ports and
+        the ports of proxies.
+        """
+        self.assertEqual(frozenset({22, 3306, 1234}),
+                         self.network.enumerate_used_ports())
+
+    def test_cached(self):
+        """
+        Listening ports found within ``LISTENING_PORTS_CACHE_LIFETIME``
+        seconds are reused.
+        """
+        self.network.enumerate_used_ports()
+        self.proc_net.child(b"tcp6").setContent(TCP6_TABLE)
+        self.clock.advance(LISTENING_PORTS_CACHE_LIFETIME - 1)
+        self.assertEqual(frozenset({22, 3306, 1234}),
+                         self.network.enumerate_used_ports())
+
+    def test_expired(self):
+        """
+        After ``LISTENING_PORTS_CACHE_LIFETIME`` seconds listening ports are
+        found again.
+        """
+        self.network.enumerate_used_ports()
+        self.proc_net.child(b"tcp6").setContent(TCP6_TABLE)
+        self.clock.advance(LISTENING_PORTS_CACHE_LIFETIME)
+        self.assertEqual(frozenset({22, 3306, 8080, 1234}),
+                         self.network.enumerate_used_ports())
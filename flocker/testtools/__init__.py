@@ -32,7 +32,7 @@ from twisted.internet.error import ConnectionDone
 from twisted.internet import reactor
 from twisted.trial.unittest import SynchronousTestCase, SkipTest
 from twisted.internet.protocol import Factory, Protocol
-from twisted.test.proto_helpers import MemoryReactor
+from twisted.test.proto_helpers import MemoryReactorClock
 from twisted.python.procutils import which
 from twisted.trial.unittest import TestCase
 from twisted.protocols.amp import AMP, InvalidSignature
@@ -688,13 +688,13 @@ from twisted.internet.base import _ThreePhaseEvent
 
 
 @implementer(IReactorCore)
-class MemoryCoreReactor(MemoryReactor):
+class MemoryCoreReactor(MemoryReactorClock):
     """
-    Fake reactor with listenTCP and just enough of an implementation of
-    IReactorCore.
+    Fake reactor with listenTCP, a clock and just enough of an
+    implementation of IReactorCore.
     """
     def __init__(self):
-        MemoryReactor.__init__(self)
+        MemoryReactorClock.__init__(self)
         self._triggers = {}
 
     def addSystemEventTrigger(self, phase, eventType, callable, *args, **kw):
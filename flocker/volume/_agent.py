@@ -0,0 +1,860 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_agent -*-
+
+"""
+A long-running volume manager which serves requests from other nodes.
+
+``RemoteVolumeManager`` runs a new ``flocker-volume`` process, over a new
+SSH session, for every request, so each push or handoff pays for starting
+several Python processes.  Instead ``flocker-volume serve`` can be started
+once for each destination and then sent any number of requests over its
+standard input and output using AMP:
+
+* ``SnapshotsCommand``, ``StreamFeaturesCommand``, ``ResumeTokenCommand``,
+  ``AcquireCommand`` and ``CloneToCommand`` match the ``flocker-volume``
+  sub-commands of the same names.
+* A volume is received with a ``ReceiveCommand``, followed by its data in
+  ``ReceiveDataCommand``\ s and finally a ``ReceiveEndCommand``.  The agent
+  doesn't answer a ``ReceiveDataCommand`` until it is ready for more data,
+  and the sender limits how many are unanswered, so data is sent no faster
+  than it can be stored.
+* The sender offers the compression codecs it can use in the
+  ``ReceiveCommand`` and the agent chooses one of them, which the data is
+  compressed with.
+* If a transfer is interrupted, the agent's ``ResumeTokenCommand`` answer
+  says how much was received so the next ``ReceiveCommand`` can resume it.
+
+The data passes through the sending process to be compressed and framed,
+so unlike pushing to ``flocker-volume receive`` it can't be moved with
+``splice_transfer``; ``flocker-zfs-agent`` only uses the agent when asked.
+"""
+
+from timeit import default_timer
+from uuid import uuid4
+
+from zope.interface import implementer
+
+from eliot import Logger
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.endpoints import connectProtocol
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.stdio import StandardIO
+from twisted.protocols.amp import (
+    AMP, Argument, BinaryBoxProtocol, BoxDispatcher, Command,
+    CommandLocator, ListOf, MAX_VALUE_LENGTH, String, Unicode,
+)
+from twisted.python.failure import Failure
+
+from ..common import (
+    CODECS, CompressionStatistics, log_compressed_transfer, negotiate_codec,
+    )
+from ._ipc import IRemoteVolumeManager
+from .filesystems.zfs import Snapshot
+from .service import DEFAULT_CONFIG_PATH, Volume, VolumeName
+
+
+# The most ``ReceiveDataCommand``\ s sent without an answer before the
+# sender stops reading the data it is sending:
+_RECEIVE_WINDOW = 16
+
+
+class UnknownTransfer(Exception):
+    """
+    A ``ReceiveDataCommand``, ``ReceiveEndCommand`` or
+    ``ReceiveAbortCommand`` referred to a transfer which was never started
+    or has already ended.
+    """
+
+
+class _VolumeNameArgument(Argument):
+    """
+    AMP argument for a ``VolumeName``.
+    """
+    def fromString(self, in_bytes):
+        return VolumeName.from_bytes(in_bytes)
+
+    def toString(self, name):
+        return name.to_bytes()
+
+
+class SnapshotsCommand(Command):
+    """
+    List the snapshots of a volume, from oldest to newest.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', _VolumeNameArgument())]
+    response = [('snapshots', ListOf(String()))]
+
+
+class ReceiveCommand(Command):
+    """
+    Start receiving a volume pushed from another volume manager.
+
+    The sender offers the names of the codecs it can compress the data
+    with, most preferred first, and is answered with the one to use.  If
+    the data resumes an interrupted transfer, the resume token it resumes
+    from is given.
+    """
+    arguments = [('transfer_id', Unicode()),
+                 ('node_id', Unicode()),
+                 ('name', _VolumeNameArgument()),
+                 ('codecs', ListOf(String())),
+                 ('resume_token', String(optional=True))]
+    response = [('codec', String())]
+
+
+class ReceiveDataCommand(Command):
+    """
+    Some of the data of a volume being received.
+
+    The answer is delayed until the volume manager is ready for more data.
+    """
+    arguments = [('transfer_id', Unicode()),
+                 ('data', String())]
+    response = []
+    errors = {UnknownTransfer: b"UNKNOWN_TRANSFER"}
+
+
+class ReceiveEndCommand(Command):
+    """
+    All of the data of a volume being received has been sent.
+
+    The answer is sent once the volume has been updated.
+    """
+    arguments = [('transfer_id', Unicode())]
+    response = []
+    errors = {UnknownTransfer: b"UNKNOWN_TRANSFER"}
+
+
+class ReceiveAbortCommand(Command):
+    """
+    Stop receiving a volume, leaving it as it was.
+    """
+    arguments = [('transfer_id', Unicode())]
+    response = []
+    errors = {UnknownTransfer: b"UNKNOWN_TRANSFER"}
+
+
+class StreamFeaturesCommand(Command):
+    """
+    List the optional ``zfs send`` stream features the volume manager's
+    storage pool can receive.
+    """
+    arguments = []
+    response = [('features', ListOf(String()))]
+
+
+class ResumeTokenCommand(Command):
+    """
+    Find out how much of an interrupted transfer of a volume was received.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', _VolumeNameArgument())]
+    response = [('resume_token', String(optional=True))]
+
+
+class AcquireCommand(Command):
+    """
+    Take ownership of a volume previously owned by another volume manager.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', _VolumeNameArgument())]
+    response = [('node_id', Unicode())]
+
+
+class CloneToCommand(Command):
+    """
+    Clone an existing volume, creating a new one.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', _VolumeNameArgument()),
+                 ('clone_name', _VolumeNameArgument())]
+    response = []
+
+
+@implementer(IStreamClientEndpoint)
+class _ReceivedStream(object):
+    """
+    The data of a volume received in ``ReceiveDataCommand``\ s, which is
+    decompressed as it arrives.
+
+    This is both the endpoint ``VolumeService.receive`` reads the data from
+    and the transport of the protocol connected to it, which is delivered
+    the data as long as it doesn't pause the transport.
+
+    :ivar list _pending: ``(data, Deferred)`` tuples of data not delivered
+        yet, and the ``Deferred`` to fire once it has been.
+    :ivar _end: ``None`` while more data may arrive, otherwise the reason
+        the connected protocol will lose its connection once the pending
+        data has been delivered.
+    :ivar bool _received_all: Whether ``VolumeService.receive`` has
+        finished.
+    :ivar _result: The result of ``VolumeService.receive`` once it has
+        finished.
+    """
+    def __init__(self, volume_service, node_id, name, codec,
+                 resume_token=None):
+        """
+        :param VolumeService volume_service: The service to receive the
+            volume.
+        :param unicode node_id: The volume's owner's node ID.
+        :param VolumeName name: The volume's name.
+        :param Codec codec: The codec the data is compressed with.
+        :param resume_token: The resume token of the interrupted transfer
+            the data resumes, or ``None``.
+
+        :raises ValueError: If the volume is owned by ``volume_service``.
+        """
+        self._decompressor = codec.decompressor()
+        self._protocol = None
+        self._pending = []
+        self._paused = False
+        self._delivering = False
+        self._discarding = False
+        self._end = None
+        self._lost = False
+        self._received_all = False
+        self._result = None
+        self._waiting = []
+        receiving = volume_service.receive(node_id, name, self, resume_token)
+        receiving.addBoth(self._received)
+
+    def connect(self, factory):
+        self._protocol = factory.buildProtocol(None)
+        self._protocol.makeConnection(self)
+        self._deliver()
+        return succeed(self._protocol)
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._deliver()
+
+    def stopProducing(self):
+        self.loseConnection()
+
+    def loseConnection(self):
+        """
+        The volume can't be updated, so stop delivering data.  Pending
+        writes fail once ``VolumeService.receive`` has failed.
+        """
+        self._discarding = True
+        if self._end is None:
+            self._end = Failure(ConnectionLost())
+        self._deliver()
+
+    def write(self, data):
+        """
+        Deliver more data to the connected protocol.
+
+        :param bytes data: The compressed data.
+
+        :return: ``Deferred`` firing once the data has been delivered, which
+            waits while the protocol has paused the transport, or failing
+            if the volume can't be received or the data can't be
+            decompressed.
+        """
+        if self._received_all:
+            return self._copy_result()
+        try:
+            data = self._decompressor.decompress(data)
+        except Exception:
+            failure = Failure()
+            self.abort()
+            return fail(failure)
+        writing = Deferred()
+        self._pending.append((data, writing))
+        self._deliver()
+        return writing
+
+    def end(self):
+        """
+        All of the data has been written.
+
+        :return: ``Deferred`` firing with the result of
+            ``VolumeService.receive``, or failing if the end of the data
+            can't be decompressed.
+        """
+        if self._end is None and not self._received_all:
+            try:
+                data = self._decompressor.flush()
+            except Exception:
+                failure = Failure()
+                self.abort()
+                return fail(failure)
+            if data:
+                # Only the result of receiving the volume is waited for,
+                # not the delivery of the end of its data:
+                delivering = Deferred()
+                delivering.addErrback(lambda _: None)
+                self._pending.append((data, delivering))
+            self._end = Failure(ConnectionDone())
+        self._deliver()
+        return self._when_received()
+
+    def abort(self):
+        """
+        Stop receiving, discarding any data not delivered yet.
+        """
+        pending, self._pending = self._pending, []
+        if self._end is None:
+            self._end = Failure(ConnectionLost())
+        self._deliver()
+        for data, writing in pending:
+            writing.callback(None)
+
+    def _deliver(self):
+        """
+        Deliver pending data until there is none or the protocol pauses,
+        then tell the protocol its connection was lost if no more data is
+        coming.
+        """
+        if self._protocol is None or self._delivering or self._lost:
+            return
+        self._delivering = True
+        try:
+            while (self._pending and not self._paused and
+                   not self._discarding):
+                data, writing = self._pending.pop(0)
+                self._protocol.dataReceived(data)
+                writing.callback(None)
+            if self._end is not None and (
+                    self._discarding or not self._pending):
+                self._lost = True
+                self._protocol.connectionLost(self._end)
+        finally:
+            self._delivering = False
+
+    def _received(self, result):
+        """
+        ``VolumeService.receive`` has finished: fail any data which will
+        now never be delivered, and tell anyone waiting.
+        """
+        self._received_all = True
+        self._result = result
+        pending, self._pending = self._pending, []
+        for data, writing in pending:
+            if isinstance(result, Failure):
+                writing.errback(result)
+            else:
+                writing.callback(None)
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(result)
+
+    def _copy_result(self):
+        """
+        :return: ``Deferred`` which has the result of
+            ``VolumeService.receive``.
+        """
+        if isinstance(self._result, Failure):
+            return fail(self._result)
+        return succeed(self._result)
+
+    def _when_received(self):
+        """
+        :return: ``Deferred`` firing with the result of
+            ``VolumeService.receive``.
+        """
+        if self._received_all:
+            return self._copy_result()
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+
+class _VolumeAgentLocator(CommandLocator):
+    """
+    Volume agent side of the protocol.
+
+    :ivar dict _receiving: Map the IDs of transfers being received to their
+        ``_ReceivedStream``.
+    """
+    def __init__(self, volume_service):
+        """
+        :param VolumeService volume_service: The volume manager to serve
+            requests for.
+        """
+        CommandLocator.__init__(self)
+        self._volume_service = volume_service
+        self._receiving = {}
+
+    def _stream(self, transfer_id):
+        """
+        :return: The ``_ReceivedStream`` of the given transfer.
+
+        :raises UnknownTransfer: If there is no such transfer.
+        """
+        try:
+            return self._receiving[transfer_id]
+        except KeyError:
+            raise UnknownTransfer(transfer_id)
+
+    @SnapshotsCommand.responder
+    def snapshots(self, node_id, name):
+        # Snapshots may have been changed by other processes since the last
+        # request:
+        self._volume_service.pool.invalidate()
+        volume = Volume(node_id=node_id, name=name,
+                        service=self._volume_service)
+        d = volume.get_filesystem().snapshots()
+        d.addCallback(lambda snapshots: {
+            "snapshots": [snapshot.name for snapshot in snapshots]})
+        return d
+
+    @ReceiveCommand.responder
+    def receive(self, transfer_id, node_id, name, codecs, resume_token):
+        codec = negotiate_codec(codecs)
+        self._receiving[transfer_id] = _ReceivedStream(
+            self._volume_service, node_id, name, codec, resume_token)
+        return {"codec": codec.name}
+
+    @ReceiveDataCommand.responder
+    def receive_data(self, transfer_id, data):
+        d = self._stream(transfer_id).write(data)
+        d.addCallback(lambda _: {})
+        return d
+
+    @ReceiveEndCommand.responder
+    def receive_end(self, transfer_id):
+        d = self._stream(transfer_id).end()
+        del self._receiving[transfer_id]
+        d.addCallback(lambda _: {})
+        return d
+
+    @ReceiveAbortCommand.responder
+    def receive_abort(self, transfer_id):
+        self._stream(transfer_id).abort()
+        del self._receiving[transfer_id]
+        return {}
+
+    @StreamFeaturesCommand.responder
+    def stream_features(self):
+        d = self._volume_service.pool.stream_features()
+        d.addCallback(lambda features: {"features": sorted(features)})
+        return d
+
+    @ResumeTokenCommand.responder
+    def resume_token(self, node_id, name):
+        volume = Volume(node_id=node_id, name=name,
+                        service=self._volume_service)
+        d = volume.get_filesystem().resume_token()
+        d.addCallback(lambda token: {"resume_token": token})
+        return d
+
+    @AcquireCommand.responder
+    def acquire(self, node_id, name):
+        d = self._volume_service.acquire(node_id, name)
+        d.addCallback(lambda _: {"node_id": self._volume_service.node_id})
+        return d
+
+    @CloneToCommand.responder
+    def clone_to(self, node_id, name, clone_name):
+        parent = Volume(node_id=node_id, name=name,
+                        service=self._volume_service)
+        d = self._volume_service.clone_to(parent, clone_name)
+        d.addCallback(lambda _: {})
+        return d
+
+    def abort_all(self):
+        """
+        Stop receiving all the volumes being received.
+        """
+        receiving, self._receiving = self._receiving, {}
+        for stream in receiving.values():
+            stream.abort()
+
+
+class VolumeAgentAMP(AMP):
+    """
+    AMP protocol serving requests for a volume manager.
+
+    :ivar finished: ``Deferred`` firing when the connection is lost.
+    """
+    def __init__(self, volume_service):
+        """
+        :param VolumeService volume_service: The volume manager to serve
+            requests for.
+        """
+        self._locator = _VolumeAgentLocator(volume_service)
+        AMP.__init__(self, locator=self._locator)
+        self.finished = Deferred()
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self._locator.abort_all()
+        self.finished.callback(None)
+
+
+def serve_standard_io(reactor, volume_service):
+    """
+    Serve requests for a volume manager over standard input and output.
+
+    :param reactor: The reactor to use.
+    :param VolumeService volume_service: The volume manager to serve
+        requests for.
+
+    :return: ``Deferred`` firing when standard input is closed.
+    """
+    protocol = VolumeAgentAMP(volume_service)
+    StandardIO(protocol, reactor=reactor)
+    return protocol.finished
+
+
+class _AgentClientProtocol(BinaryBoxProtocol):
+    """
+    AMP protocol for sending requests to a volume agent.
+
+    ``AMP`` logs the addresses of its transport when connected, which the
+    transport of a process, as the volume agent usually is, doesn't have;
+    this protocol sends the same boxes without doing so.
+    """
+    def __init__(self, lost):
+        """
+        :param lost: Callable called with this protocol when its connection
+            is lost.
+        """
+        self._dispatcher = BoxDispatcher(CommandLocator())
+        BinaryBoxProtocol.__init__(self, self._dispatcher)
+        self._lost = lost
+
+    def callRemote(self, command, **kwargs):
+        """
+        See ``AMP.callRemote``.
+        """
+        return self._dispatcher.callRemote(command, **kwargs)
+
+    def connectionLost(self, reason):
+        BinaryBoxProtocol.connectionLost(self, reason)
+        self._lost(self)
+
+
+class _AgentConnection(object):
+    """
+    A connection to a volume agent, which is made when the first command is
+    sent and then used for all the following commands.  If it is lost, a
+    new one is made for the next command.
+
+    :ivar _protocol: The connected ``_AgentClientProtocol``, or ``None``.
+    :ivar list _connecting: ``Deferred``\ s to fire with the protocol once
+        connected.
+    :ivar list _disconnecting: ``Deferred``\ s to fire once the connection
+        is lost.
+    """
+    def __init__(self, endpoint):
+        """
+        :param IStreamClientEndpoint endpoint: Connects to the volume
+            agent.
+        """
+        self._endpoint = endpoint
+        self._protocol = None
+        self._connecting = []
+        self._disconnecting = []
+
+    def callRemote(self, command, **kwargs):
+        """
+        Send a command, connecting first if necessary.
+
+        See ``AMP.callRemote``.
+        """
+        d = self._connected()
+        d.addCallback(lambda protocol: protocol.callRemote(command, **kwargs))
+        return d
+
+    def disconnect(self):
+        """
+        Close the connection, if there is one.
+
+        :return: ``Deferred`` firing once it is closed.
+        """
+        if self._protocol is None:
+            return succeed(None)
+        d = Deferred()
+        self._disconnecting.append(d)
+        self._protocol.transport.loseConnection()
+        return d
+
+    def _connected(self):
+        """
+        :return: ``Deferred`` firing with the connected protocol.
+        """
+        if self._protocol is not None:
+            return succeed(self._protocol)
+        d = Deferred()
+        self._connecting.append(d)
+        if len(self._connecting) == 1:
+            connecting = connectProtocol(
+                self._endpoint, _AgentClientProtocol(self._disconnected))
+            connecting.addBoth(self._connect_finished)
+        return d
+
+    def _connect_finished(self, result):
+        """
+        Give the result of connecting to everyone waiting for it.
+        """
+        if not isinstance(result, Failure):
+            self._protocol = result
+        connecting, self._connecting = self._connecting, []
+        for d in connecting:
+            d.callback(result)
+
+    def _disconnected(self, protocol):
+        """
+        The connection was lost.
+        """
+        if self._protocol is protocol:
+            self._protocol = None
+        disconnecting, self._disconnecting = self._disconnecting, []
+        for d in disconnecting:
+            d.callback(None)
+
+
+class _ReceiveTransport(object):
+    """
+    The transport of a protocol connected to a ``_ReceiveEndpoint``, which
+    compresses the data written to it and sends it in
+    ``ReceiveDataCommand``\ s.
+
+    While more than ``_RECEIVE_WINDOW`` are unanswered the registered
+    producer is paused.  Once the volume has been updated the transfer's
+    ``CompressionStatistics`` are logged.
+
+    :ivar int _unanswered: The number of ``ReceiveDataCommand``\ s sent
+        without an answer.
+    :ivar bool _finished: Whether the protocol has lost its connection.
+    :ivar int _bytes: The number of bytes written.
+    :ivar int _compressed_bytes: The number of bytes sent.
+    """
+    def __init__(self, connection, transfer_id, protocol, codec, logger):
+        """
+        :param connection: The ``_AgentConnection`` to send commands with.
+        :param unicode transfer_id: The ID of the transfer.
+        :param IProtocol protocol: The connected protocol.
+        :param Codec codec: The codec to compress the data with.
+        :param eliot.Logger logger: The logger to report the transfer to.
+        """
+        self._connection = connection
+        self._transfer_id = transfer_id
+        self._protocol = protocol
+        self._codec = codec
+        self._compressor = codec.compressor()
+        self._logger = logger
+        self._unanswered = 0
+        self._producer = None
+        self._paused = False
+        self._finished = False
+        self._bytes = 0
+        self._compressed_bytes = 0
+        self._start = default_timer()
+
+    def write(self, data):
+        if self._finished:
+            return
+        self._bytes += len(data)
+        self._send(self._compressor.compress(data))
+
+    def _send(self, data):
+        """
+        Send compressed data, pausing the producer if too much of it is
+        unanswered.
+
+        :param bytes data: The data.
+        """
+        self._compressed_bytes += len(data)
+        for offset in range(0, len(data), MAX_VALUE_LENGTH):
+            self._unanswered += 1
+            sending = self._connection.callRemote(
+                ReceiveDataCommand, transfer_id=self._transfer_id,
+                data=data[offset:offset + MAX_VALUE_LENGTH])
+            sending.addCallbacks(self._answered, self._finish)
+        if (self._unanswered > _RECEIVE_WINDOW and
+                self._producer is not None and not self._paused):
+            self._paused = True
+            self._producer.pauseProducing()
+
+    def writeSequence(self, data):
+        self.write(b"".join(data))
+
+    def registerProducer(self, producer, streaming):
+        self._producer = producer
+
+    def unregisterProducer(self):
+        self._producer = None
+        self._paused = False
+
+    def closeStdin(self):
+        """
+        All the data has been written; the connection is lost once the
+        volume has been updated.
+        """
+        if self._finished:
+            return
+        self._send(self._compressor.flush())
+        ending = self._connection.callRemote(
+            ReceiveEndCommand, transfer_id=self._transfer_id)
+        ending.addCallbacks(self._ended, self._finish)
+
+    def loseConnection(self):
+        """
+        Stop sending data, leaving the volume as it was.
+        """
+        if self._finished:
+            return
+        aborting = self._connection.callRemote(
+            ReceiveAbortCommand, transfer_id=self._transfer_id)
+        aborting.addBoth(lambda _: self._finish(Failure(ConnectionLost())))
+
+    def _answered(self, result):
+        """
+        A ``ReceiveDataCommand`` was answered; resume the producer if few
+        enough are still unanswered.
+        """
+        self._unanswered -= 1
+        if self._paused and self._unanswered <= _RECEIVE_WINDOW // 2:
+            self._paused = False
+            self._producer.resumeProducing()
+
+    def _ended(self, result):
+        """
+        The volume was updated; report the transfer and tell the protocol.
+        """
+        if self._finished:
+            return
+        log_compressed_transfer(CompressionStatistics(
+            codec=self._codec.name, bytes=self._bytes,
+            compressed_bytes=self._compressed_bytes,
+            seconds=default_timer() - self._start), self._logger)
+        self._finish(Failure(ConnectionDone()))
+
+    def _finish(self, reason):
+        """
+        Tell the protocol its connection was lost, the first time this is
+        called.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._protocol.connectionLost(reason)
+
+
+@implementer(IStreamClientEndpoint)
+class _ReceiveEndpoint(object):
+    """
+    An endpoint which sends the data written to it to a volume agent to
+    update a volume, compressed with a codec both ends can use.
+    """
+    def __init__(self, connection, volume, logger, codecs=CODECS,
+                 resume_token=None):
+        """
+        :param connection: The ``_AgentConnection`` to send commands with.
+        :param Volume volume: The volume to update.
+        :param eliot.Logger logger: The logger to report transfers to.
+        :param list codecs: The ``Codec``\ s to offer, most preferred
+            first.
+        :param resume_token: The resume token of the interrupted transfer
+            the data resumes, or ``None``.
+        """
+        self._connection = connection
+        self._volume = volume
+        self._logger = logger
+        self._codecs = codecs
+        self._resume_token = resume_token
+
+    def connect(self, factory):
+        transfer_id = unicode(uuid4())
+        d = self._connection.callRemote(
+            ReceiveCommand, transfer_id=transfer_id,
+            node_id=self._volume.node_id, name=self._volume.name,
+            codecs=[codec.name for codec in self._codecs],
+            resume_token=self._resume_token)
+
+        def started(result):
+            codec = negotiate_codec([result["codec"]], self._codecs)
+            protocol = factory.buildProtocol(None)
+            protocol.makeConnection(_ReceiveTransport(
+                self._connection, transfer_id, protocol, codec,
+                self._logger))
+            return protocol
+        d.addCallback(started)
+        return d
+
+
+@implementer(IRemoteVolumeManager)
+class AgentVolumeManager(object):
+    """
+    Communication with a volume agent: a long-running ``flocker-volume
+    serve`` process, which is sent all requests over one connection.
+    """
+    logger = Logger()
+
+    def __init__(self, connection):
+        """
+        :param connection: Sends AMP commands to the volume agent using its
+            ``callRemote`` method, like ``AMP.callRemote``.
+        """
+        self._connection = connection
+
+    @classmethod
+    def for_node(cls, reactor, destination,
+                 config_path=DEFAULT_CONFIG_PATH):
+        """
+        Create an ``AgentVolumeManager`` which runs ``flocker-volume
+        serve`` on the given node the first time it is used.
+
+        :param reactor: An ``IReactorProcess`` provider.
+        :param INode destination: The node to run the volume agent on.
+        :param FilePath config_path: Path to configuration file for the
+            remote ``flocker-volume``.
+
+        :return: An ``AgentVolumeManager``.
+        """
+        return cls(_AgentConnection(destination.endpoint(
+            reactor, [b"flocker-volume", b"--config", config_path.path,
+                      b"serve"])))
+
+    def disconnect(self):
+        """
+        Close the connection to the volume agent, which then exits.
+
+        :return: ``Deferred`` firing once the connection is closed.
+        """
+        return self._connection.disconnect()
+
+    def snapshots(self, volume):
+        d = self._connection.callRemote(
+            SnapshotsCommand, node_id=volume.node_id, name=volume.name)
+        d.addCallback(lambda result: [
+            Snapshot(name=name) for name in result["snapshots"]])
+        return d
+
+    def receive_endpoint(self, reactor, volume, resume_token=None):
+        return _ReceiveEndpoint(self._connection, volume, self.logger,
+                                resume_token=resume_token)
+
+    def resume_token(self, volume):
+        d = self._connection.callRemote(
+            ResumeTokenCommand, node_id=volume.node_id, name=volume.name)
+        d.addCallback(lambda result: result["resume_token"])
+        return d
+
+    def stream_features(self):
+        d = self._connection.callRemote(StreamFeaturesCommand)
+        d.addCallback(lambda result: frozenset(result["features"]))
+        return d
+
+    def acquire(self, volume):
+        d = self._connection.callRemote(
+            AcquireCommand, node_id=volume.node_id, name=volume.name)
+        d.addCallback(lambda result: result["node_id"])
+        return d
+
+    def clone_to(self, parent, name):
+        d = self._connection.callRemote(
+            CloneToCommand, node_id=parent.node_id, name=parent.name,
+            clone_name=name)
+        d.addCallback(lambda _: None)
+        return d
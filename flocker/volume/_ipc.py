@@ -10,9 +10,6 @@ well-specified communication protocol between daemon processes using
 Twisted's event loop (https://clusterhq.atlassian.net/browse/FLOC-154).
 """
 
-from contextlib import contextmanager
-from io import BytesIO
-
 from characteristic import with_cmp
 
 from zope.interface import Interface, implementer
@@ -20,8 +17,9 @@ from zope.interface import Interface, implementer
 from twisted.internet.defer import succeed
 from twisted.python.filepath import FilePath
 
+from ..common import MemoryProcessEndpoint
 from ..common._ipc import ProcessNode
-from .service import DEFAULT_CONFIG_PATH
+from .service import DEFAULT_CONFIG_PATH, Volume
 from .filesystems.zfs import Snapshot
 
 
@@ -60,16 +58,44 @@ class IRemoteVolumeManager(Interface):
             ordered from oldest to newest.
         """
 
-    def receive(volume):
+    def receive_endpoint(reactor, volume, resume_token=None):
         """
-        Context manager that returns a file-like object to which a volume's
-        contents can be written.
+        Create an endpoint which updates the volume on the remote volume
+        manager with the data written to it, without blocking.
+
+        :param reactor: An ``IReactorProcess`` provider.
 
         :param Volume volume: The volume which will be pushed to the
             remote volume manager.
 
-        :return: A file-like object that can be written to, which will
-             update the volume on the remote volume manager.
+        :param resume_token: ``None`` if a new stream will be written, or
+            the ``resume_token`` of the volume if the written stream resumes
+            an interrupted one.
+
+        :return: An ``IStreamClientEndpoint`` provider, as returned by
+            ``IFilesystem.writer_endpoint``.
+        """
+
+    def resume_token(volume):
+        """
+        Find out how much of an interrupted stream of the volume was
+        received, if ``stream_features`` includes ``"resumable"``.
+
+        :param Volume volume: The volume being pushed to the remote volume
+            manager.
+
+        :return: A ``Deferred`` that fires with ``bytes`` to pass to
+            ``IFilesystem.reader_endpoint`` and ``receive_endpoint`` to
+            resume the stream, or ``None`` if there is none to resume.
+        """
+
+    def stream_features():
+        """
+        Find out which optional features of the streams written to
+        ``receive_endpoint`` the remote volume manager can receive.
+
+        :return: A ``Deferred`` that fires with a ``frozenset`` of ``bytes``,
+            as returned by ``IStoragePool.stream_features``.
         """
 
     def acquire(volume):
@@ -79,7 +105,8 @@ class IRemoteVolumeManager(Interface):
         :param Volume volume: The volume which will be acquired by the
             remote volume manager.
 
-        :return: The node ID of the remote volume manager (as ``unicode``).
+        :return: A ``Deferred`` that fires with the node ID of the remote
+            volume manager (as ``unicode``).
         """
 
     def clone_to(parent, name):
@@ -99,6 +126,9 @@ class IRemoteVolumeManager(Interface):
 class RemoteVolumeManager(object):
     """
     ``INode``\-based communication with a remote volume manager.
+
+    :ivar _stream_features: The stream features of the destination's
+        storage pool, or ``None`` if they haven't been asked for yet.
     """
 
     def __init__(self, destination, config_path=DEFAULT_CONFIG_PATH):
@@ -109,6 +139,7 @@ class RemoteVolumeManager(object):
         """
         self._destination = destination
         self._config_path = config_path
+        self._stream_features = None
 
     def snapshots(self, volume):
         """
@@ -128,20 +159,62 @@ class RemoteVolumeManager(object):
             in data.splitlines()
         ])
 
-    def receive(self, volume):
-        return self._destination.run([b"flocker-volume",
-                                      b"--config", self._config_path.path,
-                                      b"receive",
-                                      volume.node_id.encode(b"ascii"),
-                                      volume.name.to_bytes()])
+    def _receive_command(self, volume, resume_token=None):
+        """
+        :return: The ``flocker-volume receive`` command for the volume.
+        """
+        options = []
+        if resume_token is not None:
+            options = [b"--resume-token", resume_token]
+        return [b"flocker-volume",
+                b"--config", self._config_path.path,
+                b"receive"] + options + [
+                    volume.node_id.encode(b"ascii"),
+                    volume.name.to_bytes()]
+
+    def receive_endpoint(self, reactor, volume, resume_token=None):
+        """
+        Run ``flocker-volume receive`` on the destination, passing it the
+        resume token if the stream resumes an interrupted one.
+        """
+        return self._destination.endpoint(
+            reactor, self._receive_command(volume, resume_token))
+
+    def resume_token(self, volume):
+        """
+        Run ``flocker-volume resume_token`` on the destination.
+        """
+        data = self._destination.get_output(
+            [b"flocker-volume",
+             b"--config", self._config_path.path,
+             b"resume_token",
+             volume.node_id.encode("ascii"),
+             volume.name.to_bytes()]
+        )
+        return succeed(data.strip() or None)
+
+    def stream_features(self):
+        """
+        Run ``flocker-volume stream_features`` on the destination the first
+        time this is called.  The features of its storage pool don't change,
+        so they are remembered for later pushes.
+        """
+        if self._stream_features is None:
+            data = self._destination.get_output(
+                [b"flocker-volume",
+                 b"--config", self._config_path.path,
+                 b"stream_features"]
+            )
+            self._stream_features = frozenset(data.split())
+        return succeed(self._stream_features)
 
     def acquire(self, volume):
-        return self._destination.get_output(
+        return succeed(self._destination.get_output(
             [b"flocker-volume",
              b"--config", self._config_path.path,
              b"acquire",
              volume.node_id.encode(b"ascii"),
-             volume.name.to_bytes()]).decode("ascii")
+             volume.name.to_bytes()]).decode("ascii"))
 
     def clone_to(self, parent, name):
         return self._destination.get_output(
@@ -171,16 +244,23 @@ class LocalVolumeManager(object):
         """
         return volume.get_filesystem().snapshots()
 
-    @contextmanager
-    def receive(self, volume):
-        input_file = BytesIO()
-        yield input_file
-        input_file.seek(0, 0)
-        self._service.receive(volume.node_id, volume.name, input_file)
+    def receive_endpoint(self, reactor, volume, resume_token=None):
+        return MemoryProcessEndpoint(
+            process=lambda data: self._service.receive(
+                volume.node_id, volume.name,
+                MemoryProcessEndpoint(stdout=data), resume_token))
+
+    def resume_token(self, volume):
+        return Volume(node_id=volume.node_id, name=volume.name,
+                      service=self._service).get_filesystem().resume_token()
+
+    def stream_features(self):
+        return self._service.pool.stream_features()
 
     def acquire(self, volume):
-        self._service.acquire(volume.node_id, volume.name)
-        return self._service.node_id
+        d = self._service.acquire(volume.node_id, volume.name)
+        d.addCallback(lambda _: self._service.node_id)
+        return d
 
     def clone_to(self, parent, name):
         return self._service.clone_to(parent, name)
@@ -10,3 +10,10 @@ class MaximumSizeTooSmall(Exception):
     A maximum size was specified for a filesystem which is smaller than the
     smallest allowed value.
     """
+
+
+class UnresumableStream(Exception):
+    """
+    A stream can't be resumed from the given resume token, for example
+    because the data it was sending has changed or been destroyed.
+    """
@@ -88,6 +88,52 @@ class IFilesystem(Interface):
             read as ``bytes``.
         """
 
+    def reader_endpoint(remote_snapshots=None, stream_features=frozenset(),
+                        resume_token=None):
+        """
+        Create an endpoint which delivers the contents of the filesystem,
+        like :meth:`reader`, without blocking.
+
+        :param remote_snapshots: As for :meth:`reader`.
+
+        :param frozenset stream_features: Optional stream features, as
+            returned by ``IStoragePool.stream_features``, which both this
+            filesystem's pool and the writer's support and so may be used.
+
+        :param resume_token: ``None``, or the ``bytes`` returned by the
+            writer's :meth:`resume_token` to deliver only the rest of the
+            stream it was interrupted while receiving.
+
+        :raises UnresumableStream: If the stream can't be resumed from
+            ``resume_token``.
+
+        :return: An ``IStreamClientEndpoint`` provider.  The protocol
+            connected to it receives the data as it is read, and its
+            transport is an ``IPushProducer`` which can be paused.  The
+            connection is lost with ``ConnectionDone`` once all of the data
+            has been read successfully.
+        """
+
+    def writer_endpoint(resumable=False, resume_token=None):
+        """
+        Create an endpoint which writes new contents to the filesystem, like
+        :meth:`writer`, without blocking.
+
+        :param bool resumable: Whether to record how much of the stream was
+            received if it is interrupted, so that it can be resumed.  This
+            requires the ``"resumable"`` stream feature.
+
+        :param resume_token: ``None`` if a new stream will be written, in
+            which case the state of any interrupted stream is discarded, or
+            the :meth:`resume_token` the written stream resumes from.
+
+        :return: An ``IStreamClientEndpoint`` provider.  The protocol
+            connected to it writes data to its transport, which is an
+            ``IConsumer``, and calls ``closeStdin`` on it once all of the
+            data has been written.  The connection is lost with
+            ``ConnectionDone`` once the filesystem has been updated.
+        """
+
     def writer():
         """Context manager that allows writing new contents to the filesystem.
 
@@ -106,6 +152,15 @@ class IFilesystem(Interface):
             filesystem.
         """
 
+    def resume_token():
+        """
+        Find out how much of an interrupted resumable stream was received.
+
+        :return: A ``Deferred`` that fires with ``bytes`` to pass to the
+            reader's :meth:`reader_endpoint` to resume the stream, or with
+            ``None`` if there is no stream to resume.
+        """
+
     def __eq__(other):
         """True if and only if underlying OS filesystem is the same."""
 
@@ -204,3 +259,21 @@ class IStoragePool(Interface):
         :return: A ``Deferred`` that fires with a :class:`list` of
             :class:`IFilesystem` providers.
         """
+
+    def invalidate():
+        """
+        Discard anything this pool has cached about its filesystems, so
+        that changes made to them by other processes are seen.
+
+        The pool's own changes are seen without this.
+        """
+
+    def stream_features():
+        """
+        Find out which optional features this pool can both use in the
+        streams its filesystems' ``reader_endpoint``\ s deliver and receive
+        in the streams written to their ``writer_endpoint``\ s.
+
+        :return: A ``Deferred`` that fires with a ``frozenset`` of ``bytes``
+            naming the features.
+        """
@@ -6,6 +6,7 @@ from __future__ import absolute_import
 
 from errno import ENOENT
 from contextlib import contextmanager
+from hashlib import sha256
 from tarfile import TarFile
 from io import BytesIO
 
@@ -13,13 +14,18 @@ from zope.interface import implementer
 
 from characteristic import with_init, with_cmp, with_repr
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import succeed, fail, maybeDeferred
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.python.failure import Failure
 from twisted.application.service import Service
 
+from .errors import UnresumableStream
 from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
     FilesystemAlreadyExists)
 from .zfs import Snapshot
+from ...common import MemoryProcessEndpoint
 
 from .._model import VolumeSize
 
@@ -44,6 +50,79 @@ class CannedFilesystemSnapshots(object):
         return succeed(self._snapshots)
 
 
+def _resume_token(data):
+    """
+    :param bytes data: The part of a stream which was received.
+
+    :return: A resume token recording how much of the stream was received
+        and a digest of it, so the sender can check it is resuming the same
+        stream.
+    """
+    return b"%d:%s" % (len(data), sha256(data).hexdigest())
+
+
+class _AppendingTransport(object):
+    """
+    The transport of a protocol connected to an ``_AppendingEndpoint``.
+    """
+    def __init__(self, path, finish, protocol):
+        self._file = open(path.path, "ab")
+        self._finish = finish
+        self._protocol = protocol
+        self.producer = None
+
+    def write(self, data):
+        if not self._file.closed:
+            self._file.write(data)
+            self._file.flush()
+
+    def writeSequence(self, data):
+        self.write(b"".join(data))
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def closeStdin(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        finishing = maybeDeferred(self._finish)
+        finishing.addCallback(lambda ignored: Failure(ConnectionDone()))
+        finishing.addBoth(self._protocol.connectionLost)
+
+    def loseConnection(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        self._protocol.connectionLost(Failure(ConnectionLost()))
+
+
+@implementer(IStreamClientEndpoint)
+class _AppendingEndpoint(object):
+    """
+    Pretend to run a process which appends what is written to it to a file,
+    which is kept if the process is stopped before its stdin is closed.
+    """
+    def __init__(self, path, finish):
+        """
+        :param FilePath path: The file to append to.
+        :param finish: A no-argument callable called once stdin is closed.
+            The process exits when its result, which may be a
+            ``Deferred``, is available.
+        """
+        self._path = path
+        self._finish = finish
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(
+            _AppendingTransport(self._path, self._finish, protocol))
+        return succeed(protocol)
+
+
 @implementer(IFilesystem)
 @with_cmp(["path"])
 @with_repr(["path", "size"])
@@ -58,6 +137,9 @@ class DirectoryFilesystem(object):
     taken.  No other state related to snapshots is tracked (eg, the state of
     the directory at the time of those snapshots is not recorded).
 
+    Resumable writes are appended to a ``.partial`` file next to the
+    directory until they are complete, and resumed from its length.
+
     :ivar FilePath path: The directory where data for this "filesystem" is
         stored.
     """
@@ -125,6 +207,70 @@ class DirectoryFilesystem(object):
         result.seek(0, 0)
         yield result
 
+    def reader_endpoint(self, remote_snapshots=None,
+                        stream_features=frozenset(), resume_token=None):
+        """
+        Pretend to run a process which writes the tarball ``reader`` does,
+        or the rest of it after the offset in the resume token.
+
+        The tarball is created again to resume it, so it can only be resumed
+        if the directory hasn't changed.
+        """
+        with self.reader(remote_snapshots) as reader:
+            data = reader.read()
+        if resume_token is not None:
+            offset, _, _ = resume_token.partition(b":")
+            try:
+                offset = int(offset)
+            except ValueError:
+                raise UnresumableStream(resume_token)
+            if _resume_token(data[:offset]) != resume_token:
+                raise UnresumableStream(resume_token)
+            data = data[offset:]
+        return MemoryProcessEndpoint(stdout=data)
+
+    def _partial(self):
+        """
+        :return: The ``FilePath`` of the part of a resumable write received
+            so far.
+        """
+        return self.path.siblingExtension(b".partial")
+
+    def resume_token(self):
+        partial = self._partial()
+        if not partial.exists():
+            return succeed(None)
+        return succeed(_resume_token(partial.getContent()))
+
+    def writer_endpoint(self, resumable=False, resume_token=None):
+        """
+        Pretend to run a process which gives what is written to it to
+        ``writer``.
+
+        If the write is resumable the data is kept in a file until it has
+        all been written, so that it can be resumed if it is interrupted.
+        """
+        partial = self._partial()
+        if resume_token is None:
+            if partial.exists():
+                partial.remove()
+        elif (not partial.exists() or
+              _resume_token(partial.getContent()) != resume_token):
+            raise UnresumableStream(resume_token)
+
+        def write(data):
+            with self.writer() as writer:
+                writer.write(data)
+
+        if not resumable and resume_token is None:
+            return MemoryProcessEndpoint(process=write)
+
+        def finish():
+            data = partial.getContent()
+            partial.remove()
+            write(data)
+        return _AppendingEndpoint(partial, finish)
+
     @contextmanager
     def writer(self):
         """Expect written bytes to be a tarball."""
@@ -221,6 +367,9 @@ class FilesystemStoragePool(Service):
         filesystems = set()
         if self._root.isdir():
             for path in self._root.children():
+                if not path.isdir():
+                    # The data of an interrupted resumable write:
+                    continue
                 if path.child(b".size").exists():
                     maximum_size = int(
                         path.child(b".size").getContent().decode("ascii"))
@@ -233,3 +382,15 @@ class FilesystemStoragePool(Service):
                     )
                 )
         return succeed(filesystems)
+
+    def invalidate(self):
+        """
+        Nothing is cached, the directories are listed every time.
+        """
+
+    def stream_features(self):
+        """
+        The tarballs ``DirectoryFilesystem`` writes have no optional
+        features, but can be resumed.
+        """
+        return succeed(frozenset([b"resumable"]))
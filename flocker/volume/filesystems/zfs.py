@@ -7,6 +7,7 @@ ZFS APIs.
 from __future__ import absolute_import
 
 import os
+import re
 from contextlib import contextmanager
 from uuid import uuid4
 from subprocess import (
@@ -23,16 +24,20 @@ from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
 from twisted.internet.protocol import Protocol
-from twisted.internet.defer import Deferred, succeed, gatherResults
+from twisted.internet.defer import (
+    Deferred, succeed, gatherResults, maybeDeferred,
+    )
 from twisted.internet.error import ConnectionDone, ProcessTerminated
+from twisted.internet.utils import getProcessOutputAndValue
 from twisted.application.service import Service
 
-from .errors import MaximumSizeTooSmall
+from .errors import MaximumSizeTooSmall, UnresumableStream
 from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
     FilesystemAlreadyExists)
 
 from .._model import VolumeSize
+from ...common import CommandEndpoint, ICommandEndpoint
 
 
 def random_name():
@@ -51,6 +56,113 @@ class BadArguments(Exception):
     """The ``zfs`` command was called with incorrect arguments."""
 
 
+class _FinishingProtocol(Protocol):
+    """
+    Wrap a protocol connected to a process so that, if the process exits
+    successfully, the protocol isn't told until some further work is done.
+    """
+    def __init__(self, wrapped, finish, exited=lambda: None):
+        """
+        :param IProtocol wrapped: The protocol to wrap.
+        :param finish: A no-argument callable which does the further work,
+            returning a ``Deferred`` if it isn't done immediately.
+        :param exited: A no-argument callable called as soon as the process
+            exits, whether or not it succeeded.
+        """
+        self._wrapped = wrapped
+        self._finish = finish
+        self._exited = exited
+
+    def makeConnection(self, transport):
+        Protocol.makeConnection(self, transport)
+        self._wrapped.makeConnection(transport)
+
+    def dataReceived(self, data):
+        self._wrapped.dataReceived(data)
+
+    def connectionLost(self, reason):
+        self._exited()
+        if not reason.check(ConnectionDone):
+            self._wrapped.connectionLost(reason)
+            return
+        finishing = maybeDeferred(self._finish)
+        finishing.addCallback(lambda ignored: reason)
+        finishing.addBoth(self._wrapped.connectionLost)
+
+
+@implementer(ICommandEndpoint)
+class _FinishingEndpoint(object):
+    """
+    An endpoint which connects protocols using ``_FinishingProtocol``, and
+    likewise finishes after spawning the process.
+    """
+    def __init__(self, endpoint, finish, exited=lambda: None):
+        """
+        :param ICommandEndpoint endpoint: The endpoint running the process.
+        :param finish: See ``_FinishingProtocol``.
+        :param exited: See ``_FinishingProtocol``.
+        """
+        self._endpoint = endpoint
+        self._finish = finish
+        self._exited = exited
+
+    def connect(self, factory):
+        connecting = connectProtocol(
+            self._endpoint,
+            _FinishingProtocol(factory.buildProtocol(None), self._finish,
+                               self._exited))
+        connecting.addCallback(lambda protocol: protocol._wrapped)
+        return connecting
+
+    def spawn(self, stdin=None, stdout=None):
+        spawning = self._endpoint.spawn(stdin=stdin, stdout=stdout)
+
+        def exited(result):
+            self._exited()
+            return result
+        spawning.addBoth(exited)
+        spawning.addCallback(lambda ignored: self._finish())
+        return spawning
+
+
+@implementer(ICommandEndpoint)
+class _PreparingEndpoint(object):
+    """
+    An endpoint which runs a command whose arguments are only known once
+    some work, such as running other commands, is done.
+    """
+    def __init__(self, reactor, prepare):
+        """
+        :param reactor: An ``IReactorProcess`` provider.
+        :param prepare: A no-argument callable which does the work,
+            returning a ``Deferred`` that fires with the ``list`` of
+            ``bytes`` giving the command to run.
+        """
+        self._reactor = reactor
+        self._prepare = prepare
+
+    def _endpoint(self):
+        """
+        :return: ``Deferred`` firing with a ``CommandEndpoint`` running the
+            prepared command.
+        """
+        d = self._prepare()
+        d.addCallback(lambda arguments: CommandEndpoint(
+            self._reactor, arguments, os.environ))
+        return d
+
+    def connect(self, factory):
+        d = self._endpoint()
+        d.addCallback(lambda endpoint: endpoint.connect(factory))
+        return d
+
+    def spawn(self, stdin=None, stdout=None):
+        d = self._endpoint()
+        d.addCallback(lambda endpoint: endpoint.spawn(
+            stdin=stdin, stdout=stdout))
+        return d
+
+
 class _AccumulatingProtocol(Protocol):
     """
     Accumulate all received bytes.
@@ -179,7 +291,7 @@ class Filesystem(object):
     implementation over time.
     """
     def __init__(self, pool, dataset, mountpoint=None, size=None,
-                 reactor=None):
+                 reactor=None, inventory=None):
         """
         :param pool: The filesystem's pool name, e.g. ``b"hpool"``.
 
@@ -190,6 +302,10 @@ class Filesystem(object):
             filesystem is mounted.
 
         :param VolumeSize size: The capacity information for this filesystem.
+
+        :param _Inventory inventory: The inventory of the pool, shared by the
+            filesystems of a ``StoragePool``, or ``None`` to list this
+            filesystem's snapshots on their own.
         """
         self.pool = pool
         self.dataset = dataset
@@ -198,6 +314,21 @@ class Filesystem(object):
         if reactor is None:
             from twisted.internet import reactor
         self._reactor = reactor
+        self._inventory = inventory
+
+    def _changed(self, result=None):
+        """
+        Invalidate the inventory, if there is one, because this filesystem
+        has changed.
+
+        :param result: Passed through, so this can be added to a
+            ``Deferred`` using ``addBoth``.
+
+        :return: ``result``
+        """
+        if self._inventory is not None:
+            self._inventory.invalidate()
+        return result
 
     def _exists(self):
         """
@@ -213,14 +344,20 @@ class Filesystem(object):
         return True
 
     def snapshots(self):
-        if self._exists():
-            zfs_snapshots = ZFSSnapshots(self._reactor, self)
-            d = zfs_snapshots.list()
-            d.addCallback(lambda snapshots:
-                          [Snapshot(name=name)
-                           for name in snapshots])
-            return d
-        return succeed([])
+        if self._inventory is None:
+            if self._exists():
+                zfs_snapshots = ZFSSnapshots(self._reactor, self)
+                d = zfs_snapshots.list()
+                d.addCallback(lambda snapshots:
+                              [Snapshot(name=name)
+                               for name in snapshots])
+                return d
+            return succeed([])
+        d = self._inventory.listing()
+        d.addCallback(lambda listing:
+                      [Snapshot(name=name)
+                       for name in listing.snapshots.get(self.name, [])])
+        return d
 
     @property
     def name(self):
@@ -232,50 +369,76 @@ class Filesystem(object):
     def get_path(self):
         return self._mountpoint
 
-    @contextmanager
-    def reader(self, remote_snapshots=None):
+    def _send_arguments(self, snapshot, local_snapshots, remote_snapshots):
         """
-        Send zfs stream of contents.
+        Determine what to send to bring a writer with the given snapshots up
+        to date with a newly taken snapshot.
 
+        :param bytes snapshot: The full name of the new snapshot.
+        :param list local_snapshots: ``Snapshot`` instances, ordered from
+            oldest to newest, of this filesystem.
         :param list remote_snapshots: ``Snapshot`` instances, ordered from
-            oldest to newest, which are available on the writer.  The reader
-            may generate a partial stream which relies on one of these
-            snapshots in order to minimize the data to be transferred.
-        """
-        # The existing snapshot code uses Twisted, so we're not using it
-        # in this iteration.  What's worse, though, is that it's not clear
-        # if the current snapshot naming scheme makes any sense, and
-        # moreover it violates abstraction boundaries. So as first pass
-        # I'm just using UUIDs, and hopefully requirements will become
-        # clearer as we iterate.
-        snapshot = b"%s@%s" % (self.name, uuid4())
-        check_call([b"zfs", b"snapshot", snapshot])
-
-        # Determine whether there is a shared snapshot which can be used as the
-        # basis for an incremental send.
-        local_snapshots = list(
-            Snapshot(name=name) for name in
-            _parse_snapshots(
-                check_output([b"zfs"] + _list_snapshots_command(self)),
-                self
-            ))
+            oldest to newest, which are available on the writer, or
+            ``None``.
 
+        :return: A ``list`` of ``bytes`` giving the arguments for
+            ``zfs send``.
+        """
         if remote_snapshots is None:
             remote_snapshots = []
 
+        # Determine whether there is a shared snapshot which can be used as the
+        # basis for an incremental send.
         latest_common_snapshot = _latest_common_snapshot(
             remote_snapshots, local_snapshots)
 
         if latest_common_snapshot is None:
-            identifier = [snapshot]
+            return [snapshot]
         else:
-            identifier = [
+            return [
                 b"-i",
                 u"{}@{}".format(
                     self.name, latest_common_snapshot.name).encode("ascii"),
                 snapshot,
             ]
 
+    def _new_snapshot_name(self):
+        """
+        :return: The full name, as ``bytes``, for a new snapshot of this
+            filesystem to send.
+        """
+        # The existing snapshot code uses Twisted, so we're not using it
+        # in this iteration.  What's worse, though, is that it's not clear
+        # if the current snapshot naming scheme makes any sense, and
+        # moreover it violates abstraction boundaries. So as first pass
+        # I'm just using UUIDs, and hopefully requirements will become
+        # clearer as we iterate.
+        return b"%s@%s" % (self.name, uuid4())
+
+    @contextmanager
+    def reader(self, remote_snapshots=None):
+        """
+        Send zfs stream of contents.
+
+        :param list remote_snapshots: ``Snapshot`` instances, ordered from
+            oldest to newest, which are available on the writer.  The reader
+            may generate a partial stream which relies on one of these
+            snapshots in order to minimize the data to be transferred.
+        """
+        snapshot = self._new_snapshot_name()
+        check_call([b"zfs", b"snapshot", snapshot])
+        self._changed()
+        # This method is synchronous, so it can't wait for the inventory to
+        # list the pool again; list just this filesystem's snapshots
+        # instead.
+        local_snapshots = list(
+            Snapshot(name=name) for name in
+            _parse_snapshots(
+                check_output([b"zfs"] + _list_snapshots_command(self)),
+                self
+            ))
+        identifier = self._send_arguments(
+            snapshot, local_snapshots, remote_snapshots)
         process = Popen([b"zfs", b"send"] + identifier, stdout=PIPE)
         try:
             yield process.stdout
@@ -283,11 +446,87 @@ class Filesystem(object):
             process.stdout.close()
             process.wait()
 
-    @contextmanager
-    def writer(self):
+    def _snapshot_for_send(self, remote_snapshots, stream_features):
         """
-        Read in zfs stream.
+        Take a snapshot and determine the ``zfs send`` command which brings
+        a writer with the given snapshots up to date with it, without
+        blocking.
+
+        :see: ``IFilesystem.reader_endpoint`` for parameter documentation.
+
+        :return: ``Deferred`` firing with the ``list`` of ``bytes`` giving
+            the command.
         """
+        snapshot = self._new_snapshot_name()
+        d = zfs_command(self._reactor, [b"snapshot", snapshot])
+        d.addBoth(self._changed)
+        if self._inventory is None:
+            d.addCallback(lambda _: _list_snapshots(self._reactor, self))
+            d.addCallback(lambda names: [Snapshot(name=name)
+                                         for name in names])
+        else:
+            # The new snapshot invalidated the inventory, so this lists the
+            # pool again; other filesystems share the result:
+            d.addCallback(lambda _: self.snapshots())
+        d.addCallback(
+            lambda local_snapshots: [b"zfs", b"send"] +
+            _send_options(stream_features) +
+            self._send_arguments(snapshot, local_snapshots, remote_snapshots))
+        return d
+
+    def reader_endpoint(self, remote_snapshots=None,
+                        stream_features=frozenset(), resume_token=None):
+        """
+        Run ``zfs send`` when connected to, with the options which produce
+        the given stream features, or ``zfs send -t`` to resume a stream.
+
+        The snapshot to send is taken, and the snapshots it may be based on
+        are listed, when the endpoint is connected to.  A resume token is
+        checked synchronously.
+
+        :see: ``IFilesystem.reader_endpoint`` for parameter documentation.
+        """
+        if resume_token is not None:
+            # The token says which snapshot was being sent, with which
+            # options, and how much was received; a dry run checks that
+            # snapshot still exists:
+            try:
+                check_output([b"zfs", b"send", b"-n", b"-t", resume_token],
+                             stderr=STDOUT)
+            except CalledProcessError:
+                raise UnresumableStream(resume_token)
+            return CommandEndpoint(
+                self._reactor, [b"zfs", b"send", b"-t", resume_token],
+                os.environ)
+        return _PreparingEndpoint(
+            self._reactor,
+            lambda: self._snapshot_for_send(remote_snapshots, stream_features))
+
+    def _receive_arguments(self, resumable=False, resume_token=None):
+        """
+        :param bool resumable: Whether ``zfs receive`` should keep what it
+            received if it is interrupted.
+        :param resume_token: The resume token the stream resumes from, or
+            ``None``.
+
+        :return: A ``list`` of ``bytes`` giving the ``zfs receive`` command
+            which writes a stream to this filesystem.
+        """
+        if resume_token is not None:
+            # ZFS kept the partially received data and adds the rest of the
+            # stream to it:
+            return [b"zfs", b"receive", b"-s", self.name]
+        options = []
+        if resumable:
+            options = [b"-s"]
+            # ``zfs receive`` refuses to write a new stream while the data
+            # of an interrupted one is kept, so throw that away.  This fails
+            # if there is none:
+            try:
+                check_output([b"zfs", b"receive", b"-A", self.name],
+                             stderr=STDOUT)
+            except CalledProcessError:
+                pass
         if self._exists():
             # If the filesystem already exists then this should be an
             # incremental data stream to up date it to a more recent snapshot.
@@ -308,18 +547,69 @@ class Filesystem(object):
             # it in order to receive the stream.  To do that you have to
             # force.
             #
-            cmd = [b"zfs", b"receive", b"-F", self.name]
+            return [b"zfs", b"receive"] + options + [b"-F", self.name]
         else:
             # If the filesystem doesn't already exist then this is a complete
             # data stream.
-            cmd = [b"zfs", b"receive", self.name]
-        process = Popen(cmd, stdin=PIPE)
+            return [b"zfs", b"receive"] + options + [self.name]
+
+    def writer_endpoint(self, resumable=False, resume_token=None):
+        """
+        Run ``zfs receive`` when connected to, setting the mountpoint once it
+        has succeeded.  A resumable stream is received with ``zfs receive
+        -s``.
+        """
+        endpoint = CommandEndpoint(
+            self._reactor, self._receive_arguments(resumable, resume_token),
+            os.environ)
+
+        def finish():
+            d = zfs_command(
+                self._reactor,
+                [b"set", b"mountpoint=" + self._mountpoint.path, self.name])
+            d.addBoth(self._changed)
+            return d
+        # A failed or interrupted receive may still have changed the
+        # filesystem, e.g. ``zfs receive -s`` keeps what it received:
+        return _FinishingEndpoint(endpoint, finish, self._changed)
+
+    def resume_token(self):
+        """
+        Get the ``receive_resume_token`` property which ``zfs receive -s``
+        sets when it is interrupted.
+        """
+        d = zfs_command(
+            self._reactor,
+            [b"get", b"-H", b"-o", b"value", b"receive_resume_token",
+             self.name])
+
+        def got_token(output):
+            token = output.strip()
+            if token in (b"", b"-"):
+                return None
+            return token
+
+        def failed(reason):
+            # The filesystem doesn't exist, or this version of ZFS can't
+            # resume streams:
+            reason.trap(CommandFailed, BadArguments)
+            return None
+        d.addCallbacks(got_token, failed)
+        return d
+
+    @contextmanager
+    def writer(self):
+        """
+        Read in zfs stream.
+        """
+        process = Popen(self._receive_arguments(), stdin=PIPE)
         succeeded = False
         try:
             yield process.stdin
         finally:
             process.stdin.close()
             succeeded = not process.wait()
+            self._changed()
         if succeeded:
             check_call([b"zfs", b"set",
                         b"mountpoint=" + self._mountpoint.path,
@@ -337,6 +627,7 @@ class ZFSSnapshots(object):
     def create(self, name):
         encoded_name = b"%s@%s" % (self._filesystem.name, name)
         d = zfs_command(self._reactor, [b"snapshot", encoded_name])
+        d.addBoth(self._filesystem._changed)
         d.addCallback(lambda _: None)
         return d
 
@@ -431,6 +722,58 @@ def volume_to_dataset(volume):
                        volume.name.to_bytes())
 
 
+# Optional features of ``zfs send`` streams, the ``zfs send`` option which
+# uses each one and the pool feature needed to receive it.  Large blocks and
+# embedded data are otherwise rewritten into a form any pool can receive, and
+# compressed blocks are otherwise decompressed to be sent:
+_STREAM_FEATURES = [
+    (b"large_blocks", b"L", b"feature@large_blocks"),
+    (b"embedded_data", b"e", b"feature@embedded_data"),
+    (b"compressed", b"c", b"feature@lz4_compress"),
+]
+
+
+def _send_options(stream_features):
+    """
+    :param stream_features: The names of the stream features to use.
+
+    :return: A ``list`` of ``bytes`` giving the ``zfs send`` options which
+        use them.
+    """
+    return [b"-" + option for name, option, _ in _STREAM_FEATURES
+            if name in stream_features]
+
+
+def _parse_stream_features(usage, properties):
+    """
+    Determine which stream features can be used.  As well as those in
+    ``_STREAM_FEATURES``, streams are ``"resumable"`` if ``zfs send -t``
+    is supported and the pool can keep partially received data.
+
+    :param bytes usage: The usage message of ``zfs send``, which lists the
+        options the installed ZFS supports.
+    :param bytes properties: The output of ``zpool get -H -o
+        property,value all`` for the pool.
+
+    :return: A ``frozenset`` of the names of the features supported by
+        both.
+    """
+    match = re.search(br"send \[-([A-Za-z]+)\]", usage)
+    options = match.group(1) if match else b""
+    enabled = set()
+    for line in properties.splitlines():
+        fields = line.split(b"\t")
+        if len(fields) == 2 and fields[1] in (b"enabled", b"active"):
+            enabled.add(fields[0])
+    features = set(
+        name for name, option, pool_feature in _STREAM_FEATURES
+        if option in options and pool_feature in enabled)
+    if (re.search(br"send \[-[A-Za-z]+\] -t ", usage) and
+            b"feature@extensible_dataset" in enabled):
+        features.add(b"resumable")
+    return frozenset(features)
+
+
 @implementer(IStoragePool)
 @with_repr(["_name"])
 @with_cmp(["_name", "_mount_root"])
@@ -456,6 +799,8 @@ class StoragePool(Service):
         self._reactor = reactor
         self._name = name
         self._mount_root = mount_root
+        self._stream_features = None
+        self._inventory = _Inventory(reactor, name)
 
     def startService(self):
         """
@@ -510,6 +855,7 @@ class StoragePool(Service):
             ])
         d = zfs_command(self._reactor,
                         [b"create"] + properties + [filesystem.name])
+        d.addBoth(self._inventory.changed)
         d.addErrback(self._check_for_out_of_space)
         d.addCallback(lambda _: filesystem)
         return d
@@ -528,6 +874,7 @@ class StoragePool(Service):
         d.addCallback(got_snapshots)
         d.addCallback(lambda _: zfs_command(
             self._reactor, [b"destroy", filesystem.name]))
+        d.addBoth(self._inventory.changed)
         return d
 
     def set_maximum_size(self, volume):
@@ -542,6 +889,7 @@ class StoragePool(Service):
             properties.extend([u"refquota=none"])
         d = zfs_command(self._reactor,
                         [b"set"] + properties + [filesystem.name])
+        d.addBoth(self._inventory.changed)
         d.addErrback(self._check_for_out_of_space)
         d.addCallback(lambda _: filesystem)
         return d
@@ -617,27 +965,63 @@ class StoragePool(Service):
                                 new_filesystem.name]))
             return result
         result.addCallback(exists)
+        result.addBoth(self._inventory.changed)
 
     def get(self, volume):
         dataset = volume_to_dataset(volume)
         mount_path = self._mount_root.child(dataset)
         return Filesystem(
-            self._name, dataset, mount_path, volume.size)
+            self._name, dataset, mount_path, volume.size, self._reactor,
+            self._inventory)
 
     def enumerate(self):
-        listing = _list_filesystems(self._reactor, self._name)
+        listing = self._inventory.listing()
 
-        def listed(filesystems):
+        def listed(listing):
             result = set()
-            for entry in filesystems:
+            for entry in listing.filesystems:
                 filesystem = Filesystem(
                     self._name, entry.dataset, FilePath(entry.mountpoint),
-                    VolumeSize(maximum_size=entry.refquota))
+                    VolumeSize(maximum_size=entry.refquota), self._reactor,
+                    self._inventory)
                 result.add(filesystem)
             return result
 
         return listing.addCallback(listed)
 
+    def invalidate(self):
+        """
+        Forget the inventory of the pool, so that the next query lists it
+        again.
+        """
+        self._inventory.invalidate()
+
+    def stream_features(self):
+        """
+        Ask the installed ZFS which ``zfs send`` options it supports and the
+        pool which features are enabled, the first time this is called.
+        """
+        if self._stream_features is not None:
+            return succeed(self._stream_features)
+        usage = getProcessOutputAndValue(
+            b"zfs", [b"send"], os.environ, reactor=self._reactor)
+        properties = getProcessOutputAndValue(
+            b"zpool", [b"get", b"-H", b"-o", b"property,value", b"all",
+                       self._name.split(b"/")[0]],
+            os.environ, reactor=self._reactor)
+        d = gatherResults([usage, properties], consumeErrors=True)
+
+        def got_results(results):
+            # ``zfs send`` without a snapshot prints its usage to stderr:
+            (_, usage_err, _), (properties_out, _, _) = results
+            self._stream_features = _parse_stream_features(
+                usage_err, properties_out)
+            return self._stream_features
+        d.addCallback(got_results)
+        # Plain streams can be sent to any pool:
+        d.addErrback(lambda _: frozenset())
+        return d
+
 
 @attributes(["dataset", "mountpoint", "refquota"], apply_immutable=True)
 class _DatasetInfo(object):
@@ -651,40 +1035,135 @@ class _DatasetInfo(object):
     """
 
 
-def _list_filesystems(reactor, pool):
-    """Get a listing of all filesystems on a given pool.
-
-    :param pool: A `flocker.volume.filesystems.interface.IStoragePool`
-        provider.
-    :return: A ``Deferred`` that fires with an iterator, the elements
-        of which are ``tuples`` containing the name and mountpoint of each
-        filesystem.
-    """
-    listing = zfs_command(
-        reactor,
-        [b"list",
-         # Descend the hierarchy to a depth of one (ie, list the direct
-         # children of the pool)
-         b"-d", b"1",
-         # Omit the output header
-         b"-H",
-         # Output exact, machine-parseable values (eg 65536 instead of 64K)
-         b"-p",
-         # Output each dataset's name, mountpoint and refquota
-         b"-o", b"name,mountpoint,refquota",
-         # Look at this pool
-         pool])
-
-    def listed(output, pool):
-        for line in output.splitlines():
-            name, mountpoint, refquota = line.split(b'\t')
-            name = name[len(pool) + 1:]
-            if name:
-                refquota = int(refquota.decode("ascii"))
-                if refquota == 0:
-                    refquota = None
-                yield _DatasetInfo(
-                    dataset=name, mountpoint=mountpoint, refquota=refquota)
-
-    listing.addCallback(listed, pool)
-    return listing
+@attributes(["filesystems", "snapshots"], apply_immutable=True)
+class _PoolListing(object):
+    """
+    The filesystems and snapshots in a pool.
+
+    :ivar list filesystems: A ``_DatasetInfo`` for each of the direct children
+        of the pool.
+    :ivar dict snapshots: Map the name of each filesystem in the pool with
+        snapshots, e.g. ``b"hpool/myfs"``, to a ``list`` of the names of
+        its snapshots, oldest first.
+    """
+
+
+def _list_pool_command(pool):
+    """
+    Construct a ``zfs`` command which will output the filesystems and
+    snapshots in a pool.
+
+    :param bytes pool: The name of the pool.
+
+    :return list: An argument list (of ``bytes``) which can be passed to
+        ``zfs``, not including ``zfs`` as the first element.
+    """
+    return [
+        b"list",
+        # Omit the output header
+        b"-H",
+        # Output exact, machine-parseable values (eg 65536 instead of 64K)
+        b"-p",
+        # Recurse to all the datasets in the pool
+        b"-r",
+        # Output both filesystems and their snapshots
+        b"-t", b"filesystem,snapshot",
+        # Output each dataset's name, mountpoint and refquota; snapshots
+        # have neither of the latter
+        b"-o", b"name,mountpoint,refquota",
+        # Sort by the creation property, so snapshots are in the order they
+        # were taken
+        b"-s", b"creation",
+        # Look at this pool
+        pool]
+
+
+def _parse_pool_listing(output, pool):
+    """
+    Parse the output of the command constructed by ``_list_pool_command``.
+
+    :param bytes output: The output to parse.
+    :param bytes pool: The name of the pool which was listed.
+
+    :return: A ``_PoolListing``.
+    """
+    filesystems = []
+    snapshots = {}
+    for line in output.splitlines():
+        name, mountpoint, refquota = line.split(b'\t')
+        if b"@" in name:
+            filesystem, snapshot = name.split(b"@", 1)
+            snapshots.setdefault(filesystem, []).append(snapshot)
+            continue
+        name = name[len(pool) + 1:]
+        if name and b"/" not in name:
+            refquota = int(refquota.decode("ascii"))
+            if refquota == 0:
+                refquota = None
+            filesystems.append(_DatasetInfo(
+                dataset=name, mountpoint=mountpoint, refquota=refquota))
+    return _PoolListing(filesystems=filesystems, snapshots=snapshots)
+
+
+class _Inventory(object):
+    """
+    The filesystems and snapshots in a pool, found with one ``zfs list`` and
+    kept until they are invalidated.
+
+    Every filesystem's snapshots and the pool's filesystems can then be
+    found without running ``zfs list`` for each of them.  Flocker invalidates
+    the inventory whenever it changes the pool, and the convergence loop
+    does at the start of each iteration to see changes made by other
+    processes.
+    """
+    def __init__(self, reactor, pool):
+        """
+        :param reactor: A ``IReactorProcess`` provider.
+        :param bytes pool: The name of the pool.
+        """
+        self._reactor = reactor
+        self._pool = pool
+        self._listing = None
+        self._waiting = None
+
+    def listing(self):
+        """
+        :return: A ``Deferred`` that fires with a ``_PoolListing``, found
+            with ``zfs list`` if the pool hasn't been listed since the
+            inventory was last invalidated.
+        """
+        if self._listing is not None:
+            return succeed(self._listing)
+        result = Deferred()
+        if self._waiting is None:
+            self._waiting = waiting = []
+            listing = zfs_command(
+                self._reactor, _list_pool_command(self._pool))
+            listing.addCallback(_parse_pool_listing, self._pool)
+
+            def listed(listing):
+                if self._waiting is waiting:
+                    # The pool hasn't changed since the listing was started:
+                    self._waiting = None
+                    if not isinstance(listing, Failure):
+                        self._listing = listing
+                for d in waiting:
+                    d.callback(listing)
+            listing.addBoth(listed)
+        self._waiting.append(result)
+        return result
+
+    def invalidate(self):
+        """
+        Forget the listing, because the pool has changed.
+        """
+        self._listing = None
+        self._waiting = None
+
+    def changed(self, result):
+        """
+        Invalidate the inventory once a change to the pool is done, passing
+        on the change's result, successful or not.
+        """
+        self.invalidate()
+        return result
@@ -0,0 +1,140 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Functional tests for ``flocker.volume._agent``.
+"""
+
+import os
+import sys
+
+from twisted.internet import reactor
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from ...common import CommandEndpoint
+from .._agent import AgentVolumeManager, _AgentConnection
+from ..filesystems.memory import FilesystemStoragePool
+from ..service import Volume, VolumeService
+from ..testtools import (
+    MutatingProcessNode, create_realistic_servicepair,
+    )
+from ..test.test_ipc import MY_VOLUME
+
+
+# Serve requests for a volume manager storing volumes in directories:
+_SERVE = b"""
+import sys
+from twisted.internet.task import react
+from twisted.python.filepath import FilePath
+from flocker.volume._agent import serve_standard_io
+from flocker.volume.filesystems.memory import FilesystemStoragePool
+from flocker.volume.service import VolumeService
+
+def main(reactor, config, pool):
+    service = VolumeService(
+        FilePath(config), FilesystemStoragePool(FilePath(pool)), reactor)
+    service.startService()
+    return serve_standard_io(reactor, service)
+
+react(main, sys.argv[1:])
+"""
+
+
+def create_volume_service(test, config_path, pool_path):
+    """
+    Create a ``VolumeService`` storing volumes in directories.
+
+    :param TestCase test: A unit test.
+    :param FilePath config_path: The service's configuration file.
+    :param FilePath pool_path: The directory to store volumes in.
+
+    :return: The started ``VolumeService``.
+    """
+    service = VolumeService(config_path, FilesystemStoragePool(pool_path),
+                            reactor)
+    service.startService()
+    test.addCleanup(service.stopService)
+    return service
+
+
+class ServeStandardIOTests(TestCase):
+    """
+    Tests for ``serve_standard_io`` and ``AgentVolumeManager`` talking to a
+    real process.
+    """
+    def test_handoff(self):
+        """
+        A volume can be handed off to a volume agent process, which is
+        started once and used for all of the requests.
+        """
+        from_service = create_volume_service(
+            self, FilePath(self.mktemp()), FilePath(self.mktemp()))
+        config_path = FilePath(self.mktemp())
+        pool_path = FilePath(self.mktemp())
+        to_service = create_volume_service(self, config_path, pool_path)
+        endpoint = CommandEndpoint(
+            reactor, [sys.executable, b"-c", _SERVE, config_path.path,
+                      pool_path.path],
+            os.environ)
+        connects = []
+        original_connect = endpoint.connect
+
+        def connect(factory):
+            connects.append(factory)
+            return original_connect(factory)
+        endpoint.connect = connect
+        remote = AgentVolumeManager(_AgentConnection(endpoint))
+        self.addCleanup(remote.disconnect)
+
+        d = from_service.create(from_service.get(MY_VOLUME))
+
+        def created(volume):
+            volume.get_filesystem().get_path().child(b"data").setContent(
+                b"x" * (5 * 1024 * 1024))
+            return from_service.handoff(volume, remote)
+        d.addCallback(created)
+
+        def handed_off(_):
+            volume = Volume(node_id=to_service.node_id, name=MY_VOLUME,
+                            service=to_service)
+            data = volume.get_filesystem().get_path().child(
+                b"data").getContent()
+            self.assertEqual((len(connects), data == b"x" * (5 * 1024 * 1024)),
+                             (1, True))
+        d.addCallback(handed_off)
+        return d
+
+
+class AgentVolumeManagerTests(TestCase):
+    """
+    Tests for ``AgentVolumeManager`` with ``flocker-volume serve``.
+    """
+    def test_handoff(self):
+        """
+        A volume can be handed off through ``flocker-volume serve``.
+        """
+        service_pair = create_realistic_servicepair(self)
+        from_service = service_pair.from_service
+        to_service = service_pair.to_service
+        remote = AgentVolumeManager.for_node(
+            reactor, MutatingProcessNode(to_service),
+            to_service._config_path)
+        self.addCleanup(remote.disconnect)
+
+        d = from_service.create(from_service.get(MY_VOLUME))
+
+        def created(volume):
+            volume.get_filesystem().get_path().child(b"data").setContent(
+                b"WORKS!")
+            return from_service.handoff(volume, remote)
+        d.addCallback(created)
+
+        def handed_off(_):
+            volume = Volume(node_id=to_service.node_id, name=MY_VOLUME,
+                            service=to_service)
+            self.assertEqual(
+                volume.get_filesystem().get_path().child(
+                    b"data").getContent(),
+                b"WORKS!")
+        d.addCallback(handed_off)
+        return d
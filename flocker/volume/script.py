@@ -14,6 +14,8 @@ from .service import (
     DEFAULT_CONFIG_PATH, FLOCKER_MOUNTPOINT, FLOCKER_POOL,
     Volume, VolumeScript, ICommandLineVolumeScript, VolumeName,
     )
+from ..common import StandardInputEndpoint
+from ._agent import serve_standard_io
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner
     )
@@ -101,6 +103,10 @@ class _ReceiveSubcommandOptions(Options):
     Reads the volume in from standard in. This is typically called
     automatically over SSH.
 
+    If the storage pool supports resumable streams and the stream is
+    interrupted, what was received is kept; the rest of the stream can then
+    be received by passing the volume's resume token with --resume-token.
+
     Parameters:
 
     * owner-node-id: The node ID of the volume manager that owns the volume.
@@ -110,6 +116,12 @@ class _ReceiveSubcommandOptions(Options):
 
     synopsis = "<owner-node-id> <name>"
 
+    optParameters = [
+        ["resume-token", None, None,
+         "The resume token, as output by resume_token, of the interrupted "
+         "stream which standard in resumes."],
+    ]
+
     def parseArgs(self, node_id, name):
         self["node_id"] = node_id.decode("ascii")
         self["name"] = name
@@ -119,8 +131,73 @@ class _ReceiveSubcommandOptions(Options):
 
         :param VolumeService service: The volume manager service to utilize.
         """
-        service.receive(self["node_id"], VolumeName.from_bytes(self["name"]),
-                        sys.stdin)
+        from twisted.internet import reactor
+        return service.receive(
+            self["node_id"], VolumeName.from_bytes(self["name"]),
+            StandardInputEndpoint(reactor), self["resume-token"])
+
+
+class _ResumeTokenSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume resume_token``.
+    """
+
+    longdesc = """    Output the resume token of an interrupted receive of a volume, if there
+    is one.
+
+    Parameters:
+
+    * owner-node-id: The node ID of the volume manager that owns the volume.
+
+    * name: The name of the volume.
+    """
+
+    synopsis = "<owner-node-id> <name>"
+
+    def parseArgs(self, node_id, name):
+        self["node_id"] = node_id.decode("ascii")
+        self["name"] = name
+
+    def run(self, service):
+        """
+        Run the action for this sub-command.
+
+        :param VolumeService service: The volume manager service to utilize.
+        """
+        volume = Volume(node_id=self["node_id"],
+                        name=VolumeName.from_bytes(self["name"]),
+                        service=service)
+        d = volume.get_filesystem().resume_token()
+
+        def got_token(token):
+            if token is not None:
+                sys.stdout.write(token + b"\n")
+        d.addCallback(got_token)
+        return d
+
+
+class _StreamFeaturesSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume stream_features``.
+    """
+
+    longdesc = """    Output the optional features of the streams the storage pool can
+    receive, one per line.
+    """
+
+    def run(self, service):
+        """
+        Run the action for this sub-command.
+
+        :param VolumeService service: The volume manager service to utilize.
+        """
+        d = service.pool.stream_features()
+
+        def got_features(features):
+            for feature in sorted(features):
+                sys.stdout.write(feature + b"\n")
+        d.addCallback(got_features)
+        return d
 
 
 class _AcquireSubcommandOptions(Options):
@@ -201,6 +278,30 @@ class _CloneToSubcommandOptions(Options):
             parent, VolumeName.from_bytes(self["child_name"]))
 
 
+class _ServeSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume serve``.
+    """
+
+    longdesc = """\
+    Serve requests from another volume manager until standard in is closed.
+
+    Requests are read from standard in and answered on standard out. This is
+    typically started once over SSH by another node's volume manager, which
+    then sends it many snapshots, receive, acquire and clone_to requests
+    instead of running a separate command for each one.
+    """
+
+    def run(self, service):
+        """
+        Run the action for this sub-command.
+
+        :param VolumeService service: The volume manager service to utilize.
+        """
+        from twisted.internet import reactor
+        return serve_standard_io(reactor, service)
+
+
 @flocker_standard_options
 @flocker_volume_options
 class VolumeOptions(Options):
@@ -217,10 +318,16 @@ class VolumeOptions(Options):
          "List snapshots for a volume."],
         ["receive", None, _ReceiveSubcommandOptions,
          "Receive a remotely pushed volume."],
+        ["resume_token", None, _ResumeTokenSubcommandOptions,
+         "Output the resume token of an interrupted receive."],
+        ["stream_features", None, _StreamFeaturesSubcommandOptions,
+         "List the stream features the storage pool can receive."],
         ["acquire", None, _AcquireSubcommandOptions,
          "Acquire a remotely owned volume."],
         ["clone_to", None, _CloneToSubcommandOptions,
          "Clone an existing volume."],
+        ["serve", None, _ServeSubcommandOptions,
+         "Serve requests from another volume manager."],
     ]
 
 
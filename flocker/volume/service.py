@@ -20,13 +20,15 @@ from twisted.internet.defer import maybeDeferred
 from twisted.internet.task import deferLater
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
-from twisted.internet.defer import fail
+from twisted.internet.defer import fail, succeed
 
 # We might want to make these utilities shared, rather than in zfs
 # module... but in this case the usage is temporary and should go away as
 # part of https://clusterhq.atlassian.net/browse/FLOC-64
 from .filesystems.zfs import StoragePool
+from .filesystems.errors import UnresumableStream
 from ._model import VolumeSize
+from ..common import can_splice, splice_transfer, transfer
 from ..common.script import ICommandLineScript
 
 DEFAULT_CONFIG_PATH = FilePath(b"/etc/flocker/volume.json")
@@ -234,6 +236,10 @@ class VolumeService(Service):
             for volume in volumes:
                 if volume.node_id == node_id and volume.name == name:
                     return volume
+            # The volume will be created by another process, for example
+            # when it is handed off to this node, so the pool must be
+            # listed again:
+            self.pool.invalidate()
             return deferLater(
                 self._reactor, WAIT_FOR_VOLUME_INTERVAL,
                 check_for_volume, node_id, name
@@ -280,11 +286,40 @@ class VolumeService(Service):
         enumerating.addCallback(enumerated)
         return enumerating
 
+    def _transfer(self, source, sink):
+        """
+        Stream data from one endpoint to another.
+
+        If both ends are processes, or the source is a file descriptor, the
+        data is moved between their pipes with ``splice_transfer`` so that
+        it isn't copied through Python, and the amount moved and throughput
+        are logged.  Otherwise it is streamed with ``transfer``.
+
+        :param IStreamClientEndpoint source: The endpoint to read from.
+        :param IStreamClientEndpoint sink: The endpoint to write to.
+
+        :return: ``Deferred`` that fires with ``None`` when the transfer is
+            done.
+        """
+        if can_splice(source, sink):
+            transferring = splice_transfer(self._reactor, source, sink)
+            transferring.addCallback(lambda statistics: None)
+            return transferring
+        return transfer(source, sink)
+
     def push(self, volume, destination):
         """
         Push the latest data in the volume to a remote destination.
 
-        This is a blocking API for now.
+        The data is streamed from the filesystem to the destination without
+        blocking, reading only as fast as the destination accepts it, so
+        several pushes can proceed at once.  Optional stream features are
+        used if both this service's pool and the destination support them.
+
+        If the streams are resumable and the destination was interrupted
+        while receiving an earlier push, only the rest of that push's
+        stream is sent, unless the volume has changed so that it can't be
+        resumed.
 
         Only locally owned volumes (i.e. volumes whose ``uuid`` matches
         this service's) can be pushed.
@@ -296,6 +331,8 @@ class VolumeService(Service):
 
         :raises ValueError: If the uuid of the volume is different than
             our own; only locally-owned volumes can be pushed.
+
+        :return: ``Deferred`` that fires when the volume has been pushed.
         """
         if volume.node_id != self.node_id:
             raise ValueError()
@@ -303,37 +340,75 @@ class VolumeService(Service):
         getting_snapshots = destination.snapshots(volume)
 
         def got_snapshots(snapshots):
-            with destination.receive(volume) as receiver:
-                with fs.reader(snapshots) as contents:
-                    for chunk in iter(lambda: contents.read(1024 * 1024), b""):
-                        receiver.write(chunk)
+            d = destination.stream_features()
+            d.addCallback(got_remote_features, snapshots)
+            return d
+
+        def got_remote_features(remote_features, snapshots):
+            d = self.pool.stream_features()
+            d.addCallback(lambda local_features: got_features(
+                local_features & remote_features, snapshots))
+            return d
+
+        def got_features(features, snapshots):
+            if b"resumable" in features:
+                d = destination.resume_token(volume)
+            else:
+                d = succeed(None)
+            d.addCallback(got_resume_token, features, snapshots)
+            return d
+
+        def got_resume_token(resume_token, features, snapshots):
+            reader = None
+            if resume_token is not None:
+                try:
+                    reader = fs.reader_endpoint(
+                        snapshots, features, resume_token)
+                except UnresumableStream:
+                    resume_token = None
+            if reader is None:
+                reader = fs.reader_endpoint(snapshots, features)
+            return self._transfer(
+                reader, destination.receive_endpoint(
+                    self._reactor, volume, resume_token))
 
         pushing = getting_snapshots.addCallback(got_snapshots)
         return pushing
 
-    def receive(self, volume_node_id, volume_name, input_file):
+    def receive(self, volume_node_id, volume_name, source, resume_token=None):
         """
-        Process a volume's data that can be read from a file-like object.
+        Process a volume's data, streamed without blocking from a source
+        such as standard input.
 
-        This is a blocking API for now.
+        If this service's pool supports resumable streams, how much was
+        received is recorded in case the stream is interrupted.
 
         Only remotely owned volumes (i.e. volumes whose ``uuid`` do not match
         this service's) can be received.
 
         :param unicode volume_node_id: The volume's owner's node ID.
         :param VolumeName volume_name: The volume's name.
-        :param input_file: A file-like object, typically ``sys.stdin``, from
-            which to read the data.
+        :param IStreamClientEndpoint source: The endpoint, typically a
+            ``StandardInputEndpoint``, whose connected protocol receives the
+            data.
+        :param resume_token: ``None`` for a new stream, or the resume token
+            of the interrupted stream which the data resumes.
 
         :raises ValueError: If the uuid of the volume matches our own;
             remote nodes can't overwrite locally-owned volumes.
+
+        :return: ``Deferred`` that fires when the volume has been received,
+            or fails with ``UnresumableStream`` if the stream can't be
+            resumed from ``resume_token``.
         """
         if volume_node_id == self.node_id:
             raise ValueError()
         volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
-        with volume.get_filesystem().writer() as writer:
-            for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
-                writer.write(chunk)
+        d = self.pool.stream_features()
+        d.addCallback(lambda features: self._transfer(
+            source, volume.get_filesystem().writer_endpoint(
+                b"resumable" in features, resume_token)))
+        return d
 
     def acquire(self, volume_node_id, volume_name):
         """
@@ -361,8 +436,8 @@ class VolumeService(Service):
 
         The remote destination will be the new owner of the volume.
 
-        This is a blocking API for now (but it does return a ``Deferred``
-        for success/failure).
+        This blocks if ``destination`` does, as ``RemoteVolumeManager``
+        does, but not with ``AgentVolumeManager``.
 
         :param Volume volume: The volume to handoff.
         :param IRemoteVolumeManager destination: The remote volume manager
@@ -373,11 +448,8 @@ class VolumeService(Service):
             volume is not locally owned).
         """
         pushing = maybeDeferred(self.push, volume, destination)
-
-        def pushed(ignored):
-            remote_uuid = destination.acquire(volume)
-            return volume.change_owner(remote_uuid)
-        changing_owner = pushing.addCallback(pushed)
+        pushing.addCallback(lambda ignored: destination.acquire(volume))
+        changing_owner = pushing.addCallback(volume.change_owner)
         return changing_owner
 
 
@@ -9,6 +9,9 @@ instance as its first argument and returns some object to be used in a test.
 
 from __future__ import absolute_import
 
+import os
+from random import Random
+
 from characteristic import attributes
 from zope.interface.verify import verifyObject
 
@@ -16,10 +19,11 @@ from twisted.trial.unittest import TestCase
 from twisted.internet.defer import gatherResults
 from twisted.application.service import IService
 
+from ...common import transfer
 from ...testtools import (
     assertNoFDsLeaked, assert_equal_comparison, assert_not_equal_comparison)
 
-from ..testtools import service_for_pool
+from ..testtools import InterruptingEndpoint, service_for_pool
 
 from ..filesystems.interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
@@ -83,6 +87,24 @@ def copy(from_volume, to_volume):
     return getting_snapshots
 
 
+def stream(from_volume, to_volume):
+    """Copy contents of one volume to another using the filesystems'
+    endpoints.
+
+    :param Volume from_volume: Volume to read from.
+    :param Volume to_volume: Volume to write to.
+    """
+    from_filesystem = from_volume.get_filesystem()
+    to_filesystem = to_volume.get_filesystem()
+    getting_snapshots = to_filesystem.snapshots()
+
+    def got_snapshots(snapshots):
+        return transfer(from_filesystem.reader_endpoint(snapshots),
+                        to_filesystem.writer_endpoint())
+    getting_snapshots.addCallback(got_snapshots)
+    return getting_snapshots
+
+
 @attributes(["from_volume", "to_volume"])
 class CopyVolumes(object):
     """A pair of volumes that had data copied from one to the other.
@@ -136,6 +158,48 @@ def create_and_copy(test, fixture):
     return d
 
 
+def interrupt_stream(test, after):
+    """
+    Create a volume's filesystem on one pool and start streaming it to a new
+    filesystem on another, with a resumable write which is interrupted after
+    the given number of bytes.
+
+    :param TestCase test: A ``TestCase`` that will be the context for this
+        operation.
+    :param int after: The number of bytes to stream.
+
+    :return: ``Deferred`` that fires with the two volumes in a
+        ``CopyVolumes`` once the stream has been interrupted.
+    """
+    d = create_and_copy(test, test.fixture)
+
+    def got_volumes(copy_volumes):
+        from_volume = copy_volumes.from_volume
+        to_volume = Volume(node_id=from_volume.node_id, name=MY_VOLUME2,
+                           service=copy_volumes.to_volume.service)
+        features = to_volume.service.pool.stream_features()
+        features.addCallback(
+            lambda features: b"resumable" in features or test.skipTest(
+                "Streams can't be resumed."))
+
+        def resumable(_):
+            from_volume.get_filesystem().get_path().child(
+                b"random").setContent(os.urandom(100000))
+            interrupted = transfer(
+                InterruptingEndpoint(
+                    from_volume.get_filesystem().reader_endpoint(), after),
+                to_volume.get_filesystem().writer_endpoint(resumable=True))
+            # Either end may be the one to report the interruption:
+            interrupted.addErrback(lambda reason: None)
+            interrupted.addCallback(lambda _: CopyVolumes(
+                from_volume=from_volume, to_volume=to_volume))
+            return interrupted
+        features.addCallback(resumable)
+        return features
+    d.addCallback(got_volumes)
+    return d
+
+
 def assertVolumesEqual(test, first, second):
     """
     Assert that two filesystems have the same contents.
@@ -528,6 +592,119 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             d.addCallback(got_volumes)
             return d
 
+        def test_stream_new_filesystem(self):
+            """
+            Transferring the contents of one pool's filesystem to another
+            pool's filesystem using their endpoints creates that filesystem
+            with the given contents.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copy_volumes):
+                path = copy_volumes.from_volume.get_filesystem().get_path()
+                path.child(b"anotherfile").setContent(b"hello")
+                volume3 = Volume(
+                    node_id=copy_volumes.from_volume.node_id,
+                    name=MY_VOLUME2,
+                    service=copy_volumes.to_volume.service)
+                streaming = stream(copy_volumes.from_volume, volume3)
+                streaming.addCallback(lambda ignored: assertVolumesEqual(
+                    self, copy_volumes.from_volume, volume3))
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_stream_update(self):
+            """
+            Transferring an update of the contents of one pool's filesystem
+            to another pool's filesystem using their endpoints updates its
+            contents.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copy_volumes):
+                path = copy_volumes.from_volume.get_filesystem().get_path()
+                path.child(b"anotherfile").setContent(b"hello")
+                path.child(b"file").remove()
+                streaming = stream(
+                    copy_volumes.from_volume, copy_volumes.to_volume)
+                streaming.addCallback(lambda ignored: assertVolumesEqual(
+                    self, copy_volumes.from_volume, copy_volumes.to_volume))
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_no_resume_token(self):
+            """
+            A filesystem which never had a stream written to it has no
+            resume token.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            d = pool.create(volume)
+            d.addCallback(lambda filesystem: filesystem.resume_token())
+            d.addCallback(self.assertIs, None)
+            return d
+
+        def test_resume_interrupted_stream(self):
+            """
+            If a resumable stream is interrupted, the rest of it can be
+            streamed from the writer's resume token, however far it got.
+            """
+            self.fixture = fixture
+            random = Random(0)
+
+            def resume(after):
+                d = interrupt_stream(self, after)
+
+                def interrupted(copy_volumes):
+                    from_filesystem = copy_volumes.from_volume.get_filesystem()
+                    to_filesystem = copy_volumes.to_volume.get_filesystem()
+                    getting_token = to_filesystem.resume_token()
+
+                    def got_token(token):
+                        self.assertIsNot(token, None)
+                        return transfer(
+                            from_filesystem.reader_endpoint(
+                                resume_token=token),
+                            to_filesystem.writer_endpoint(
+                                resumable=True, resume_token=token))
+                    getting_token.addCallback(got_token)
+                    getting_token.addCallback(
+                        lambda _: to_filesystem.resume_token())
+                    getting_token.addCallback(self.assertIs, None)
+                    getting_token.addCallback(lambda _: assertVolumesEqual(
+                        self, copy_volumes.from_volume,
+                        copy_volumes.to_volume))
+                    return getting_token
+                d.addCallback(interrupted)
+                return d
+            return gatherResults([
+                resume(random.randint(1, 100000)) for i in range(3)])
+
+        def test_new_stream_after_interrupted(self):
+            """
+            If a resumable stream is interrupted, a new stream can be
+            written instead of resuming it.
+            """
+            self.fixture = fixture
+            d = interrupt_stream(self, 5000)
+
+            def interrupted(copy_volumes):
+                from_filesystem = copy_volumes.from_volume.get_filesystem()
+                to_filesystem = copy_volumes.to_volume.get_filesystem()
+                streaming = transfer(
+                    from_filesystem.reader_endpoint(),
+                    to_filesystem.writer_endpoint(resumable=True))
+                streaming.addCallback(lambda _: to_filesystem.resume_token())
+                streaming.addCallback(self.assertIs, None)
+                streaming.addCallback(lambda _: assertVolumesEqual(
+                    self, copy_volumes.from_volume, copy_volumes.to_volume))
+                return streaming
+            d.addCallback(interrupted)
+            return d
+
         def test_exception_passes_through_read(self):
             """
             If an exception is raised in the context of the reader, it is not
@@ -675,6 +852,42 @@ def make_istoragepool_tests(fixture, snapshot_factory):
                 self.assertEqual(expected, result)
             return enumerating.addCallback(enumerated)
 
+        def test_enumerate_sees_changes(self):
+            """
+            Filesystems created and destroyed by the pool after it was
+            enumerated are seen the next time it is enumerated.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            volume2 = service.get(MY_VOLUME2)
+            d = pool.create(volume)
+            d.addCallback(lambda _: pool.enumerate())
+            d.addCallback(lambda _: pool.create(volume2))
+            d.addCallback(lambda _: pool.destroy(volume))
+            d.addCallback(lambda _: pool.enumerate())
+            d.addCallback(self.assertEqual, {volume2.get_filesystem()})
+            return d
+
+        def test_invalidate(self):
+            """
+            ``IStoragePool.invalidate`` doesn't change what the pool
+            enumerates.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            d = pool.create(volume)
+            d.addCallback(lambda _: pool.enumerate())
+
+            def enumerated(filesystems):
+                pool.invalidate()
+                enumerating = pool.enumerate()
+                enumerating.addCallback(self.assertEqual, filesystems)
+                return enumerating
+            d.addCallback(enumerated)
+            return d
+
         def test_enumerate_provides_null_size(self):
             """
             The ``IStoragePool.enumerate`` implementation produces
@@ -0,0 +1,822 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._agent``.
+"""
+
+import os
+import zlib
+from random import Random
+
+from zope.interface import implementer
+
+from eliot import MemoryLogger
+from eliot.testing import assertHasMessage
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.error import (
+    ConnectionDone, ConnectionLost, ConnectionRefusedError,
+)
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import Clock
+from twisted.protocols.amp import MAX_VALUE_LENGTH
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+
+from ...common import (
+    FakeNode, IDENTITY, MemoryProcessEndpoint, transfer,
+    )
+from ...common._compression import COMPRESSED_TRANSFER, ZLIB
+from ...control.test.test_protocol import LoopbackAMPClient
+from .._agent import (
+    AgentVolumeManager, ReceiveAbortCommand, ReceiveCommand,
+    ReceiveDataCommand, ReceiveEndCommand, ResumeTokenCommand,
+    SnapshotsCommand, StreamFeaturesCommand,
+    UnknownTransfer, VolumeAgentAMP, _AgentConnection, _ReceivedStream,
+    _ReceiveEndpoint, _ReceiveTransport, _VolumeAgentLocator,
+    _RECEIVE_WINDOW,
+)
+from ..filesystems.memory import FilesystemStoragePool
+from ..service import Volume, VolumeService
+from ..testtools import ServicePair
+from .test_ipc import MY_VOLUME, make_iremote_volume_manager
+
+
+def create_agent_servicepair(test):
+    """
+    Create a ``ServicePair`` allowing testing of ``AgentVolumeManager``,
+    whose commands are handled in memory by a volume agent locator.
+
+    :param TestCase test: A unit test.
+
+    :return: A new ``ServicePair``.
+    """
+    def create_service():
+        path = FilePath(test.mktemp())
+        path.createDirectory()
+        pool = FilesystemStoragePool(path)
+        service = VolumeService(FilePath(test.mktemp()), pool, reactor=Clock())
+        service.startService()
+        test.addCleanup(service.stopService)
+        return service
+    to_service = create_service()
+    remote = AgentVolumeManager(
+        LoopbackAMPClient(_VolumeAgentLocator(to_service)))
+    return ServicePair(from_service=create_service(), to_service=to_service,
+                       remote=remote)
+
+
+class AgentVolumeManagerInterfaceTests(
+        make_iremote_volume_manager(create_agent_servicepair)):
+    """
+    Tests for ``AgentVolumeManager`` as a ``IRemoteVolumeManager``.
+    """
+
+
+class AgentVolumeManagerTests(SynchronousTestCase):
+    """
+    Tests for ``AgentVolumeManager``.
+    """
+    def test_for_node(self):
+        """
+        ``AgentVolumeManager.for_node`` returns an ``AgentVolumeManager``
+        which runs ``flocker-volume serve`` on the node when first used.
+        """
+        node = FakeNode()
+        remote = AgentVolumeManager.for_node(
+            Clock(), node, FilePath(b"/path/to/json"))
+        remote.snapshots(
+            create_agent_servicepair(self).from_service.get(MY_VOLUME))
+        self.assertEqual(node.remote_command,
+                         [b"flocker-volume", b"--config", b"/path/to/json",
+                          b"serve"])
+
+    def test_receive_endpoint_fails(self):
+        """
+        If the volume agent fails to receive the volume, the transfer to the
+        endpoint returned by ``AgentVolumeManager.receive_endpoint`` fails.
+        """
+        service_pair = create_agent_servicepair(self)
+        volume = service_pair.to_service.get(MY_VOLUME)
+        self.failureResultOf(
+            transfer(MemoryProcessEndpoint(stdout=b"data"),
+                     service_pair.remote.receive_endpoint(None, volume)),
+            ConnectionLost)
+
+
+class _Endpoint(object):
+    """
+    An endpoint whose protocols are connected to ``StringTransport``\ s.
+
+    :ivar list protocols: The protocols connected so far.
+    :ivar list factories: The factories given to ``connect``.
+    :ivar results: ``None`` to connect immediately, or a ``list`` of the
+        results to return from future calls to ``connect``.
+    """
+    def __init__(self, results=None):
+        self.protocols = []
+        self.factories = []
+        self.results = results
+
+    def connect(self, factory):
+        self.factories.append(factory)
+        if self.results is not None:
+            return self.results.pop(0)
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        self.protocols.append(protocol)
+        return succeed(protocol)
+
+
+class AgentConnectionTests(SynchronousTestCase):
+    """
+    Tests for ``_AgentConnection``.
+    """
+    def test_one_connection(self):
+        """
+        All the commands sent with ``_AgentConnection.callRemote`` are sent
+        over the same connection.
+        """
+        endpoint = _Endpoint()
+        connection = _AgentConnection(endpoint)
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"1")
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"2")
+        self.assertEqual(
+            (len(endpoint.protocols),
+             endpoint.protocols[0].transport.value().count(b"_command")),
+            (1, 2))
+
+    def test_one_connection_attempt(self):
+        """
+        Commands sent while connecting wait for the same connection.
+        """
+        connecting = Deferred()
+        endpoint = _Endpoint([connecting])
+        connection = _AgentConnection(endpoint)
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"1")
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"2")
+        protocol = endpoint.factories[0].buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        connecting.callback(protocol)
+        self.assertEqual(
+            (len(endpoint.factories),
+             protocol.transport.value().count(b"_command")),
+            (1, 2))
+
+    def test_reconnect(self):
+        """
+        If the connection is lost, a new one is made for the next command.
+        """
+        endpoint = _Endpoint()
+        connection = _AgentConnection(endpoint)
+        sending = connection.callRemote(ReceiveEndCommand, transfer_id=u"1")
+        endpoint.protocols[0].connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(sending, ConnectionLost)
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"2")
+        self.assertEqual(len(endpoint.protocols), 2)
+
+    def test_connection_failed(self):
+        """
+        If the connection can't be made, the commands waiting for it fail
+        and the next command tries to connect again.
+        """
+        endpoint = _Endpoint([fail(ConnectionRefusedError())])
+        connection = _AgentConnection(endpoint)
+        self.failureResultOf(
+            connection.callRemote(ReceiveEndCommand, transfer_id=u"1"),
+            ConnectionRefusedError)
+        endpoint.results = None
+        connection.callRemote(ReceiveEndCommand, transfer_id=u"2")
+        self.assertEqual(len(endpoint.protocols), 1)
+
+    def test_disconnect(self):
+        """
+        ``_AgentConnection.disconnect`` closes the connection, returning a
+        ``Deferred`` which fires once it has been lost.
+        """
+        endpoint = _Endpoint()
+        connection = _AgentConnection(endpoint)
+        sending = connection.callRemote(ReceiveEndCommand, transfer_id=u"1")
+        protocol = endpoint.protocols[0]
+        disconnecting = connection.disconnect()
+        self.assertNoResult(disconnecting)
+        self.assertTrue(protocol.transport.disconnecting)
+        protocol.connectionLost(Failure(ConnectionDone()))
+        self.successResultOf(disconnecting)
+        self.failureResultOf(sending, ConnectionDone)
+
+    def test_disconnect_not_connected(self):
+        """
+        ``_AgentConnection.disconnect`` returns a ``Deferred`` which has
+        already fired if there is no connection.
+        """
+        self.successResultOf(_AgentConnection(_Endpoint()).disconnect())
+
+
+class _SingleProtocolFactory(object):
+    """
+    A factory which builds a given protocol.
+    """
+    def __init__(self, protocol):
+        self._protocol = protocol
+
+    def buildProtocol(self, addr):
+        return self._protocol
+
+
+class _RecordingConnection(object):
+    """
+    A fake ``_AgentConnection`` which records the commands sent.
+
+    :ivar list calls: ``(command, kwargs, Deferred)`` tuples for each
+        command sent.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, command, **kwargs):
+        d = Deferred()
+        self.calls.append((command, kwargs, d))
+        return d
+
+
+@implementer(IPushProducer)
+class _Producer(object):
+    """
+    A push producer which records whether it is paused.
+    """
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        pass
+
+
+class _Protocol(Protocol):
+    """
+    Record the data received and the reason the connection was lost.
+
+    :ivar bool pause: Whether to pause the transport whenever data is
+        received.
+    """
+    pause = False
+
+    def __init__(self):
+        self.data = []
+        self.reason = None
+
+    def dataReceived(self, data):
+        self.data.append(data)
+        if self.pause:
+            self.transport.pauseProducing()
+
+    def connectionLost(self, reason):
+        self.reason = reason
+
+
+class ReceiveTransportTests(SynchronousTestCase):
+    """
+    Tests for ``_ReceiveTransport``.
+    """
+    def setUp(self):
+        self.connection = _RecordingConnection()
+        self.protocol = _Protocol()
+        self.logger = MemoryLogger()
+        self.transport = _ReceiveTransport(
+            self.connection, u"123", self.protocol, IDENTITY, self.logger)
+        self.producer = _Producer()
+        self.transport.registerProducer(self.producer, True)
+
+    def test_chunks(self):
+        """
+        Data written to the transport is sent in ``ReceiveDataCommand``\ s
+        no bigger than the largest AMP value.
+        """
+        data = b"x" * (MAX_VALUE_LENGTH * 2 + 1)
+        self.transport.write(data)
+        self.assertEqual(
+            [(command, kwargs) for (command, kwargs, _) in
+             self.connection.calls],
+            [(ReceiveDataCommand,
+              dict(transfer_id=u"123", data=data[i:i + MAX_VALUE_LENGTH]))
+             for i in (0, MAX_VALUE_LENGTH, MAX_VALUE_LENGTH * 2)])
+
+    def test_pause(self):
+        """
+        The producer is paused while more than ``_RECEIVE_WINDOW``
+        ``ReceiveDataCommand``\ s are unanswered.
+        """
+        for i in range(_RECEIVE_WINDOW):
+            self.transport.write(b"x")
+        paused_at_window = self.producer.paused
+        self.transport.write(b"x")
+        self.assertEqual((paused_at_window, self.producer.paused),
+                         (False, True))
+
+    def test_resume(self):
+        """
+        The producer is resumed once no more than half of
+        ``_RECEIVE_WINDOW`` ``ReceiveDataCommand``\ s are unanswered.
+        """
+        for i in range(_RECEIVE_WINDOW + 1):
+            self.transport.write(b"x")
+        calls = self.connection.calls
+        for command, kwargs, d in calls[:_RECEIVE_WINDOW // 2]:
+            d.callback({})
+        still_paused = self.producer.paused
+        calls[_RECEIVE_WINDOW // 2][2].callback({})
+        self.assertEqual((still_paused, self.producer.paused),
+                         (True, False))
+
+    def test_close(self):
+        """
+        ``_ReceiveTransport.closeStdin`` sends a ``ReceiveEndCommand``, and
+        the protocol's connection is lost with ``ConnectionDone`` once it
+        is answered.
+        """
+        self.transport.closeStdin()
+        command, kwargs, d = self.connection.calls[-1]
+        self.assertEqual((command, kwargs, self.protocol.reason),
+                         (ReceiveEndCommand, dict(transfer_id=u"123"), None))
+        d.callback({})
+        self.protocol.reason.trap(ConnectionDone)
+
+    def test_compressed(self):
+        """
+        The data is compressed with the given codec, and the end of the
+        compressed data is sent before the ``ReceiveEndCommand``.
+        """
+        transport = _ReceiveTransport(
+            self.connection, u"123", self.protocol, ZLIB, self.logger)
+        data = b"hello world " * 1000
+        transport.write(data)
+        transport.closeStdin()
+        commands = [command for (command, _, _) in self.connection.calls]
+        sent = b"".join(kwargs["data"] for (command, kwargs, _) in
+                        self.connection.calls
+                        if command is ReceiveDataCommand)
+        self.assertEqual((commands[-1], zlib.decompress(sent)),
+                         (ReceiveEndCommand, data))
+
+    def test_statistics_logged(self):
+        """
+        Once the ``ReceiveEndCommand`` is answered, the codec and the
+        numbers of bytes written and sent are logged.
+        """
+        transport = _ReceiveTransport(
+            self.connection, u"123", self.protocol, ZLIB, self.logger)
+        transport.write(b"x" * 100000)
+        transport.closeStdin()
+        sent = sum(len(kwargs["data"]) for (command, kwargs, _) in
+                   self.connection.calls if command is ReceiveDataCommand)
+        self.connection.calls[-1][2].callback({})
+        self.logger.validate()
+        message = assertHasMessage(
+            self, self.logger, COMPRESSED_TRANSFER,
+            dict(codec=b"zlib", bytes=100000, compressed_bytes=sent))
+        self.assertEqual(message.message["ratio"], 100000.0 / sent)
+
+    def test_failure_not_logged(self):
+        """
+        Nothing is logged if the ``ReceiveEndCommand`` fails.
+        """
+        self.transport.closeStdin()
+        self.connection.calls[-1][2].errback(ZeroDivisionError())
+        self.assertEqual(self.logger.messages, [])
+
+    def test_receive_failed(self):
+        """
+        If the ``ReceiveEndCommand`` fails, the protocol's connection is lost
+        with that failure.
+        """
+        self.transport.closeStdin()
+        self.connection.calls[-1][2].errback(ZeroDivisionError())
+        self.protocol.reason.trap(ZeroDivisionError)
+
+    def test_data_failed(self):
+        """
+        If a ``ReceiveDataCommand`` fails, the protocol's connection is lost
+        with that failure and no more data is sent.
+        """
+        self.transport.write(b"x")
+        self.connection.calls[-1][2].errback(ZeroDivisionError())
+        self.transport.write(b"y")
+        self.protocol.reason.trap(ZeroDivisionError)
+        self.assertEqual(len(self.connection.calls), 1)
+
+    def test_lose_connection(self):
+        """
+        ``_ReceiveTransport.loseConnection`` sends a ``ReceiveAbortCommand``
+        and the protocol's connection is lost with ``ConnectionLost``.
+        """
+        self.transport.loseConnection()
+        command, kwargs, d = self.connection.calls[-1]
+        d.callback({})
+        self.assertEqual((command, kwargs),
+                         (ReceiveAbortCommand, dict(transfer_id=u"123")))
+        self.protocol.reason.trap(ConnectionLost)
+
+
+class _ReceivingService(object):
+    """
+    A fake ``VolumeService`` which connects a protocol to the endpoint
+    given to ``receive``.
+
+    :ivar receiving: ``Deferred`` returned by ``receive``.
+    """
+    def __init__(self):
+        self.protocol = _Protocol()
+        self.receiving = Deferred()
+
+    def receive(self, node_id, name, source, resume_token=None):
+        self.arguments = (node_id, name)
+        self.resume_token = resume_token
+        source.connect(_SingleProtocolFactory(self.protocol))
+        return self.receiving
+
+
+class ReceivedStreamTests(SynchronousTestCase):
+    """
+    Tests for ``_ReceivedStream``.
+    """
+    def setUp(self):
+        self.service = _ReceivingService()
+        self.stream = _ReceivedStream(
+            self.service, u"abc", MY_VOLUME, IDENTITY)
+
+    def test_receive(self):
+        """
+        The volume is received by the given service.
+        """
+        self.assertEqual(self.service.arguments, (u"abc", MY_VOLUME))
+
+    def test_resume_token(self):
+        """
+        The resume token given to ``_ReceivedStream`` is passed on to the
+        service, and none is passed by default.
+        """
+        service = _ReceivingService()
+        _ReceivedStream(service, u"abc", MY_VOLUME, IDENTITY, b"1:abc")
+        self.assertEqual((self.service.resume_token, service.resume_token),
+                         (None, b"1:abc"))
+
+    def test_write(self):
+        """
+        Data written to the stream is delivered to the connected protocol,
+        and the result of writing fires.
+        """
+        writing = self.stream.write(b"hello")
+        self.successResultOf(writing)
+        self.assertEqual(self.service.protocol.data, [b"hello"])
+
+    def test_paused(self):
+        """
+        Data isn't delivered while the protocol has paused the stream, so
+        the result of writing it doesn't fire until it is resumed.
+        """
+        self.service.protocol.pause = True
+        self.stream.write(b"hello")
+        writing = self.stream.write(b"world")
+        self.assertNoResult(writing)
+        self.stream.resumeProducing()
+        self.successResultOf(writing)
+        self.assertEqual(self.service.protocol.data, [b"hello", b"world"])
+
+    def test_end(self):
+        """
+        After ``_ReceivedStream.end`` the protocol's connection is lost with
+        ``ConnectionDone`` once all the data has been delivered, and its
+        result fires once the volume has been received.
+        """
+        self.service.protocol.pause = True
+        self.stream.write(b"hello")
+        self.stream.write(b"world")
+        ending = self.stream.end()
+        reason_while_paused = self.service.protocol.reason
+        self.stream.resumeProducing()
+        self.service.protocol.reason.trap(ConnectionDone)
+        self.assertNoResult(ending)
+        self.service.receiving.callback(None)
+        self.successResultOf(ending)
+        self.assertEqual(reason_while_paused, None)
+
+    def test_failed(self):
+        """
+        If the volume can't be received, pending writes fail, as do later
+        writes and ``_ReceivedStream.end``.
+        """
+        self.service.protocol.pause = True
+        self.stream.write(b"hello")
+        pending = self.stream.write(b"world")
+        self.service.receiving.errback(ZeroDivisionError())
+        self.failureResultOf(pending, ZeroDivisionError)
+        self.failureResultOf(self.stream.write(b"!"), ZeroDivisionError)
+        self.failureResultOf(self.stream.end(), ZeroDivisionError)
+
+    def test_lose_connection(self):
+        """
+        ``_ReceivedStream.loseConnection`` stops delivering data and the
+        protocol's connection is lost with ``ConnectionLost``.
+        """
+        self.service.protocol.pause = True
+        self.stream.write(b"hello")
+        self.stream.write(b"world")
+        self.stream.loseConnection()
+        self.service.protocol.reason.trap(ConnectionLost)
+        self.assertEqual(self.service.protocol.data, [b"hello"])
+
+    def test_decompressed(self):
+        """
+        Data is decompressed with the given codec before it is delivered.
+        """
+        stream = _ReceivedStream(self.service, u"abc", MY_VOLUME, ZLIB)
+        compressed = zlib.compress(b"hello world")
+        stream.write(compressed[:5])
+        stream.write(compressed[5:])
+        stream.end()
+        self.assertEqual(b"".join(self.service.protocol.data),
+                         b"hello world")
+
+    def test_corrupt(self):
+        """
+        If the data can't be decompressed, writing it fails and the
+        protocol's connection is lost with ``ConnectionLost``.
+        """
+        stream = _ReceivedStream(self.service, u"abc", MY_VOLUME, ZLIB)
+        self.failureResultOf(stream.write(b"not zlib data"), zlib.error)
+        self.service.protocol.reason.trap(ConnectionLost)
+
+    def test_abort(self):
+        """
+        After ``_ReceivedStream.abort`` the protocol's connection is lost
+        with ``ConnectionLost`` and pending data is discarded.
+        """
+        self.service.protocol.pause = True
+        self.stream.write(b"hello")
+        pending = self.stream.write(b"world")
+        self.stream.abort()
+        self.service.protocol.reason.trap(ConnectionLost)
+        self.successResultOf(pending)
+        self.assertEqual(self.service.protocol.data, [b"hello"])
+
+
+class VolumeAgentLocatorTests(SynchronousTestCase):
+    """
+    Tests for ``_VolumeAgentLocator``.
+    """
+    def test_unknown_transfer(self):
+        """
+        Sending data for a transfer which was never started fails with
+        ``UnknownTransfer``.
+        """
+        client = LoopbackAMPClient(_VolumeAgentLocator(_ReceivingService()))
+        self.failureResultOf(
+            client.callRemote(ReceiveDataCommand, transfer_id=u"123",
+                              data=b"hello"),
+            UnknownTransfer)
+
+    def test_ended_transfer(self):
+        """
+        A transfer can't be used once it has ended.
+        """
+        service = _ReceivingService()
+        client = LoopbackAMPClient(_VolumeAgentLocator(service))
+        client.callRemote(ReceiveCommand, transfer_id=u"123",
+                          node_id=u"abc", name=MY_VOLUME, codecs=[])
+        client.callRemote(ReceiveEndCommand, transfer_id=u"123")
+        self.failureResultOf(
+            client.callRemote(ReceiveAbortCommand, transfer_id=u"123"),
+            UnknownTransfer)
+
+    def test_connection_lost(self):
+        """
+        When a ``VolumeAgentAMP`` connection is lost the volumes being
+        received over it are aborted.
+        """
+        service = _ReceivingService()
+        protocol = VolumeAgentAMP(service)
+        protocol.makeConnection(StringTransport())
+        LoopbackAMPClient(protocol._locator).callRemote(
+            ReceiveCommand, transfer_id=u"123", node_id=u"abc",
+            name=MY_VOLUME, codecs=[])
+        protocol.connectionLost(Failure(ConnectionDone()))
+        service.protocol.reason.trap(ConnectionLost)
+        self.successResultOf(protocol.finished)
+
+    def test_codec_negotiated(self):
+        """
+        The agent chooses the first codec offered in a ``ReceiveCommand``
+        which it can use.
+        """
+        client = LoopbackAMPClient(_VolumeAgentLocator(_ReceivingService()))
+        self.assertEqual(
+            self.successResultOf(client.callRemote(
+                ReceiveCommand, transfer_id=u"123", node_id=u"abc",
+                name=MY_VOLUME, codecs=[b"unknown", b"zlib", b"identity"])),
+            {"codec": b"zlib"})
+
+    def test_no_codec_negotiated(self):
+        """
+        If none of the offered codecs can be used, the data is not
+        compressed.
+        """
+        client = LoopbackAMPClient(_VolumeAgentLocator(_ReceivingService()))
+        self.assertEqual(
+            self.successResultOf(client.callRemote(
+                ReceiveCommand, transfer_id=u"123", node_id=u"abc",
+                name=MY_VOLUME, codecs=[b"unknown"])),
+            {"codec": b"identity"})
+
+    def test_stream_features(self):
+        """
+        ``StreamFeaturesCommand`` is answered with the stream features of
+        the volume manager's storage pool.
+        """
+        service = create_agent_servicepair(self).to_service
+        self.patch(service.pool, "stream_features",
+                   lambda: succeed(frozenset([b"b", b"a"])))
+        client = LoopbackAMPClient(_VolumeAgentLocator(service))
+        self.assertEqual(
+            self.successResultOf(client.callRemote(StreamFeaturesCommand)),
+            {"features": [b"a", b"b"]})
+
+    def test_snapshots_invalidated(self):
+        """
+        The storage pool is invalidated before answering
+        ``SnapshotsCommand``, since other processes may have changed the
+        volume's snapshots.
+        """
+        service = create_agent_servicepair(self).to_service
+        invalidated = []
+        self.patch(service.pool, "invalidate",
+                   lambda: invalidated.append(True))
+        client = LoopbackAMPClient(_VolumeAgentLocator(service))
+        self.successResultOf(client.callRemote(
+            SnapshotsCommand, node_id=service.node_id, name=MY_VOLUME))
+        self.assertEqual(invalidated, [True])
+
+    def test_no_resume_token(self):
+        """
+        ``ResumeTokenCommand`` is answered with no token if no stream to the
+        volume was interrupted.
+        """
+        service = create_agent_servicepair(self).to_service
+        client = LoopbackAMPClient(_VolumeAgentLocator(service))
+        self.assertEqual(
+            self.successResultOf(client.callRemote(
+                ResumeTokenCommand, node_id=u"abc", name=MY_VOLUME)),
+            {"resume_token": None})
+
+
+class ReceiveEndpointTests(SynchronousTestCase):
+    """
+    Tests for ``_ReceiveEndpoint``.
+    """
+    def test_codecs_offered(self):
+        """
+        The given codecs are offered in the ``ReceiveCommand``, and the
+        connected protocol's transport compresses with the one chosen.
+        """
+        connection = _RecordingConnection()
+        endpoint = _ReceiveEndpoint(
+            connection, create_agent_servicepair(self).from_service.get(
+                MY_VOLUME),
+            MemoryLogger(), [ZLIB, IDENTITY])
+        connecting = endpoint.connect(_SingleProtocolFactory(_Protocol()))
+        command, kwargs, d = connection.calls[0]
+        d.callback({"codec": b"zlib"})
+        protocol = self.successResultOf(connecting)
+        self.assertEqual((kwargs["codecs"], protocol.transport._codec),
+                         ([b"zlib", b"identity"], ZLIB))
+
+
+class _DroppingClient(LoopbackAMPClient):
+    """
+    Send commands to a volume agent locator in memory, dropping the
+    connection once a given amount of data has been sent for transfers.
+
+    :ivar int sent: The number of bytes of data sent for transfers.
+    :ivar bool dropped: Whether the connection has been dropped.
+    """
+    def __init__(self, command_locator, after):
+        """
+        :param command_locator: The ``_VolumeAgentLocator`` to send commands
+            to.
+        :param int after: The number of bytes of data to send before
+            dropping the connection.
+        """
+        LoopbackAMPClient.__init__(self, command_locator)
+        self._after = after
+        self.sent = 0
+        self.dropped = False
+
+    def callRemote(self, command, **kwargs):
+        if self.dropped:
+            return fail(ConnectionLost())
+        if command is ReceiveDataCommand:
+            self.sent += len(kwargs["data"])
+            if self.sent > self._after:
+                # The agent aborts the transfers on the connection once it
+                # is lost, as ``VolumeAgentAMP`` does:
+                self.dropped = True
+                self._locator.abort_all()
+                return fail(ConnectionLost())
+        return LoopbackAMPClient.callRemote(self, command, **kwargs)
+
+
+class ResumeTests(SynchronousTestCase):
+    """
+    Tests for resuming pushes to a volume agent whose connection was lost.
+    """
+    def setUp(self):
+        self.service_pair = create_agent_servicepair(self)
+        from_service = self.service_pair.from_service
+        volume = self.successResultOf(
+            from_service.create(from_service.get(MY_VOLUME)))
+        self.data = os.urandom(200000)
+        volume.get_filesystem().get_path().child(b"data").setContent(
+            self.data)
+        self.received = Volume(node_id=from_service.node_id, name=MY_VOLUME,
+                               service=self.service_pair.to_service)
+
+    def push(self, after=2 ** 64):
+        """
+        Push the volume to the agent, dropping the connection after some of
+        its data.
+
+        :param int after: The number of bytes to send before dropping the
+            connection.
+
+        :return: A tuple of the ``_DroppingClient`` used and the result of
+            pushing.
+        """
+        from_service = self.service_pair.from_service
+        client = _DroppingClient(
+            _VolumeAgentLocator(self.service_pair.to_service), after)
+        pushing = from_service.push(from_service.get(MY_VOLUME),
+                                    AgentVolumeManager(client))
+        return client, pushing
+
+    def interrupt(self, after):
+        """
+        Push the volume, dropping the connection after some of its data.
+
+        :param int after: The number of bytes to send before dropping the
+            connection.
+
+        :return: The resume token of the interrupted stream.
+        """
+        client, pushing = self.push(after)
+        self.failureResultOf(pushing, ConnectionLost)
+        return self.successResultOf(
+            self.received.get_filesystem().resume_token())
+
+    def test_resume(self):
+        """
+        However far a push got before its connection was dropped, the next
+        push resumes it, sending less data than a whole new stream.
+        """
+        full, pushing = self.push()
+        self.successResultOf(pushing)
+        random = Random(0)
+        results = []
+        for i in range(5):
+            self.data = os.urandom(200000)
+            self.service_pair.from_service.get(
+                MY_VOLUME).get_filesystem().get_path().child(
+                    b"data").setContent(self.data)
+            token = self.interrupt(
+                random.randint(MAX_VALUE_LENGTH, full.sent - 1))
+            resumed, pushing = self.push()
+            self.successResultOf(pushing)
+            results.append((
+                token is not None, resumed.sent < full.sent,
+                self.received.get_filesystem().get_path().child(
+                    b"data").getContent() == self.data,
+                self.successResultOf(
+                    self.received.get_filesystem().resume_token())))
+        self.assertEqual(results, [(True, True, True, None)] * 5)
+
+    def test_resume_token_sent(self):
+        """
+        The resume token of the interrupted stream is sent when resuming.
+        """
+        token = self.interrupt(100000)
+        to_service = self.service_pair.to_service
+        received = []
+        original_receive = to_service.receive
+
+        def receive(node_id, name, source, resume_token=None):
+            received.append(resume_token)
+            return original_receive(node_id, name, source, resume_token)
+        self.patch(to_service, "receive", receive)
+        self.successResultOf(self.push()[1])
+        self.assertEqual(received, [token])
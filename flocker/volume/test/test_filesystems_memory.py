@@ -11,12 +11,14 @@ from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 
 from .filesystemtests import (
-    make_ifilesystemsnapshots_tests, make_istoragepool_tests,
+    MY_VOLUME, make_ifilesystemsnapshots_tests, make_istoragepool_tests,
 )
+from ..filesystems.errors import UnresumableStream
 from ..filesystems.memory import (
     CannedFilesystemSnapshots, FilesystemStoragePool,
-    DirectoryFilesystem,
+    DirectoryFilesystem, _resume_token,
 )
+from ..testtools import service_for_pool
 from ...testtools import (
     assert_equal_comparison, assert_not_equal_comparison
 )
@@ -95,3 +97,64 @@ class DirectoryFilesystemTests(SynchronousTestCase):
             repr(DirectoryFilesystem(
                 path=FilePath(b"/foo/bar"), size=123))
         )
+
+
+class DirectoryFilesystemResumeTests(SynchronousTestCase):
+    """
+    Tests for resuming streams to and from ``DirectoryFilesystem``.
+    """
+    def setUp(self):
+        self.pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = service_for_pool(self, self.pool)
+        self.filesystem = self.successResultOf(
+            self.pool.create(service.get(MY_VOLUME)))
+
+    def test_changed(self):
+        """
+        ``DirectoryFilesystem.reader_endpoint`` raises ``UnresumableStream``
+        if the directory changed since the stream being resumed was
+        started.
+        """
+        self.filesystem.get_path().child(b"data").setContent(b"old")
+        with self.filesystem.reader() as reader:
+            data = reader.read()
+        self.filesystem.get_path().child(b"data").setContent(b"new")
+        self.assertRaises(
+            UnresumableStream, self.filesystem.reader_endpoint,
+            resume_token=_resume_token(data[:-1]))
+
+    def test_bad_token(self):
+        """
+        ``DirectoryFilesystem.reader_endpoint`` raises ``UnresumableStream``
+        if the resume token can't be parsed.
+        """
+        self.assertRaises(
+            UnresumableStream, self.filesystem.reader_endpoint,
+            resume_token=b"garbage")
+
+    def test_wrong_token(self):
+        """
+        ``DirectoryFilesystem.writer_endpoint`` raises ``UnresumableStream``
+        if the resume token isn't that of the interrupted write.
+        """
+        self.filesystem._partial().setContent(b"partial")
+        self.assertRaises(
+            UnresumableStream, self.filesystem.writer_endpoint,
+            resumable=True, resume_token=b"7:abc")
+
+    def test_nothing_to_resume(self):
+        """
+        ``DirectoryFilesystem.writer_endpoint`` raises ``UnresumableStream``
+        if a resume token is given but no write was interrupted.
+        """
+        self.assertRaises(
+            UnresumableStream, self.filesystem.writer_endpoint,
+            resumable=True, resume_token=b"0:abc")
+
+    def test_enumerate_ignores_partial(self):
+        """
+        The data of an interrupted write is not enumerated as a filesystem.
+        """
+        self.filesystem._partial().setContent(b"partial")
+        self.assertEqual(self.successResultOf(self.pool.enumerate()),
+                         {self.filesystem})
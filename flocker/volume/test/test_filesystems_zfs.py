@@ -9,6 +9,8 @@ Further coverage is provided in
 import os
 
 from twisted.trial.unittest import SynchronousTestCase
+from twisted.internet.endpoints import connectProtocol
+from twisted.internet.protocol import Protocol
 from twisted.internet.error import ProcessDone, ProcessTerminated
 from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
@@ -22,12 +24,18 @@ from ...testtools import (
     FakeProcessReactor, assert_equal_comparison, assert_not_equal_comparison
 )
 
+from ..filesystems import zfs
 from ..filesystems.zfs import (
     _DatasetInfo,
     zfs_command, CommandFailed, BadArguments, Filesystem, ZFSSnapshots,
     _sync_command_error_squashed, _latest_common_snapshot, ZFS_ERROR,
-    Snapshot,
+    Snapshot, StoragePool, _parse_stream_features, _send_options,
+    _Inventory, _PoolListing, _parse_pool_listing, _list_pool_command,
+    _list_snapshots_command,
 )
+from .._model import VolumeSize
+from ..service import Volume
+from .filesystemtests import MY_VOLUME
 
 
 class FilesystemTests(SynchronousTestCase):
@@ -412,3 +420,562 @@ class DatasetInfoTests(SynchronousTestCase):
         """
         self.assertRaises(
             AttributeError, setattr, self.info, "refquota", 321)
+
+
+# ``zfs send`` usage and ``zpool get`` output of a ZFS supporting every
+# stream feature, on a pool with every feature enabled:
+_USAGE = b"""missing snapshot argument
+usage:
+\tsend [-DnPpRvLec] [-[iI] snapshot] <snapshot>
+\tsend [-Lec] [-i snapshot|bookmark] <filesystem|volume|snapshot>
+"""
+
+_PROPERTIES = b"""size\t1073741824
+feature@lz4_compress\tactive
+feature@embedded_data\tactive
+feature@large_blocks\tenabled
+"""
+
+
+class ParseStreamFeaturesTests(SynchronousTestCase):
+    """
+    Tests for ``_parse_stream_features``.
+    """
+    def test_all(self):
+        """
+        Every stream feature whose ``zfs send`` option is supported and
+        whose pool feature is enabled or active can be used.
+        """
+        self.assertEqual(
+            _parse_stream_features(_USAGE, _PROPERTIES),
+            frozenset([b"large_blocks", b"embedded_data", b"compressed"]))
+
+    def test_option_unsupported(self):
+        """
+        A stream feature can't be used if ``zfs send`` doesn't support its
+        option.
+        """
+        self.assertEqual(
+            _parse_stream_features(
+                b"usage:\n\tsend [-DnPpRvLe] [-[iI] snapshot] <snapshot>\n",
+                _PROPERTIES),
+            frozenset([b"large_blocks", b"embedded_data"]))
+
+    def test_pool_feature_disabled(self):
+        """
+        A stream feature can't be used if its pool feature is disabled.
+        """
+        self.assertEqual(
+            _parse_stream_features(
+                _USAGE, _PROPERTIES.replace(b"\tenabled", b"\tdisabled")),
+            frozenset([b"embedded_data", b"compressed"]))
+
+    def test_resumable(self):
+        """
+        Streams are resumable if ``zfs send`` can resume them from a token
+        and the pool's ``extensible_dataset`` feature is enabled.
+        """
+        self.assertIn(
+            b"resumable",
+            _parse_stream_features(
+                _USAGE + b"\tsend [-Penv] -t <receive_resume_token>\n",
+                _PROPERTIES + b"feature@extensible_dataset\tenabled\n"))
+
+    def test_resumable_pool_feature_disabled(self):
+        """
+        Streams are not resumable if the pool's ``extensible_dataset``
+        feature is disabled.
+        """
+        self.assertNotIn(
+            b"resumable",
+            _parse_stream_features(
+                _USAGE + b"\tsend [-Penv] -t <receive_resume_token>\n",
+                _PROPERTIES + b"feature@extensible_dataset\tdisabled\n"))
+
+    def test_unknown_usage(self):
+        """
+        No stream features can be used if the ``zfs send`` usage can't be
+        understood.
+        """
+        self.assertEqual(_parse_stream_features(b"", _PROPERTIES),
+                         frozenset())
+
+
+class SendOptionsTests(SynchronousTestCase):
+    """
+    Tests for ``_send_options``.
+    """
+    def test_options(self):
+        """
+        ``_send_options`` returns the ``zfs send`` options using the given
+        stream features.
+        """
+        self.assertEqual(
+            _send_options(frozenset([b"compressed", b"large_blocks"])),
+            [b"-L", b"-c"])
+
+    def test_none(self):
+        """
+        No options are used without stream features.
+        """
+        self.assertEqual(_send_options(frozenset()), [])
+
+
+class StoragePoolStreamFeaturesTests(SynchronousTestCase):
+    """
+    Tests for ``StoragePool.stream_features``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(self.reactor, b"hpool/flocker",
+                                FilePath(b"/flocker"))
+
+    def finish(self, usage=_USAGE, properties=_PROPERTIES):
+        """
+        End the ``zfs send`` and ``zpool get`` processes.
+        """
+        send, get = self.reactor.processes
+        send.processProtocol.childDataReceived(2, usage)
+        send.processProtocol.processEnded(Failure(ProcessTerminated(2)))
+        get.processProtocol.childDataReceived(1, properties)
+        get.processProtocol.processEnded(Failure(ProcessDone(0)))
+
+    def test_commands(self):
+        """
+        ``zfs send`` is run without arguments to find its supported options,
+        and ``zpool get`` to find the features of the pool containing the
+        Flocker filesystems.
+        """
+        self.pool.stream_features()
+        self.assertEqual(
+            [list(process.args) for process in self.reactor.processes],
+            [[b"zfs", b"send"],
+             [b"zpool", b"get", b"-H", b"-o", b"property,value", b"all",
+              b"hpool"]])
+
+    def test_features(self):
+        """
+        ``StoragePool.stream_features`` fires with the features supported
+        by both ZFS and the pool.
+        """
+        d = self.pool.stream_features()
+        self.finish()
+        self.assertEqual(
+            self.successResultOf(d),
+            frozenset([b"large_blocks", b"embedded_data", b"compressed"]))
+
+    def test_cached(self):
+        """
+        The features are only found once.
+        """
+        self.pool.stream_features()
+        self.finish()
+        d = self.pool.stream_features()
+        self.assertEqual(
+            (len(self.reactor.processes), self.successResultOf(d)),
+            (2, frozenset([b"large_blocks", b"embedded_data",
+                           b"compressed"])))
+
+    def test_failed(self):
+        """
+        If the commands can't be run no stream features are used.
+        """
+        d = self.pool.stream_features()
+        send, get = self.reactor.processes
+        send.processProtocol.processEnded(Failure(ProcessTerminated(2)))
+        get.processProtocol.processEnded(
+            Failure(ProcessTerminated(signal=9)))
+        self.assertEqual(self.successResultOf(d), frozenset())
+
+
+class FilesystemResumeTokenTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.resume_token``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.filesystem = Filesystem(b"hpool", b"mydataset",
+                                     reactor=self.reactor)
+
+    def test_command(self):
+        """
+        The token is the filesystem's ``receive_resume_token`` property.
+        """
+        self.filesystem.resume_token()
+        self.assertEqual(
+            list(self.reactor.processes[0].args),
+            [b"zfs", b"get", b"-H", b"-o", b"value", b"receive_resume_token",
+             b"hpool/mydataset"])
+
+    def test_token(self):
+        """
+        ``Filesystem.resume_token`` fires with the token if a receive was
+        interrupted.
+        """
+        d = self.filesystem.resume_token()
+        protocol = self.reactor.processes[0].processProtocol
+        protocol.childDataReceived(1, b"1-abc-def\n")
+        protocol.processEnded(Failure(ProcessDone(0)))
+        self.assertEqual(self.successResultOf(d), b"1-abc-def")
+
+    def test_no_token(self):
+        """
+        ``Filesystem.resume_token`` fires with ``None`` if no receive was
+        interrupted.
+        """
+        d = self.filesystem.resume_token()
+        protocol = self.reactor.processes[0].processProtocol
+        protocol.childDataReceived(1, b"-\n")
+        protocol.processEnded(Failure(ProcessDone(0)))
+        self.assertIs(self.successResultOf(d), None)
+
+    def test_unsupported(self):
+        """
+        ``Filesystem.resume_token`` fires with ``None`` if the property
+        can't be read.
+        """
+        d = self.filesystem.resume_token()
+        self.reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(2)))
+        self.assertIs(self.successResultOf(d), None)
+
+
+class FilesystemReaderEndpointTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.reader_endpoint``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.filesystem = Filesystem(b"hpool", b"mydataset",
+                                     reactor=self.reactor)
+
+    def test_nothing_run_until_connected(self):
+        """
+        No snapshot is taken until the endpoint is connected to.
+        """
+        self.filesystem.reader_endpoint()
+        self.assertEqual(self.reactor.processes, [])
+
+    def test_full_stream(self):
+        """
+        If the writer has none of the filesystem's snapshots, connecting to
+        the endpoint takes a snapshot, lists the filesystem's snapshots
+        without blocking and sends the whole new snapshot.
+        """
+        endpoint = self.filesystem.reader_endpoint([Snapshot(name=b"other")])
+        connecting = connectProtocol(endpoint, Protocol())
+        snapshot = self.reactor.processes[0].args[-1]
+        self.reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessDone(0)))
+        listing = self.reactor.processes[1].processProtocol
+        listing.childDataReceived(1, b"hpool/mydataset@snap1\n" + snapshot)
+        listing.processEnded(Failure(ProcessDone(0)))
+        self.assertEqual(
+            ([list(process.args) for process in self.reactor.processes],
+             self.successResultOf(connecting).__class__),
+            ([[b"zfs", b"snapshot", snapshot],
+              [b"zfs"] + _list_snapshots_command(self.filesystem),
+              [b"zfs", b"send", snapshot]],
+             Protocol))
+
+    def test_snapshot_failed(self):
+        """
+        If the snapshot can't be taken, connecting to the endpoint fails.
+        """
+        endpoint = self.filesystem.reader_endpoint()
+        connecting = connectProtocol(endpoint, Protocol())
+        self.reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.failureResultOf(connecting, CommandFailed)
+
+
+# ``zfs list`` output for a pool with filesystems, a nested filesystem and
+# snapshots:
+_POOL_LISTING = b"""hpool\t/hpool\t0
+hpool/fs1\t/flocker/fs1\t0
+hpool/fs1@snap1\t-\t-
+hpool/fs2\t/flocker/fs2\t1048576
+hpool/fs2/child\t/flocker/fs2/child\t0
+hpool/fs1@snap2\t-\t-
+hpool/fs2/child@snap3\t-\t-
+"""
+
+
+class ParsePoolListingTests(SynchronousTestCase):
+    """
+    Tests for ``_parse_pool_listing``.
+    """
+    def test_parse(self):
+        """
+        ``_parse_pool_listing`` finds the direct children of the pool and the
+        snapshots of every filesystem, in the order they are listed.
+        """
+        self.assertEqual(
+            _parse_pool_listing(_POOL_LISTING, b"hpool"),
+            _PoolListing(
+                filesystems=[
+                    _DatasetInfo(dataset=b"fs1", mountpoint=b"/flocker/fs1",
+                                 refquota=None),
+                    _DatasetInfo(dataset=b"fs2", mountpoint=b"/flocker/fs2",
+                                 refquota=1048576)],
+                snapshots={b"hpool/fs1": [b"snap1", b"snap2"],
+                           b"hpool/fs2/child": [b"snap3"]}))
+
+    def test_empty(self):
+        """
+        A pool without filesystems lists nothing.
+        """
+        self.assertEqual(
+            _parse_pool_listing(b"hpool\t/hpool\t0\n", b"hpool"),
+            _PoolListing(filesystems=[], snapshots={}))
+
+
+class InventoryTests(SynchronousTestCase):
+    """
+    Tests for ``_Inventory``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.inventory = _Inventory(self.reactor, b"hpool")
+
+    def finish(self, index=-1, output=_POOL_LISTING):
+        """
+        End a ``zfs list`` process successfully.
+
+        :param int index: The index of the process in those spawned.
+        :param bytes output: The output of the process.
+        """
+        protocol = self.reactor.processes[index].processProtocol
+        protocol.childDataReceived(1, output)
+        protocol.processEnded(Failure(ProcessDone(0)))
+
+    def test_command(self):
+        """
+        The filesystems and snapshots of the whole pool are listed with one
+        ``zfs list``.
+        """
+        self.inventory.listing()
+        self.assertEqual(
+            [list(process.args) for process in self.reactor.processes],
+            [[b"zfs", b"list", b"-H", b"-p", b"-r",
+              b"-t", b"filesystem,snapshot",
+              b"-o", b"name,mountpoint,refquota", b"-s", b"creation",
+              b"hpool"]])
+
+    def test_listing(self):
+        """
+        ``_Inventory.listing`` fires with the parsed output of ``zfs list``.
+        """
+        d = self.inventory.listing()
+        self.finish()
+        self.assertEqual(self.successResultOf(d),
+                         _parse_pool_listing(_POOL_LISTING, b"hpool"))
+
+    def test_cached(self):
+        """
+        Once the pool has been listed the listing is reused.
+        """
+        self.inventory.listing()
+        self.finish()
+        d = self.inventory.listing()
+        self.assertEqual(
+            (len(self.reactor.processes), self.successResultOf(d)),
+            (1, _parse_pool_listing(_POOL_LISTING, b"hpool")))
+
+    def test_concurrent(self):
+        """
+        Listings asked for while the pool is being listed wait for that
+        listing rather than starting another.
+        """
+        first = self.inventory.listing()
+        second = self.inventory.listing()
+        self.finish()
+        self.assertEqual(
+            (len(self.reactor.processes), self.successResultOf(first),
+             self.successResultOf(second)),
+            (1, _parse_pool_listing(_POOL_LISTING, b"hpool"),
+             _parse_pool_listing(_POOL_LISTING, b"hpool")))
+
+    def test_invalidate(self):
+        """
+        After ``_Inventory.invalidate`` the pool is listed again.
+        """
+        self.inventory.listing()
+        self.finish()
+        self.inventory.invalidate()
+        d = self.inventory.listing()
+        self.finish(output=b"")
+        self.assertEqual(
+            (len(self.reactor.processes), self.successResultOf(d)),
+            (2, _PoolListing(filesystems=[], snapshots={})))
+
+    def test_invalidated_while_listing(self):
+        """
+        If the inventory is invalidated while the pool is being listed, the
+        listing is given to those who were already waiting for it but isn't
+        reused, since it may not include the change.
+        """
+        first = self.inventory.listing()
+        self.inventory.invalidate()
+        second = self.inventory.listing()
+        self.finish(0)
+        self.assertNoResult(second)
+        self.finish(1, b"")
+        third = self.inventory.listing()
+        self.assertEqual(
+            (len(self.reactor.processes), self.successResultOf(first),
+             self.successResultOf(second), self.successResultOf(third)),
+            (2, _parse_pool_listing(_POOL_LISTING, b"hpool"),
+             _PoolListing(filesystems=[], snapshots={}),
+             _PoolListing(filesystems=[], snapshots={})))
+
+    def test_failed(self):
+        """
+        If the pool can't be listed everyone waiting for the listing is told,
+        and the pool is listed again next time.
+        """
+        first = self.inventory.listing()
+        second = self.inventory.listing()
+        self.reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.failureResultOf(first, CommandFailed)
+        self.failureResultOf(second, CommandFailed)
+        self.inventory.listing()
+        self.assertEqual(len(self.reactor.processes), 2)
+
+    def test_changed(self):
+        """
+        ``_Inventory.changed`` invalidates the inventory and returns its
+        argument, so it can be added to the result of a change.
+        """
+        self.inventory.listing()
+        self.finish()
+        result = object()
+        self.assertIs(self.inventory.changed(result), result)
+        self.inventory.listing()
+        self.assertEqual(len(self.reactor.processes), 2)
+
+
+class StoragePoolInventoryTests(SynchronousTestCase):
+    """
+    Tests for ``StoragePool`` and its ``Filesystem``\ s sharing an
+    ``_Inventory``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(self.reactor, b"hpool", FilePath(b"/flocker"))
+        enumerating = self.pool.enumerate()
+        self.finish()
+        self.filesystems = sorted(self.successResultOf(enumerating),
+                                  key=lambda filesystem: filesystem.name)
+
+    def finish(self):
+        """
+        End the last process spawned with the output of ``zfs list``.
+        """
+        protocol = self.reactor.processes[-1].processProtocol
+        protocol.childDataReceived(1, _POOL_LISTING)
+        protocol.processEnded(Failure(ProcessDone(0)))
+
+    def test_enumerate(self):
+        """
+        ``StoragePool.enumerate`` returns the pool's direct children.
+        """
+        self.assertEqual(
+            [(filesystem.name, filesystem.get_path(), filesystem.size)
+             for filesystem in self.filesystems],
+            [(b"hpool/fs1", FilePath(b"/flocker/fs1"),
+              VolumeSize(maximum_size=None)),
+             (b"hpool/fs2", FilePath(b"/flocker/fs2"),
+              VolumeSize(maximum_size=1048576))])
+
+    def test_snapshots(self):
+        """
+        The snapshots of all the enumerated filesystems are found without
+        running any more commands.
+        """
+        snapshots = [self.successResultOf(filesystem.snapshots())
+                     for filesystem in self.filesystems]
+        self.assertEqual(
+            (len(self.reactor.processes), snapshots),
+            (1, [[Snapshot(name=b"snap1"), Snapshot(name=b"snap2")], []]))
+
+    def test_invalidate(self):
+        """
+        After ``StoragePool.invalidate`` the pool is listed again.
+        """
+        self.pool.invalidate()
+        self.pool.enumerate()
+        self.assertEqual(len(self.reactor.processes), 2)
+
+    def test_snapshot_created(self):
+        """
+        Creating a snapshot of a filesystem invalidates the inventory once
+        it is done.
+        """
+        ZFSSnapshots(self.reactor, self.filesystems[0]).create(b"snap4")
+        self.reactor.processes[-1].processProtocol.processEnded(
+            Failure(ProcessDone(0)))
+        self.filesystems[0].snapshots()
+        self.assertEqual(len(self.reactor.processes), 3)
+
+    def test_receive_failed(self):
+        """
+        A ``zfs receive`` connected to using ``Filesystem.writer_endpoint``
+        invalidates the inventory when it exits, even if it fails, since it
+        may have kept what it received.
+        """
+        endpoint = self.filesystems[0].writer_endpoint(True, b"1-abc")
+        connectProtocol(endpoint, Protocol())
+        self.reactor.processes[-1].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.filesystems[0].snapshots()
+        self.assertEqual(len(self.reactor.processes), 3)
+
+    def test_spawned_receive_failed(self):
+        """
+        A ``zfs receive`` spawned using ``Filesystem.writer_endpoint``
+        invalidates the inventory when it exits, even if it fails.
+        """
+        endpoint = self.filesystems[0].writer_endpoint(True, b"1-abc")
+        receiving = endpoint.spawn()
+        self.reactor.processes[-1].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.failureResultOf(receiving, ProcessTerminated)
+        self.filesystems[0].snapshots()
+        self.assertEqual(len(self.reactor.processes), 3)
+
+    def test_reader_endpoint_uses_inventory(self):
+        """
+        Connecting to ``Filesystem.reader_endpoint`` takes a snapshot, then
+        finds the latest snapshot the writer has using the inventory rather
+        than listing the filesystem's snapshots synchronously.
+        """
+        def check_output(*args, **kwargs):
+            raise AssertionError("Blocking command run")
+        self.patch(zfs, "check_output", check_output)
+        endpoint = self.filesystems[0].reader_endpoint(
+            [Snapshot(name=b"snap1")], frozenset([b"compressed"]))
+        connectProtocol(endpoint, Protocol())
+        snapshot = self.reactor.processes[-1].args[-1]
+        self.reactor.processes[-1].processProtocol.processEnded(
+            Failure(ProcessDone(0)))
+        self.finish()
+        self.assertEqual(
+            [list(process.args) for process in self.reactor.processes[1:]],
+            [[b"zfs", b"snapshot", snapshot],
+             [b"zfs"] + _list_pool_command(b"hpool"),
+             [b"zfs", b"send", b"-c", b"-i", b"hpool/fs1@snap1", snapshot]])
+
+    def test_maximum_size_set(self):
+        """
+        Setting the maximum size of a filesystem invalidates the inventory
+        once it is done, even if it fails.
+        """
+        volume = Volume(node_id=u"abc", name=MY_VOLUME, service=None)
+        setting = self.pool.set_maximum_size(volume)
+        self.reactor.processes[-1].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.failureResultOf(setting)
+        self.pool.enumerate()
+        self.assertEqual(len(self.reactor.processes), 3)
@@ -6,8 +6,13 @@ Unit tests for IPC.
 
 from __future__ import absolute_import
 
+import os
+
 from zope.interface.verify import verifyObject
 
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.internet.error import ConnectionLost
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
@@ -18,8 +23,10 @@ from ..filesystems.memory import FilesystemStoragePool
 from .._ipc import (
     IRemoteVolumeManager, RemoteVolumeManager, LocalVolumeManager,
     standard_node, SSH_PRIVATE_KEY_PATH)
-from ..testtools import ServicePair
-from ...common import FakeNode
+from ..testtools import (
+    ServicePair, VolumeCommandNode, create_volume_service,
+    )
+from ...common import FakeNode, transfer
 from ...common._ipc import ProcessNode
 
 
@@ -64,25 +71,9 @@ def make_iremote_volume_manager(fixture):
             getting_snapshots.addCallback(got_snapshots)
             return getting_snapshots
 
-        def test_receive_exceptions_pass_through(self):
-            """
-            Exceptions raised in the ``receive()`` context manager are not
-            swallowed.
-            """
-            service_pair = fixture(self)
-            created = service_pair.from_service.create(
-                service_pair.from_service.get(MY_VOLUME)
-            )
-
-            def got_volume(volume):
-                with service_pair.remote.receive(volume):
-                    raise RuntimeError()
-            created.addCallback(got_volume)
-            return self.assertFailure(created, RuntimeError)
-
-        def test_receive_creates_volume(self):
+        def test_receive_endpoint_creates_volume(self):
             """
-            ``receive`` creates a volume.
+            ``receive_endpoint`` returns an endpoint which creates a volume.
             """
             service_pair = fixture(self)
             created = service_pair.from_service.create(
@@ -90,9 +81,9 @@ def make_iremote_volume_manager(fixture):
             )
 
             def do_push(volume):
-                with volume.get_filesystem().reader() as reader:
-                    with service_pair.remote.receive(volume) as receiver:
-                        receiver.write(reader.read())
+                return transfer(
+                    volume.get_filesystem().reader_endpoint(),
+                    service_pair.remote.receive_endpoint(reactor, volume))
             created.addCallback(do_push)
 
             def pushed(_):
@@ -109,8 +100,11 @@ def make_iremote_volume_manager(fixture):
 
             return created
 
-        def test_creates_files(self):
-            """``receive`` recreates files pushed from origin."""
+        def test_receive_endpoint_creates_files(self):
+            """
+            ``receive_endpoint`` returns an endpoint which recreates files
+            pushed from origin.
+            """
             service_pair = fixture(self)
             created = service_pair.from_service.create(
                 service_pair.from_service.get(MY_VOLUME)
@@ -119,10 +113,9 @@ def make_iremote_volume_manager(fixture):
             def do_push(volume):
                 root = volume.get_filesystem().get_path()
                 root.child(b"afile.txt").setContent(b"WORKS!")
-
-                with volume.get_filesystem().reader() as reader:
-                    with service_pair.remote.receive(volume) as receiver:
-                        receiver.write(reader.read())
+                return transfer(
+                    volume.get_filesystem().reader_endpoint(),
+                    service_pair.remote.receive_endpoint(reactor, volume))
             created.addCallback(do_push)
 
             def pushed(_):
@@ -167,8 +160,8 @@ def make_iremote_volume_manager(fixture):
             created = self.remotely_owned_volume(service_pair)
 
             def got_volume(pushed_volume):
-                service_pair.remote.acquire(pushed_volume)
-                d = to_service.enumerate()
+                d = service_pair.remote.acquire(pushed_volume)
+                d.addCallback(lambda _: to_service.enumerate())
                 d.addCallback(lambda results: self.assertEqual(
                     list(results),
                     [Volume(node_id=to_service.node_id,
@@ -194,16 +187,17 @@ def make_iremote_volume_manager(fixture):
                 pushing = service_pair.from_service.push(
                     pushed_volume, service_pair.remote)
 
-                def pushed(ignored):
-                    service_pair.remote.acquire(pushed_volume)
+                pushing.addCallback(
+                    lambda _: service_pair.remote.acquire(pushed_volume))
 
+                def acquired(ignored):
                     filesystem = Volume(node_id=to_service.node_id,
                                         name=pushed_volume.name,
                                         service=to_service).get_filesystem()
                     new_root = filesystem.get_path()
                     self.assertEqual(new_root.child(b"test").getContent(),
                                      b"some data")
-                pushing.addCallback(pushed)
+                pushing.addCallback(acquired)
                 return pushing
 
             created.addCallback(got_volume)
@@ -211,16 +205,44 @@ def make_iremote_volume_manager(fixture):
 
         def test_acquire_returns_node_id(self):
             """
-            ``acquire()`` returns the node ID of the remote volume manager.
+            ``acquire()`` returns a ``Deferred`` that fires with the node ID
+            of the remote volume manager.
             """
             service_pair = fixture(self)
             to_service = service_pair.to_service
             created = self.remotely_owned_volume(service_pair)
+            created.addCallback(service_pair.remote.acquire)
+            created.addCallback(self.assertEqual, to_service.node_id)
+            return created
 
-            def got_volume(pushed_volume):
-                result = service_pair.remote.acquire(pushed_volume)
-                self.assertEqual(result, to_service.node_id)
-            created.addCallback(got_volume)
+        def test_stream_features(self):
+            """
+            ``stream_features()`` returns a ``Deferred`` that fires with a
+            ``frozenset`` of stream features, all of which the remote
+            volume manager's storage pool supports.
+            """
+            service_pair = fixture(self)
+            d = gatherResults([
+                service_pair.remote.stream_features(),
+                service_pair.to_service.pool.stream_features()])
+
+            def got_features((remote_features, pool_features)):
+                self.assertEqual(
+                    (type(remote_features),
+                     remote_features <= pool_features),
+                    (frozenset, True))
+            d.addCallback(got_features)
+            return d
+
+        def test_no_resume_token(self):
+            """
+            ``resume_token()`` returns a ``Deferred`` that fires with
+            ``None`` if no stream to the volume was interrupted.
+            """
+            service_pair = fixture(self)
+            created = self.remotely_owned_volume(service_pair)
+            created.addCallback(service_pair.remote.resume_token)
+            created.addCallback(self.assertIs, None)
             return created
 
         def test_clone_to(self):
@@ -296,6 +318,88 @@ class LocalVolumeManagerInterfaceTests(
             [], self.successResultOf(pair.remote.snapshots(volume)))
 
 
+def create_command_servicepair(test):
+    """
+    Create a ``ServicePair`` allowing testing of ``RemoteVolumeManager``,
+    whose ``flocker-volume`` commands are run in this process.
+
+    :param TestCase test: A unit test.
+
+    :return: A new ``ServicePair``.
+    """
+    to_service = create_volume_service(test)
+    return ServicePair(
+        from_service=create_volume_service(test), to_service=to_service,
+        remote=RemoteVolumeManager(VolumeCommandNode(to_service)))
+
+
+class RemoteVolumeManagerInterfaceTests(
+        make_iremote_volume_manager(create_command_servicepair)):
+    """
+    Tests for ``RemoteVolumeManager`` as a ``IRemoteVolumeManager``.
+    """
+
+
+class RemoteVolumeManagerResumeTests(TestCase):
+    """
+    Tests for resuming pushes to ``RemoteVolumeManager`` which were
+    interrupted.
+    """
+    def setUp(self):
+        self.service_pair = create_command_servicepair(self)
+        self.node = self.service_pair.remote._destination
+        from_service = self.service_pair.from_service
+        self.volume = self.successResultOf(
+            from_service.create(from_service.get(MY_VOLUME)))
+        self.data = os.urandom(200000)
+        self.volume.get_filesystem().get_path().child(b"data").setContent(
+            self.data)
+        self.received = Volume(node_id=self.volume.node_id, name=MY_VOLUME,
+                               service=self.service_pair.to_service)
+
+    def push(self):
+        """
+        Push the volume.
+
+        :return: The ``Deferred`` returned by ``VolumeService.push``.
+        """
+        return self.service_pair.from_service.push(
+            self.volume, self.service_pair.remote)
+
+    def test_resume(self):
+        """
+        If ``flocker-volume receive`` is interrupted, the next push resumes
+        the stream from the resume token reported by ``flocker-volume
+        resume_token``, using ``flocker-volume receive --resume-token``.
+        """
+        self.node.interrupt_after = 100000
+        self.failureResultOf(self.push(), ConnectionLost)
+        token = self.successResultOf(
+            self.service_pair.remote.resume_token(self.volume))
+        self.node.interrupt_after = None
+        self.successResultOf(self.push())
+        self.assertEqual(
+            (token is not None,
+             self.node.commands[-1][3:6],
+             self.received.get_filesystem().get_path().child(
+                 b"data").getContent() == self.data,
+             self.successResultOf(
+                 self.received.get_filesystem().resume_token())),
+            (True, [b"receive", b"--resume-token", token], True, None))
+
+    def test_new_stream(self):
+        """
+        If no push was interrupted, a new stream is sent.
+        """
+        self.successResultOf(self.push())
+        self.assertEqual(
+            ([command[3] for command in self.node.commands],
+             self.received.get_filesystem().get_path().child(
+                 b"data").getContent() == self.data),
+            ([b"snapshots", b"stream_features", b"resume_token",
+              b"receive"], True))
+
+
 class RemoteVolumeManagerTests(TestCase):
     """
     Tests for ``RemoteVolumeManager``.
@@ -325,36 +429,102 @@ class RemoteVolumeManagerTests(TestCase):
         self.assertEqual(
             [Snapshot(name="abc"), Snapshot(name="def")], snapshots)
 
-    def test_receive_destination_run(self):
+    def test_receive_endpoint_default_config(self):
         """
-        Receiving calls ``flocker-volume`` remotely with ``receive`` command.
+        ``RemoteVolumeManager`` by default calls ``flocker-volume`` with
+        default config path.
+        """
+        node = FakeNode()
+
+        remote = RemoteVolumeManager(node)
+        remote.receive_endpoint(reactor, self.volume)
+        self.assertEqual(node.remote_command,
+                         [b"flocker-volume", b"--config",
+                          DEFAULT_CONFIG_PATH.path,
+                          b"receive", self.volume.node_id.encode("ascii"),
+                          b"myns.myvol"])
+
+    def test_receive_endpoint_destination_endpoint(self):
+        """
+        ``RemoteVolumeManager.receive_endpoint()`` returns an endpoint which
+        calls ``flocker-volume`` remotely with the ``receive`` command.
         """
         node = FakeNode()
 
         remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
-        with remote.receive(self.volume):
-            pass
+        remote.receive_endpoint(reactor, self.volume)
         self.assertEqual(node.remote_command,
                          [b"flocker-volume", b"--config", b"/path/to/json",
                           b"receive", self.volume.node_id.encode("ascii"),
                           b"myns.myvol"])
 
-    def test_receive_default_config(self):
+    def test_receive_endpoint_resume_token(self):
         """
-        ``RemoteVolumeManager`` by default calls ``flocker-volume`` with
-        default config path.
+        ``RemoteVolumeManager.receive_endpoint()`` passes the resume token
+        of the stream it resumes to ``flocker-volume receive``.
         """
         node = FakeNode()
 
-        remote = RemoteVolumeManager(node)
-        with remote.receive(self.volume):
-            pass
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        remote.receive_endpoint(reactor, self.volume, b"1-abc")
         self.assertEqual(node.remote_command,
-                         [b"flocker-volume", b"--config",
-                          DEFAULT_CONFIG_PATH.path,
-                          b"receive", self.volume.node_id.encode("ascii"),
+                         [b"flocker-volume", b"--config", b"/path/to/json",
+                          b"receive", b"--resume-token", b"1-abc",
+                          self.volume.node_id.encode("ascii"),
                           b"myns.myvol"])
 
+    def test_resume_token_destination_run(self):
+        """
+        ``RemoteVolumeManager.resume_token()`` calls ``flocker-volume``
+        remotely with the ``resume_token`` sub-command, and returns a
+        ``Deferred`` that fires with the token it outputs.
+        """
+        node = FakeNode([b"1-abc\n"])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        token = self.successResultOf(remote.resume_token(self.volume))
+        self.assertEqual(
+            (node.remote_command, token),
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"resume_token", self.volume.node_id.encode("ascii"),
+              b"myns.myvol"], b"1-abc"))
+
+    def test_no_resume_token(self):
+        """
+        ``RemoteVolumeManager.resume_token()`` returns a ``Deferred`` that
+        fires with ``None`` if ``flocker-volume resume_token`` outputs
+        nothing.
+        """
+        remote = RemoteVolumeManager(FakeNode([b""]))
+        self.assertIs(
+            self.successResultOf(remote.resume_token(self.volume)), None)
+
+    def test_stream_features_destination_run(self):
+        """
+        ``RemoteVolumeManager.stream_features()`` calls ``flocker-volume``
+        remotely with the ``stream_features`` sub-command, and returns a
+        ``Deferred`` that fires with the features it outputs.
+        """
+        node = FakeNode([b"compressed\nresumable\n"])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        features = self.successResultOf(remote.stream_features())
+        self.assertEqual(
+            (node.remote_command, features),
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"stream_features"],
+             frozenset([b"compressed", b"resumable"])))
+
+    def test_stream_features_cached(self):
+        """
+        ``RemoteVolumeManager.stream_features()`` only calls
+        ``flocker-volume`` the first time it is called.
+        """
+        remote = RemoteVolumeManager(FakeNode([b"compressed\n"]))
+        remote.stream_features()
+        self.assertEqual(self.successResultOf(remote.stream_features()),
+                         frozenset([b"compressed"]))
+
     def test_acquire_destination_run(self):
         """
         ``RemoteVolumeManager.acquire()`` calls ``flocker-volume`` remotely
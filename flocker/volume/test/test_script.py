@@ -61,3 +61,27 @@ class StandardVolumeOptionsTests(make_volume_options_tests(VolumeOptions)):
     """
     Tests for ``VolumeService`` specific arguments of ``VolumeOptions``.
     """
+
+
+class ReceiveSubcommandOptionsTests(SynchronousTestCase):
+    """
+    Tests for the options of ``flocker-volume receive``.
+    """
+    def test_no_resume_token(self):
+        """
+        By default a new stream is received.
+        """
+        options = VolumeOptions()
+        options.parseOptions([b"receive", b"node1", b"myns.myvol"])
+        self.assertIs(options.subOptions["resume-token"], None)
+
+    def test_resume_token(self):
+        """
+        ``--resume-token`` gives the resume token of the stream that is
+        resumed.
+        """
+        options = VolumeOptions()
+        options.parseOptions(
+            [b"receive", b"--resume-token", b"1-abc", b"node1",
+             b"myns.myvol"])
+        self.assertEqual(options.subOptions["resume-token"], b"1-abc")
@@ -7,7 +7,6 @@ from __future__ import absolute_import
 from io import BytesIO
 import sys
 import json
-from contextlib import contextmanager
 
 from uuid import uuid4
 from StringIO import StringIO
@@ -16,6 +15,7 @@ from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
 from twisted.application.service import IService, Service
+from twisted.internet.defer import succeed
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath, Permissions
 from twisted.trial.unittest import SynchronousTestCase, TestCase
@@ -31,7 +31,7 @@ from ..filesystems.memory import FilesystemStoragePool
 from ..filesystems.zfs import StoragePool
 from .._ipc import RemoteVolumeManager, LocalVolumeManager
 from ..testtools import create_volume_service
-from ...common import FakeNode
+from ...common import FakeNode, MemoryProcessEndpoint
 from ...testtools import (
     skip_on_broken_permissions, attempt_effective_uid, make_with_init_tests,
     assert_equal_comparison, assert_not_equal_comparison,
@@ -441,6 +441,9 @@ class VolumeServiceAPITests(TestCase):
             # run.  It doesn't need to produce any particular output for this
             # test, it just needs to not fail.
             b"",
+            # Then `flocker-volume stream_features`; with no features the
+            # stream is not resumable, so no resume token is asked for.
+            b"",
         ])
 
         self.successResultOf(service.push(volume, RemoteVolumeManager(node)))
@@ -461,11 +464,13 @@ class VolumeServiceAPITests(TestCase):
             def snapshots(self, volume):
                 return volume.get_filesystem().snapshots()
 
-            @contextmanager
-            def receive(self, volume):
+            def stream_features(self):
+                return succeed(frozenset())
+
+            def receive_endpoint(self, reactor, volume, resume_token=None):
                 writer = BytesIO()
-                yield writer
                 self.written.append(writer)
+                return MemoryProcessEndpoint(stdin=writer)
 
         pool = FilesystemStoragePool(FilePath(self.mktemp()))
         service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
@@ -483,6 +488,35 @@ class VolumeServiceAPITests(TestCase):
             [b"incremental stream based on", b"stuff"],
             writer.getvalue().splitlines()[-2:])
 
+    def test_push_stream_features(self):
+        """
+        Pushing a volume uses the stream features supported by both the
+        local storage pool and the remote volume manager.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        self.patch(pool, "stream_features",
+                   lambda: succeed(frozenset([b"a", b"b"])))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        used = []
+        original_reader_endpoint = filesystem.reader_endpoint
+
+        def reader_endpoint(remote_snapshots, stream_features):
+            used.append(stream_features)
+            return original_reader_endpoint(remote_snapshots, stream_features)
+        filesystem.reader_endpoint = reader_endpoint
+        self.patch(volume, "get_filesystem", lambda: filesystem)
+
+        remote_service = create_volume_service(self)
+        remote_manager = LocalVolumeManager(remote_service)
+        self.patch(remote_service.pool, "stream_features",
+                   lambda: succeed(frozenset([b"b", b"c"])))
+
+        self.successResultOf(service.push(volume, remote_manager))
+        self.assertEqual(used, [frozenset([b"b"])])
+
     def test_receive_local_node_id(self):
         """
         If a volume with the same node ID as the service is received,
@@ -507,7 +541,9 @@ class VolumeServiceAPITests(TestCase):
         new_name = VolumeName(namespace=u"myns", dataset_id=u"newvolume")
 
         with filesystem.reader() as reader:
-            service.receive(manager_node_id, new_name, reader)
+            self.successResultOf(service.receive(
+                manager_node_id, new_name,
+                MemoryProcessEndpoint(stdout=reader.read())))
         new_volume = Volume(node_id=manager_node_id, name=new_name,
                             service=service)
         d = service.enumerate()
@@ -533,7 +569,9 @@ class VolumeServiceAPITests(TestCase):
         new_name = VolumeName(namespace=u"myns", dataset_id=u"newvolume")
 
         with filesystem.reader() as reader:
-            service.receive(manager_node_id, new_name, reader)
+            self.successResultOf(service.receive(
+                manager_node_id, new_name,
+                MemoryProcessEndpoint(stdout=reader.read())))
 
         new_volume = Volume(node_id=manager_node_id, name=new_name,
                             service=service)
@@ -970,6 +1008,18 @@ class WaitForVolumeTests(TestCase):
         """
         self.assertNoResult(self.service.wait_for_volume(MY_VOLUME))
 
+    def test_pool_invalidated(self):
+        """
+        If the volume doesn't exist yet the storage pool is invalidated
+        before looking for it again, since it will be created by another
+        process.
+        """
+        invalidated = []
+        self.patch(self.pool, "invalidate", lambda: invalidated.append(True))
+        self.service.wait_for_volume(MY_VOLUME)
+        self.clock.advance(WAIT_FOR_VOLUME_INTERVAL)
+        self.assertEqual(invalidated, [True, True])
+
     def test_remote_volume(self):
         """
         The ``Deferred`` returned by ``VolumeService.wait_for_volume`` does not
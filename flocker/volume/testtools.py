@@ -5,22 +5,32 @@ Testing utilities provided by ``flocker.volume``.
 """
 
 import os
+import sys
 import uuid
 import subprocess
+from io import BytesIO
 from unittest import SkipTest
 
 from characteristic import attributes
 
+from zope.interface import implementer
+
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
+from twisted.internet.endpoints import connectProtocol
+from twisted.internet.error import ConnectionLost
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.protocol import Protocol
 from twisted.internet.task import Clock
 from twisted.internet import reactor
 from twisted.trial.unittest import SynchronousTestCase
 
-from ..common import ProcessNode
+from ..common import MemoryProcessEndpoint, ProcessNode
 from ._ipc import RemoteVolumeManager
+from .script import VolumeOptions
 
 from .filesystems.zfs import StoragePool
-from .service import VolumeService
+from .service import VolumeService, VolumeName
 from .filesystems.memory import FilesystemStoragePool
 
 
@@ -80,6 +90,71 @@ def create_zfs_pool(test_case):
     return pool_name
 
 
+class _InterruptingProtocol(Protocol):
+    """
+    Pass on no more than a given number of bytes to a wrapped protocol, then
+    tell it its connection was lost.
+    """
+    def __init__(self, wrapped, remaining):
+        """
+        :param IProtocol wrapped: The protocol to wrap.
+        :param int remaining: The number of bytes to pass on.
+        """
+        self._wrapped = wrapped
+        self._remaining = remaining
+        self._interrupted = False
+
+    def makeConnection(self, transport):
+        Protocol.makeConnection(self, transport)
+        self._wrapped.makeConnection(transport)
+        if self._remaining <= 0:
+            self._interrupt()
+
+    def dataReceived(self, data):
+        if self._interrupted:
+            return
+        data = data[:self._remaining]
+        self._remaining -= len(data)
+        self._wrapped.dataReceived(data)
+        if self._remaining <= 0:
+            self._interrupt()
+
+    def _interrupt(self):
+        """
+        Stop reading and tell the wrapped protocol the connection was lost.
+        """
+        self._interrupted = True
+        self.transport.loseConnection()
+        self._wrapped.connectionLost(Failure(ConnectionLost()))
+
+    def connectionLost(self, reason):
+        if not self._interrupted:
+            self._wrapped.connectionLost(reason)
+
+
+@implementer(IStreamClientEndpoint)
+class InterruptingEndpoint(object):
+    """
+    An endpoint which loses its connections, as a dropped network connection
+    would, once a given number of bytes has been read from them.
+    """
+    def __init__(self, endpoint, after):
+        """
+        :param IStreamClientEndpoint endpoint: The endpoint to wrap.
+        :param int after: The number of bytes delivered to each connected
+            protocol before its connection is lost.
+        """
+        self._endpoint = endpoint
+        self._after = after
+
+    def connect(self, factory):
+        connecting = connectProtocol(
+            self._endpoint,
+            _InterruptingProtocol(factory.buildProtocol(None), self._after))
+        connecting.addCallback(lambda protocol: protocol._wrapped)
+        return connecting
+
+
 class MutatingProcessNode(ProcessNode):
     """Mutate the command being run in order to make tests work.
 
@@ -113,6 +188,72 @@ class MutatingProcessNode(ProcessNode):
     def get_output(self, remote_command):
         return ProcessNode.get_output(self, self._mutate(remote_command))
 
+    def endpoint(self, reactor, remote_command):
+        return ProcessNode.endpoint(
+            self, reactor, self._mutate(remote_command))
+
+
+class VolumeCommandNode(object):
+    """
+    A node which runs ``flocker-volume`` commands in this process, with a
+    given ``VolumeService`` as the node's volume manager, rather than
+    running them remotely.
+
+    Only ``get_output`` and ``endpoint``, which only runs ``flocker-volume
+    receive``, are supported.  The service's storage pool must answer
+    synchronously, as ``FilesystemStoragePool`` does.
+
+    :ivar list commands: The commands run so far.
+    :ivar interrupt_after: ``None``, or the number of bytes of its input
+        ``flocker-volume receive`` reads before the connection is lost, as
+        if the connection to the node was dropped.
+    """
+    def __init__(self, service):
+        """
+        :param VolumeService service: The node's volume manager.
+        """
+        self.service = service
+        self.commands = []
+        self.interrupt_after = None
+
+    def _parse(self, remote_command):
+        """
+        :param remote_command: ``list`` of ``bytes``, the ``flocker-volume``
+            command to run.
+
+        :return: The options of the command's sub-command.
+        """
+        self.commands.append(remote_command)
+        options = VolumeOptions()
+        options.parseOptions(remote_command[1:])
+        return options.subOptions
+
+    def get_output(self, remote_command):
+        options = self._parse(remote_command)
+        stdout = BytesIO()
+        original_stdout = sys.stdout
+        sys.stdout = stdout
+        try:
+            result = []
+            options.run(self.service).addBoth(result.append)
+        finally:
+            sys.stdout = original_stdout
+        if isinstance(result[0], Failure):
+            raise IOError("Bad exit", remote_command, 1, stdout.getvalue())
+        return stdout.getvalue()
+
+    def endpoint(self, reactor, remote_command):
+        options = self._parse(remote_command)
+
+        def receive(data):
+            source = MemoryProcessEndpoint(stdout=data)
+            if self.interrupt_after is not None:
+                source = InterruptingEndpoint(source, self.interrupt_after)
+            return self.service.receive(
+                options["node_id"], VolumeName.from_bytes(options["name"]),
+                source, options["resume-token"])
+        return MemoryProcessEndpoint(process=receive)
+
 
 @attributes(["from_service", "to_service", "remote"])
 class ServicePair(object):
@@ -144,7 +144,6 @@ setup(
 
         "treq == 0.2.1",
 
-        "psutil == 2.1.2",
         "netifaces >= 0.8",
         "ipaddr == 2.1.11",
         "docker-py == 0.7.1",